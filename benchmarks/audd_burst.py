@@ -0,0 +1,111 @@
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'music_identification_service')
+
+
+def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1.0)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def run_bursts(url: str, bursts: int, burst_size: int, distinct: int, pause: float) -> dict:
+    """
+    Send 'bursts' waves of 'burst_size' concurrent /identify calls, each wave drawing from 'distinct'
+    new fragments, so the waves mix repeated fragments with fragments never seen before.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=burst_size)
+    session.mount('http://', adapter)
+    statuses = {}
+    latencies = []
+
+    def identify(fragment: str) -> None:
+        start = time.perf_counter()
+        response = session.post(f'{url}/identify', json={'encoded_fragment': fragment})
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=burst_size) as pool:
+        for _ in range(bursts):
+            fragments = [base64.b64encode(os.urandom(64)).decode('utf-8') for _ in range(distinct)]
+            list(pool.map(identify, [random.choice(fragments) for _ in range(burst_size)]))
+            time.sleep(pause)
+    elapsed = time.perf_counter() - started
+
+    milliseconds = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'error_rate': round(1 - statuses.get(200, 0) / len(latencies), 3),
+        'elapsed_s': round(elapsed, 2),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 1),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Send bursts of /identify calls through the Audd.io backend against a rate-limited local stub.')
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--burst-size', type=int, default=50, help='Concurrent calls per burst')
+    parser.add_argument('--distinct', type=int, default=20, help='Different fragments per burst')
+    parser.add_argument('--pause', type=float, default=2.0, help='Seconds between bursts')
+    parser.add_argument('--stub-rate', type=float, default=5.0, help="Stub's quota in calls per second")
+    parser.add_argument('--stub-latency', type=float, default=0.3)
+    parser.add_argument('--service-port', type=int, default=5101)
+    parser.add_argument('--stub-port', type=int, default=5109)
+    args = parser.parse_args()
+
+    stub_url = f'http://localhost:{args.stub_port}'
+    service_url = f'http://localhost:{args.service_port}'
+    stub = subprocess.Popen([sys.executable, 'audd_stub.py', '--port', str(args.stub_port), '--rate', str(args.stub_rate),
+                             '--burst', str(int(args.stub_rate)), '--latency', str(args.stub_latency)],
+                            cwd=SERVICE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # The service's scheduler is sized to the stub's quota, as it would be to the real API plan
+    environment = dict(os.environ, IDENTIFY_BACKEND='audd', AUDD_API_KEY='stub', AUDD_URL=stub_url,
+                       AUDD_RATE_LIMIT=str(args.stub_rate), AUDD_BURST=str(int(args.stub_rate)))
+    service = subprocess.Popen([sys.executable, '-c', f"import app; app.app.run(host='localhost', port={args.service_port}, threaded=True)"],
+                               cwd=SERVICE_DIR, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(stub_url)
+        wait_until_up(service_url)
+        if service.poll() is not None:
+            raise RuntimeError(f'Identification service exited, is port {args.service_port} already in use?')
+
+        result = run_bursts(service_url, args.bursts, args.burst_size, args.distinct, args.pause)
+        result['upstream'] = requests.get(f'{stub_url}/stats').json()['stats']
+        scheduler = requests.get(f'{service_url}/scheduler/stats')
+        if scheduler.status_code == 200:
+            result['scheduler'] = scheduler.json()['scheduler']
+    finally:
+        service.terminate()
+        service.wait()
+        stub.terminate()
+        stub.wait()
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
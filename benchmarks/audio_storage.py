@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src/catalogue_managment_service'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+from common.audio_codec import RAW, ZPCM
+
+TRACK_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../music/tracks')
+RANGE_SIZE = 64 * 1024
+
+
+def cpu_ms(run: Callable[[], object], repeats: int) -> float:
+    """
+    Median CPU time of a call, in milliseconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.process_time()
+        run()
+        times.append(time.process_time() - start)
+    return round(float(np.median(times)) * 1000, 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Stored size and download CPU cost of the sample tracks, stored raw and compressed.')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--level', type=int, default=6, help='zlib level of the compressed copy')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='shamzam-audio-')
+    try:
+        os.environ['CATALOGUE_DATABASE'] = os.path.join(directory, 'catalogue.db')
+        import app
+        app.create_tables()
+        app.SONG_COMPRESSION_LEVEL = args.level
+        db = app.pool.connect()
+
+        results: Dict[str, object] = {'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                                      'cpus': os.cpu_count(), 'tracks': {}}
+        totals = {RAW: 0, ZPCM: 0}
+        for file_name in sorted(os.listdir(TRACK_FOLDER)):
+            with open(os.path.join(TRACK_FOLDER, file_name), 'rb') as audio_file:
+                song = audio_file.read()
+            track = {'size': len(song)}
+            # The same track stored each way, as /add stores it
+            for encoding in (RAW, ZPCM):
+                app.SONG_ENCODING = encoding
+                start = time.process_time()
+                body, status = app.store_track(db, encoding, file_name, song)
+                track[f'{encoding}_add_ms'] = round((time.process_time() - start) * 1000, 1)
+                db.commit()
+                assert status == 201, body
+                track_id = db.execute('SELECT id FROM tracks WHERE artist = ? AND title = ?', (encoding, file_name)).fetchone()['id']
+                stored = db.execute('SELECT length(song) FROM songs WHERE track_id = ?', (track_id,)).fetchone()[0]
+                totals[encoding] += stored
+                track[f'{encoding}_stored'] = stored
+                assert b''.join(app.read_song_chunks(track_id, 0, len(song))) == song
+                middle = len(song) // 2
+                track[f'{encoding}_download_ms'] = cpu_ms(lambda: b''.join(app.read_song_chunks(track_id, 0, len(song))), args.repeats)
+                track[f'{encoding}_range_ms'] = cpu_ms(lambda: b''.join(app.read_song_chunks(track_id, middle, middle + RANGE_SIZE)), args.repeats)
+                track[f'{encoding}_inline_ms'] = cpu_ms(lambda: app.read_song(db, track_id), args.repeats)
+            track['ratio'] = round(track[f'{ZPCM}_stored'] / track[f'{RAW}_stored'], 3)
+            results['tracks'][file_name] = track
+            print(f'{file_name}: {track}', file=sys.stderr)
+
+        results['stored'] = {**totals, 'ratio': round(totals[ZPCM] / totals[RAW], 3)}
+        db.close()
+        app.pool.close_all()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
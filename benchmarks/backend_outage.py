@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+GATEWAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'shamzam_service')
+
+# Launch commands of the two gateway modes, given the port to listen on
+GATEWAY_COMMANDS = {
+    'sync': lambda port: [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'async': lambda port: [sys.executable, '-c', 'import asyncio, async_app; from hypercorn.asyncio import serve; '
+                           'from hypercorn.config import Config; config = Config(); '
+                           f"config.bind = ['127.0.0.1:{port}']; asyncio.run(serve(async_app.app, config))"],
+}
+
+
+def hung_backend(port: int) -> socket.socket:
+    """
+    Listen on 'port' without ever accepting, so connections complete in the backlog and then hang,
+    like a backend that is overloaded or stuck.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(4096)
+    return listener
+
+
+def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1.0)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def load(url: str, concurrency: int, duration: float) -> dict:
+    """
+    Keep 'concurrency' /catalogue/search calls in flight for 'duration' seconds.
+    """
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    latencies = []
+    statuses = {}
+    stop_at = time.perf_counter() + duration
+
+    def worker() -> None:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                status = session.post(f'{url}/catalogue/search?include_song=false', json={'artist': 'A', 'title': 'B'}, timeout=60).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+
+    milliseconds = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 1),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure gateway latency while the catalogue backend hangs.')
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=sorted(GATEWAY_COMMANDS))
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--search-deadline', type=float, default=2.0, help='SEARCH_DEADLINE of the gateway')
+    parser.add_argument('--gateway-port', type=int, default=5100)
+    parser.add_argument('--backend-port', type=int, default=5102)
+    args = parser.parse_args()
+
+    listener = hung_backend(args.backend_port)
+    backend_url = f'http://127.0.0.1:{args.backend_port}'
+    environment = dict(os.environ, DATABASE_URL=backend_url, AUDIO_URL=backend_url, SEARCH_DEADLINE=str(args.search_deadline))
+    results = []
+    try:
+        for mode in args.modes:
+            gateway = subprocess.Popen(GATEWAY_COMMANDS[mode](args.gateway_port), cwd=GATEWAY_DIR, env=environment,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                gateway_url = f'http://127.0.0.1:{args.gateway_port}'
+                wait_until_up(gateway_url)
+                if gateway.poll() is not None:
+                    raise RuntimeError(f'{mode} gateway exited, is port {args.gateway_port} already in use?')
+                result = {'mode': mode, **load(gateway_url, args.concurrency, args.duration)}
+                status = requests.get(f'{gateway_url}/status')
+                if status.status_code == 200:
+                    result['breaker'] = status.json()['backends']['catalogue']
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+            finally:
+                gateway.terminate()
+                gateway.wait()
+    finally:
+        listener.close()
+
+    print(json.dumps({'search_deadline_s': args.search_deadline, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'catalogue_managment_service'))
+from catalogue_concurrency import synthetic_wav
+from import_tracks import find_tracks, import_tracks
+
+DEFAULT_URL = 'http://localhost:5002'
+
+
+def write_tracks(directory: str, count: int, seconds: float) -> None:
+    """
+    Write 'count' distinct synthetic tracks named 'Benchmark - Track N.wav'.
+    """
+    for track in range(count):
+        with open(os.path.join(directory, f'Benchmark - Track {track}.wav'), 'wb') as wav_file:
+            wav_file.write(synthetic_wav(seconds, 200.0 + track % 2000))
+
+
+def add_one_by_one(url: str, tracks: list) -> float:
+    """
+    Add every track with its own /add request, as loading the catalogue worked before /add/bulk.
+    """
+    session = requests.Session()
+    start = time.perf_counter()
+    for path, artist, title in tracks:
+        with open(path, 'rb') as audio_file:
+            response = session.post(f'{url}/add', data=audio_file.read(),
+                                    headers={'Content-Type': 'application/octet-stream', 'X-Artist': artist, 'X-Title': title})
+        assert response.status_code == 201, response.text
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare one-by-one /add with the bulk importer against the catalogue service.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--tracks', type=int, default=3000)
+    parser.add_argument('--seconds-per-track', type=float, default=1.0)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--concurrency', type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_tracks(directory, args.tracks, args.seconds_per_track)
+        tracks = find_tracks(directory, 'Benchmark')
+
+        requests.delete(f'{args.url}/clear_database')
+        single = add_one_by_one(args.url, tracks)
+
+        requests.delete(f'{args.url}/clear_database')
+        start = time.perf_counter()
+        totals = import_tracks(tracks, args.url, args.batch_size, args.processes, args.concurrency)
+        bulk = time.perf_counter() - start
+        requests.delete(f'{args.url}/clear_database')
+
+    print(json.dumps({
+        'tracks': args.tracks,
+        'seconds_per_track': args.seconds_per_track,
+        'one_by_one': {'seconds': round(single, 2), 'tracks_per_s': round(args.tracks / single, 1)},
+        'bulk': {'seconds': round(bulk, 2), 'tracks_per_s': round(args.tracks / bulk, 1), **totals,
+                 'batch_size': args.batch_size, 'processes': args.processes, 'concurrency': args.concurrency},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
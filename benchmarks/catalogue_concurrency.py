@@ -0,0 +1,107 @@
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import wave
+
+import numpy as np
+import requests
+
+DEFAULT_URL = 'http://localhost:5002'
+
+# Share of each request type in the mixed workload
+WORKLOAD = (('tracks', 0.45), ('search', 0.45), ('add', 0.10))
+
+
+def synthetic_wav(seconds: float, frequency: float, rate: int = 48000) -> bytes:
+    """
+    Build a mono 16-bit WAV file holding a sine tone.
+    """
+    samples = (np.sin(2 * np.pi * frequency * np.arange(int(seconds * rate)) / rate) * 12000).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def add_track(session: requests.Session, url: str, artist: str, title: str, song: bytes) -> requests.Response:
+    return session.post(f'{url}/add', data=song,
+                        headers={'Content-Type': 'application/octet-stream', 'X-Artist': artist, 'X-Title': title})
+
+
+def worker(url: str, song: bytes, seed_tracks: int, deadline: float, worker_id: int, results: dict, lock: threading.Lock) -> None:
+    """
+    Issue mixed requests until the deadline, recording latency per request type.
+    """
+    session = requests.Session()
+    rng = random.Random(worker_id)
+    names, weights = zip(*WORKLOAD)
+    latencies = {name: [] for name in names}
+    errors = 0
+    added = 0
+    while time.perf_counter() < deadline:
+        kind = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        if kind == 'tracks':
+            response = session.get(f'{url}/tracks')
+        elif kind == 'search':
+            track = rng.randrange(seed_tracks)
+            response = session.post(f'{url}/search', json={'artist': 'Benchmark', 'title': f'Seed {track}'})
+        else:
+            added += 1
+            response = add_track(session, url, 'Benchmark', f'Worker {worker_id} Track {added}', song)
+        latencies[kind].append(time.perf_counter() - start)
+        errors += response.status_code >= 500
+    with lock:
+        for name, values in latencies.items():
+            results['latencies'][name].extend(values)
+        results['errors'] += errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Mixed /tracks, /search and /add load against the catalogue service.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load')
+    parser.add_argument('--seed-tracks', type=int, default=200)
+    parser.add_argument('--seconds-per-track', type=float, default=2.0)
+    args = parser.parse_args()
+
+    song = synthetic_wav(args.seconds_per_track, 440.0)
+    session = requests.Session()
+    session.delete(f'{args.url}/clear_database')
+    for track in range(args.seed_tracks):
+        add_track(session, args.url, 'Benchmark', f'Seed {track}', song)
+
+    results = {'latencies': {name: [] for name, _ in WORKLOAD}, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(args.url, song, args.seed_tracks, deadline, i, results, lock))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = {'threads': args.threads, 'duration': args.duration, 'errors': results['errors']}
+    total = 0
+    for name, values in results['latencies'].items():
+        total += len(values)
+        milliseconds = np.array(values) * 1000 if values else np.zeros(1)
+        summary[name] = {
+            'requests': len(values),
+            'p50_ms': round(float(np.percentile(milliseconds, 50)), 2),
+            'p99_ms': round(float(np.percentile(milliseconds, 99)), 2),
+        }
+    summary['throughput_rps'] = round(total / args.duration, 1)
+    print(json.dumps(summary, indent=2))
+    session.delete(f'{args.url}/clear_database')
+
+
+if __name__ == '__main__':
+    main()
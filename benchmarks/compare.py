@@ -0,0 +1,77 @@
+import argparse
+import json
+import sys
+from typing import List, Optional, Tuple
+
+# Metrics compared per workload, and whether a higher value is better
+METRICS = (('throughput_rps', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('error_rate', False))
+
+
+def change(baseline: Optional[float], candidate: Optional[float]) -> Optional[float]:
+    if baseline is None or candidate is None or baseline == 0:
+        return None
+    return (candidate - baseline) / baseline
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> Tuple[List[str], List[str]]:
+    """
+    Compare two result files written by suite.py.
+
+    Args:
+        baseline (dict): Results of the reference commit.
+        candidate (dict): Results of the commit under test.
+        threshold (float): Relative change beyond which a metric counts as regressed, e.g. 0.1 for 10%.
+
+    Returns:
+        Tuple[List[str], List[str]]: The lines of the comparison table and the regressions found.
+    """
+    lines = [f"{'workload':<10} {'metric':<16} {'baseline':>10} {'candidate':>10} {'change':>8}"]
+    regressions = []
+    for workload in sorted(set(baseline['workloads']) & set(candidate['workloads'])):
+        before, after = baseline['workloads'][workload], candidate['workloads'][workload]
+        for metric, higher_is_better in METRICS:
+            relative = change(before.get(metric), after.get(metric))
+            shown = f'{relative:+.1%}' if relative is not None else ''
+            lines.append(f"{workload:<10} {metric:<16} {before.get(metric, ''):>10} {after.get(metric, ''):>10} {shown:>8}")
+            # Error rates start at zero, so any new errors count as a regression
+            if metric == 'error_rate':
+                regressed = after.get(metric, 0) > before.get(metric, 0) + 0.001
+            else:
+                regressed = relative is not None and (-relative if higher_is_better else relative) > threshold
+            if regressed:
+                regressions.append(f'{workload} {metric}: {before.get(metric)} -> {after.get(metric)}')
+
+    for service in sorted(set(baseline.get('peak_rss_mb', {})) & set(candidate.get('peak_rss_mb', {}))):
+        before, after = baseline['peak_rss_mb'][service], candidate['peak_rss_mb'][service]
+        relative = change(before, after)
+        shown = f'{relative:+.1%}' if relative is not None else ''
+        lines.append(f"{'rss':<10} {service:<16} {before:>10} {after:>10} {shown:>8}")
+        if relative is not None and relative > threshold:
+            regressions.append(f'{service} peak RSS: {before} MB -> {after} MB')
+    return lines, regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare two suite.py result files and exit with 1 on a regression.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    if baseline.get('config') != candidate.get('config'):
+        print('Warning: the runs used different settings', file=sys.stderr)
+
+    lines, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    print('\n'.join(lines))
+    if regressions:
+        print('\nRegressions:\n' + '\n'.join(f'  {regression}' for regression in regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
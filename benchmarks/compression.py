@@ -0,0 +1,72 @@
+import argparse
+import base64
+import glob
+import json
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from common.compression import ENCODINGS, compress, decompress
+
+TRACKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'music', 'tracks')
+
+
+def best_milliseconds(function, runs: int) -> float:
+    """
+    Best of 'runs' calls, in milliseconds.
+    """
+    best = float('inf')
+    for _ in range(runs):
+        started = time.process_time()
+        function()
+        best = min(best, time.process_time() - started)
+    return best * 1000
+
+
+def search_body(path: str) -> bytes:
+    """
+    The catalogue /search response for a sample track, audio included, as the gateway relays it.
+    """
+    title = os.path.splitext(os.path.basename(path))[0]
+    with open(path, 'rb') as file:
+        song = file.read()
+    return json.dumps({
+        'message': 'Track found',
+        'artist': 'Sample',
+        'title': title,
+        'size': len(song),
+        'download_url': f"/catalogue/download?{urlencode({'artist': 'Sample', 'title': title})}",
+        'encoded_song': base64.b64encode(song).decode('utf-8'),
+    }, indent=2).encode('utf-8')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure bytes on the wire and CPU cost of each content coding for the sample tracks.')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per measurement, the best is kept')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {'encodings': ENCODINGS, 'tracks': {}}
+    for path in sorted(glob.glob(os.path.join(TRACKS_DIR, '*.wav'))):
+        body = search_body(path)
+        track = {'identity_bytes': len(body)}
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding)
+            track[encoding] = {
+                'bytes': len(compressed),
+                'ratio': round(len(compressed) / len(body), 3),
+                'compress_ms': round(best_milliseconds(lambda: compress(body, encoding), args.runs), 1),
+                'decompress_ms': round(best_milliseconds(lambda: decompress(compressed, encoding), args.runs), 1),
+            }
+        results['tracks'][os.path.basename(path)] = track
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+from common.fingerprint import FingerprintIndex
+
+# The sample tracks in music/tracks produce 1,700-2,700 hashes each
+DEFAULT_TRACKS = 10000
+DEFAULT_HASHES_PER_TRACK = 2000
+FRAGMENT_HASHES = 750
+QUERIES = 200
+
+
+def synthetic_postings(tracks: int, hashes_per_track: int, seed: int = 0):
+    """
+    Generate random (hash, track id, offset) postings for a synthetic catalogue.
+    """
+    rng = np.random.default_rng(seed)
+    count = tracks * hashes_per_track
+    hashes = rng.integers(0, 1 << 32, count, dtype=np.uint64).astype(np.uint32)
+    track_ids = np.repeat(np.arange(tracks, dtype=np.uint32), hashes_per_track)
+    offsets = rng.integers(0, 350, count, dtype=np.uint32)
+    return hashes, track_ids, offsets
+
+
+def dict_index_bytes(hashes: np.ndarray, track_ids: np.ndarray, offsets: np.ndarray) -> int:
+    """
+    Measure the memory a dict-of-lists index over the same postings allocates.
+    """
+    tracemalloc.start()
+    index = defaultdict(list)
+    for hash_value, track_id, offset in zip(hashes.tolist(), track_ids.tolist(), offsets.tolist()):
+        index[hash_value].append((track_id, offset))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del index
+    return size
+
+
+def fragment_queries(hashes: np.ndarray, track_ids: np.ndarray, offsets: np.ndarray, seed: int = 1):
+    """
+    Build fragments that half share postings with a random track and half are noise.
+    """
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(QUERIES):
+        track_id = int(rng.integers(0, track_ids.max() + 1))
+        positions = np.nonzero(track_ids == track_id)[0][:FRAGMENT_HASHES // 2]
+        noise = rng.integers(0, 1 << 32, FRAGMENT_HASHES - len(positions), dtype=np.uint64)
+        queries.append((track_id,
+                        [(int(hashes[p]), int(offsets[p]) - 20) for p in positions] +
+                        [(int(h), int(rng.integers(0, 200))) for h in noise]))
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Memory and lookup latency of the packed fingerprint index.')
+    parser.add_argument('--tracks', type=int, default=DEFAULT_TRACKS)
+    parser.add_argument('--hashes-per-track', type=int, default=DEFAULT_HASHES_PER_TRACK)
+    parser.add_argument('--dict-sample-tracks', type=int, default=500,
+                        help='Tracks used to measure the dict-of-lists baseline, extrapolated linearly')
+    args = parser.parse_args()
+
+    hashes, track_ids, offsets = synthetic_postings(args.tracks, args.hashes_per_track)
+    postings = len(hashes)
+    print(f'catalogue: {args.tracks} tracks, {postings:,} postings')
+
+    sample = args.dict_sample_tracks * args.hashes_per_track
+    dict_bytes = dict_index_bytes(hashes[:sample], track_ids[:sample], offsets[:sample]) * postings / sample
+    print(f'dict-of-lists index (extrapolated from {args.dict_sample_tracks} tracks): {dict_bytes / 2**20:,.0f} MiB')
+
+    start = time.perf_counter()
+    index = FingerprintIndex.build(hashes, track_ids, offsets)
+    build_seconds = time.perf_counter() - start
+    packed_bytes = index.hashes.nbytes + index.track_ids.nbytes + index.offsets.nbytes
+    print(f'packed index: {packed_bytes / 2**20:,.0f} MiB ({packed_bytes / postings:.0f} bytes/posting), built in {build_seconds:.2f} s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fingerprints.idx')
+        start = time.perf_counter()
+        index.save(path)
+        print(f'save: {time.perf_counter() - start:.2f} s, {os.path.getsize(path) / 2**20:,.0f} MiB on disk')
+
+        start = time.perf_counter()
+        loaded = FingerprintIndex.load(path)
+        print(f'mmap load: {(time.perf_counter() - start) * 1000:.2f} ms')
+
+        queries = fragment_queries(hashes, track_ids, offsets)
+        correct = 0
+        latencies = []
+        for expected, fragment in queries:
+            start = time.perf_counter()
+            match = loaded.match(fragment)
+            latencies.append(time.perf_counter() - start)
+            correct += match is not None and match[0] == expected
+        latencies_ms = np.array(latencies) * 1000
+        print(f'lookup of {FRAGMENT_HASHES}-hash fragments ({QUERIES} queries, first touches page cache): '
+              f'p50 {np.percentile(latencies_ms, 50):.2f} ms, p99 {np.percentile(latencies_ms, 99):.2f} ms, '
+              f'{correct}/{QUERIES} correct')
+        del loaded
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import requests
+
+DEFAULT_URL = 'http://localhost:5000'
+MUSIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../music')
+
+
+def read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as audio_file:
+        return audio_file.read()
+
+
+def run(url: str, route: str, send, threads: int, requests_per_thread: int) -> dict:
+    """
+    Send requests to one gateway route from several threads and summarise their latency.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        local_latencies = []
+        local_errors = 0
+        for _ in range(requests_per_thread):
+            start = time.perf_counter()
+            response = send(session)
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += response.status_code != 200
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    milliseconds = np.array(latencies) * 1000
+    return {
+        'route': route,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 2),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Latency of /catalogue/search and /music/identify through the gateway.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per thread')
+    args = parser.parse_args()
+
+    song = read_file(os.path.join(MUSIC_FOLDER, 'tracks/Blinding Lights.wav'))
+    fragment = read_file(os.path.join(MUSIC_FOLDER, 'fragments/~Blinding Lights.wav'))
+    track = {'artist': 'The Weeknd', 'title': 'Blinding Lights'}
+
+    requests.delete('http://localhost:5002/clear_database')
+    requests.post(f'{args.url}/catalogue/add', data=song,
+                  headers={'Content-Type': 'application/octet-stream', 'X-Artist': 'The%20Weeknd', 'X-Title': 'Blinding%20Lights'})
+
+    results = [
+        run(args.url, '/catalogue/search', lambda session: session.post(f'{args.url}/catalogue/search', json=track),
+            args.threads, args.requests),
+        run(args.url, '/catalogue/search?include_song=false',
+            lambda session: session.post(f'{args.url}/catalogue/search?include_song=false', json=track),
+            args.threads, args.requests),
+        run(args.url, '/music/identify', lambda session: session.post(f'{args.url}/music/identify', data=fragment,
+                                                                     headers={'Content-Type': 'application/octet-stream'}),
+            args.threads, args.requests),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
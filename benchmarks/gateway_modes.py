@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+GATEWAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'shamzam_service')
+
+# Launch commands of the two gateway modes, given the port to listen on; both serve from a single process
+GATEWAY_COMMANDS = {
+    'sync': lambda port: [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'async': lambda port: [sys.executable, '-c', 'import asyncio, async_app; from hypercorn.asyncio import serve; '
+                           'from hypercorn.config import Config; config = Config(); '
+                           f"config.bind = ['127.0.0.1:{port}']; config.backlog = 4096; asyncio.run(serve(async_app.app, config))"],
+}
+
+
+def stub_app(latency: float):
+    """
+    Build a backend standing in for both the identification and the catalogue service, answering after 'latency' seconds.
+    """
+    from quart import Quart, jsonify
+
+    stub = Quart(__name__)
+
+    @stub.route('/identify', methods=['POST'])
+    async def identify():
+        await asyncio.sleep(latency)
+        return jsonify({'message': 'Song identified', 'artist': 'Stub', 'title': 'Track'})
+
+    @stub.route('/search', methods=['POST'])
+    async def search():
+        await asyncio.sleep(latency)
+        return jsonify({'message': 'Track found', 'artist': 'Stub', 'title': 'Track', 'size': 4, 'download_url': '/download'})
+
+    return stub
+
+
+def serve_stub(port: int, latency: float) -> None:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f'127.0.0.1:{port}']
+    config.backlog = 4096
+    config.loglevel = 'WARNING'
+    asyncio.run(serve(stub_app(latency), config))
+
+
+def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1.0)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def process_usage(pid: int) -> dict:
+    """
+    Resident memory and thread count of a process, read from /proc (Linux only).
+    """
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith('Threads:'):
+                    usage['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
+
+
+async def load(url: str, route: str, concurrency: int, duration: float, gateway_pid: int) -> dict:
+    """
+    Keep 'concurrency' requests in flight against one gateway route for 'duration' seconds.
+
+    aiohttp is used as the load generator because it costs far less CPU per request than
+    httpx, which matters when the generator shares a machine with the services.
+    """
+    import aiohttp
+
+    latencies = []
+    statuses = {}
+    peak = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(url, connector=connector, timeout=timeout) as session:
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                try:
+                    if route == 'identify':
+                        request = session.post('/music/identify', json={'encoded_fragment': 'UklGRg=='})
+                    else:
+                        request = session.post('/catalogue/search?include_song=false', json={'artist': 'Stub', 'title': 'Track'})
+                    async with request as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async def sample():
+            # Track the gateway's peak memory and thread count while the load runs
+            while time.perf_counter() < stop_at:
+                for name, value in process_usage(gateway_pid).items():
+                    peak[name] = max(peak.get(name, 0), value)
+                await asyncio.sleep(0.5)
+
+        started = time.perf_counter()
+        await asyncio.gather(sample(), *(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    milliseconds = np.array(latencies) * 1000
+    return {
+        'route': route,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': {str(status): count for status, count in statuses.items() if status != 200},
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 1),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 1),
+        'gateway_peak_rss_mb': peak.get('rss_mb'),
+        'gateway_peak_threads': peak.get('threads'),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare the sync (Flask) and async (Quart/hypercorn) gateway under concurrent load.')
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=sorted(GATEWAY_COMMANDS))
+    parser.add_argument('--routes', nargs='+', default=['identify', 'search'], choices=['identify', 'search'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load per measurement')
+    parser.add_argument('--backend-latency-ms', type=float, default=2000.0, help='Time the stub backends take to answer, e.g. Audd.io under load')
+    parser.add_argument('--gateway-port', type=int, default=5100)
+    parser.add_argument('--stub-port', type=int, default=5101)
+    parser.add_argument('--serve-stub', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_stub:
+        serve_stub(args.stub_port, args.backend_latency_ms / 1000)
+        return
+
+    stub_url = f'http://127.0.0.1:{args.stub_port}'
+    stub = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve-stub', '--stub-port', str(args.stub_port),
+                             '--backend-latency-ms', str(args.backend_latency_ms)])
+    results = []
+    try:
+        wait_until_up(stub_url)
+        environment = dict(os.environ, DATABASE_URL=stub_url, AUDIO_URL=stub_url)
+        for mode in args.modes:
+            gateway = subprocess.Popen(GATEWAY_COMMANDS[mode](args.gateway_port), cwd=GATEWAY_DIR, env=environment,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                gateway_url = f'http://127.0.0.1:{args.gateway_port}'
+                wait_until_up(gateway_url)
+                if gateway.poll() is not None:
+                    raise RuntimeError(f'{mode} gateway exited, is port {args.gateway_port} already in use?')
+                for route in args.routes:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(load(gateway_url, route, concurrency, args.duration, gateway.pid))
+                        results.append({'mode': mode, **result})
+                        print(json.dumps(results[-1]), file=sys.stderr)
+            finally:
+                gateway.terminate()
+                gateway.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(json.dumps({'backend_latency_ms': args.backend_latency_ms, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
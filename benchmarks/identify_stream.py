@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List
+from urllib.parse import quote
+
+import numpy as np
+import requests
+
+from suite import read_wavs
+from common.audio import parse_wav_header
+
+DEFAULT_URL = 'http://localhost:5000'
+MUSIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../music')
+
+
+def recording(fragment: bytes, chunk_seconds: float, sent: List[int]) -> Iterator[bytes]:
+    """
+    Yield a WAV file at the pace it would be recorded, one chunk of audio every 'chunk_seconds'.
+
+    Args:
+        fragment (bytes): The WAV file; its header goes out with the first chunk.
+        chunk_seconds (float): Seconds of audio per chunk.
+        sent (List[int]): Appended with the size of every chunk sent.
+    """
+    fmt, offset, _ = parse_wav_header(fragment)
+    size = int(chunk_seconds * fmt['sample_rate']) * fmt['block_align']
+    start, end = 0, offset + size
+    while start < len(fragment):
+        sent.append(len(fragment[start:end]))
+        yield fragment[start:end]
+        time.sleep(chunk_seconds)
+        start, end = end, end + size
+
+
+def time_to_answer(url: str, route: str, fragment: bytes, chunk_seconds: float) -> Dict[str, float]:
+    """
+    Record a fragment to a route in real time and time how long the answer takes from the first byte.
+    """
+    sent: List[int] = []
+    start = time.perf_counter()
+    response = requests.post(f'{url}{route}', params={'include_song': 'false'}, data=recording(fragment, chunk_seconds, sent),
+                             headers={'Content-Type': 'application/octet-stream'}, timeout=120)
+    return {
+        'seconds': time.perf_counter() - start,
+        'status': response.status_code,
+        'sent_share': sum(sent) / len(fragment),
+        'audio_seconds': float(response.headers.get('X-Audio-Seconds', 'nan')),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time to answer of /music/identify and /music/identify/stream for '
+                                                 'fragments recorded in real time, through a running gateway.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--runs', type=int, default=3, help='Recordings of each fragment per route, the median is reported')
+    parser.add_argument('--chunk-seconds', type=float, default=0.1, help='Audio sent per chunk, once per this many seconds')
+    parser.add_argument('--concurrency', type=int, default=1, help='Fragments recorded at once')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    # The tracks the fragments are cut from, added under their file names (already added ones get a 409)
+    for title, song in read_wavs(os.path.join(MUSIC_FOLDER, 'tracks')):
+        requests.post(f'{args.url}/catalogue/add', data=song, timeout=60,
+                      headers={'Content-Type': 'application/octet-stream', 'X-Artist': 'Benchmark', 'X-Title': quote(title)})
+
+    fragments = read_wavs(os.path.join(MUSIC_FOLDER, 'fragments'))
+    results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'cpus': os.cpu_count(), 'fragments': {}}
+    for name, fragment in fragments:
+        fmt, _, length = parse_wav_header(fragment)
+        measured = {}
+        for route in ('/music/identify', '/music/identify/stream'):
+            samples = []
+            lock = threading.Lock()
+
+            def record() -> None:
+                for _ in range(args.runs):
+                    sample = time_to_answer(args.url, route, fragment, args.chunk_seconds)
+                    with lock:
+                        samples.append(sample)
+
+            workers = [threading.Thread(target=record) for _ in range(args.concurrency)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            measured[route] = {
+                'status': sorted({sample['status'] for sample in samples}),
+                'p50_seconds': round(float(np.median([sample['seconds'] for sample in samples])), 3),
+                'max_seconds': round(max(sample['seconds'] for sample in samples), 3),
+                'sent_share': round(float(np.median([sample['sent_share'] for sample in samples])), 3),
+            }
+            if route == '/music/identify/stream':
+                measured[route]['audio_seconds'] = round(float(np.median([sample['audio_seconds'] for sample in samples])), 3)
+
+        results['fragments'][name] = {'clip_seconds': round(length / fmt['block_align'] / fmt['sample_rate'], 3), **measured}
+        print(f"{name}: clip {results['fragments'][name]['clip_seconds']} s, answered after "
+              f"{measured['/music/identify']['p50_seconds']} s whole, {measured['/music/identify/stream']['p50_seconds']} s streamed",
+              file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
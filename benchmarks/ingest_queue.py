@@ -0,0 +1,90 @@
+import argparse
+import json
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import requests
+
+from catalogue_concurrency import synthetic_wav
+
+DEFAULT_URL = 'http://localhost:5002'
+
+
+def add_tracks(url: str, songs: List[bytes], clients: int, queued: bool) -> Dict[str, object]:
+    """
+    Add every song from 'clients' concurrent clients, inline or queued with ?async=true, and wait until all are in.
+
+    Returns:
+        Dict[str, object]: Latency of the /add responses, and the time until every track was added.
+    """
+    latencies: List[float] = []
+    status_urls: List[str] = []
+    lock = threading.Lock()
+    pending = list(enumerate(songs))
+
+    def client() -> None:
+        session = requests.Session()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index, song = pending.pop()
+            start = time.perf_counter()
+            response = session.post(f'{url}/add', data=song, params={'async': 'true'} if queued else None,
+                                    headers={'Content-Type': 'application/octet-stream', 'X-Artist': 'Benchmark', 'X-Title': f'Track {index}'})
+            with lock:
+                latencies.append(time.perf_counter() - start)
+            assert response.status_code == (202 if queued else 201), response.text
+            if queued:
+                with lock:
+                    status_urls.append(response.json()['status_url'])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    responded = time.perf_counter() - start
+
+    # Queued tracks are in once their jobs have finished
+    session = requests.Session()
+    for status_url in status_urls:
+        while True:
+            job = session.get(f'{url}{status_url}').json()
+            if job['state'] in ('succeeded', 'failed'):
+                assert job['state'] == 'succeeded', job
+                break
+            time.sleep(0.05)
+    added = time.perf_counter() - start
+
+    return {
+        'response_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1),
+        'response_p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 1),
+        'all_responded_s': round(responded, 2),
+        'all_added_s': round(added, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare inline /add with /add?async=true (queued for the ingest workers) '
+                                                 'against a running catalogue service.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--tracks', type=int, default=40)
+    parser.add_argument('--seconds-per-track', type=float, default=30.0)
+    parser.add_argument('--clients', type=int, default=4)
+    args = parser.parse_args()
+
+    songs = [synthetic_wav(args.seconds_per_track, 200.0 + track) for track in range(args.tracks)]
+    results = {'config': vars(args)}
+    for mode, queued in (('inline', False), ('queued', True)):
+        requests.delete(f'{args.url}/clear_database')
+        results[mode] = add_tracks(args.url, songs, args.clients, queued)
+    requests.delete(f'{args.url}/clear_database')
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
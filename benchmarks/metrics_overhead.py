@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from common.metrics import STAGE_SECONDS, instrument_app, render_metrics, stage
+
+
+def per_call_microseconds(function, iterations: int) -> float:
+    """
+    Best of five runs of 'iterations' calls, in microseconds per call.
+    """
+    best = float('inf')
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+
+def make_app(instrumented: bool) -> Flask:
+    app = Flask(__name__)
+    if instrumented:
+        instrument_app(app)
+
+    @app.route('/tracks/<name>')
+    def track(name: str):
+        with stage('db_query'):
+            result = {'name': name}
+        return jsonify(result)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the per-request cost of the metrics instrumentation.')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    series = STAGE_SECONDS.labels('benchmark')
+
+    def timed_block() -> None:
+        with stage('benchmark'):
+            pass
+
+    # The same request through Flask's test client with and without the instrumentation,
+    # so the difference is what the hooks cost per request
+    plain = make_app(False).test_client()
+    instrumented = make_app(True).test_client()
+    plain_us = per_call_microseconds(lambda: plain.get('/tracks/a'), args.requests)
+    instrumented_us = per_call_microseconds(lambda: instrumented.get('/tracks/a'), args.requests)
+
+    print(json.dumps({
+        'histogram_observe_us': round(per_call_microseconds(lambda: series.observe(0.001), args.iterations), 2),
+        'stage_timer_us': round(per_call_microseconds(timed_block, args.iterations), 2),
+        'request_plain_us': round(plain_us, 1),
+        'request_instrumented_us': round(instrumented_us, 1),
+        'request_overhead_us': round(instrumented_us - plain_us, 1),
+        'render_metrics_us': round(per_call_microseconds(render_metrics, 200), 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
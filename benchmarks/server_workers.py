@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Optional
+
+from suite import ROOT, WORKLOADS, Services, read_wavs, run_workload, seed_catalogue, synthetic_tracks, workload_senders
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure throughput through the gateway with the services on their development '
+                                                 'servers, then under serve.py with each number of workers.')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4], help='Worker counts per service to compare')
+    parser.add_argument('--workloads', nargs='+', default=['list', 'search', 'identify'], choices=WORKLOADS)
+    parser.add_argument('--catalogue-size', type=int, default=200)
+    parser.add_argument('--track-seconds', type=float, default=2.0)
+    parser.add_argument('--fragment-seconds', type=float, default=1.5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--stub-latency', type=float, default=0.1)
+    parser.add_argument('--gateway-mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--base-port', type=int, default=5200)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    tracks = read_wavs(os.path.join(ROOT, 'music', 'tracks'))
+    fragments = read_wavs(os.path.join(ROOT, 'music', 'fragments'))
+    first_track = next(synthetic_tracks(tracks, 1, args.track_seconds))
+    results = {'cpus': os.cpu_count(), 'config': {key: value for key, value in vars(args).items() if key not in ('output', 'base_port')},
+               'servers': {}}
+
+    servers: List[Optional[int]] = [None, *args.workers]
+    for workers in servers:
+        name = 'development' if workers is None else f'{workers} workers'
+        services = Services(args.base_port, args.gateway_mode, args.stub_latency, first_track[0], first_track[1], workers)
+        results['servers'][name] = {}
+        try:
+            services.start()
+            catalogue = seed_catalogue(services.urls['catalogue'], synthetic_tracks(tracks, args.catalogue_size, args.track_seconds))
+            senders = workload_senders(services.urls['gateway'], catalogue, tracks, fragments, args)
+            for workload in args.workloads:
+                result = run_workload(senders[workload], args.concurrency, args.duration, args.warmup)
+                result['peak_rss_mb'] = services.peak_rss()
+                results['servers'][name][workload] = result
+                print(f'{name} {workload}: {result["throughput_rps"]} requests/s, p50 {result["p50_ms"]} ms, '
+                      f'p99 {result["p99_ms"]} ms, errors {result["error_rate"]}', file=sys.stderr)
+        finally:
+            services.stop()
+        # Give the ports time to be released before the next server binds them
+        time.sleep(1)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
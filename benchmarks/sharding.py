@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import List
+from urllib.parse import quote
+
+import requests
+
+from suite import ARTIST, SERVICE_DIRS, clip_wav, read_wavs, run_workload, wait_until_up
+
+TRACKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'music', 'tracks')
+
+
+class ShardedCatalogue:
+    """
+    A gateway in front of 'shards' catalogue processes, each with its own database file, on consecutive ports.
+    """
+
+    def __init__(self, shards: int, base_port: int, gateway_mode: str) -> None:
+        self.shards = shards
+        self.gateway_url = f'http://127.0.0.1:{base_port}'
+        self.shard_ports = [base_port + 2 + shard for shard in range(shards)]
+        self.gateway_mode = gateway_mode
+        self.directory = tempfile.mkdtemp(prefix='shamzam-shards-')
+        self.processes: List[subprocess.Popen] = []
+
+    def start(self) -> None:
+        for shard, port in enumerate(self.shard_ports):
+            environment = dict(os.environ, CATALOGUE_DATABASE=os.path.join(self.directory, f'shard{shard}.db'),
+                               CATALOGUE_SHARD=f'{shard}/{self.shards}')
+            command = [sys.executable, '-c', f'import sys; sys.path.insert(0, {SERVICE_DIRS["catalogue"]!r}); import app; '
+                                             f"app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+            self.processes.append(subprocess.Popen(command, cwd=self.directory, env=environment,
+                                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            wait_until_up(f'http://127.0.0.1:{port}', self.processes[-1])
+
+        port = self.gateway_url.rsplit(':', 1)[1]
+        command = ([sys.executable, '-c', 'import asyncio, async_app; from hypercorn.asyncio import serve; '
+                    'from hypercorn.config import Config; config = Config(); '
+                    f"config.bind = ['127.0.0.1:{port}']; config.backlog = 4096; asyncio.run(serve(async_app.app, config))"]
+                   if self.gateway_mode == 'async' else
+                   [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"])
+        environment = dict(os.environ, DATABASE_URL=','.join(f'http://127.0.0.1:{port}' for port in self.shard_ports))
+        self.processes.append(subprocess.Popen(command, cwd=SERVICE_DIRS['gateway'], env=environment,
+                                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        wait_until_up(self.gateway_url, self.processes[-1])
+
+    def stop(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure /catalogue/add write throughput and /catalogue/list page latency '
+                                                 'through the gateway for different numbers of catalogue shards.')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='Shard counts to measure')
+    parser.add_argument('--gateway-mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds measured per workload')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before measuring')
+    parser.add_argument('--track-seconds', type=float, default=0.5, help='Length of each added track, kept short so fingerprinting does not dominate')
+    parser.add_argument('--page-size', type=int, default=50, help='Limit of each /catalogue/list request')
+    parser.add_argument('--base-port', type=int, default=5400)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    tracks = read_wavs(TRACKS_DIR)
+
+    def add(session: requests.Session, worker: int, count: int) -> int:
+        name, data = tracks[(worker + count) % len(tracks)]
+        song = clip_wav(data, args.track_seconds, (worker * 100003 + count) * 7919)
+        return session.post(f'{catalogue.gateway_url}/catalogue/add', data=song, timeout=60, headers={
+            'Content-Type': 'application/octet-stream', 'X-Artist': quote(ARTIST), 'X-Title': quote(f'{name} {worker}-{count}')}).status_code
+
+    def list_page(session: requests.Session, worker: int, count: int) -> int:
+        return session.get(f'{catalogue.gateway_url}/catalogue/list', params={'limit': args.page_size}, timeout=60).status_code
+
+    results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'cpus': os.cpu_count(), 'shards': {}}
+    for shards in args.shards:
+        catalogue = ShardedCatalogue(shards, args.base_port, args.gateway_mode)
+        catalogue.start()
+        try:
+            results['shards'][str(shards)] = {
+                'add': run_workload(add, args.concurrency, args.duration, args.warmup),
+                # Listed from the catalogue the add workload just wrote
+                'list': run_workload(list_page, args.concurrency, args.duration, args.warmup),
+            }
+        finally:
+            catalogue.stop()
+        print(f"{shards} shard(s): add {results['shards'][str(shards)]['add'].get('throughput_rps')} req/s, "
+              f"list p50 {results['shards'][str(shards)]['list'].get('p50_ms')} ms", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
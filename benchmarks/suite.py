@@ -0,0 +1,386 @@
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import numpy as np
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC_DIR = os.path.join(ROOT, 'src')
+SERVICE_DIRS = {
+    'catalogue': os.path.join(SRC_DIR, 'catalogue_managment_service'),
+    'identification': os.path.join(SRC_DIR, 'music_identification_service'),
+    'gateway': os.path.join(SRC_DIR, 'shamzam_service'),
+}
+SERVE_PATH = os.path.join(SRC_DIR, 'serve.py')
+
+# Name of each service in serve.py
+SERVED_NAMES = {'catalogue': 'catalogue', 'identification': 'identification', 'gateway': 'shamzam'}
+
+sys.path.append(SRC_DIR)
+from common.audio import parse_wav_header
+
+WORKLOADS = ('add', 'list', 'search', 'identify')
+
+# Artist of every synthetic track, so the catalogue's own tracks are never touched
+ARTIST = 'Benchmark'
+
+# Number of synthetic tracks sent per /add/bulk request while seeding
+SEED_BATCH_SIZE = 50
+
+
+def read_wavs(directory: str) -> List[Tuple[str, bytes]]:
+    """
+    Read the WAV files of a directory, in name order.
+    """
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith('.wav'))
+    if not names:
+        raise RuntimeError(f'No .wav files in {directory}')
+    wavs = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as file:
+            wavs.append((os.path.splitext(name)[0].lstrip('~'), file.read()))
+    return wavs
+
+
+def clip_wav(data: bytes, seconds: float, position: int) -> bytes:
+    """
+    Cut a clip out of a WAV file, keeping its format.
+
+    Args:
+        data (bytes): The WAV file.
+        seconds (float): Length of the clip, capped at the length of the file.
+        position (int): Selects the first frame of the clip; consecutive positions give clips one frame apart.
+
+    Returns:
+        bytes: The clip as a WAV file.
+    """
+    fmt, offset, length = parse_wav_header(data)
+    block = fmt['block_align']
+    total = min(length, len(data) - offset) // block
+    frames = min(int(seconds * fmt['sample_rate']), total)
+    start = position % (total - frames + 1)
+    samples = data[offset + start * block:offset + (start + frames) * block]
+    header = bytearray(data[:offset])
+    header[4:8] = struct.pack('<I', len(header) - 8 + len(samples))
+    header[offset - 4:offset] = struct.pack('<I', len(samples))
+    return bytes(header) + samples
+
+
+def synthetic_tracks(sources: List[Tuple[str, bytes]], size: int, seconds: float) -> Iterator[Tuple[str, str, bytes]]:
+    """
+    Generate a catalogue of distinct tracks, cycling through clips of the source WAVs.
+
+    The same arguments always give the same tracks, so catalogues are comparable across runs.
+    """
+    for index in range(size):
+        name, data = sources[index % len(sources)]
+        yield ARTIST, f'{name} {index:06d}', clip_wav(data, seconds, index * 7919)
+
+
+def seed_catalogue(url: str, tracks: Iterator[Tuple[str, str, bytes]]) -> List[Tuple[str, str]]:
+    """
+    Add the synthetic tracks to the catalogue with /add/bulk.
+
+    Returns:
+        List[Tuple[str, str]]: Artist and title of every track added.
+    """
+    session = requests.Session()
+    added = []
+    batch = []
+
+    def flush() -> None:
+        body = ''.join(json.dumps({'artist': artist, 'title': title, 'encoded_song': base64.b64encode(song).decode('ascii')}) + '\n'
+                       for artist, title, song in batch)
+        response = session.post(f'{url}/add/bulk', data=body.encode('utf-8'), headers={'Content-Type': 'application/x-ndjson'}, timeout=600)
+        response.raise_for_status()
+        added.extend((artist, title) for artist, title, _ in batch)
+        batch.clear()
+
+    for track in tracks:
+        batch.append(track)
+        if len(batch) == SEED_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    return added
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{url} exited with {process.returncode}, is the port already in use?')
+        try:
+            urllib.request.urlopen(url, timeout=1.0)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """
+    Peak resident memory of a process in MB, from /proc (Linux only).
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid: int) -> List[int]:
+    """
+    Process ids of the children of a process, e.g. the workers of a gunicorn master, from /proc (Linux only).
+    """
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+
+
+class Services:
+    """
+    The three services and the Audd.io stub, each in its own process on its own port, with a fresh catalogue database.
+
+    The services run on their development servers, or under serve.py with 'workers' worker processes each.
+    """
+
+    def __init__(self, base_port: int, gateway_mode: str, stub_latency: float, artist: str, title: str,
+                 workers: Optional[int] = None) -> None:
+        self.ports = {'gateway': base_port, 'identification': base_port + 1, 'catalogue': base_port + 2, 'audd_stub': base_port + 9}
+        self.urls = {name: f'http://127.0.0.1:{port}' for name, port in self.ports.items()}
+        self.gateway_mode = gateway_mode
+        self.stub_latency = stub_latency
+        self.artist = artist
+        self.title = title
+        self.workers = workers
+        self.directory = tempfile.mkdtemp(prefix='shamzam-bench-')
+        self.processes: Dict[str, subprocess.Popen] = {}
+
+    def start(self) -> None:
+        def flask_app(service: str) -> List[str]:
+            return [sys.executable, '-c', f'import sys; sys.path.insert(0, {SERVICE_DIRS[service]!r}); import app; '
+                                          f"app.app.run(host='127.0.0.1', port={self.ports[service]}, threaded=True)"]
+
+        def served(service: str) -> List[str]:
+            return [sys.executable, SERVE_PATH, SERVED_NAMES[service], '--bind', f'127.0.0.1:{self.ports[service]}',
+                    '--workers', str(self.workers), '--gateway-mode', self.gateway_mode]
+
+        # The stub answers every fragment as the same catalogue track after a fixed latency, with no quota to speak of
+        commands = {
+            'audd_stub': ([sys.executable, 'audd_stub.py', '--port', str(self.ports['audd_stub']), '--rate', '100000', '--burst', '100000',
+                           '--latency', str(self.stub_latency), '--artist', self.artist, '--title', self.title],
+                          SERVICE_DIRS['identification'], {}),
+            # The catalogue keeps its database in the working directory
+            'catalogue': (flask_app('catalogue'), self.directory, {}),
+            'identification': (flask_app('identification'), self.directory, {
+                'IDENTIFY_BACKEND': 'audd', 'AUDD_API_KEY': 'benchmark', 'AUDD_URL': self.urls['audd_stub'],
+                'AUDD_RATE_LIMIT': '100000', 'AUDD_BURST': '100000', 'AUDD_QUEUE_SIZE': '100000',
+                'CATALOGUE_URL': self.urls['catalogue']}),
+            'gateway': ([sys.executable, '-c', 'import asyncio, async_app; from hypercorn.asyncio import serve; '
+                         'from hypercorn.config import Config; config = Config(); '
+                         f"config.bind = ['127.0.0.1:{self.ports['gateway']}']; config.backlog = 4096; asyncio.run(serve(async_app.app, config))"]
+                        if self.gateway_mode == 'async' else
+                        [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={self.ports['gateway']}, threaded=True)"],
+                        SERVICE_DIRS['gateway'], {'DATABASE_URL': self.urls['catalogue'], 'AUDIO_URL': self.urls['identification']}),
+        }
+        if self.workers:
+            # serve.py runs each service from its own folder, so the catalogue is told where its database is
+            for name in SERVED_NAMES:
+                command, directory, environment = commands[name]
+                commands[name] = (served(name), directory, {**environment, 'CATALOGUE_DATABASE': os.path.join(self.directory, 'catalogue.db')})
+        for name, (command, directory, environment) in commands.items():
+            self.processes[name] = subprocess.Popen(command, cwd=directory, env=dict(os.environ, **environment),
+                                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_until_up(self.urls[name], self.processes[name])
+
+    def peak_rss(self) -> Dict[str, Optional[float]]:
+        # Under serve.py, the sum over the master process and its workers
+        peaks = {}
+        for name, process in self.processes.items():
+            values = [peak for peak in map(peak_rss_mb, [process.pid, *child_pids(process.pid)]) if peak is not None]
+            peaks[name] = round(sum(values), 1) if values else None
+        return peaks
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def run_workload(send: Callable[[requests.Session, int, int], int], concurrency: int, duration: float, warmup: float) -> dict:
+    """
+    Keep 'concurrency' requests in flight for 'warmup' + 'duration' seconds, measuring only the last 'duration'.
+
+    Args:
+        send (Callable[[requests.Session, int, int], int]): Makes one request, given the worker's session, the worker
+            number and the worker's request count, and returns its status code.
+        concurrency (int): Number of workers, each with one request in flight at a time.
+        duration (float): Seconds measured.
+        warmup (float): Seconds of load before measuring starts.
+
+    Returns:
+        dict: Requests, status counts, throughput and latency percentiles.
+    """
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def worker(number: int) -> None:
+        session = requests.Session()
+        count = 0
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                status = str(send(session, number, count))
+            except requests.RequestException as e:
+                status = type(e).__name__
+            end = time.perf_counter()
+            count += 1
+            if start >= measure_from:
+                with lock:
+                    latencies.append(end - start)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if not latencies:
+        return {'requests': 0, 'statuses': {}}
+    milliseconds = np.array(latencies) * 1000
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500)
+    return {
+        'requests': len(latencies),
+        'statuses': dict(sorted(statuses.items())),
+        'error_rate': round(errors / len(latencies), 4),
+        'throughput_rps': round(len(latencies) / duration, 1),
+        'mean_ms': round(float(milliseconds.mean()), 2),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 2),
+        'p95_ms': round(float(np.percentile(milliseconds, 95)), 2),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 2),
+    }
+
+
+def workload_senders(gateway_url: str, catalogue: List[Tuple[str, str]], tracks: List[Tuple[str, bytes]],
+                     fragments: List[Tuple[str, bytes]], args: argparse.Namespace) -> Dict[str, Callable[[requests.Session, int, int], int]]:
+    """
+    Build the request of each workload, all sent through the gateway.
+    """
+    def add(session: requests.Session, worker: int, count: int) -> int:
+        # Every added track is new: a clip the seeded catalogue does not hold, under a unique title
+        name, data = tracks[(worker + count) % len(tracks)]
+        song = clip_wav(data, args.track_seconds, (worker * 100003 + count) * 7919 + 1)
+        return session.post(f'{gateway_url}/catalogue/add', data=song, timeout=60, headers={
+            'Content-Type': 'application/octet-stream', 'X-Artist': quote(ARTIST), 'X-Title': quote(f'Added {worker}-{count}')}).status_code
+
+    def list_tracks(session: requests.Session, worker: int, count: int) -> int:
+        return session.get(f'{gateway_url}/catalogue/list', params={'limit': args.page_size}, timeout=60).status_code
+
+    def search(session: requests.Session, worker: int, count: int) -> int:
+        artist, title = catalogue[random.Random(worker * 1000003 + count).randrange(len(catalogue))]
+        return session.post(f'{gateway_url}/catalogue/search', params={'include_song': 'false'},
+                            json={'artist': artist, 'title': title}, timeout=60).status_code
+
+    def identify(session: requests.Session, worker: int, count: int) -> int:
+        # A different clip for every request, so the identification cache never answers in place of the stub
+        _, data = fragments[(worker + count) % len(fragments)]
+        fragment = clip_wav(data, args.fragment_seconds, worker * 100003 + count)
+        return session.post(f'{gateway_url}/music/identify', data=fragment, timeout=60,
+                            headers={'Content-Type': 'application/octet-stream'}).status_code
+
+    return {'add': add, 'list': list_tracks, 'search': search, 'identify': identify}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Boot all three services against a local Audd.io stub, seed a synthetic catalogue '
+                                                 'and measure add/list/search/identify through the gateway.')
+    parser.add_argument('--workloads', nargs='+', default=list(WORKLOADS), choices=WORKLOADS)
+    parser.add_argument('--catalogue-size', type=int, default=200, help='Synthetic tracks seeded before measuring')
+    parser.add_argument('--track-seconds', type=float, default=2.0, help='Length of each synthetic track')
+    parser.add_argument('--fragment-seconds', type=float, default=1.5, help='Length of each identified fragment')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds measured per workload')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of unmeasured load before each workload')
+    parser.add_argument('--page-size', type=int, default=100, help='limit of the /catalogue/list requests')
+    parser.add_argument('--stub-latency', type=float, default=0.1, help='Seconds the Audd.io stub takes per fragment')
+    parser.add_argument('--gateway-mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--workers', type=int, help='Run the services under serve.py with this many workers each, '
+                                                    'instead of their development servers')
+    parser.add_argument('--base-port', type=int, default=5200, help='Gateway port; the other services use the next ports')
+    parser.add_argument('--output', help='Write the results to this JSON file as well as stdout')
+    args = parser.parse_args()
+
+    tracks = read_wavs(os.path.join(ROOT, 'music', 'tracks'))
+    fragments = read_wavs(os.path.join(ROOT, 'music', 'fragments'))
+    catalogue_tracks = list(synthetic_tracks(tracks, 1, args.track_seconds))
+    services = Services(args.base_port, args.gateway_mode, args.stub_latency, catalogue_tracks[0][0], catalogue_tracks[0][1], args.workers)
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'base_port')},
+        'workloads': {},
+    }
+    try:
+        services.start()
+        started = time.perf_counter()
+        catalogue = seed_catalogue(services.urls['catalogue'], synthetic_tracks(tracks, args.catalogue_size, args.track_seconds))
+        results['seed_s'] = round(time.perf_counter() - started, 2)
+        print(f'Seeded {len(catalogue)} tracks in {results["seed_s"]} s', file=sys.stderr)
+
+        senders = workload_senders(services.urls['gateway'], catalogue, tracks, fragments, args)
+        for name in args.workloads:
+            result = run_workload(senders[name], args.concurrency, args.duration, args.warmup)
+            result['peak_rss_mb'] = services.peak_rss()
+            results['workloads'][name] = result
+            print(f'{name}: {json.dumps(result)}', file=sys.stderr)
+        results['peak_rss_mb'] = services.peak_rss()
+    finally:
+        services.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
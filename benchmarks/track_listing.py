@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from sqlite3 import Connection
+from typing import Callable, Dict
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src/catalogue_managment_service'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+from common.db import ConnectionPool
+
+DEFAULT_TRACKS = 5000
+DEFAULT_SONG_KB = 200
+PAGE_SIZE = 100
+
+# The catalogue's schema before the audio was split from the metadata
+OLD_SCHEMA = 'CREATE TABLE tracks (artist TEXT NOT NULL, title TEXT NOT NULL, song BLOB NOT NULL, PRIMARY KEY (artist, title))'
+TRACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../music/tracks/Blinding Lights.wav')
+
+
+def drop_caches() -> None:
+    """
+    Drop the OS page cache, so the next query reads the database from disk (Linux, as root).
+    """
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as file:
+        file.write('3')
+
+
+def timed(pool: ConnectionPool, run: Callable[[Connection], object], repeats: int, cold: bool) -> Dict[str, float]:
+    """
+    Time a query, on one warm connection or, when 'cold', on a new connection after dropping the OS page cache.
+    """
+    latencies = []
+    db = pool.connect()
+    for _ in range(repeats):
+        if cold:
+            db.close()
+            drop_caches()
+            db = pool.connect()
+        start = time.perf_counter()
+        run(db)
+        latencies.append(time.perf_counter() - start)
+    db.close()
+    return {'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3), 'max_ms': round(max(latencies) * 1000, 3)}
+
+
+def structure_pages(db, name: str) -> int:
+    """
+    Returns:
+        int: Pages of a table or index b-tree a scan of it reads, i.e. without the overflow pages holding large values.
+    """
+    return db.execute("SELECT count(*) FROM dbstat WHERE name = ? AND pagetype != 'overflow'", (name,)).fetchone()[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Cost of listing and looking up tracks with the audio in the tracks table '
+                                                 '(the old schema) and split into its own table.')
+    parser.add_argument('--tracks', type=int, default=DEFAULT_TRACKS)
+    parser.add_argument('--song-kb', type=int, default=DEFAULT_SONG_KB, help='Size of each track\'s audio')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--cold', action='store_true', help='Drop the OS page cache before every query (Linux, needs root)')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    # WAV files of the requested size: the header of a real track, then silence
+    with open(TRACK_PATH, 'rb') as file:
+        header = file.read(4096)
+    song = header + bytes(args.song_kb * 1024 - len(header))
+    rng = random.Random(0)
+    keys = sorted({(f'Artist {rng.randrange(args.tracks // 10)}', f'Title {index}') for index in range(args.tracks)})
+
+    directory = tempfile.mkdtemp(prefix='shamzam-listing-')
+    try:
+        old_pool = ConnectionPool(os.path.join(directory, 'old.db'), 1)
+        old_db = old_pool.connect()
+        old_db.execute(OLD_SCHEMA)
+        old_db.executemany('INSERT INTO tracks (artist, title, song) VALUES (?, ?, ?)', ((artist, title, song) for artist, title in keys))
+        old_db.commit()
+
+        # The new schema, by migrating a copy in place as the catalogue does when it starts
+        new_path = os.path.join(directory, 'new.db')
+        shutil.copy(old_pool.database, new_path)
+        os.environ['CATALOGUE_DATABASE'] = os.path.join(directory, 'empty.db')
+        import app
+        app.DATABASE = new_path
+        app.pool = app.create_pool()
+        start = time.perf_counter()
+        app.create_tables()
+        migration_seconds = time.perf_counter() - start
+        new_db = app.pool.connect()
+
+        columns = ', '.join(app.METADATA_COLUMNS)
+        sample = rng.sample(keys, PAGE_SIZE)
+        results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'cpus': os.cpu_count(),
+                   'migration_seconds': round(migration_seconds, 2),
+                   'pages read by a listing': {'before': structure_pages(old_db, 'tracks'), 'after': structure_pages(new_db, 'tracks_listing')},
+                   'queries': {}}
+        # Each query as the old and the new schema run it
+        queries = {
+            'full listing with sizes': (
+                lambda db: db.execute('SELECT artist, title, length(song) FROM tracks ORDER BY artist, title').fetchall(),
+                lambda db: db.execute(f'SELECT {columns} FROM tracks ORDER BY artist, title').fetchall()),
+            f'page of {PAGE_SIZE} with sizes': (
+                lambda db: db.execute('SELECT artist, title, length(song) FROM tracks WHERE (artist, title) > (?, ?) '
+                                      'ORDER BY artist, title LIMIT ?', (*sample[0], PAGE_SIZE)).fetchall(),
+                lambda db: db.execute(f'SELECT {columns} FROM tracks WHERE (artist, title) > (?, ?) '
+                                      'ORDER BY artist, title LIMIT ?', (*sample[0], PAGE_SIZE)).fetchall()),
+            f'{PAGE_SIZE} lookups of the whole row': (
+                lambda db: [db.execute('SELECT * FROM tracks WHERE artist = ? AND title = ?', key).fetchone() for key in sample],
+                lambda db: [db.execute('SELECT * FROM tracks WHERE artist = ? AND title = ?', key).fetchone() for key in sample]),
+            'scan by rowid (search index rebuild)': (
+                lambda db: db.execute('SELECT rowid, artist, title FROM tracks').fetchall(),
+                lambda db: db.execute('SELECT rowid, artist, title FROM tracks').fetchall()),
+        }
+        print(f"pages read by a listing: {results['pages read by a listing']}", file=sys.stderr)
+        for name, (old_query, new_query) in queries.items():
+            results['queries'][name] = {'before': timed(old_pool, old_query, args.repeats, args.cold),
+                                        'after': timed(app.pool, new_query, args.repeats, args.cold)}
+            print(f"{name}: {results['queries'][name]['before']} before, {results['queries'][name]['after']} after", file=sys.stderr)
+
+        plan = new_db.execute(f'EXPLAIN QUERY PLAN SELECT {columns} FROM tracks ORDER BY artist, title').fetchall()
+        results['listing_plan'] = ' '.join(row['detail'] for row in plan)
+        old_db.close()
+        new_db.close()
+        app.pool.close_all()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src/catalogue_managment_service'))
+
+DEFAULT_TRACKS = 100000
+QUERIES = 300
+
+# Syllables for made-up artist and title words, so a synthetic catalogue has a realistic spread of trigrams
+ONSETS = list('bcdfghjklmnprstvwyz') + ['ch', 'sh', 'th', 'st', 'br', 'tr', 'gr', 'pl', 'cl', 'dr', 'fl', 'kr', 'sl', 'sw', 'qu', 'wh']
+NUCLEI = list('aeiou') + ['ai', 'ea', 'ou', 'oo', 'ie', 'ay', 'y']
+CODAS = [''] * 6 + list('nrstlmkdgx') + ['ng', 'nd', 'st', 'rk', 'll', 'ss']
+# Common words that many titles share, some with diacritics
+COMMON_WORDS = ['The', 'Love', 'Of', 'You', 'Me', 'Night', 'Baby', 'Girl', 'Heart', 'Live', 'Remix', 'Feat.', 'Café', 'Señor']
+
+
+def synthetic_catalogue(tracks: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Generate distinct (artist, title) pairs from a vocabulary of made-up words, a few of them very common.
+    """
+    rng = random.Random(seed)
+    syllables = [onset + nucleus + coda for onset in ONSETS for nucleus in NUCLEI for coda in CODAS]
+    vocabulary = [''.join(rng.choice(syllables) for _ in range(rng.choice([1, 1, 2, 2, 2, 3]))).capitalize() for _ in range(40000)]
+
+    def word() -> str:
+        # Zipf-like: some words turn up in thousands of names
+        if rng.random() < 0.3:
+            return vocabulary[min(int(rng.paretovariate(0.8)), len(vocabulary)) - 1]
+        return rng.choice(vocabulary)
+
+    artists = [' '.join(word() for _ in range(rng.randint(1, 2))) for _ in range(tracks // 12)]
+    keys = set()
+    while len(keys) < tracks:
+        title = ' '.join(rng.choice([word(), word(), rng.choice(COMMON_WORDS)]) for _ in range(rng.randint(1, 4)))
+        keys.add((rng.choice(artists), title))
+    return sorted(keys)
+
+
+def misspell(text: str, rng: random.Random) -> str:
+    """
+    Swap two neighbouring characters, the commonest typing mistake.
+    """
+    position = rng.randrange(len(text) - 1)
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def query_kinds(rng: random.Random) -> Dict[str, Callable[[str, str], Dict[str, str]]]:
+    """
+    Queries made from a track's artist and title, each expected to find that track first (prefixes: any track containing them).
+    """
+    return {
+        'exact fields': lambda artist, title: {'artist': artist, 'title': title},
+        'case and diacritics': lambda artist, title: {'artist': artist.upper(), 'title': title.lower().replace('é', 'e').replace('ñ', 'n')},
+        'misspelt title': lambda artist, title: {'artist': artist, 'title': misspell(title, rng)},
+        'free text': lambda artist, title: {'text': f'{artist} {title}'},
+        'misspelt free text': lambda artist, title: {'text': f'{misspell(artist, rng)} {title}'},
+        'title prefix': lambda artist, title: {'text': title[:6]},
+    }
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    milliseconds = np.array(latencies) * 1000
+    return {'p50_ms': round(float(np.percentile(milliseconds, 50)), 3), 'p99_ms': round(float(np.percentile(milliseconds, 99)), 3)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Latency and accuracy of the catalogue\'s fuzzy track search on a synthetic catalogue.')
+    parser.add_argument('--tracks', type=int, default=DEFAULT_TRACKS)
+    parser.add_argument('--queries', type=int, default=QUERIES, help='Queries of each kind')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['CATALOGUE_DATABASE'] = os.path.join(directory, 'catalogue.db')
+        import app
+        from common.search import normalise
+        app.create_tables()
+
+        keys = synthetic_catalogue(args.tracks)
+        db = app.pool.connect()
+        start = time.perf_counter()
+        # Metadata only: the search never reads the audio
+        db.executemany('INSERT INTO tracks (artist, title, size) VALUES (?, ?, 44)', keys)
+        db.commit()
+        insert_seconds = time.perf_counter() - start
+        vocabulary = app.track_search.document_frequencies(db)
+        print(f'catalogue: {len(keys)} tracks inserted and indexed in {insert_seconds:.1f} s, {len(vocabulary)} distinct trigrams, '
+              f'median {np.median(list(vocabulary.values())):.0f} tracks per trigram')
+
+        rng = random.Random(1)
+        # Names long enough to stay searchable (3 letters or digits) when misspelt or cut to a prefix
+        searchable = [key for key in keys if min(len(key[0]), len(key[1])) >= 5]
+        sample = rng.sample(searchable, args.queries)
+        results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'cpus': os.cpu_count(), 'queries': {}}
+
+        # The exact lookup /search makes, for reference
+        latencies = []
+        for artist, title in sample:
+            start = time.perf_counter()
+            db.execute('SELECT artist, title, size FROM tracks WHERE artist = ? AND title = ?', (artist, title)).fetchone()
+            latencies.append(time.perf_counter() - start)
+        results['queries']['exact lookup (/search)'] = percentiles(latencies)
+
+        client = app.app.test_client()
+        for kind, make_query in query_kinds(rng).items():
+            search_latencies, request_latencies, found = [], [], 0
+            for artist, title in sample:
+                query = make_query(artist, title)
+                start = time.perf_counter()
+                matches = app.track_search.search(db, query, 10)
+                search_latencies.append(time.perf_counter() - start)
+
+                top = db.execute('SELECT artist, title FROM tracks WHERE id = ?', (matches[0][0],)).fetchone() if matches else None
+                if kind == 'title prefix':
+                    found += top is not None and normalise(query['text']) in normalise(f"{top['artist']} {top['title']}")
+                else:
+                    found += top is not None and (top['artist'], top['title']) == (artist, title)
+
+                start = time.perf_counter()
+                client.get('/search/fuzzy', query_string={'q': query['text']} if 'text' in query else query)
+                request_latencies.append(time.perf_counter() - start)
+            results['queries'][kind] = {**percentiles(search_latencies), 'found_first': round(found / len(sample), 3),
+                                        'request': percentiles(request_latencies)}
+            print(f"{kind}: search p50 {results['queries'][kind]['p50_ms']} ms, p99 {results['queries'][kind]['p99_ms']} ms, "
+                  f"found first {results['queries'][kind]['found_first']:.0%}; "
+                  f"/search/fuzzy request p50 {results['queries'][kind]['request']['p50_ms']} ms", file=sys.stderr)
+        db.close()
+        app.pool.close_all()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,93 +1,926 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import sqlite3
+import os
+import atexit
+import sys
+import threading
+import base64
+import binascii
+import json
 from sqlite3 import Connection, Cursor
+from typing import Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.audio import WavError, wav_properties
+from common.audio_codec import RAW, ZPCM, compress_audio, decompress_audio, decompress_range
+from common.compression import compress_app, etag_matches
+from common.db import ConnectionPool, initialisation_lock
+from common.fingerprint import INDEX_DTYPE, fingerprint_wav, vote
+from common.jobs import JobQueue
+from common.metrics import instrument_app, stage
+from common.search import TrackSearch, normalise
+from common.sharding import decode_cursor, encode_cursor, shard_of
+from common.tracing import trace_app
+from common.uploads import JSON, MULTIPART, NDJSON, is_binary_upload, read_binary_upload, stream_lines
 
 app = Flask(__name__)
+instrument_app(app)
+trace_app(app, 'catalogue')
+compress_app(app)
+
+# SQLite file of this catalogue, or of this shard when the catalogue is split across several
+DATABASE = os.environ.get('CATALOGUE_DATABASE', 'catalogue.db')
+
+# 'index/count' when this process is one shard of a sharded catalogue, e.g. '1/4'. Tracks are
+# owned by the shard common.sharding.shard_of() picks, and a shard refuses to store the tracks of another
+CATALOGUE_SHARD = os.environ.get('CATALOGUE_SHARD')
+
+# Maximum number of idle database connections kept open between requests
+POOL_SIZE = int(os.environ.get('CATALOGUE_POOL_SIZE', 16))
+
+# Number of hashes looked up per query when matching a fragment
+MATCH_BATCH_SIZE = 500
+
+# Number of fingerprint rows packed per chunk of an export
+EXPORT_BATCH_SIZE = 65536
+
+# Size of the chunks track audio is read from the database and streamed in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Largest page of tracks /tracks returns when paginating
+MAX_PAGE_SIZE = 1000
+
+# Number of rows fetched per step of a streamed /tracks listing
+LIST_BATCH_SIZE = 1000
+
+# Largest number of tracks one /add/bulk request may carry
+MAX_BULK_TRACKS = int(os.environ.get('MAX_BULK_TRACKS', 1000))
+
+# Number of (artist, title) pairs checked per query when looking for existing tracks
+BULK_LOOKUP_BATCH_SIZE = 400
+
+# Largest number of results /search/fuzzy returns
+MAX_SEARCH_RESULTS = 50
 
-DATABASE = 'catalogue.db'
+# How the audio of new tracks is stored: 'zpcm' compresses integer PCM WAV files losslessly (see
+# common.audio_codec) and keeps anything else as uploaded, 'raw' keeps every upload as it is
+SONG_ENCODING = os.environ.get('SONG_ENCODING', ZPCM)
+
+# zlib level the audio is compressed with, 1 (fastest) to 9 (smallest)
+SONG_COMPRESSION_LEVEL = int(os.environ.get('SONG_COMPRESSION_LEVEL', 6))
+
+# Worker threads processing the tracks queued by /add?async=true, per process
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+
+# Attempts at adding a queued track before its job fails, and the seconds before the first retry (doubled for each retry after it)
+INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 3))
+INGEST_RETRY_BACKOFF = float(os.environ.get('INGEST_RETRY_BACKOFF', 1.0))
+
+# Seconds an exiting process waits for each ingest worker to finish its current job
+INGEST_STOP_TIMEOUT = float(os.environ.get('INGEST_STOP_TIMEOUT', 10.0))
+
+# Columns describing a track without its audio, all read from the 'tracks_listing' covering index
+METADATA_COLUMNS = ('artist', 'title', 'size', 'duration', 'sample_rate', 'channels')
+
+# Index of the normalised artist and title of every track, for /search/fuzzy
+track_search = TrackSearch()
 
 # Helper functions:
+def create_pool() -> ConnectionPool:
+    """
+    Create the connection pool for the configured database.
+
+    Connections register search_text(), which the triggers keeping the search index up to date call.
+
+    Returns:
+        ConnectionPool: Pool of SQLite connections to DATABASE.
+    """
+    return ConnectionPool(DATABASE, POOL_SIZE, functions={'search_text': normalise})
+
+pool = create_pool()
+
 def get_db() -> Connection:
     """
-    Establish a connection to the SQLite database.
+    Get the SQLite database connection of the current request.
+
+    The connection is taken from the pool on first use and handed back when the request's
+    app context is torn down, so handlers must not close it.
     
     Returns:
         Connection: SQLite database connection object.
     """
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception: BaseException = None) -> None:
+    """
+    Return the request's database connection to the pool, rolling back any unfinished transaction.
+    """
+    db = g.pop('db', None)
+    if db is not None:
+        pool.release(db)
 
 def create_tables() -> None:
     """
-    Create the 'tracks' table in the database if it does not already exist.
+    Create the 'tracks', 'songs' and 'fingerprints' tables in the database if they do not already exist.
+
+    Tracks hold the metadata of each track under an integer id: its artist and title, and the size,
+    duration, sample rate and channels of its audio, read from the WAV header when it is added (NULL
+    for audio that is not a WAV file). The audio is kept apart in 'songs', keyed by the same id, so
+    metadata queries never page through audio; its 'encoding' says whether it is stored as uploaded
+    ('raw') or losslessly compressed ('zpcm'), in which case 'size' is still that of the upload. The 'tracks_listing' index holds every
+    metadata column in (artist, title) order, which /tracks reads without touching the table.
+    Fingerprints reference their track by its id, and are clustered on the hash so that matching a
+    fragment is an index range lookup per hash. Triggers bump the single row of 'catalogue_version'
+    whenever 'tracks' changes, which is what /tracks uses as its ETag; others keep the search index
+    of common.search.TrackSearch in step with it, which is rebuilt if it was created after the tracks.
+    The tables of the ingest job queue (see common.jobs.JobQueue) live alongside them, so a queued
+    track is added and its job marked done in one transaction. Databases from earlier versions are
+    migrated in place. Worker processes starting together take turns (see common.db.initialisation_lock()),
+    so only the first one migrates.
     """
     create_tables_sql = """
     CREATE TABLE IF NOT EXISTS tracks (
+        id INTEGER PRIMARY KEY,
         artist TEXT NOT NULL,
         title TEXT NOT NULL,
-        encoded_song BLOB NOT NULL,
-        PRIMARY KEY (artist, title)
+        size INTEGER NOT NULL,
+        duration REAL,
+        sample_rate INTEGER,
+        channels INTEGER,
+        UNIQUE (artist, title)
+    );
+    CREATE TABLE IF NOT EXISTS songs (
+        track_id INTEGER PRIMARY KEY,
+        song BLOB NOT NULL,
+        encoding TEXT NOT NULL DEFAULT 'raw'
+    );
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        hash INTEGER NOT NULL,
+        track_id INTEGER NOT NULL,
+        track_offset INTEGER NOT NULL,
+        PRIMARY KEY (hash, track_id, track_offset)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS fingerprints_track_id ON fingerprints (track_id);
+    CREATE TABLE IF NOT EXISTS catalogue_version (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        epoch TEXT NOT NULL,
+        version INTEGER NOT NULL
     );
+    INSERT OR IGNORE INTO catalogue_version (id, epoch, version) VALUES (0, lower(hex(randomblob(8))), 0);
+    """
+    # Created after any migration, which replaces the 'tracks' table and with it its indexes and triggers
+    create_triggers_sql = """
+    CREATE INDEX IF NOT EXISTS tracks_listing ON tracks (artist, title, size, duration, sample_rate, channels);
+    CREATE TRIGGER IF NOT EXISTS tracks_version_insert AFTER INSERT ON tracks
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS tracks_version_update AFTER UPDATE ON tracks
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS tracks_version_delete AFTER DELETE ON tracks
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+    """
+    with initialisation_lock(pool.database):
+        db = pool.connect()
+        cursor = db.cursor()
+        cursor.executescript(create_tables_sql)
+        db.commit()
+        cursor.close()
+        migrate_encoded_songs(db)
+        migrate_song_encoding(db)
+        migrate_song_column(db)
+        db.executescript(create_triggers_sql)
+        db.executescript(track_search.schema())
+        db.executescript(ingest_queue.schema())
+        db.commit()
+        track_search.rebuild_if_stale(db)
+        db.close()
+
+def migrate_encoded_songs(db: Connection) -> None:
+    """
+    Convert a 'tracks' table from the old base64 'encoded_song' column to raw 'song' BLOBs.
+
+    Rowids are kept so the stored fingerprints still point at their tracks.
+
+    Args:
+        db (Connection): SQLite database connection object.
     """
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(create_tables_sql)
+    columns = [column['name'] for column in db.execute('PRAGMA table_info(tracks)')]
+    if 'encoded_song' not in columns:
+        return
+
+    db.execute("""
+    CREATE TABLE tracks_migrated (
+        artist TEXT NOT NULL,
+        title TEXT NOT NULL,
+        song BLOB NOT NULL,
+        PRIMARY KEY (artist, title)
+    )
+    """)
+    rowids = [row['rowid'] for row in db.execute('SELECT rowid FROM tracks')]
+    for rowid in rowids:
+        track = db.execute('SELECT artist, title, encoded_song FROM tracks WHERE rowid = ?', (rowid,)).fetchone()
+        db.execute('INSERT INTO tracks_migrated (rowid, artist, title, song) VALUES (?, ?, ?, ?)',
+                   (rowid, track['artist'], track['title'], decode_song(track['encoded_song'])))
+    db.execute('DROP TABLE tracks')
+    db.execute('ALTER TABLE tracks_migrated RENAME TO tracks')
     db.commit()
-    cursor.close()
-    db.close()
 
-# Initialise the database
-create_tables()
+def migrate_song_encoding(db: Connection) -> None:
+    """
+    Add the 'encoding' column to a 'songs' table from before audio could be stored compressed.
+    Its songs are marked 'raw', as they were stored; compress_songs.py compresses them.
 
-# Routes
-@app.route('/add', methods=['POST'])
-def add_track() -> jsonify:
+    Args:
+        db (Connection): SQLite database connection object.
     """
-    Add a new track to the database.
-    
+    columns = [column['name'] for column in db.execute('PRAGMA table_info(songs)')]
+    if 'encoding' not in columns:
+        db.execute("ALTER TABLE songs ADD COLUMN encoding TEXT NOT NULL DEFAULT 'raw'")
+        db.commit()
+
+def migrate_song_column(db: Connection) -> None:
+    """
+    Move the audio of a 'tracks' table that still stores it in a 'song' column into 'songs', and
+    fill in the properties read from each song's WAV header.
+
+    The tracks keep their rowids as ids, so the stored fingerprints and the search index still
+    point at them. The migration runs in one transaction, so an interrupted one leaves the
+    database as it was, and it bumps the catalogue version, as listings now carry the properties.
+
+    Args:
+        db (Connection): SQLite database connection object.
+    """
+    columns = [column['name'] for column in db.execute('PRAGMA table_info(tracks)')]
+    if 'song' not in columns:
+        return
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute("""
+        CREATE TABLE tracks_migrated (
+            id INTEGER PRIMARY KEY,
+            artist TEXT NOT NULL,
+            title TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            duration REAL,
+            sample_rate INTEGER,
+            channels INTEGER,
+            UNIQUE (artist, title)
+        )
+        """)
+        rowids = [row['rowid'] for row in db.execute('SELECT rowid FROM tracks')]
+        for rowid in rowids:
+            # One song in memory at a time
+            track = db.execute('SELECT artist, title, song FROM tracks WHERE rowid = ?', (rowid,)).fetchone()
+            db.execute('INSERT INTO tracks_migrated (id, artist, title, size, duration, sample_rate, channels) '
+                       'VALUES (:id, :artist, :title, :size, :duration, :sample_rate, :channels)',
+                       {'id': rowid, 'artist': track['artist'], 'title': track['title'], **song_properties(track['song'])})
+            db.execute('INSERT INTO songs (track_id, song) VALUES (?, ?)', (rowid, track['song']))
+        db.execute('DROP TABLE tracks')
+        db.execute('ALTER TABLE tracks_migrated RENAME TO tracks')
+        db.execute('UPDATE catalogue_version SET version = version + 1')
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+
+def read_song_chunks(track_id: int, start: int, stop: int) -> Iterator[bytes]:
+    """
+    Read a byte range of a track's audio in fixed-size chunks.
+
+    Uses incremental blob I/O so only one chunk is in memory at a time; on Python versions
+    without Connection.blobopen it falls back to substr() queries. Compressed audio is decoded
+    as it is streamed, one block of about a chunk at a time, from the blocks the range overlaps.
+
+    The stream outlives the request that started it, so it holds its own pooled connection.
+
+    Args:
+        track_id (int): Id of the track.
+        start (int): First byte to read.
+        stop (int): Byte to stop before.
+
+    Yields:
+        bytes: The next chunk of audio.
+    """
+    db = pool.acquire()
+    blob = None
+    try:
+        row = db.execute('SELECT encoding FROM songs WHERE track_id = ?', (track_id,)).fetchone()
+        if row is None:
+            return
+        if hasattr(db, 'blobopen'):
+            blob = db.blobopen('songs', 'song', track_id, readonly=True)
+
+            def read(offset: int, length: int) -> bytes:
+                blob.seek(offset)
+                return blob.read(length)
+        else:
+            def read(offset: int, length: int) -> bytes:
+                chunk = db.execute('SELECT substr(song, ?, ?) FROM songs WHERE track_id = ?', (offset + 1, length, track_id)).fetchone()
+                return chunk[0] if chunk and chunk[0] else b''
+
+        if row['encoding'] == ZPCM:
+            yield from decompress_range(read, start, stop)
+            return
+        for position in range(start, stop, DOWNLOAD_CHUNK_SIZE):
+            chunk = read(position, min(DOWNLOAD_CHUNK_SIZE, stop - position))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if blob is not None:
+            blob.close()
+        pool.release(db)
+
+def read_song(db: Connection, track_id: int) -> bytes:
+    """
+    Read the whole audio of a track, decoding it if it is stored compressed.
+
+    Args:
+        db (Connection): SQLite database connection object.
+        track_id (int): Id of the track.
+
     Returns:
-        jsonify: JSON response indicating success or failure.
+        bytes: The audio as it was uploaded.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
-    # Get the song data from the request
-    data = request.json
+    with stage('db_query'):
+        row = db.execute('SELECT song, encoding FROM songs WHERE track_id = ?', (track_id,)).fetchone()
+    if row['encoding'] == ZPCM:
+        with stage('decode_audio'):
+            return decompress_audio(row['song'])
+    return row['song']
+
+def pack_song(song: bytes) -> Tuple[bytes, str]:
+    """
+    Encode a track's audio for storage as SONG_ENCODING says.
+
+    Args:
+        song (bytes): The audio as uploaded.
+
+    Returns:
+        Tuple[bytes, str]: The bytes to store and their encoding, 'zpcm' or 'raw'.
+    """
+    if SONG_ENCODING == ZPCM:
+        with stage('encode_audio'):
+            compressed = compress_audio(song, SONG_COMPRESSION_LEVEL)
+        if compressed is not None:
+            return compressed, ZPCM
+    return song, RAW
+
+def download_reference(artist: str, title: str) -> str:
+    """
+    Build the path a track's audio can be downloaded from.
+
+    A proxy serving the endpoint under another path (the gateway's /catalogue/download) names
+    that path's prefix in the 'X-Forwarded-Prefix' header, so responses can be relayed untouched.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+
+    Returns:
+        str: Path and query string of the download endpoint.
+    """
+    prefix = request.headers.get('X-Forwarded-Prefix', '').rstrip('/')
+    if not prefix.startswith('/'):
+        prefix = ''
+    return f"{prefix}/download?{urlencode({'artist': artist, 'title': title})}"
+
+def catalogue_etag(db: Connection) -> str:
+    """
+    Build the entity tag of the catalogue's current contents.
 
+    The epoch is random per database file, so a recreated database never reuses old tags.
+
+    Args:
+        db (Connection): SQLite database connection object.
+
+    Returns:
+        str: Quoted entity tag.
+    """
+    row = db.execute('SELECT epoch, version FROM catalogue_version').fetchone()
+    return f'"{row["epoch"]}-{row["version"]}"'
+
+def parse_shard(value: Optional[str]) -> Tuple[int, int]:
+    """
+    Parse the CATALOGUE_SHARD setting.
+
+    Args:
+        value (Optional[str]): 'index/count', or None for an unsharded catalogue.
+
+    Returns:
+        Tuple[int, int]: Index of this shard and the number of shards.
+
+    Raises:
+        ValueError: If the setting is malformed.
+    """
+    if not value:
+        return 0, 1
+    index, _, count = value.partition('/')
+    if not index.isdigit() or not count.isdigit() or not int(index) < int(count):
+        raise ValueError(f"CATALOGUE_SHARD must be 'index/count', e.g. '0/4', not {value!r}")
+    return int(index), int(count)
+
+SHARD_INDEX, SHARD_COUNT = parse_shard(CATALOGUE_SHARD)
+
+def owning_shard_error(artist: str, title: str) -> Optional[str]:
+    """
+    Check a track being added belongs to this shard, so a misrouted write cannot hide it from the router.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+
+    Returns:
+        Optional[str]: Error message naming the owning shard, or None if this shard owns the track.
+    """
+    owner = shard_of(artist, title, SHARD_COUNT)
+    if owner == SHARD_INDEX:
+        return None
+    return f'Track belongs to catalogue shard {owner}/{SHARD_COUNT}'
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Find the smallest string greater than every string starting with a prefix.
+
+    Args:
+        prefix (str): Non-empty prefix.
+
+    Returns:
+        Optional[str]: Exclusive upper bound, or None if there is none.
+    """
+    while prefix and ord(prefix[-1]) == 0x10FFFF:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def decode_song(encoded_song: str) -> bytes:
+    """
+    Decode a base64 encoded track stored by earlier versions, tolerating content that is not valid base64.
+
+    Args:
+        encoded_song (str): Base64 encoded track.
+
+    Returns:
+        bytes: The decoded track, empty if it could not be decoded.
+    """
+    try:
+        return base64.b64decode(encoded_song)
+    except (binascii.Error, ValueError):
+        return b''
+
+def song_properties(song: bytes) -> dict:
+    """
+    Read the properties stored with a track from its audio.
+
+    Args:
+        song (bytes): The track's audio file.
+
+    Returns:
+        dict: 'size' in bytes, and the 'duration', 'sample_rate' and 'channels' of its WAV header,
+            None for audio that is not a WAV file.
+    """
+    try:
+        properties = wav_properties(song, len(song))
+    except WavError:
+        properties = {'duration': None, 'sample_rate': None, 'channels': None}
+    return {'size': len(song), **properties}
+
+def track_metadata(track: sqlite3.Row) -> dict:
+    """
+    Returns:
+        dict: The METADATA_COLUMNS of a 'tracks' row.
+    """
+    return {column: track[column] for column in METADATA_COLUMNS}
+
+def compute_fingerprints(song: bytes) -> List[Tuple[int, int]]:
+    """
+    Fingerprint a WAV track.
+
+    Tracks that are not decodable WAV files are still accepted into the catalogue, they
+    just cannot be matched by the local identification backend.
+
+    Args:
+        song (bytes): The track's audio file.
+
+    Returns:
+        List[Tuple[int, int]]: (hash, offset) pairs, empty if the track could not be decoded.
+    """
+    try:
+        with stage('fingerprint'):
+            return fingerprint_wav(song)
+    except WavError:
+        return []
+
+def store_fingerprints(db: Connection, track_id: int, fingerprints: List[Tuple[int, int]]) -> None:
+    """
+    Replace the stored fingerprints of a track. The caller is responsible for committing.
+
+    Args:
+        db (Connection): SQLite database connection object.
+        track_id (int): Id of the track in the 'tracks' table.
+        fingerprints (List[Tuple[int, int]]): (hash, offset) pairs of the track.
+    """
+    db.execute('DELETE FROM fingerprints WHERE track_id = ?', (track_id,))
+    db.executemany('INSERT OR IGNORE INTO fingerprints (hash, track_id, track_offset) VALUES (?, ?, ?)',
+                   ((hash_value, track_id, offset) for hash_value, offset in fingerprints))
+
+def parse_track(data: Optional[dict], song: Optional[bytes] = None) -> Tuple[str, str, bytes]:
+    """
+    Validate the fields of a track to add and decode its audio.
+
+    Args:
+        data (Optional[dict]): The track's fields: 'artist', 'title' and, for JSON uploads, 'encoded_song'.
+        song (Optional[bytes]): The audio of a raw upload, None for JSON uploads.
+
+    Returns:
+        Tuple[str, str, bytes]: Artist, title and the raw audio.
+
+    Raises:
+        ValueError: If a field is missing, is not a string, or the song is not valid base64.
+    """
     # Check if the required fields are present
     if not data:
-        return jsonify({'error': 'No data provided'}), 400
+        raise ValueError('No data provided')
+    if not isinstance(data, dict):
+        raise ValueError('Track must be a JSON object')
     if 'artist' not in data:
-        return jsonify({'error': 'Artist is required'}), 400
+        raise ValueError('Artist is required')
     if 'title' not in data:
-        return jsonify({'error': 'Title is required'}), 400
-    if 'encoded_song' not in data:
-        return jsonify({'error': 'Encoded song is required'}), 400
-    
+        raise ValueError('Title is required')
+    if song is None and 'encoded_song' not in data:
+        raise ValueError('Encoded song is required')
+
     # Check if all fields are strings
     for field, value in data.items():
         if not isinstance(value, str):
-            return jsonify({'error': f'{field.capitalize()} must be a string'}), 400
-    
+            raise ValueError(f'{field.capitalize()} must be a string')
+
+    # Songs are stored as raw bytes, so JSON uploads are decoded once here
+    if song is None:
+        try:
+            with stage('decode'):
+                song = base64.b64decode(data['encoded_song'], validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError('Encoded song must be Base64 encoded')
+    return data['artist'], data['title'], song
+
+def read_bulk_items() -> Iterator[Tuple[Optional[dict], Optional[bytes]]]:
+    """
+    Read the tracks of a bulk add request.
+
+    Accepts a JSON body {"tracks": [...]}, an NDJSON body with one track object per line (read
+    line by line as it arrives), or a multipart/form-data body with repeated 'artist', 'title'
+    and 'song' fields matched up by position.
+
+    Yields:
+        Tuple[Optional[dict], Optional[bytes]]: The fields of each track and, for multipart bodies, its audio.
+        Lines of an NDJSON body that are not valid JSON yield (None, None).
+
+    Raises:
+        ValueError: If the body as a whole is malformed.
+    """
+    if request.mimetype == MULTIPART:
+        artists, titles = request.form.getlist('artist'), request.form.getlist('title')
+        songs = request.files.getlist('song')
+        if not len(artists) == len(titles) == len(songs):
+            raise ValueError('Each song needs an artist and a title')
+        for artist, title, song in zip(artists, titles, songs):
+            yield {'artist': artist, 'title': title}, song.read()
+
+    elif request.mimetype == NDJSON:
+        for line in stream_lines(request):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError:
+                yield None, None
+
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('tracks'), list):
+            raise ValueError('Tracks must be a JSON list')
+        for track in data['tracks']:
+            yield track, None
+
+def find_existing_tracks(db: Connection, keys: List[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+    """
+    Find which of a list of tracks are already in the catalogue.
+
+    Args:
+        db (Connection): SQLite database connection object.
+        keys (List[Tuple[str, str]]): Artist and title of each track.
+
+    Returns:
+        Set[Tuple[str, str]]: The keys that already exist.
+    """
+    existing = set()
+    for start in range(0, len(keys), BULK_LOOKUP_BATCH_SIZE):
+        batch = keys[start:start + BULK_LOOKUP_BATCH_SIZE]
+        values = ', '.join('(?, ?)' for _ in batch)
+        rows = db.execute(f'SELECT artist, title FROM tracks WHERE (artist, title) IN (VALUES {values})',
+                          [field for key in batch for field in key])
+        existing.update((row['artist'], row['title']) for row in rows)
+    return existing
+
+def store_track(db: Connection, artist: str, title: str, song: bytes) -> Tuple[dict, int]:
+    """
+    Fingerprint a track and insert it with its audio and fingerprints, leaving the transaction for the caller to commit.
+
+    Args:
+        db (Connection): SQLite database connection object.
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+        song (bytes): Raw audio of the track.
+
+    Returns:
+        Tuple[dict, int]: The response body and status code: 201 once inserted, 409 if the track already exists.
+    """
+    # Check if the track already exists
+    with stage('db_query'):
+        existing_track = db.execute('SELECT id FROM tracks WHERE artist = ? AND title = ?', (artist, title)).fetchone()
+    if existing_track:
+        return {'error': 'Track already exists'}, 409
+
+    # Fingerprint and compress the track before taking the write lock
+    fingerprints = compute_fingerprints(song)
+    stored, encoding = pack_song(song)
+
+    # Insert the new track, its audio and its fingerprints in one transaction. The same track may have
+    # been added by another request while this one was fingerprinting, in which case nothing is inserted
+    with stage('db_write'):
+        cursor = db.execute('INSERT INTO tracks (artist, title, size, duration, sample_rate, channels) '
+                            'VALUES (:artist, :title, :size, :duration, :sample_rate, :channels) '
+                            'ON CONFLICT (artist, title) DO NOTHING',
+                            {'artist': artist, 'title': title, **song_properties(song)})
+        if cursor.rowcount == 0:
+            return {'error': 'Track already exists'}, 409
+        db.execute('INSERT INTO songs (track_id, song, encoding) VALUES (?, ?, ?)', (cursor.lastrowid, stored, encoding))
+        store_fingerprints(db, cursor.lastrowid, fingerprints)
+    return {'message': 'Track added successfully'}, 201
+
+def ingest_track(db: Connection, params: dict, song: Optional[bytes]) -> Tuple[dict, int]:
+    """
+    Process a job of the ingest queue: add the track /add?async=true queued.
+
+    Args:
+        db (Connection): The worker's connection.
+        params (dict): Artist and title of the track.
+        song (Optional[bytes]): Raw audio of the track.
+
+    Returns:
+        Tuple[dict, int]: The response /add would have given.
+    """
+    return store_track(db, params['artist'], params['title'], song)
+
+def format_job_id(job_id: int) -> str:
+    """
+    Build the public id of an ingest job. Ids of a sharded catalogue start with the shard's index,
+    e.g. '1.17', so the gateway can route status requests to the shard holding the job.
+    """
+    return f'{SHARD_INDEX}.{job_id}' if CATALOGUE_SHARD else str(job_id)
+
+def parse_job_id(value: str) -> Optional[int]:
+    """
+    Parse the public id of an ingest job.
+
+    Args:
+        value (str): Id made by format_job_id().
+
+    Returns:
+        Optional[int]: Id of the job in this catalogue's queue, None if the id is malformed or names another shard.
+    """
+    shard, _, job_id = value.rpartition('.')
+    if not job_id.isdigit() or shard != (str(SHARD_INDEX) if CATALOGUE_SHARD else ''):
+        return None
+    return int(job_id)
+
+def job_reference(job_id: str) -> str:
+    """
+    Build the path an ingest job's status can be read from, under the prefix a proxy names in
+    'X-Forwarded-Prefix' (see download_reference()).
+
+    Args:
+        job_id (str): Public id of the job.
+
+    Returns:
+        str: Path of the job status endpoint.
+    """
+    prefix = request.headers.get('X-Forwarded-Prefix', '').rstrip('/')
+    if not prefix.startswith('/'):
+        prefix = ''
+    return f'{prefix}/jobs/{job_id}'
+
+def queue_track(artist: str, title: str, song: bytes) -> jsonify:
+    """
+    Queue a validated track for the ingest workers to fingerprint and add, answering at once.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+        song (bytes): Raw audio of the track.
+
+    Returns:
+        jsonify: 202 Accepted with the job's id and the URL of its status (also in the 'Location' header),
+            or an error message.
+    """
     try:
         db = get_db()
-        # Check if the track already exists
-        cursor = db.execute('SELECT * FROM tracks WHERE artist = ? AND title = ?', (data['artist'], data['title']))
-        existing_track = cursor.fetchone()
+        # Tracks already in the catalogue are refused now rather than by the job
+        with stage('db_query'):
+            existing_track = db.execute('SELECT id FROM tracks WHERE artist = ? AND title = ?', (artist, title)).fetchone()
         if existing_track:
             return jsonify({'error': 'Track already exists'}), 409
+
+        with stage('db_write'):
+            job_id = format_job_id(ingest_queue.enqueue(db, {'artist': artist, 'title': title}, song))
+        status_url = job_reference(job_id)
+        return jsonify({'message': 'Track queued', 'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+    except Exception as e:
+        return jsonify({'error': 'Failed to queue track', 'message': str(e)}), 500
+
+# Tracks queued by /add?async=true, added by a pool of worker threads (see common.jobs.JobQueue)
+ingest_queue = JobQueue(pool, 'ingest', ingest_track, workers=INGEST_WORKERS, max_attempts=INGEST_MAX_ATTEMPTS,
+                        retry_backoff=INGEST_RETRY_BACKOFF)
+
+# Whether this process has initialised the database, which its first request does (see initialise())
+initialised = False
+initialise_lock = threading.Lock()
+
+@app.before_request
+def initialise() -> None:
+    """
+    Initialise the database (see create_tables()) before the first request the process serves.
+
+    Importing the module leaves the database alone, so tools can point DATABASE and the pool at
+    another catalogue first, then call create_tables() themselves.
+    """
+    global initialised
+    if initialised:
+        return
+    with initialise_lock:
+        if not initialised:
+            create_tables()
+            initialised = True
+
+@app.before_request
+def start_ingest_workers() -> None:
+    """
+    Start the ingest workers with the first request, so they run in the process serving requests (and
+    not, say, in the parent process of Flask's reloader or of a pre-forking server), picking up jobs
+    left queued by an earlier run.
+    """
+    ingest_queue.start()
+
+# Let the ingest workers finish their current job when the process exits, e.g. a server worker being
+# replaced by a graceful reload, rather than leaving it to be retried once its lease runs out
+atexit.register(ingest_queue.stop, INGEST_STOP_TIMEOUT)
+
+# Routes
+@app.route('/add', methods=['POST'])
+def add_track() -> jsonify:
+    """
+    Add a new track to the database.
+
+    With 'async=true' the track is checked and queued, and fingerprinted and added by the ingest
+    workers after the response (see queue_track()).
+    
+    Returns:
+        jsonify: JSON response indicating success or failure.
+    """
+    song = None
+    if is_binary_upload(request):
+        # Raw audio uploads carry the metadata in headers or form fields
+        data, song = read_binary_upload(request, 'song')
+        if song is None:
+            return jsonify({'error': 'Song file is required'}), 400
+    else:
+        # Check if the request is JSON
+        if not request.is_json:
+            return jsonify({'error': 'Request must be JSON'}), 415
         
-        # Insert the new track
-        db.execute('INSERT INTO tracks (artist, title, encoded_song) VALUES (?, ?, ?)',
-                   (data['artist'], data['title'], data['encoded_song']))
+        # Get the song data from the request
+        data = request.json
+
+    # Check the fields and decode the song
+    try:
+        artist, title, song = parse_track(data, song)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 421 Misdirected Request: the track is stored by another shard
+    error = owning_shard_error(artist, title)
+    if error:
+        return jsonify({'error': error}), 421
+
+    if request.args.get('async', 'false').lower() in ('true', '1'):
+        return queue_track(artist, title, song)
+
+    try:
+        db = get_db()
+        body, status = store_track(db, artist, title, song)
         db.commit()
-        return jsonify({'message': 'Track added successfully'}), 201
+        return jsonify(body), status
     except Exception as e:
         return jsonify({'error': 'Failed to add track', 'message': str(e)}), 500
 
 
+@app.route('/add/bulk', methods=['POST'])
+def add_tracks_bulk() -> jsonify:
+    """
+    Add many tracks to the database in a single transaction.
+
+    The body is a JSON object {"tracks": [{artist, title, encoded_song}, ...]}, NDJSON with one such
+    object per line, or multipart/form-data with repeated 'artist', 'title' and 'song' fields.
+    Every track gets its own status in the response, mirroring what /add would have returned for it:
+    201 when added, 400 when invalid and 409 when it already exists or is repeated in the request
+    (and 421 on a shard that does not own it).
+    
+    Returns:
+        jsonify: JSON response with the number of tracks added and the result of each track.
+    """
+    # Check the content type
+    if request.mimetype not in (JSON, NDJSON, MULTIPART):
+        return jsonify({'error': 'Request must be JSON, NDJSON or multipart/form-data'}), 415
+
+    # Check the fields of every track, keeping the valid ones in request order
+    results = []
+    pending = []
+    seen = set()
+    try:
+        for index, (data, song) in enumerate(read_bulk_items()):
+            if index >= MAX_BULK_TRACKS:
+                return jsonify({'error': f'At most {MAX_BULK_TRACKS} tracks can be added per request'}), 400
+            if data is None:
+                results.append({'index': index, 'status': 400, 'error': 'Invalid JSON'})
+                continue
+            try:
+                artist, title, song = parse_track(data, song)
+            except ValueError as e:
+                results.append({'index': index, 'status': 400, 'error': str(e)})
+                continue
+
+            result = {'index': index, 'artist': artist, 'title': title}
+            error = owning_shard_error(artist, title)
+            if error:
+                result.update(status=421, error=error)
+            elif (artist, title) in seen:
+                result.update(status=409, error='Duplicate track in request')
+            else:
+                seen.add((artist, title))
+                pending.append((result, song))
+            results.append(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not results:
+        return jsonify({'error': 'No tracks provided'}), 400
+
+    # Fingerprint and compress the tracks before taking the write lock
+    fingerprints = [compute_fingerprints(song) for _, song in pending]
+    packed = [pack_song(song) for _, song in pending]
+
+    try:
+        db = get_db()
+        # Hold the write lock from the existence check to the commit, so the ids handed out
+        # below stay free and the fingerprints can be inserted alongside their tracks
+        db.execute('BEGIN IMMEDIATE')
+        existing = find_existing_tracks(db, [(result['artist'], result['title']) for result, _ in pending])
+        track_id = db.execute('SELECT coalesce(max(id), 0) FROM tracks').fetchone()[0]
+
+        track_rows = []
+        song_rows = []
+        fingerprint_rows = []
+        for (result, song), track_fingerprints, (stored, encoding) in zip(pending, fingerprints, packed):
+            if (result['artist'], result['title']) in existing:
+                result.update(status=409, error='Track already exists')
+                continue
+            track_id += 1
+            track_rows.append({'id': track_id, 'artist': result['artist'], 'title': result['title'], **song_properties(song)})
+            song_rows.append((track_id, stored, encoding))
+            fingerprint_rows.extend((hash_value, track_id, offset) for hash_value, offset in track_fingerprints)
+            result.update(status=201, message='Track added successfully')
+
+        with stage('db_write'):
+            db.executemany('INSERT INTO tracks (id, artist, title, size, duration, sample_rate, channels) '
+                           'VALUES (:id, :artist, :title, :size, :duration, :sample_rate, :channels) '
+                           'ON CONFLICT (artist, title) DO NOTHING', track_rows)
+            db.executemany('INSERT INTO songs (track_id, song, encoding) VALUES (?, ?, ?)', song_rows)
+            db.executemany('INSERT OR IGNORE INTO fingerprints (hash, track_id, track_offset) VALUES (?, ?, ?)', fingerprint_rows)
+            db.commit()
+    except Exception as e:
+        return jsonify({'error': 'Failed to add tracks', 'message': str(e)}), 500
+
+    return jsonify({'message': 'Bulk add processed', 'added': len(track_rows), 'results': results}), 200
+
+
 @app.route('/delete', methods=['DELETE'])
 def delete_track() -> jsonify:
     """
@@ -109,13 +942,15 @@ def delete_track() -> jsonify:
         db = get_db()
 
         # Check if the track exists
-        cursor = db.execute('SELECT * FROM tracks WHERE artist = ? AND title = ?', (artist, title))
+        cursor = db.execute('SELECT id FROM tracks WHERE artist = ? AND title = ?', (artist, title))
         track = cursor.fetchone()
         if not track:
             return jsonify({'error': 'Track not found'}), 404
         
-        # Delete the track
-        db.execute('DELETE FROM tracks WHERE artist = ? AND title = ?', (artist, title))
+        # Delete the track, its audio and its fingerprints
+        db.execute('DELETE FROM fingerprints WHERE track_id = ?', (track['id'],))
+        db.execute('DELETE FROM songs WHERE track_id = ?', (track['id'],))
+        db.execute('DELETE FROM tracks WHERE id = ?', (track['id'],))
         db.commit()
         return jsonify({'message': 'Track deleted successfully'}), 200
     except Exception as e:
@@ -123,34 +958,104 @@ def delete_track() -> jsonify:
     
 
 @app.route('/tracks', methods=['GET'])
-def list_tracks() -> jsonify:
+def list_tracks() -> Response:
     """
-    List all tracks in the database.
+    List the tracks in the database with the properties of their audio, ordered by artist then title.
+
+    Query parameters:
+        limit: Page size (at most MAX_PAGE_SIZE). Without it every track is returned as a streamed JSON document.
+        cursor: The 'next_cursor' of the previous page.
+        prefix: Only list artists starting with this (case-sensitive) prefix.
+
+    Every response carries the catalogue version as its ETag, and a request whose 'If-None-Match'
+    still matches it gets '304 Not Modified' without the tracks table being read.
     
     Returns:
-        jsonify: JSON response containing the list of tracks or an error message.
+        Response: JSON response containing the list of tracks or an error message.
     """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    prefix = request.args.get('prefix')
+
+    # Check the pagination parameters
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            return jsonify({'error': f'Limit must be an integer between 1 and {MAX_PAGE_SIZE}'}), 400
+        limit = int(limit)
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    # Keyset conditions, all answered from the 'tracks_listing' index, which also covers the listed columns
+    conditions, parameters = [], []
+    if cursor is not None:
+        conditions.append('(artist, title) > (?, ?)')
+        parameters.extend(after)
+    if prefix:
+        conditions.append('artist >= ?')
+        parameters.append(prefix)
+        upper_bound = prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            conditions.append('artist < ?')
+            parameters.append(upper_bound)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"SELECT {', '.join(METADATA_COLUMNS)} FROM tracks {where} ORDER BY artist, title"
+
     try:
         db = get_db()
-        cursor = db.execute('SELECT artist, title FROM tracks')
-        tracks = cursor.fetchall()
+        etag = catalogue_etag(db)
+        if etag_matches(request.if_none_match, etag):
+            return Response(status=304, headers={'ETag': etag})
+
+        if limit is not None:
+            with stage('db_query'):
+                tracks = db.execute(f'{query} LIMIT ?', (*parameters, limit + 1)).fetchall()
+            if not tracks:
+                return jsonify({'message': 'No tracks found'}), 404, {'ETag': etag}
+
+            next_cursor = encode_cursor(tracks[limit - 1]['artist'], tracks[limit - 1]['title']) if len(tracks) > limit else None
+            return jsonify({'message': 'Tracks listed',
+                            'tracks': [track_metadata(track) for track in tracks[:limit]],
+                            'next_cursor': next_cursor}), 200, {'ETag': etag}
+
+        if db.execute(f'SELECT 1 FROM tracks {where} LIMIT 1', parameters).fetchone() is None:
+            return jsonify({'message': 'No tracks found'}), 404, {'ETag': etag}
 
-        if not tracks:
-            return jsonify({'message': 'No tracks found'}), 404
-        
-        return jsonify({'message': 'Tracks listed', 'tracks' : [{'artist': track['artist'], 'title': track['title']} for track in tracks]}), 200
-    
     except Exception as e:
         return jsonify({'error': 'Failed to list tracks', 'message': str(e)}), 500
+
+    def generate():
+        # The stream outlives the request, so it holds its own pooled connection
+        stream_db = pool.acquire()
+        try:
+            yield '{"message": "Tracks listed", "tracks": ['
+            rows = stream_db.execute(query, parameters)
+            separator = ''
+            while True:
+                batch = rows.fetchmany(LIST_BATCH_SIZE)
+                if not batch:
+                    break
+                yield separator + ', '.join(json.dumps(track_metadata(track)) for track in batch)
+                separator = ', '
+            yield ']}'
+        finally:
+            pool.release(stream_db)
+
+    return Response(generate(), status=200, mimetype='application/json', headers={'ETag': etag})
     
 
 @app.route('/search', methods=['POST'])
 def search() -> jsonify:
     """
     Search for a track in the database by artist and title.
+
+    The response carries the track's metadata and a reference to download its audio from.
+    The audio itself is only inlined, base64 encoded, when the 'include_song' query parameter is 'true'.
     
     Returns:
-        jsonify: JSON response containing the track details - including encoded song, or an error message.
+        jsonify: JSON response containing the track details, or an error message.
     """
     # Check if the request is JSON
     if not request.is_json:
@@ -171,20 +1076,305 @@ def search() -> jsonify:
         if not isinstance(value, str):
             return jsonify({'error': f'{field.capitalize()} must be a string'}), 400
 
+    include_song = request.args.get('include_song', 'false').lower() == 'true'
+
     try:
         db = get_db()
-        cursor = db.execute('SELECT * FROM tracks WHERE artist = ? AND title = ?', (song_data['artist'], song_data['title']))
-        track = cursor.fetchone()
+        with stage('db_query'):
+            track = db.execute(f"SELECT id, {', '.join(METADATA_COLUMNS)} FROM tracks WHERE artist = ? AND title = ?",
+                               (song_data['artist'], song_data['title'])).fetchone()
 
         if not track:
             return jsonify({'error': 'Track not found in catalogue'}), 404
         
-        return jsonify({'message': 'Track found', 'artist': track['artist'], 'title': track['title'], 'encoded_song': track['encoded_song']}), 200
+        result = {
+            'message': 'Track found',
+            **track_metadata(track),
+            'download_url': download_reference(track['artist'], track['title'])
+        }
+        if include_song:
+            song = read_song(db, track['id'])
+            with stage('encode'):
+                result['encoded_song'] = base64.b64encode(song).decode('utf-8')
+        with stage('serialise'):
+            return jsonify(result), 200
     
     except Exception as e:
         return jsonify({'error': 'Database error', 'message': str(e)}), 500
 
 
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch() -> jsonify:
+    """
+    Look up many tracks by artist and title in one request, e.g. the matches of a batch identification.
+
+    The request body is {"tracks": [{"artist": ..., "title": ...}, ...]}. Tracks are looked up with
+    a few multi-key queries rather than one query per track, and only the ones found are returned.
+
+    Returns:
+        jsonify: JSON response listing the metadata and download reference of each track found, or an error message.
+    """
+    # Check if the request is JSON
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 415
+
+    data = request.json
+    if not isinstance(data, dict) or not isinstance(data.get('tracks'), list):
+        return jsonify({'error': 'Tracks must be a JSON list'}), 400
+    if len(data['tracks']) > MAX_BULK_TRACKS:
+        return jsonify({'error': f'A batch holds at most {MAX_BULK_TRACKS} tracks'}), 413
+
+    # Check each track has a string artist and title
+    keys = []
+    for track in data['tracks']:
+        if not isinstance(track, dict) or not isinstance(track.get('artist'), str) or not isinstance(track.get('title'), str):
+            return jsonify({'error': 'Each track needs a string artist and title'}), 400
+        keys.append((track['artist'], track['title']))
+    keys = list(dict.fromkeys(keys))
+
+    try:
+        db = get_db()
+        tracks = []
+        for start in range(0, len(keys), BULK_LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + BULK_LOOKUP_BATCH_SIZE]
+            values = ', '.join('(?, ?)' for _ in batch)
+            with stage('db_query'):
+                rows = db.execute(f"SELECT {', '.join(METADATA_COLUMNS)} FROM tracks WHERE (artist, title) IN (VALUES {values})",
+                                  [field for key in batch for field in key]).fetchall()
+            tracks.extend({
+                **track_metadata(row),
+                'download_url': download_reference(row['artist'], row['title'])
+            } for row in rows)
+        return jsonify({'message': 'Tracks looked up', 'tracks': tracks}), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Database error', 'message': str(e)}), 500
+
+@app.route('/search/fuzzy', methods=['GET'])
+def search_fuzzy() -> jsonify:
+    """
+    Search for tracks by approximate artist and/or title, ignoring case, diacritics and punctuation.
+
+    Query parameters:
+        q: Free text matched against the artist, the title or both, e.g. a prefix or a misspelt name.
+        artist, title: Match these fields instead of 'q'; either or both may be given.
+        limit: Number of results (1 to MAX_SEARCH_RESULTS, 10 by default).
+        min_score: Lowest score returned, from 0 to 1 (0 by default).
+
+    Every query is at least 3 letters or digits long. Results are ordered by a score from 0 to 1,
+    which is 1 for tracks matching the query once both are normalised.
+
+    Returns:
+        jsonify: JSON response listing the metadata, score and download reference of each match, or an error message.
+    """
+    if 'q' in request.args:
+        fields = {'text': request.args['q']}
+    else:
+        fields = {field: request.args[field] for field in ('artist', 'title') if field in request.args}
+    if not fields:
+        return jsonify({'error': 'Query, artist or title is required'}), 400
+
+    limit = request.args.get('limit', '10')
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_SEARCH_RESULTS:
+        return jsonify({'error': f'Limit must be an integer between 1 and {MAX_SEARCH_RESULTS}'}), 400
+    try:
+        min_score = float(request.args.get('min_score', 0))
+    except ValueError:
+        return jsonify({'error': 'min_score must be a number'}), 400
+
+    try:
+        db = get_db()
+        with stage('db_query'):
+            matches = track_search.search(db, fields, int(limit), min_score)
+            rows = db.execute(f"SELECT id, {', '.join(METADATA_COLUMNS)} FROM tracks WHERE id IN ({', '.join('?' * len(matches))})",
+                              [rowid for rowid, _ in matches]).fetchall() if matches else []
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Database error', 'message': str(e)}), 500
+
+    if not rows:
+        return jsonify({'message': 'No tracks found'}), 404
+
+    tracks = {row['id']: row for row in rows}
+    return jsonify({'message': 'Tracks found', 'tracks': [{
+        **track_metadata(tracks[rowid]),
+        'score': score,
+        'download_url': download_reference(tracks[rowid]['artist'], tracks[rowid]['title'])
+    } for rowid, score in matches if rowid in tracks]}), 200
+
+@app.route('/download', methods=['GET'])
+def download() -> Response:
+    """
+    Stream a track's audio, honouring single-range 'Range' requests with '206 Partial Content'.
+
+    The audio is read from the database in fixed-size chunks, so memory per request stays
+    constant regardless of the size of the track.
+    
+    Returns:
+        Response: The audio (or the requested part of it), or a JSON error message.
+    """
+    artist = request.args.get('artist')
+    title = request.args.get('title')
+
+    # Check if the required parameters are present
+    if not artist:
+        return jsonify({'error': 'Artist is required'}), 400
+    if not title:
+        return jsonify({'error': 'Title is required'}), 400
+
+    try:
+        db = get_db()
+        track = db.execute('SELECT id, size FROM tracks WHERE artist = ? AND title = ?', (artist, title)).fetchone()
+        if not track:
+            return jsonify({'error': 'Track not found in catalogue'}), 404
+    except Exception as e:
+        return jsonify({'error': 'Database error', 'message': str(e)}), 500
+
+    size = track['size']
+    headers = {'Accept-Ranges': 'bytes'}
+    status_code = 200
+    start, stop = 0, size
+
+    # Invalid or multi-part Range headers are ignored and the whole track is sent
+    if request.range is not None and request.range.units == 'bytes' and len(request.range.ranges) == 1:
+        requested = request.range.range_for_length(size)
+        if requested is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+        start, stop = requested
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        status_code = 206
+
+    headers['Content-Length'] = str(stop - start)
+    return Response(read_song_chunks(track['id'], start, stop), status=status_code,
+                    mimetype='audio/wav', headers=headers, direct_passthrough=True)
+
+
+@app.route('/match', methods=['POST'])
+def match() -> jsonify:
+    """
+    Find the track whose stored fingerprints best match those of a fragment.
+    
+    Returns:
+        jsonify: JSON response containing the artist and title of the best match, or an error message.
+    """
+    # Check if the request is JSON
+    if not request.is_json:
+        return jsonify({'error': 'Request must be JSON'}), 415
+    
+    data = request.json
+
+    # Check the fingerprints are a list of [hash, offset] integer pairs
+    if not data or 'fingerprints' not in data:
+        return jsonify({'error': 'Fingerprints are required'}), 400
+    fingerprints = data['fingerprints']
+    if not isinstance(fingerprints, list) or not all(
+            isinstance(pair, list) and len(pair) == 2 and all(isinstance(value, int) for value in pair)
+            for pair in fingerprints):
+        return jsonify({'error': 'Fingerprints must be a list of [hash, offset] integer pairs'}), 400
+
+    # Group the fragment offsets by hash so each hash is looked up once
+    fragment_offsets = {}
+    for hash_value, offset in fingerprints:
+        fragment_offsets.setdefault(hash_value, []).append(offset)
+
+    try:
+        db = get_db()
+        candidates = []
+        hashes = list(fragment_offsets)
+        # Look the hashes up in batches to stay under SQLite's bound parameter limit
+        for start in range(0, len(hashes), MATCH_BATCH_SIZE):
+            batch = hashes[start:start + MATCH_BATCH_SIZE]
+            with stage('db_query'):
+                rows = db.execute(f'SELECT hash, track_id, track_offset FROM fingerprints WHERE hash IN ({", ".join("?" * len(batch))})', batch).fetchall()
+            for row in rows:
+                candidates.extend((row['track_id'], row['track_offset'], offset) for offset in fragment_offsets[row['hash']])
+
+        with stage('vote'):
+            best = vote(candidates)
+        if best is None:
+            return jsonify({'error': 'No matching track found in catalogue'}), 404
+        
+        track_id, votes, _ = best
+        track = db.execute('SELECT artist, title FROM tracks WHERE id = ?', (track_id,)).fetchone()
+        if not track:
+            return jsonify({'error': 'No matching track found in catalogue'}), 404
+
+        return jsonify({'message': 'Match found', 'artist': track['artist'], 'title': track['title'], 'score': votes}), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Database error', 'message': str(e)}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str) -> jsonify:
+    """
+    Get the status of a track queued by /add?async=true.
+
+    Args:
+        job_id (str): Id of the job, as /add returned it.
+
+    Returns:
+        jsonify: JSON response with the job's 'state' ('queued', 'running', 'succeeded' or 'failed'), its
+            attempts and timestamps and, once finished, the 'status' and 'result' /add would have returned.
+    """
+    queue_id = parse_job_id(job_id)
+    if queue_id is None:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        job = ingest_queue.job(get_db(), queue_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'message': 'Job found', 'job_id': job_id, **job}), 200
+    except Exception as e:
+        return jsonify({'error': 'Failed to get job', 'message': str(e)}), 500
+
+
+@app.route('/fingerprints/export', methods=['GET'])
+def export_fingerprints() -> Response:
+    """
+    Stream every stored fingerprint as packed little-endian uint32 (hash, track id, offset) triples.
+
+    Rows come out in primary key order, i.e. already sorted by hash, and are streamed in chunks
+    so the export never holds the whole table in memory.
+    
+    Returns:
+        Response: application/octet-stream body of packed triples.
+    """
+    def generate():
+        # The stream outlives the request, so it holds its own pooled connection
+        db = pool.acquire()
+        try:
+            cursor = db.execute('SELECT hash, track_id, track_offset FROM fingerprints ORDER BY hash')
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                yield np.array([tuple(row) for row in rows], dtype=INDEX_DTYPE).tobytes()
+        finally:
+            pool.release(db)
+
+    return Response(generate(), mimetype='application/octet-stream')
+
+
+@app.route('/fingerprints/tracks', methods=['GET'])
+def fingerprint_tracks() -> jsonify:
+    """
+    List the track id used in the fingerprint export for every track.
+    
+    Returns:
+        jsonify: JSON response containing the id, artist and title of each track.
+    """
+    try:
+        db = get_db()
+        cursor = db.execute('SELECT id, artist, title FROM tracks')
+        tracks = [{'id': track['id'], 'artist': track['artist'], 'title': track['title']} for track in cursor]
+        return jsonify({'message': 'Tracks listed', 'tracks': tracks}), 200
+    except Exception as e:
+        return jsonify({'error': 'Failed to list tracks', 'message': str(e)}), 500
+
+
 @app.route('/clear_database', methods=['DELETE'])
 def clear_database() -> jsonify:
     """
@@ -195,9 +1385,10 @@ def clear_database() -> jsonify:
     """
     try:
         db = get_db()
+        db.execute('DELETE FROM fingerprints')
+        db.execute('DELETE FROM songs')
         db.execute('DELETE FROM tracks')  
         db.commit()
-        db.close()
         return jsonify({'message': 'Database cleared successfully'}), 200
     except Exception as e:
         return jsonify({'error': 'Failed to clear database', 'message': str(e)}), 500
@@ -0,0 +1,48 @@
+import argparse
+from typing import Tuple
+
+import app
+from common.audio_codec import RAW, ZPCM
+
+
+def compress_songs() -> Tuple[int, int, int]:
+    """
+    Compress the audio of every track still stored as uploaded, e.g. in databases from before
+    audio was compressed at ingest. Audio that is not an integer PCM WAV file is left as it is.
+
+    Returns:
+        Tuple[int, int, int]: Number of tracks compressed, and their stored size in bytes before and after.
+    """
+    db = app.pool.connect()
+    try:
+        compressed, before, after = 0, 0, 0
+        track_ids = [row['track_id'] for row in db.execute('SELECT track_id FROM songs WHERE encoding = ?', (RAW,))]
+        for track_id in track_ids:
+            song = db.execute('SELECT song FROM songs WHERE track_id = ?', (track_id,)).fetchone()['song']
+            stored, encoding = app.pack_song(song)
+            if encoding != ZPCM:
+                continue
+            db.execute('UPDATE songs SET song = ?, encoding = ? WHERE track_id = ? AND encoding = ?', (stored, encoding, track_id, RAW))
+            # Commit per track so a long run does not hold the write lock throughout
+            db.commit()
+            compressed += 1
+            before += len(song)
+            after += len(stored)
+        return compressed, before, after
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Losslessly compress the audio of the tracks in the catalogue database.')
+    parser.add_argument('--database', default=app.DATABASE, help='Path to the catalogue database')
+    parser.add_argument('--level', type=int, default=app.SONG_COMPRESSION_LEVEL, help='zlib level, 1 (fastest) to 9 (smallest)')
+    args = parser.parse_args()
+
+    app.DATABASE = args.database
+    app.SONG_ENCODING = ZPCM
+    app.SONG_COMPRESSION_LEVEL = args.level
+    app.pool = app.create_pool()
+    app.create_tables()
+    count, before, after = compress_songs()
+    print(f'Compressed {count} tracks in {app.DATABASE} from {before} to {after} bytes; run VACUUM to return the space to the file system')
@@ -0,0 +1,161 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.http import BackendClient
+from common.uploads import NDJSON
+
+CATALOGUE_URL = os.environ.get('CATALOGUE_URL', 'http://localhost:5002')
+
+# File extensions picked up when walking a directory
+AUDIO_EXTENSIONS = ('.wav',)
+
+# Seconds to wait for the catalogue to answer one batch, which fingerprints every track in it
+BATCH_READ_TIMEOUT = 300
+
+
+def find_tracks(directory: str, default_artist: str) -> List[Tuple[str, str, str]]:
+    """
+    List the audio files under a directory with the artist and title to store them under.
+
+    Files named 'Artist - Title.wav' are split on the first ' - ', other files are stored under
+    the default artist with their name as the title.
+
+    Args:
+        directory (str): Directory to walk, e.g. music/tracks.
+        default_artist (str): Artist of files whose name does not include one.
+
+    Returns:
+        List[Tuple[str, str, str]]: Path, artist and title of each file, in path order.
+    """
+    tracks = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            stem, extension = os.path.splitext(name)
+            if extension.lower() not in AUDIO_EXTENSIONS:
+                continue
+            artist, separator, title = stem.partition(' - ')
+            if not separator:
+                artist, title = default_artist, stem
+            tracks.append((os.path.join(root, name), artist.strip(), title.strip()))
+    return sorted(tracks)
+
+
+def encode_track(track: Tuple[str, str, str]) -> bytes:
+    """
+    Read and base64 encode one file as a line of an /add/bulk NDJSON body. Runs in a worker process.
+
+    Args:
+        track (Tuple[str, str, str]): Path, artist and title of the file.
+
+    Returns:
+        bytes: The JSON encoded track followed by a newline.
+    """
+    path, artist, title = track
+    with open(path, 'rb') as audio_file:
+        encoded_song = base64.b64encode(audio_file.read()).decode('ascii')
+    return json.dumps({'artist': artist, 'title': title, 'encoded_song': encoded_song}).encode('utf-8') + b'\n'
+
+
+def send_batch(client: BackendClient, lines: List[bytes]) -> Dict[str, int]:
+    """
+    Add one batch of encoded tracks through the bulk add endpoint.
+
+    Args:
+        client (BackendClient): Client of the catalogue management service.
+        lines (List[bytes]): NDJSON lines made by encode_track().
+
+    Returns:
+        Dict[str, int]: Number of tracks added, already present, rejected as invalid, and failed.
+    """
+    counts = {'added': 0, 'exists': 0, 'invalid': 0, 'failed': 0}
+    try:
+        response = client.post('/add/bulk', data=b''.join(lines), headers={'Content-Type': NDJSON})
+    except Exception as e:
+        print(f'Batch of {len(lines)} tracks failed: {e}', file=sys.stderr)
+        counts['failed'] = len(lines)
+        return counts
+
+    if response.status_code != 200:
+        print(f'Batch of {len(lines)} tracks failed: {response.text}', file=sys.stderr)
+        counts['failed'] = len(lines)
+        return counts
+
+    for result in response.json()['results']:
+        if result['status'] == 201:
+            counts['added'] += 1
+        elif result['status'] == 409:
+            counts['exists'] += 1
+        else:
+            print(f"Track {result.get('artist')} - {result.get('title')} rejected: {result['error']}", file=sys.stderr)
+            counts['invalid'] += 1
+    return counts
+
+
+def import_tracks(tracks: List[Tuple[str, str, str]], catalogue_url: str, batch_size: int,
+                  processes: int, concurrency: int) -> Dict[str, int]:
+    """
+    Add files to the catalogue in batches.
+
+    Files are read and encoded by a pool of worker processes while up to 'concurrency' batches
+    are in flight, so the catalogue fingerprints one batch while the next is being encoded.
+
+    Args:
+        tracks (List[Tuple[str, str, str]]): Path, artist and title of each file, as returned by find_tracks().
+        catalogue_url (str): URL of the catalogue management service.
+        batch_size (int): Number of tracks per /add/bulk request.
+        processes (int): Number of worker processes encoding files.
+        concurrency (int): Number of batches sent at the same time.
+
+    Returns:
+        Dict[str, int]: Number of tracks added, already present, rejected as invalid, and failed.
+    """
+    client = BackendClient(catalogue_url, pool_size=concurrency, read_timeout=BATCH_READ_TIMEOUT)
+    totals = {'added': 0, 'exists': 0, 'invalid': 0, 'failed': 0}
+
+    def collect(done) -> None:
+        for future in done:
+            for name, count in future.result().items():
+                totals[name] += count
+
+    with ProcessPoolExecutor(processes) as encoders, ThreadPoolExecutor(concurrency) as senders:
+        in_flight = set()
+        batch = []
+        for line in encoders.map(encode_track, tracks, chunksize=8):
+            batch.append(line)
+            if len(batch) < batch_size:
+                continue
+            # Bound the number of encoded batches held in memory
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(senders.submit(send_batch, client, batch))
+            batch = []
+        if batch:
+            in_flight.add(senders.submit(send_batch, client, batch))
+        collect(wait(in_flight).done)
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a directory of audio files into the catalogue through /add/bulk.')
+    parser.add_argument('directory', help='Directory of .wav files, named "Artist - Title.wav" or "Title.wav"')
+    parser.add_argument('--artist', default='Unknown', help='Artist of files whose name does not include one')
+    parser.add_argument('--catalogue-url', default=CATALOGUE_URL, help='URL of the catalogue management service')
+    parser.add_argument('--batch-size', type=int, default=100, help='Tracks per bulk request')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Worker processes reading and encoding files')
+    parser.add_argument('--concurrency', type=int, default=2, help='Bulk requests in flight at once')
+    args = parser.parse_args()
+
+    tracks = find_tracks(args.directory, args.artist)
+    start = time.perf_counter()
+    totals = import_tracks(tracks, args.catalogue_url, args.batch_size, args.processes, args.concurrency)
+    elapsed = time.perf_counter() - start
+    print(f"Imported {len(tracks)} files in {elapsed:.1f} s ({len(tracks) / elapsed:.1f} tracks/s): "
+          f"{totals['added']} added, {totals['exists']} already present, {totals['invalid']} invalid, {totals['failed']} failed")
@@ -0,0 +1,38 @@
+import argparse
+import app
+
+
+def rebuild_fingerprints() -> int:
+    """
+    Recompute the stored fingerprints of every track in the catalogue.
+
+    Used to backfill databases created before fingerprints were stored at ingest, or after
+    the fingerprint parameters have changed.
+
+    Returns:
+        int: Number of tracks fingerprinted.
+    """
+    db = app.pool.connect()
+    try:
+        track_ids = [row['id'] for row in db.execute('SELECT id FROM tracks')]
+        for track_id in track_ids:
+            app.store_fingerprints(db, track_id, app.compute_fingerprints(app.read_song(db, track_id)))
+            # Commit per track so a long rebuild does not hold the write lock throughout
+            db.commit()
+        # Drop fingerprints left behind by tracks that no longer exist
+        db.execute('DELETE FROM fingerprints WHERE track_id NOT IN (SELECT id FROM tracks)')
+        db.commit()
+        return len(track_ids)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the fingerprint index of the catalogue database.')
+    parser.add_argument('--database', default=app.DATABASE, help='Path to the catalogue database')
+    args = parser.parse_args()
+
+    app.DATABASE = args.database
+    app.pool = app.create_pool()
+    app.create_tables()
+    print(f'Fingerprinted {rebuild_fingerprints()} tracks in {app.DATABASE}')
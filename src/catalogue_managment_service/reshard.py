@@ -0,0 +1,150 @@
+import argparse
+import os
+import sqlite3
+from sqlite3 import Connection
+from typing import List, Tuple
+from urllib.parse import quote
+
+import app
+from common.sharding import shard_of
+
+# Tracks copied between commits
+COMMIT_BATCH_SIZE = 100
+
+
+def open_database(path: str) -> Connection:
+    """
+    Open a target database, creating its tables if it is new.
+
+    Args:
+        path (str): Path to the database.
+
+    Returns:
+        Connection: Connection to the database.
+    """
+    app.DATABASE = path
+    app.pool = app.create_pool()
+    app.create_tables()
+    return app.pool.connect()
+
+
+def open_source(path: str) -> Connection:
+    """
+    Open a source database read-only, so it is left exactly as it was: it is not migrated, and no
+    lock file is created beside it.
+
+    Args:
+        path (str): Path to the database.
+
+    Returns:
+        Connection: Read-only connection to the database.
+    """
+    db = sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def is_current(db: Connection) -> bool:
+    """
+    Whether a database has the current layout, with the audio in 'songs' and its encoding recorded.
+
+    Args:
+        db (Connection): Connection to the database.
+
+    Returns:
+        bool: True if the tracks can be copied from it as they are.
+    """
+    track_columns = {column['name'] for column in db.execute('PRAGMA table_info(tracks)')}
+    song_columns = {column['name'] for column in db.execute('PRAGMA table_info(songs)')}
+    return 'song' not in track_columns and 'encoding' in song_columns
+
+
+def reshard(sources: List[str], targets: List[str], dry_run: bool = False) -> Tuple[List[int], int]:
+    """
+    Redistribute the tracks of one or more catalogue databases over a new set of shards.
+
+    Every track is copied, with its fingerprints, into the target shard that owns it for
+    len(targets) shards; the sources are left as they are. Resharding is done offline: the catalogue
+    services must not accept writes while it runs, and are restarted on the targets (with
+    CATALOGUE_SHARD set and the gateway's DATABASE_URL listing them in the same order) afterwards.
+
+    Args:
+        sources (List[str]): Paths to the current databases, in shard order if the catalogue is already sharded.
+        targets (List[str]): Paths to the new databases, in shard order. They must not hold any tracks.
+        dry_run (bool): Only count where the tracks would go, without writing anything.
+
+    Returns:
+        Tuple[List[int], int]: Number of tracks owned by each target shard, and how many of them
+            changed shard number.
+
+    Raises:
+        ValueError: If a source does not exist or is from an older version of the catalogue (start the
+            catalogue service on it first, which migrates it), or a target is also a source or already
+            holds tracks.
+    """
+    for path in sources:
+        if not os.path.exists(path):
+            raise ValueError(f'Source {path} does not exist')
+    if {os.path.abspath(path) for path in sources} & {os.path.abspath(path) for path in targets}:
+        raise ValueError('Targets must be different files from the sources')
+
+    counts = [0] * len(targets)
+    moved = 0
+    target_dbs = [] if dry_run else [open_database(path) for path in targets]
+    try:
+        for path, db in zip(targets, target_dbs):
+            if db.execute('SELECT 1 FROM tracks LIMIT 1').fetchone() is not None:
+                raise ValueError(f'Target {path} already holds tracks')
+
+        for source_shard, source in enumerate(sources):
+            source_db = open_source(source)
+            try:
+                if not dry_run and not is_current(source_db):
+                    raise ValueError(f'Source {source} is from an older version of the catalogue, start the catalogue service on it to migrate it first')
+                # Rowids are the track ids, and the artist and title are there in databases of any version, which a dry run can count
+                columns = ('artist', 'title') if dry_run else app.METADATA_COLUMNS
+                track_ids = [row['id'] for row in source_db.execute('SELECT rowid AS id FROM tracks ORDER BY rowid')]
+                for copied, track_id in enumerate(track_ids, 1):
+                    track = source_db.execute(f"SELECT {', '.join(columns)} FROM tracks WHERE rowid = ?", (track_id,)).fetchone()
+                    shard = shard_of(track['artist'], track['title'], len(targets))
+                    counts[shard] += 1
+                    moved += shard != source_shard
+                    if dry_run:
+                        continue
+
+                    # The audio and fingerprints follow their track to the id it gets in the target
+                    target_db = target_dbs[shard]
+                    cursor = target_db.execute('INSERT INTO tracks (artist, title, size, duration, sample_rate, channels) '
+                                               'VALUES (:artist, :title, :size, :duration, :sample_rate, :channels)', dict(track))
+                    song = source_db.execute('SELECT song, encoding FROM songs WHERE track_id = ?', (track_id,)).fetchone()
+                    target_db.execute('INSERT INTO songs (track_id, song, encoding) VALUES (?, ?, ?)',
+                                      (cursor.lastrowid, song['song'], song['encoding']))
+                    fingerprints = source_db.execute('SELECT hash, track_offset FROM fingerprints WHERE track_id = ?', (track_id,))
+                    target_db.executemany('INSERT OR IGNORE INTO fingerprints (hash, track_id, track_offset) VALUES (?, ?, ?)',
+                                          ((row['hash'], cursor.lastrowid, row['track_offset']) for row in fingerprints))
+                    # Commit in batches so a long reshard does not hold the write locks throughout
+                    if copied % COMMIT_BATCH_SIZE == 0:
+                        for db in target_dbs:
+                            db.commit()
+            finally:
+                source_db.close()
+
+        for db in target_dbs:
+            db.commit()
+    finally:
+        for db in target_dbs:
+            db.close()
+    return counts, moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Redistribute the tracks of the catalogue databases over a new set of shards.')
+    parser.add_argument('--source', nargs='+', required=True, help='Paths to the current catalogue databases')
+    parser.add_argument('--target', nargs='+', required=True, help='Paths to the new shard databases, in shard order')
+    parser.add_argument('--dry-run', action='store_true', help='Only report how the tracks would be distributed')
+    args = parser.parse_args()
+
+    counts, moved = reshard(args.source, args.target, args.dry_run)
+    for shard, (path, count) in enumerate(zip(args.target, counts)):
+        print(f'Shard {shard}/{len(args.target)} ({path}): {count} tracks')
+    print(f"{sum(counts)} tracks, {moved} of them on a different shard number{' (dry run, nothing written)' if args.dry_run else ''}")
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Optional, Set
+
+import aiohttp
+
+from common.breaker import CircuitBreaker
+from common.metrics import STAGE_SECONDS
+from common.tracing import SERVER_TIMING, ClientSpan, client_span
+from common.http import CONNECT_TIMEOUT, READ_TIMEOUT, Deadline, DeadlineExceeded
+
+# Maximum number of calls in flight to one backend; further calls wait for a slot within their deadline
+CONCURRENCY = int(os.environ.get('BACKEND_CONCURRENCY', 256))
+
+# Errors meaning a backend did not answer in time, whether the deadline ran out first or a timeout fired
+TIMEOUT_ERRORS = (asyncio.TimeoutError, DeadlineExceeded)
+
+
+class BackendResponse:
+    """
+    Response of an AsyncBackendClient call, exposing the parts of the requests interface the gateway uses.
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse, content: Optional[bytes] = None) -> None:
+        """
+        Args:
+            response (aiohttp.ClientResponse): The underlying response.
+            content (Optional[bytes]): The body, None while a streamed body has not been read.
+        """
+        self.raw = response
+        self.status_code = response.status
+        self.headers = response.headers
+        self.content = content
+
+    def json(self) -> Any:
+        """
+        Returns:
+            Any: The body parsed as JSON.
+
+        Raises:
+            ValueError: If the body is not valid JSON.
+        """
+        return json.loads(self.content)
+
+    async def aread(self) -> bytes:
+        """
+        Read the rest of a streamed body.
+
+        Returns:
+            bytes: The body.
+        """
+        if self.content is None:
+            self.content = await self.raw.read()
+        return self.content
+
+    async def iter_chunks(self, chunk_size: int) -> AsyncIterator[bytes]:
+        """
+        Iterate over a streamed body as it arrives.
+
+        Args:
+            chunk_size (int): Largest chunk to yield.
+
+        Yields:
+            bytes: The next chunk of the body.
+        """
+        async for chunk in self.raw.content.iter_chunked(chunk_size):
+            yield chunk
+
+
+class AsyncBackendClient:
+    """
+    Asyncio HTTP client for one backend service, the counterpart of BackendClient for the async gateway.
+
+    Calls share a pool of keep-alive connections and are bounded by a semaphore, so a burst of
+    requests queues in the gateway instead of opening thousands of sockets to one backend. Time
+    spent waiting for a slot counts towards the route's deadline, which also caps the read timeout.
+    With a circuit breaker, calls fail fast while the backend is unhealthy and a background task
+    probes 'probe_path' until it recovers. With a stage name, the time of every call (until the
+    response headers, for streamed calls) is recorded in the stage_duration_seconds metric. Calls
+    made while handling a traced request carry its trace on to the backend and are recorded as spans.
+    """
+
+    def __init__(self, base_url: str, concurrency: int = CONCURRENCY,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 breaker: Optional[CircuitBreaker] = None, probe_path: str = '/', stage: Optional[str] = None) -> None:
+        """
+        Args:
+            base_url (str): URL the request paths are appended to.
+            concurrency (int): Maximum number of calls in flight, and of connections kept open.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait between bytes of the response.
+            breaker (Optional[CircuitBreaker]): Circuit breaker guarding the backend, if any.
+            probe_path (str): Cheap endpoint requested to check whether the backend has recovered.
+            stage (Optional[str]): Stage the calls are timed as, e.g. 'upstream_catalogue'.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self.probe_path = probe_path
+        self.stage_name = stage or 'upstream'
+        self.stage_series = STAGE_SECONDS.labels(stage) if stage else None
+        self.slots = asyncio.Semaphore(concurrency)
+        self.open_streams: Set[BackendResponse] = set()
+        # Running probe tasks, referenced here so they are not garbage collected
+        self.probes: Set[asyncio.Task] = set()
+        # Created on first use, as an aiohttp session belongs to the event loop it was created in
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def request(self, method: str, path: str, deadline: Optional[Deadline] = None,
+                      stream: bool = False, record_latency: bool = True, **kwargs) -> BackendResponse:
+        """
+        Send a request to the backend.
+
+        A streamed response keeps its slot until it is closed with aclose().
+
+        Args:
+            method (str): HTTP method.
+            path (str): Path of the endpoint, starting with '/'.
+            deadline (Optional[Deadline]): Budget of the route making the call.
+            stream (bool): Return as soon as the headers arrive, leaving the body to be read.
+            record_latency (bool): Count the call as slow for the circuit breaker when it takes long;
+                False for calls that are expected to, such as bulk uploads.
+            **kwargs: Passed on to aiohttp.ClientSession.request (json, data, params, headers).
+
+        Returns:
+            BackendResponse: The backend's response.
+
+        Raises:
+            CircuitOpen: If the backend's circuit breaker is open.
+            DeadlineExceeded: If the deadline passed before the call could be made.
+            asyncio.TimeoutError: If the backend did not connect or respond in time.
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+
+        # Fail fast, before queueing for a slot, while the backend is known to be unhealthy
+        trial = self.breaker.before_call() if self.breaker is not None else False
+
+        if deadline is not None:
+            try:
+                await asyncio.wait_for(self.slots.acquire(), deadline.remaining())
+            except asyncio.TimeoutError:
+                self.release_trial(trial)
+                raise DeadlineExceeded(f'Deadline exceeded before calling {self.base_url}{path}')
+        else:
+            await self.slots.acquire()
+
+        span = client_span(self.stage_name, method, path)
+        if span is not None:
+            kwargs['headers'] = span.headers(kwargs.get('headers'))
+        started = time.perf_counter()
+        try:
+            read_timeout = self.read_timeout
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    self.release_trial(trial)
+                    raise DeadlineExceeded(f'Deadline exceeded before calling {self.base_url}{path}')
+                read_timeout = min(read_timeout, remaining)
+            timeout = aiohttp.ClientTimeout(sock_connect=min(self.connect_timeout, read_timeout), sock_read=read_timeout)
+            response = await self.session.request(method, f'{self.base_url}{path}', timeout=timeout, **kwargs)
+        except DeadlineExceeded:
+            self.slots.release()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.slots.release()
+            self.finish(False, started, trial, record_latency, span)
+            raise
+        except BaseException:
+            self.slots.release()
+            self.release_trial(trial)
+            raise
+        self.finish(response.status < 500, started, trial, record_latency, span,
+                    response.status, response.headers.get(SERVER_TIMING))
+
+        if stream:
+            backend_response = BackendResponse(response)
+            self.open_streams.add(backend_response)
+            return backend_response
+
+        try:
+            content = await response.read()
+        finally:
+            response.release()
+            self.slots.release()
+        return BackendResponse(response, content)
+
+    def release_trial(self, trial: bool) -> None:
+        if self.breaker is not None:
+            self.breaker.release(trial)
+
+    def finish(self, success: bool, started: float, trial: bool, record_latency: bool,
+               span: Optional[ClientSpan] = None, status: Optional[int] = None, server_timing: Optional[str] = None) -> None:
+        """
+        Record the outcome and duration of a call, starting the background probe if it opened the circuit breaker.
+        """
+        duration = time.perf_counter() - started
+        if self.stage_series is not None:
+            self.stage_series.observe(duration)
+        if span is not None:
+            span.end(started, duration, status, server_timing)
+        if self.breaker is not None and self.breaker.record(success, duration if record_latency else 0.0, trial):
+            task = asyncio.get_running_loop().create_task(self.probe())
+            self.probes.add(task)
+            task.add_done_callback(self.probes.discard)
+
+    async def probe(self) -> None:
+        """
+        Request the probe path every few seconds until the backend answers without a 5xx, then half-open the breaker.
+        """
+        timeout = aiohttp.ClientTimeout(total=self.connect_timeout)
+        while True:
+            await asyncio.sleep(self.breaker.open_seconds)
+            try:
+                async with self.session.get(f'{self.base_url}{self.probe_path}', timeout=timeout) as response:
+                    healthy = response.status < 500
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                healthy = False
+            if healthy:
+                self.breaker.probe_succeeded()
+                return
+            self.breaker.probe_failed()
+
+    async def aclose(self, response: BackendResponse) -> None:
+        """
+        Close a streamed response and free its slot.
+
+        Args:
+            response (BackendResponse): Response returned by request(..., stream=True).
+        """
+        response.raw.release()
+        if response in self.open_streams:
+            self.open_streams.remove(response)
+            self.slots.release()
+
+    async def shutdown(self) -> None:
+        """
+        Close every pooled connection.
+        """
+        for task in list(self.probes):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    async def get(self, path: str, **kwargs) -> BackendResponse:
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> BackendResponse:
+        return await self.request('POST', path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> BackendResponse:
+        return await self.request('DELETE', path, **kwargs)
@@ -0,0 +1,257 @@
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# WAVE format tags we know how to turn into samples
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Most bytes a streamed WAV file may send before its data chunk starts
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class WavError(ValueError):
+    """Raised when a byte string is not a WAV file we can decode."""
+
+
+class IncompleteWav(WavError):
+    """Raised when a WAV header is cut short, e.g. because the rest of a streamed file has not arrived yet."""
+
+
+def parse_wav_header(data: bytes) -> Tuple[dict, int, int]:
+    """
+    Parse the RIFF chunks of a WAV file up to the start of the sample data.
+
+    Unlike the standard library 'wave' module this accepts WAVE_FORMAT_EXTENSIBLE
+    and IEEE float files, which some of the fragments in 'music/fragments' use.
+
+    Args:
+        data (bytes): Raw bytes of the WAV file (only the header needs to be present).
+
+    Returns:
+        Tuple[dict, int, int]: The format fields, the offset of the sample data and its declared length in bytes.
+
+    Raises:
+        IncompleteWav: If the bytes end before the data chunk starts.
+        WavError: If the bytes are not a supported WAV file.
+    """
+    if len(data) < 12:
+        # The start of a RIFF/WAVE header may still become one
+        if data[0:4] == b'RIFF'[:len(data)] and data[8:] == b'WAVE'[:max(len(data) - 8, 0)]:
+            raise IncompleteWav('WAV header is incomplete')
+        raise WavError('Not a RIFF/WAVE file')
+    if data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise WavError('Not a RIFF/WAVE file')
+
+    fmt: Optional[dict] = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        chunk_size = struct.unpack('<I', data[position + 4:position + 8])[0]
+        body = position + 8
+
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                raise WavError('fmt chunk is too short')
+            if body + chunk_size > len(data):
+                raise IncompleteWav('fmt chunk is incomplete')
+            format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', data[body:body + 16])
+            # Extensible files carry the real format tag in the first two bytes of the sub-format GUID
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                format_tag = struct.unpack('<H', data[body + 24:body + 26])[0]
+            fmt = {
+                'format_tag': format_tag,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'block_align': block_align,
+                'bits_per_sample': bits,
+            }
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WavError('data chunk found before fmt chunk')
+            # Some writers leave the size at 0 or 0xFFFFFFFF when streaming, so fall back to what we have
+            if chunk_size in (0, 0xFFFFFFFF):
+                chunk_size = len(data) - body
+            return fmt, body, chunk_size
+
+        # Chunks are padded to an even number of bytes
+        position = body + chunk_size + (chunk_size & 1)
+
+    raise IncompleteWav('No data chunk found')
+
+
+def pcm_to_mono(raw: bytes, fmt: dict) -> np.ndarray:
+    """
+    Convert interleaved PCM sample bytes to a mono float32 array in the range [-1, 1].
+
+    Args:
+        raw (bytes): Sample bytes from the data chunk.
+        fmt (dict): Format fields returned by parse_wav_header.
+
+    Returns:
+        np.ndarray: Mono samples.
+
+    Raises:
+        WavError: If the sample format is not supported.
+    """
+    channels = fmt['channels']
+    bits = fmt['bits_per_sample']
+    format_tag = fmt['format_tag']
+    if channels < 1:
+        raise WavError('WAV file has no channels')
+
+    width = bits // 8
+    frame_size = width * channels
+    raw = raw[:len(raw) - (len(raw) % frame_size)] if frame_size else b''
+
+    if format_tag == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 24:
+        triples = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        samples = values.astype(np.float32) / 8388608.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 32:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(raw, dtype='<f4').astype(np.float32)
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 64:
+        samples = np.frombuffer(raw, dtype='<f8').astype(np.float32)
+    else:
+        raise WavError(f'Unsupported WAV sample format: tag {format_tag}, {bits} bits')
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def decode_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decode a complete WAV file into mono float32 samples.
+
+    Args:
+        data (bytes): Raw bytes of the WAV file.
+
+    Returns:
+        Tuple[np.ndarray, int]: Mono samples and the sample rate.
+
+    Raises:
+        WavError: If the bytes are not a supported WAV file.
+    """
+    fmt, start, size = parse_wav_header(data)
+    return pcm_to_mono(data[start:start + size], fmt), fmt['sample_rate']
+
+
+def wav_properties(header: bytes, file_size: int) -> dict:
+    """
+    Read the duration, sample rate and channels of a WAV file from its header alone.
+
+    Args:
+        header (bytes): The start of the file, at least up to its data chunk (MAX_HEADER_SIZE bytes are enough).
+        file_size (int): Size of the whole file, which caps a declared data size that overruns it.
+
+    Returns:
+        dict: 'duration' in seconds, 'sample_rate' and 'channels'.
+
+    Raises:
+        WavError: If the header is not that of a WAV file.
+    """
+    fmt, start, size = parse_wav_header(header)
+    if not fmt['sample_rate'] or not fmt['block_align']:
+        raise WavError('WAV file has no sample rate or frame size')
+    frames = min(size, max(file_size - start, 0)) // fmt['block_align']
+    return {'duration': round(frames / fmt['sample_rate'], 3), 'sample_rate': fmt['sample_rate'], 'channels': fmt['channels']}
+
+
+class WavStream:
+    """
+    Decode a WAV file as its bytes arrive, e.g. from a chunked upload.
+
+    Whole sample frames are converted to mono as soon as they are in, so the audio received so
+    far can be analysed at any point without decoding it again.
+    """
+
+    def __init__(self) -> None:
+        self.fmt: Optional[dict] = None
+        self.header = b''
+        # Sample bytes still to come, None until the header is in or when its writer left the size unset
+        self.remaining: Optional[int] = None
+        self.pending = bytearray()
+        self.data = bytearray()
+        self.blocks: List[np.ndarray] = []
+        self.frames = 0
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Add the next bytes of the file.
+
+        Args:
+            chunk (bytes): The bytes, split anywhere.
+
+        Raises:
+            WavError: If the bytes are not a supported WAV file.
+        """
+        self.pending += chunk
+        if self.fmt is None:
+            try:
+                fmt, start, _ = parse_wav_header(bytes(self.pending))
+            except IncompleteWav:
+                if len(self.pending) > MAX_HEADER_SIZE:
+                    raise WavError(f'No data chunk in the first {MAX_HEADER_SIZE} bytes')
+                return
+            # Rejects unsupported sample formats before any samples arrive
+            pcm_to_mono(b'', fmt)
+            declared = struct.unpack('<I', self.pending[start - 4:start])[0]
+            self.fmt, self.header = fmt, bytes(self.pending[:start])
+            self.remaining = None if declared in (0, 0xFFFFFFFF) else declared
+            del self.pending[:start]
+
+        frame_size = self.fmt['bits_per_sample'] // 8 * self.fmt['channels']
+        usable = len(self.pending) if self.remaining is None else min(len(self.pending), self.remaining)
+        usable -= usable % frame_size
+        if usable:
+            raw = bytes(self.pending[:usable])
+            del self.pending[:usable]
+            self.data += raw
+            self.blocks.append(pcm_to_mono(raw, self.fmt))
+            self.frames += usable // frame_size
+            if self.remaining is not None:
+                self.remaining -= usable
+
+    @property
+    def done(self) -> bool:
+        """Whether every sample declared by the header has arrived."""
+        return self.remaining == 0
+
+    @property
+    def seconds(self) -> float:
+        """Length of the audio received so far."""
+        return self.frames / self.fmt['sample_rate'] if self.fmt and self.fmt['sample_rate'] else 0.0
+
+    def samples(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Mono samples of the audio received so far.
+        """
+        if len(self.blocks) != 1:
+            self.blocks = [np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.float32)]
+        return self.blocks[0]
+
+    def wav(self) -> bytes:
+        """
+        Returns:
+            bytes: A WAV file of the audio received so far, its sizes set to match.
+
+        Raises:
+            WavError: If the header has not arrived yet.
+        """
+        if self.fmt is None:
+            raise WavError('No data chunk found')
+        header = bytearray(self.header)
+        struct.pack_into('<I', header, 4, len(header) - 8 + len(self.data))
+        struct.pack_into('<I', header, len(header) - 4, len(self.data))
+        return bytes(header) + bytes(self.data)
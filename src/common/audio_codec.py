@@ -0,0 +1,217 @@
+import struct
+import zlib
+from typing import Callable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from common.audio import WAVE_FORMAT_PCM, WavError, parse_wav_header
+
+# Values of the catalogue's 'songs.encoding' column: the file as uploaded, or compressed by compress_audio()
+RAW = 'raw'
+ZPCM = 'zpcm'
+
+# Fixed header of a compressed file: magic, version, bytes per sample, channels, then the lengths of the
+# WAV header, the PCM data and whatever follows it, the PCM bytes per block and the number of blocks
+LAYOUT = struct.Struct('<4sBBHIIIII')
+MAGIC = b'ZPCM'
+VERSION = 1
+
+# PCM bytes per block (rounded down to whole frames). Blocks are compressed independently, so a range
+# of the file is decoded from the blocks it overlaps, and one block is about one download chunk
+BLOCK_SIZE = 64 * 1024
+
+# Highest order of the fixed polynomial predictors tried on each block, as FLAC's fixed subframes use
+MAX_PREDICTOR_ORDER = 3
+
+# Predictor order marking a block stored uncompressed, because compressing it saved nothing
+STORED_BLOCK = 0xFF
+
+# Reads 'length' bytes of a stored file from 'offset', e.g. through SQLite incremental blob I/O
+Reader = Callable[[int, int], bytes]
+
+
+def read_samples(pcm: bytes, width: int, channels: int) -> np.ndarray:
+    """
+    Convert interleaved integer PCM bytes to one int64 column per channel, keeping the exact values.
+    """
+    if width == 1:
+        samples = np.frombuffer(pcm, dtype=np.uint8).astype(np.int64)
+    elif width == 3:
+        triples = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3).astype(np.int64)
+        samples = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        samples = np.where(samples & 0x800000, samples - 0x1000000, samples)
+    else:
+        samples = np.frombuffer(pcm, dtype=f'<i{width}').astype(np.int64)
+    return samples.reshape(-1, channels)
+
+
+def write_samples(samples: np.ndarray, width: int) -> bytes:
+    """
+    Convert the output of read_samples() back to the same PCM bytes.
+    """
+    samples = samples.ravel()
+    if width == 1:
+        return samples.astype(np.uint8).tobytes()
+    if width == 3:
+        values = samples & 0xFFFFFF
+        return np.stack([values & 0xFF, (values >> 8) & 0xFF, values >> 16], axis=1).astype(np.uint8).tobytes()
+    return samples.astype(f'<i{width}').tobytes()
+
+
+def compress_block(pcm: bytes, width: int, channels: int, level: int) -> bytes:
+    """
+    Compress one block of PCM losslessly.
+
+    Each channel is replaced by the residual of the fixed polynomial predictor (of order 0 to
+    MAX_PREDICTOR_ORDER) that leaves the smallest residuals, which for audio are mostly small
+    numbers. They are zigzag-mapped to unsigned integers, split into byte planes so the mostly
+    empty high bytes sit together, and deflated.
+
+    Returns:
+        bytes: The predictor order, the bytes per residual, then the deflated planes; or STORED_BLOCK then the PCM.
+    """
+    residual = read_samples(pcm, width, channels)
+    best, best_order = residual, 0
+    for order in range(1, MAX_PREDICTOR_ORDER + 1):
+        # Differencing with a leading 0 keeps the first samples, so cumsum() inverts it exactly
+        residual = np.diff(residual, axis=0, prepend=0)
+        if np.abs(residual).sum() < np.abs(best).sum():
+            best, best_order = residual, order
+    zigzag = ((best << 1) ^ (best >> 63)).astype(np.uint64).ravel()
+    plane_width = next(size for size in (1, 2, 4, 8) if size == 8 or int(zigzag.max(initial=0)) < 1 << (8 * size))
+    planes = zigzag.astype(f'<u{plane_width}').view(np.uint8).reshape(-1, plane_width).T.tobytes()
+    compressed = zlib.compress(planes, level)
+    if 2 + len(compressed) >= 1 + len(pcm):
+        return bytes([STORED_BLOCK]) + pcm
+    return bytes([best_order, plane_width]) + compressed
+
+
+def decompress_block(block: bytes, width: int, channels: int) -> bytes:
+    """
+    Decode a block made by compress_block() back to its PCM bytes.
+    """
+    if block[0] == STORED_BLOCK:
+        return block[1:]
+    order, plane_width = block[0], block[1]
+    planes = np.frombuffer(zlib.decompress(block[2:]), dtype=np.uint8).reshape(plane_width, -1)
+    zigzag = np.ascontiguousarray(planes.T).view(f'<u{plane_width}').ravel().astype(np.int64)
+    residual = ((zigzag >> 1) ^ -(zigzag & 1)).reshape(-1, channels)
+    for _ in range(order):
+        residual = np.cumsum(residual, axis=0)
+    return write_samples(residual, width)
+
+
+def compress_audio(song: bytes, level: int = 6) -> Optional[bytes]:
+    """
+    Compress an integer PCM WAV file losslessly for storage.
+
+    The WAV header, and any chunks after the sample data, are kept as they are; the samples are
+    compressed in blocks of about BLOCK_SIZE bytes, with a table of where each block starts.
+
+    Args:
+        song (bytes): The WAV file.
+        level (int): zlib compression level, 1 (fastest) to 9 (smallest).
+
+    Returns:
+        Optional[bytes]: The compressed file, None if it is not an integer PCM WAV file or would not get smaller.
+    """
+    try:
+        fmt, start, size = parse_wav_header(song)
+    except WavError:
+        return None
+    width, channels = fmt['bits_per_sample'] // 8, fmt['channels']
+    if fmt['format_tag'] != WAVE_FORMAT_PCM or width not in (1, 2, 3, 4) or channels < 1 or fmt['block_align'] != width * channels:
+        return None
+
+    frame_size = fmt['block_align']
+    pcm_length = min(size, len(song) - start)
+    pcm_length -= pcm_length % frame_size
+    block_size = BLOCK_SIZE - BLOCK_SIZE % frame_size
+    blocks = [compress_block(song[position:min(position + block_size, start + pcm_length)], width, channels, level)
+              for position in range(start, start + pcm_length, block_size)]
+
+    # Blocks start after the fixed header, the WAV header, the trailing bytes and the offset table
+    tail = song[start + pcm_length:]
+    offset = LAYOUT.size + start + len(tail) + 4 * (len(blocks) + 1)
+    offsets = [offset]
+    for block in blocks:
+        offset += len(block)
+        offsets.append(offset)
+    compressed = b''.join([LAYOUT.pack(MAGIC, VERSION, width, channels, start, pcm_length, len(tail), block_size, len(blocks)),
+                           song[:start], tail, struct.pack(f'<{len(offsets)}I', *offsets), *blocks])
+    return compressed if len(compressed) < len(song) else None
+
+
+def read_layout(read: Reader) -> Tuple[tuple, int]:
+    """
+    Read the fixed header of a compressed file.
+
+    Returns:
+        Tuple[tuple, int]: Its fields from the bytes per sample on, and the length of the file it decodes to.
+
+    Raises:
+        ValueError: If the bytes were not made by compress_audio().
+    """
+    magic, version, *fields = LAYOUT.unpack(read(0, LAYOUT.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a compressed audio file')
+    _, _, header_length, pcm_length, tail_length, _, _ = fields
+    return tuple(fields), header_length + pcm_length + tail_length
+
+
+def decompress_range(read: Reader, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Decode a byte range of the original file from a compressed one, one block at a time.
+
+    Only the blocks the range overlaps are read and decoded, so memory stays at about one block
+    and a range near the end of a long track costs as little as one near its start.
+
+    Args:
+        read (Reader): Reads bytes of the compressed file.
+        start (int): First byte of the original file to return.
+        stop (Optional[int]): Byte to stop before, None for the end of the file.
+
+    Yields:
+        bytes: The next part of the range, e.g. one decoded block.
+
+    Raises:
+        ValueError: If the bytes were not made by compress_audio().
+    """
+    (width, channels, header_length, pcm_length, tail_length, block_size, block_count), length = read_layout(read)
+    stop = length if stop is None else min(stop, length)
+    if start >= stop:
+        return
+
+    # The WAV header is stored as it is
+    if start < header_length:
+        yield read(LAYOUT.size + start, min(stop, header_length) - start)
+
+    # The samples, from the blocks overlapping the range
+    pcm_start, pcm_stop = max(start, header_length) - header_length, min(stop, header_length + pcm_length) - header_length
+    if pcm_start < pcm_stop:
+        first, last = pcm_start // block_size, (pcm_stop - 1) // block_size
+        table = LAYOUT.size + header_length + tail_length
+        offsets = struct.unpack(f'<{last - first + 2}I', read(table + 4 * first, 4 * (last - first + 2)))
+        for index in range(first, last + 1):
+            pcm = decompress_block(read(offsets[index - first], offsets[index - first + 1] - offsets[index - first]), width, channels)
+            block_start = index * block_size
+            yield pcm[max(pcm_start - block_start, 0):pcm_stop - block_start]
+
+    # Whatever followed the samples, also stored as it is
+    tail_start = header_length + pcm_length
+    if stop > tail_start:
+        offset = max(start, tail_start) - tail_start
+        yield read(LAYOUT.size + header_length + offset, stop - tail_start - offset)
+
+
+def decompress_audio(data: bytes) -> bytes:
+    """
+    Decode a whole file made by compress_audio().
+
+    Args:
+        data (bytes): The compressed file.
+
+    Returns:
+        bytes: The original file.
+    """
+    return b''.join(decompress_range(lambda offset, length: data[offset:offset + length]))
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional
+
+# Defaults for every circuit breaker, overridable per process through the environment
+FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+SLOW_CALL_SECONDS = float(os.environ.get('BREAKER_SLOW_CALL_SECONDS', 5))
+WINDOW_SIZE = int(os.environ.get('BREAKER_WINDOW_SIZE', 20))
+MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 10))
+OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 5))
+HALF_OPEN_CALLS = int(os.environ.get('BREAKER_HALF_OPEN_CALLS', 3))
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a backend whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        """
+        Args:
+            name (str): Name of the backend.
+            retry_after (float): Seconds until the backend is next probed.
+        """
+        super().__init__(f'Circuit breaker for {name} is open')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one backend, driven by the error rate and latency of recent calls.
+
+    - closed: calls go through. Each call is recorded as good or bad (an error, a 5xx, or slower
+      than 'slow_call_seconds'); once at least 'min_calls' of the last 'window_size' calls were
+      recorded and 'failure_rate' of them were bad, the breaker opens.
+    - open: calls fail fast with CircuitOpen. The client probes the backend in the background
+      every 'open_seconds' and a healthy probe half-opens the breaker.
+    - half_open: up to 'half_open_calls' trial calls go through at a time. That many good calls
+      close the breaker, a bad one opens it again.
+
+    Thread-safe, and cheap enough to consult from an event loop.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_rate: float = FAILURE_RATE, slow_call_seconds: float = SLOW_CALL_SECONDS,
+                 window_size: int = WINDOW_SIZE, min_calls: int = MIN_CALLS, open_seconds: float = OPEN_SECONDS,
+                 half_open_calls: int = HALF_OPEN_CALLS) -> None:
+        """
+        Args:
+            name (str): Name of the backend, used in errors and on the status endpoint.
+            failure_rate (float): Share of bad calls in the window that opens the breaker.
+            slow_call_seconds (float): Calls slower than this count as bad.
+            window_size (int): Number of recent calls the failure rate is measured over.
+            min_calls (int): Calls needed in the window before the breaker may open.
+            open_seconds (float): Seconds between probes while the breaker is open.
+            half_open_calls (int): Trial calls allowed, and good calls needed to close, when half-open.
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.window: Deque[bool] = deque(maxlen=window_size)
+        self.opened_at: Optional[float] = None
+        self.trials = 0
+        self.trial_successes = 0
+        # Whether a background probe is running, so reopening the breaker does not start a second one
+        self.probing = False
+        self.stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+
+    def before_call(self) -> bool:
+        """
+        Check whether a call may be made, taking a trial slot when half-open.
+
+        Returns:
+            bool: True if the call is a half-open trial, to be passed on to record().
+
+        Raises:
+            CircuitOpen: If the breaker is open, or half-open with every trial slot taken.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.HALF_OPEN and self.trials < self.half_open_calls:
+                self.trials += 1
+                return True
+            self.stats['rejected'] += 1
+            raise CircuitOpen(self.name, self.retry_after())
+
+    def record(self, success: bool, duration: float, trial: bool = False) -> bool:
+        """
+        Record the outcome of a call let through by before_call().
+
+        Args:
+            success (bool): Whether the backend answered without an error or a 5xx.
+            duration (float): Seconds the call took.
+            trial (bool): What before_call() returned for the call.
+
+        Returns:
+            bool: True if the caller should start probing the backend in the background.
+        """
+        slow = duration > self.slow_call_seconds
+        good = success and not slow
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['failures'] += not success
+            self.stats['slow_calls'] += slow
+
+            # Calls that started in an earlier state than the current one no longer say anything about it
+            if trial:
+                self.trials = max(0, self.trials - 1)
+                if self.state != self.HALF_OPEN:
+                    return False
+                if not good:
+                    return self.open()
+                self.trial_successes += 1
+                if self.trial_successes >= self.half_open_calls:
+                    self.state = self.CLOSED
+                    self.window.clear()
+                return False
+            if self.state != self.CLOSED:
+                return False
+
+            self.window.append(good)
+            if len(self.window) >= self.min_calls and self.window.count(False) >= self.failure_rate * len(self.window):
+                return self.open()
+            return False
+
+    def release(self, trial: bool) -> None:
+        """
+        Give back the trial slot of a call let through by before_call() that was never made.
+
+        Args:
+            trial (bool): What before_call() returned for the call.
+        """
+        if trial:
+            with self.lock:
+                self.trials = max(0, self.trials - 1)
+
+    def probe_succeeded(self) -> None:
+        """
+        Half-open the breaker after a healthy background probe, which ends the probing.
+        """
+        with self.lock:
+            self.probing = False
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+                self.trials = 0
+                self.trial_successes = 0
+
+    def probe_failed(self) -> None:
+        """
+        Keep the breaker open after a failed background probe.
+        """
+        with self.lock:
+            self.opened_at = time.monotonic()
+
+    def open(self) -> bool:
+        # Called with the lock held; returns whether a probe needs starting
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.stats['opened'] += 1
+        start_probe = not self.probing
+        self.probing = True
+        return start_probe
+
+    def retry_after(self) -> float:
+        # Called with the lock held
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: State of the breaker, the failure rate over its window and its counters.
+        """
+        with self.lock:
+            window = len(self.window)
+            return {
+                'state': self.state,
+                'failure_rate': round(self.window.count(False) / window, 3) if window else 0.0,
+                'window': window,
+                'retry_after': round(self.retry_after(), 3) if self.state == self.OPEN else None,
+                **self.stats
+            }
@@ -0,0 +1,126 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with per-entry expiry and an optional SQLite tier that survives restarts.
+
+    Entries are JSON-serialisable values. The in-memory tier evicts the least recently used
+    entry once it is full; the SQLite tier is unbounded but expired rows are pruned as new
+    entries are written.
+    """
+
+    # Expired SQLite rows are pruned once every this many writes
+    PRUNE_INTERVAL = 256
+
+    def __init__(self, max_entries: int, database: Optional[str] = None) -> None:
+        """
+        Args:
+            max_entries (int): Maximum number of entries held in memory.
+            database (Optional[str]): Path of the SQLite database for the on-disk tier, or None for memory only.
+        """
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.writes = 0
+
+        self.db: Optional[sqlite3.Connection] = None
+        if database:
+            self.db = sqlite3.connect(database, check_same_thread=False)
+            self.db.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up an entry, counting a hit or a miss.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[Any]: The cached value, or None if absent or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.time():
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return value
+                del self.entries[key]
+                self.stats['expirations'] += 1
+
+            if self.db is not None:
+                row = self.db.execute('SELECT value, expires_at FROM result_cache WHERE key = ?', (key,)).fetchone()
+                if row and row[1] > time.time():
+                    value = json.loads(row[0])
+                    self._store(key, value, row[1])
+                    self.stats['disk_hits'] += 1
+                    return value
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Store an entry in every tier.
+
+        Args:
+            key (str): Cache key.
+            value (Any): JSON-serialisable value.
+            ttl (float): Seconds until the entry expires.
+        """
+        expires_at = time.time() + ttl
+        with self.lock:
+            self._store(key, value, expires_at)
+
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                                (key, json.dumps(value), expires_at))
+                self.writes += 1
+                if self.writes % self.PRUNE_INTERVAL == 0:
+                    self.db.execute('DELETE FROM result_cache WHERE expires_at <= ?', (time.time(),))
+                self.db.commit()
+
+    def clear(self) -> None:
+        """
+        Remove every entry from every tier.
+        """
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM result_cache')
+                self.db.commit()
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        Return the counters and current size of the in-memory tier.
+
+        Returns:
+            Dict[str, int]: Hit, disk hit, miss, eviction and expiration counts plus the number of entries.
+        """
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), max_entries=self.max_entries)
+
+    def _store(self, key: str, value: Any, expires_at: float) -> None:
+        """
+        Insert into the in-memory tier, evicting the least recently used entries. Caller holds the lock.
+        """
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
@@ -0,0 +1,508 @@
+import json
+import os
+import zlib
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from common.metrics import stage
+
+# zstd and brotli are offered when their packages are installed; gzip always is
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Request bodies are only decoded from brotli when its decompressor can bound its output (brotli >= 1.2)
+BROTLI_BOUNDED = False
+if brotli is not None:
+    try:
+        brotli.Decompressor().process(b'', output_buffer_limit=1)
+        BROTLI_BOUNDED = True
+    except TypeError:
+        pass
+
+# Compression levels, chosen for speed since most bodies are compressed once per request
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+# Bodies smaller than this are sent uncompressed, as the headers would outweigh the saving
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+# Largest request body accepted once decompressed, so a small compressed body cannot exhaust memory
+MAX_DECOMPRESSED_SIZE = int(os.environ.get('MAX_DECOMPRESSED_SIZE', 1024 * 1024 * 1024))
+
+# Content types worth compressing; audio is left alone, PCM barely compresses
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# Supported content codings, most preferred first
+ENCODINGS: List[str] = [name for name, available in (('zstd', zstandard), ('br', brotli), ('gzip', True)) if available]
+
+# Every content coding a service may compress in, each appended to the ETag of responses it compresses
+ETAG_ENCODINGS = ('zstd', 'br', 'gzip')
+
+
+class DecompressionLimitExceeded(ValueError):
+    """Raised when a body decompresses to more than MAX_DECOMPRESSED_SIZE bytes."""
+
+
+class UnsupportedEncoding(ValueError):
+    """Raised for a Content-Encoding this process cannot decode."""
+
+
+class Compressor:
+    """
+    Incremental compressor for one body. flush() ends a block, so everything compressed so far
+    can be decoded by the receiver straight away, as streamed NDJSON lines need to be.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        """
+        Args:
+            encoding (str): 'gzip', 'zstd' or 'br'.
+        """
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self.engine = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd' and zstandard is not None:
+            self.engine = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == 'br' and brotli is not None:
+            self.engine = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            raise UnsupportedEncoding(f'Unsupported content encoding: {encoding}')
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self.engine.process(data)
+        return self.engine.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == 'gzip':
+            return self.engine.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'zstd':
+            return self.engine.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self.engine.flush()
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self.engine.finish()
+        return self.engine.flush()
+
+
+class OutputLimit:
+    """
+    Sink collecting the output of a zstd stream writer, which fails the write producing more than 'limit' bytes.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.remaining = limit
+        self.parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise DecompressionLimitExceeded('Decompressed body is too large')
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        output = b''.join(self.parts)
+        self.parts.clear()
+        return output
+
+
+class Decompressor:
+    """
+    Incremental decompressor for one body, refusing to produce more than 'limit' bytes. Every coding
+    stops inflating just past the limit, so a bomb is caught before it is inflated in full.
+    """
+
+    def __init__(self, encoding: str, limit: int = MAX_DECOMPRESSED_SIZE) -> None:
+        """
+        Args:
+            encoding (str): 'gzip', 'zstd' or 'br'.
+            limit (int): Most bytes the body may decompress to.
+
+        Raises:
+            UnsupportedEncoding: If the encoding is not supported.
+        """
+        self.encoding = encoding
+        self.remaining = limit
+        if encoding == 'gzip':
+            self.engine = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd' and zstandard is not None:
+            # zstd's decompressobj cannot bound its output, so it is written out through a sink that can
+            self.output = OutputLimit(limit + 1)
+            self.engine = zstandard.ZstdDecompressor().stream_writer(self.output, write_size=64 * 1024)
+        elif encoding == 'br' and BROTLI_BOUNDED:
+            self.engine = brotli.Decompressor()
+        else:
+            raise UnsupportedEncoding(f'Unsupported content encoding: {encoding}')
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Raises:
+            DecompressionLimitExceeded: If the body grew past the limit.
+        """
+        if self.encoding == 'gzip':
+            output = self.engine.decompress(data, self.remaining + 1)
+            if self.engine.unconsumed_tail:
+                raise DecompressionLimitExceeded('Decompressed body is too large')
+        elif self.encoding == 'br':
+            output = self.engine.process(data, output_buffer_limit=self.remaining + 1)
+        else:
+            self.engine.write(data)
+            output = self.output.take()
+        self.remaining -= len(output)
+        if self.remaining < 0:
+            raise DecompressionLimitExceeded('Decompressed body is too large')
+        return output
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def decompress(data: bytes, encoding: str, limit: int = MAX_DECOMPRESSED_SIZE) -> bytes:
+    return Decompressor(encoding, limit).decompress(data)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the content coding of a response from the client's Accept-Encoding header.
+
+    Args:
+        accept_encoding (Optional[str]): The header, e.g. 'gzip, br;q=0.8'.
+
+    Returns:
+        Optional[str]: The supported coding with the highest q-value, ties going to the most
+            preferred in ENCODINGS, or None to send the body uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for entry in accept_encoding.split(','):
+        name, *parameters = entry.strip().lower().split(';')
+        weight = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.strip().partition('=')
+            if key == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.strip()] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def is_compressible(response) -> bool:
+    """
+    Whether a response should be compressed: a text or JSON body that is not already encoded,
+    nor partial, nor empty by definition.
+    """
+    return (response.status_code not in (204, 206, 304)
+            and 'Content-Encoding' not in response.headers
+            and (response.mimetype or '').startswith(COMPRESSIBLE_TYPES))
+
+
+def coded_etag(etag: str, encoding: str) -> str:
+    """
+    The entity tag of a response compressed in a content coding: that of the uncompressed response
+    with the coding appended inside the quotes, e.g. "3-gzip". Each coding is a different
+    representation, which needs a validator of its own (RFC 9110, section 8.8.3).
+
+    Args:
+        etag (str): Quoted entity tag of the uncompressed response.
+        encoding (str): The content coding.
+
+    Returns:
+        str: Quoted entity tag.
+    """
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def identity_etag(etag: str) -> str:
+    """
+    The entity tag of the uncompressed response, from that of the response in any content coding.
+
+    Args:
+        etag (str): Quoted entity tag, as built by coded_etag() or of an uncompressed response.
+
+    Returns:
+        str: Quoted entity tag.
+    """
+    for encoding in ETAG_ENCODINGS:
+        if etag.endswith(f'-{encoding}"'):
+            return f'{etag[:-len(encoding) - 2]}"'
+    return etag
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """
+    Whether an 'If-None-Match' header names a response, uncompressed or in any content coding.
+
+    Args:
+        if_none_match (ETags): The parsed header, as request.if_none_match.
+        etag (str): Quoted entity tag of the uncompressed response.
+
+    Returns:
+        bool: True if the client's copy is current.
+    """
+    tag = etag.strip('"')
+    return if_none_match.contains(tag) or any(if_none_match.contains(f'{tag}-{encoding}') for encoding in ETAG_ENCODINGS)
+
+
+def not_modified_etag(if_none_match, etag: str) -> str:
+    """
+    The entity tag a 304 response carries: that of the representation the client has, in the
+    coding it named in 'If-None-Match'.
+
+    Args:
+        if_none_match (ETags): The parsed header, as request.if_none_match.
+        etag (str): Quoted entity tag of the response.
+
+    Returns:
+        str: Quoted entity tag.
+    """
+    tag = etag.strip('"')
+    if if_none_match.star_tag or if_none_match.contains(tag):
+        return etag
+    for encoding in ETAG_ENCODINGS:
+        if if_none_match.contains(f'{tag}-{encoding}'):
+            return coded_etag(etag, encoding)
+    return etag
+
+
+def is_encoded(headers) -> bool:
+    """
+    Whether a request or response body was sent with a Content-Encoding other than identity.
+    """
+    return headers.get('Content-Encoding', 'identity').strip().lower() != 'identity'
+
+
+def accept_encoding(headers) -> Dict[str, str]:
+    """
+    The Accept-Encoding to send a backend whose response is relayed to the client untouched, so
+    the backend compresses it (or not) for the client rather than for this service.
+
+    Clients that name no coding may not be able to decode any, so 'identity' is asked for in their place.
+
+    Args:
+        headers: The client's request headers.
+
+    Returns:
+        Dict[str, str]: The header to send.
+    """
+    return {'Accept-Encoding': headers.get('Accept-Encoding', 'identity')}
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    Compress a streamed body, flushing after every chunk so each arrives decodable.
+    """
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            yield compressor.compress(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+async def compress_async_chunks(body, encoding: str) -> AsyncIterator[bytes]:
+    """
+    Compress a streamed Quart response body, flushing after every chunk.
+    """
+    compressor = Compressor(encoding)
+    async with body as chunks:
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+def error_response(status: int, message: str):
+    """
+    Build the JSON error response of a request body that cannot be decompressed.
+    """
+    from werkzeug.wrappers import Response
+
+    return Response(json.dumps({'error': message}), status=status, mimetype='application/json')
+
+
+class DecompressingStream:
+    """
+    File-like view of a compressed request body that decompresses it as it is read.
+
+    Read errors surface as HTTP errors: 413 when the body decompresses past MAX_DECOMPRESSED_SIZE,
+    400 when it is not valid in its coding.
+    """
+
+    def __init__(self, stream, encoding: str) -> None:
+        self.stream = stream
+        self.decompressor = Decompressor(encoding, MAX_DECOMPRESSED_SIZE)
+        self.buffer = bytearray()
+        self.done = False
+
+    def fill(self, size: int) -> None:
+        from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            chunk = self.stream.read(64 * 1024)
+            if not chunk:
+                self.done = True
+                break
+            try:
+                self.buffer += self.decompressor.decompress(chunk)
+            except DecompressionLimitExceeded as e:
+                raise RequestEntityTooLarge(response=error_response(413, str(e)))
+            except Exception:
+                raise BadRequest(response=error_response(400, f'Request body is not valid {self.decompressor.encoding}'))
+
+    def take(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            self.fill(-1)
+            return self.take(len(self.buffer))
+        self.fill(size)
+        return self.take(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        while b'\n' not in self.buffer and not self.done:
+            self.fill(len(self.buffer) + 64 * 1024)
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        return self.take(end)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.readline, b'')
+
+
+class DecompressRequests:
+    """
+    WSGI middleware accepting request bodies sent with a Content-Encoding, which are decompressed
+    as the application reads them, so every route sees the plain body.
+
+    Bodies in an unsupported coding get a 415.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import get_input_stream
+
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return self.app(environ, start_response)
+        try:
+            stream = DecompressingStream(get_input_stream(environ), encoding)
+        except UnsupportedEncoding as e:
+            return error_response(415, str(e))(environ, start_response)
+
+        # The decompressed length is unknown, so the body is read until the decompressor runs dry
+        environ['wsgi.input'] = stream
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.app(environ, start_response)
+
+
+def compress_app(app, decompress_requests: bool = True) -> None:
+    """
+    Compress the text and JSON responses of a Flask app in the coding the client prefers,
+    and accept request bodies sent with a Content-Encoding.
+
+    Args:
+        app (Flask): The application.
+        decompress_requests (bool): Decompress request bodies; False for a proxy that passes them through.
+    """
+    from flask import Response, request
+
+    if decompress_requests:
+        app.wsgi_app = DecompressRequests(app.wsgi_app)
+
+    @app.after_request
+    def compress_response(response: Response) -> Response:
+        if response.status_code == 304 and 'ETag' in response.headers:
+            response.headers['ETag'] = not_modified_etag(request.if_none_match, response.headers['ETag'])
+        if not is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            # A relayed body the backend left uncompressed for being small stays that way
+            if int(response.headers.get('Content-Length', COMPRESS_MIN_SIZE)) < COMPRESS_MIN_SIZE:
+                return response
+            response.response = compress_chunks(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESS_MIN_SIZE:
+                return response
+            with stage('compress'):
+                response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = coded_etag(response.headers['ETag'], encoding)
+        return response
+
+
+def compress_async_app(app) -> None:
+    """
+    Compress the text and JSON responses of a Quart app in the coding the client prefers.
+
+    Request bodies are not decompressed; the async gateway passes them through to the backend.
+
+    Args:
+        app (Quart): The application.
+    """
+    from quart import Response, request
+    from quart.wrappers.response import DataBody, IterableBody
+
+    @app.after_request
+    async def compress_response(response: Response) -> Response:
+        if response.status_code == 304 and 'ETag' in response.headers:
+            response.headers['ETag'] = not_modified_etag(request.if_none_match, response.headers['ETag'])
+        if not is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        if isinstance(response.response, DataBody):
+            data = await response.get_data()
+            if len(data) < COMPRESS_MIN_SIZE:
+                return response
+            with stage('compress'):
+                response.set_data(compress(data, encoding))
+        elif int(response.headers.get('Content-Length', COMPRESS_MIN_SIZE)) < COMPRESS_MIN_SIZE:
+            return response
+        else:
+            response.response = IterableBody(compress_async_chunks(response.response, encoding))
+            response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = coded_etag(response.headers['ETag'], encoding)
+        return response
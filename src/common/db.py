@@ -0,0 +1,130 @@
+import queue
+import sqlite3
+from contextlib import contextmanager
+from sqlite3 import Connection
+from typing import Callable, Dict, Iterator, Optional, Union
+
+# File locks serialise database initialisation across processes; without fcntl (Windows) services run as one process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Prepared statements kept per connection, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+
+# Pragmas applied to every pooled connection: WAL lets readers run alongside a writer, and
+# synchronous=NORMAL is durable across application crashes in WAL mode while skipping an fsync per commit
+DEFAULT_PRAGMAS: Dict[str, Union[int, str]] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,       # KiB, i.e. ~20 MB of page cache per connection
+    'mmap_size': 268435456,     # bytes, reads go through the shared OS page cache
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,       # ms to wait for the write lock instead of failing at once
+}
+
+
+class ConnectionPool:
+    """
+    Pool of configured SQLite connections shared by the request threads of one process.
+
+    Connections stay open between requests, so the pragmas and the per-connection prepared
+    statement cache are only paid for once. The pool never blocks: when every connection is
+    in use a new one is opened, and connections beyond 'size' are closed when released.
+    """
+
+    def __init__(self, database: str, size: int, pragmas: Dict[str, Union[int, str]] = DEFAULT_PRAGMAS,
+                 functions: Optional[Dict[str, Callable]] = None) -> None:
+        """
+        Args:
+            database (str): Path of the SQLite database.
+            size (int): Maximum number of idle connections kept open.
+            pragmas (Dict[str, Union[int, str]]): Pragmas applied to each new connection.
+            functions (Optional[Dict[str, Callable]]): Deterministic one-argument SQL functions registered
+                on each new connection, e.g. for triggers or indexes that call them.
+        """
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self.functions = functions or {}
+        self.idle: 'queue.LifoQueue[Connection]' = queue.LifoQueue()
+
+    def connect(self) -> Connection:
+        """
+        Open a new configured connection outside the pool.
+
+        Returns:
+            Connection: SQLite database connection object.
+        """
+        db = sqlite3.connect(self.database, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        db.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            db.execute(f'PRAGMA {name} = {value}')
+        for name, function in self.functions.items():
+            db.create_function(name, 1, function, deterministic=True)
+        return db
+
+    def acquire(self) -> Connection:
+        """
+        Take an idle connection, opening a new one if none is free.
+
+        Returns:
+            Connection: SQLite database connection object.
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, db: Connection) -> None:
+        """
+        Return a connection to the pool, rolling back anything left uncommitted.
+
+        Args:
+            db (Connection): Connection previously returned by acquire().
+        """
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            db.close()
+            return
+
+        if self.idle.qsize() < self.size:
+            self.idle.put(db)
+        else:
+            db.close()
+
+    def close_all(self) -> None:
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+@contextmanager
+def initialisation_lock(database: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock, across processes, on initialising a database.
+
+    Every worker process of a multi-worker server creates the tables and runs any migrations as it
+    starts. The lock, on a file next to the database, makes the workers take turns, so the first one
+    does the work and the others find it done instead of racing it.
+
+    Args:
+        database (str): Path of the SQLite database.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f'{database}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
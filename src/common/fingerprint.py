@@ -0,0 +1,354 @@
+import json
+import os
+import struct
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from common.audio import decode_wav
+
+# Analysis parameters - tracks and fragments must be fingerprinted with the same values
+TARGET_RATE = 11025     # Hz, everything is resampled to this before analysis
+WINDOW_SIZE = 1024      # samples per FFT frame (~93 ms)
+HOP_SIZE = 256          # samples between frames (~23 ms), the unit of every offset
+PEAK_NEIGHBOURHOOD = 15 # frames/bins either side a peak must dominate
+PEAKS_PER_SECOND = 40   # density cap on the constellation
+FAN_OUT = 10            # number of later peaks each anchor is paired with
+MIN_DELTA = 1           # frames, closest target peak
+MAX_DELTA = 100         # frames, furthest target peak
+
+# Minimum number of aligned hashes before a match is trusted
+MIN_MATCH_VOTES = 8
+
+# Hash layout: 10 bits anchor frequency | 10 bits target frequency | 12 bits time delta
+FREQ_BITS = 10
+DELTA_BITS = 12
+FREQ_MASK = (1 << FREQ_BITS) - 1
+DELTA_MASK = (1 << DELTA_BITS) - 1
+
+# On-disk layout of a saved FingerprintIndex
+INDEX_MAGIC = b'SHZFP001'
+INDEX_HEADER = '<8sQQ'
+INDEX_DTYPE = np.dtype('<u4')
+
+
+def resample(samples: np.ndarray, sample_rate: int, target_rate: int = TARGET_RATE) -> np.ndarray:
+    """
+    Resample mono audio to the analysis rate.
+
+    A moving average removes most of the content above the new Nyquist frequency before
+    linear interpolation, which is plenty for picking spectrogram peaks.
+
+    Args:
+        samples (np.ndarray): Mono samples.
+        sample_rate (int): Sample rate of the input.
+        target_rate (int): Sample rate to convert to.
+
+    Returns:
+        np.ndarray: Resampled float32 samples.
+    """
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples.astype(np.float32, copy=False)
+
+    factor = sample_rate / target_rate
+    if factor > 1:
+        width = int(round(factor))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode='same')
+
+    duration = len(samples) / sample_rate
+    positions = np.arange(int(duration * target_rate), dtype=np.float64) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def spectrogram(samples: np.ndarray) -> np.ndarray:
+    """
+    Compute a log-magnitude spectrogram.
+
+    Args:
+        samples (np.ndarray): Mono samples at TARGET_RATE.
+
+    Returns:
+        np.ndarray: Array of shape (frames, WINDOW_SIZE // 2) in decibels.
+    """
+    if len(samples) < WINDOW_SIZE:
+        return np.zeros((0, WINDOW_SIZE // 2), dtype=np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, WINDOW_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(WINDOW_SIZE).astype(np.float32), axis=1))
+    # Drop the Nyquist bin so bin indices fit in FREQ_BITS
+    spectrum = spectrum[:, :WINDOW_SIZE // 2]
+    return (20 * np.log10(spectrum + 1e-10)).astype(np.float32)
+
+
+def _max_filter(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """
+    Sliding maximum along one axis, padded so the output has the input's shape.
+    """
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size, size)
+    padded = np.pad(values, pad, mode='constant', constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * size + 1, axis=axis).max(axis=-1)
+
+
+def find_peaks(spec: np.ndarray) -> np.ndarray:
+    """
+    Pick the constellation of local maxima from a spectrogram.
+
+    Args:
+        spec (np.ndarray): Log-magnitude spectrogram from spectrogram().
+
+    Returns:
+        np.ndarray: Array of (frame, bin) pairs sorted by frame then bin.
+    """
+    if spec.size == 0:
+        return np.zeros((0, 2), dtype=np.int32)
+
+    # The max filter is separable, so two 1-D passes replace one expensive 2-D pass
+    neighbourhood = _max_filter(_max_filter(spec, PEAK_NEIGHBOURHOOD, axis=0), PEAK_NEIGHBOURHOOD, axis=1)
+    is_peak = (spec == neighbourhood) & (spec > np.median(spec))
+    frames, bins = np.nonzero(is_peak)
+
+    # Keep the loudest peaks up to the density cap
+    duration = spec.shape[0] * HOP_SIZE / TARGET_RATE
+    limit = max(int(duration * PEAKS_PER_SECOND), 1)
+    if len(frames) > limit:
+        loudest = np.argsort(spec[frames, bins])[::-1][:limit]
+        frames, bins = frames[loudest], bins[loudest]
+
+    order = np.lexsort((bins, frames))
+    return np.stack([frames[order], bins[order]], axis=1).astype(np.int32)
+
+
+def hash_peaks(peaks: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Pair each anchor peak with peaks just after it and pack each pair into a 32-bit hash.
+
+    Args:
+        peaks (np.ndarray): (frame, bin) pairs sorted by frame.
+
+    Returns:
+        List[Tuple[int, int]]: (hash, anchor frame) pairs.
+    """
+    hashes = []
+    count = len(peaks)
+    for i in range(count):
+        anchor_frame, anchor_bin = int(peaks[i, 0]), int(peaks[i, 1])
+        paired = 0
+        for j in range(i + 1, count):
+            delta = int(peaks[j, 0]) - anchor_frame
+            if delta < MIN_DELTA:
+                continue
+            if delta > MAX_DELTA or paired >= FAN_OUT:
+                break
+            target_bin = int(peaks[j, 1])
+            packed = ((anchor_bin & FREQ_MASK) << (FREQ_BITS + DELTA_BITS)) | ((target_bin & FREQ_MASK) << DELTA_BITS) | (delta & DELTA_MASK)
+            hashes.append((packed, anchor_frame))
+            paired += 1
+    return hashes
+
+
+def fingerprint_samples(samples: np.ndarray, sample_rate: int) -> List[Tuple[int, int]]:
+    """
+    Fingerprint mono audio.
+
+    Args:
+        samples (np.ndarray): Mono samples.
+        sample_rate (int): Sample rate of the samples.
+
+    Returns:
+        List[Tuple[int, int]]: (hash, offset) pairs, offsets counted in HOP_SIZE frames.
+    """
+    return hash_peaks(find_peaks(spectrogram(resample(samples, sample_rate))))
+
+
+def fingerprint_wav(data: bytes) -> List[Tuple[int, int]]:
+    """
+    Fingerprint a complete WAV file.
+
+    Args:
+        data (bytes): Raw bytes of the WAV file.
+
+    Returns:
+        List[Tuple[int, int]]: (hash, offset) pairs.
+
+    Raises:
+        WavError: If the bytes are not a supported WAV file.
+    """
+    samples, sample_rate = decode_wav(data)
+    return fingerprint_samples(samples, sample_rate)
+
+
+def vote(candidates: Iterable[Tuple[int, int, int]]) -> Optional[Tuple[int, int, int]]:
+    """
+    Score candidate matches by time-offset alignment.
+
+    A true match lines up many hashes at the same difference between the track offset and
+    the fragment offset, while chance collisions spread out over many differences.
+
+    Args:
+        candidates (Iterable[Tuple[int, int, int]]): (track id, track offset, fragment offset) triples.
+
+    Returns:
+        Optional[Tuple[int, int, int]]: (track id, votes, offset in frames) of the best match, or None.
+    """
+    histogram = Counter((track_id, track_offset - fragment_offset) for track_id, track_offset, fragment_offset in candidates)
+    if not histogram:
+        return None
+    (track_id, offset), votes = histogram.most_common(1)[0]
+    if votes < MIN_MATCH_VOTES:
+        return None
+    return track_id, votes, offset
+
+
+class FingerprintIndex:
+    """
+    Inverted index from hash to the (track id, offset) pairs it occurs at.
+
+    Postings are held as three parallel packed uint32 arrays sorted by hash, so a lookup is a
+    binary search and the whole index costs 12 bytes per posting. Saved indexes are memory-mapped
+    when loaded, so every worker process shares one page-cache copy and loading is near instant.
+    """
+
+    def __init__(self, hashes: np.ndarray, track_ids: np.ndarray, offsets: np.ndarray,
+                 names: Optional[Dict[int, Tuple[str, str]]] = None) -> None:
+        """
+        Args:
+            hashes (np.ndarray): Hash of each posting, sorted ascending.
+            track_ids (np.ndarray): Track id of each posting.
+            offsets (np.ndarray): Track offset of each posting, in frames.
+            names (Optional[Dict[int, Tuple[str, str]]]): (artist, title) of each track id.
+        """
+        self.hashes = hashes
+        self.track_ids = track_ids
+        self.offsets = offsets
+        self.names = names or {}
+
+    @classmethod
+    def build(cls, hashes: np.ndarray, track_ids: np.ndarray, offsets: np.ndarray,
+              names: Optional[Dict[int, Tuple[str, str]]] = None) -> 'FingerprintIndex':
+        """
+        Build an index from unsorted postings.
+
+        Args:
+            hashes (np.ndarray): Hash of each posting.
+            track_ids (np.ndarray): Track id of each posting.
+            offsets (np.ndarray): Track offset of each posting, in frames.
+            names (Optional[Dict[int, Tuple[str, str]]]): (artist, title) of each track id.
+
+        Returns:
+            FingerprintIndex: The index.
+        """
+        hashes = np.asarray(hashes, dtype=INDEX_DTYPE)
+        order = np.argsort(hashes, kind='stable')
+        return cls(hashes[order],
+                   np.asarray(track_ids, dtype=INDEX_DTYPE)[order],
+                   np.asarray(offsets, dtype=INDEX_DTYPE)[order],
+                   names)
+
+    @classmethod
+    def from_tracks(cls, tracks: Dict[int, List[Tuple[int, int]]],
+                    names: Optional[Dict[int, Tuple[str, str]]] = None) -> 'FingerprintIndex':
+        """
+        Build an index from the fingerprints of each track.
+
+        Args:
+            tracks (Dict[int, List[Tuple[int, int]]]): (hash, offset) pairs keyed by track id.
+            names (Optional[Dict[int, Tuple[str, str]]]): (artist, title) of each track id.
+
+        Returns:
+            FingerprintIndex: The index.
+        """
+        postings = [(hash_value, track_id, offset) for track_id, hashes in tracks.items() for hash_value, offset in hashes]
+        columns = np.array(postings, dtype=np.int64).reshape(-1, 3)
+        return cls.build(columns[:, 0], columns[:, 1], columns[:, 2], names)
+
+    def save(self, path: str) -> None:
+        """
+        Write the index to a file, atomically replacing any existing one.
+
+        The layout is a fixed header (magic, posting count, length of the names JSON), the
+        three little-endian uint32 arrays, then the track names as JSON.
+
+        Args:
+            path (str): Destination file.
+        """
+        names = json.dumps({str(track_id): list(name) for track_id, name in self.names.items()}).encode('utf-8')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(struct.pack(INDEX_HEADER, INDEX_MAGIC, len(self.hashes), len(names)))
+            for column in (self.hashes, self.track_ids, self.offsets):
+                index_file.write(np.ascontiguousarray(column, dtype=INDEX_DTYPE).tobytes())
+            index_file.write(names)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FingerprintIndex':
+        """
+        Memory-map an index written by save().
+
+        Args:
+            path (str): Index file.
+
+        Returns:
+            FingerprintIndex: The index, backed by the file.
+
+        Raises:
+            ValueError: If the file is not a fingerprint index.
+        """
+        header_size = struct.calcsize(INDEX_HEADER)
+        with open(path, 'rb') as index_file:
+            magic, count, names_length = struct.unpack(INDEX_HEADER, index_file.read(header_size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f'{path} is not a fingerprint index')
+            index_file.seek(header_size + 3 * count * INDEX_DTYPE.itemsize)
+            names = json.loads(index_file.read(names_length).decode('utf-8'))
+
+        columns = []
+        for position in range(3):
+            if count == 0:
+                columns.append(np.zeros(0, dtype=INDEX_DTYPE))
+                continue
+            columns.append(np.memmap(path, dtype=INDEX_DTYPE, mode='r', shape=(count,),
+                                     offset=header_size + position * count * INDEX_DTYPE.itemsize))
+        return cls(*columns, {int(track_id): tuple(name) for track_id, name in names.items()})
+
+    def match(self, hashes: List[Tuple[int, int]]) -> Optional[Tuple[int, int, int]]:
+        """
+        Find the indexed track that best matches a fragment.
+
+        Args:
+            hashes (List[Tuple[int, int]]): (hash, offset) pairs of the fragment.
+
+        Returns:
+            Optional[Tuple[int, int, int]]: (track id, votes, offset in frames) of the best match, or None.
+        """
+        if not hashes or len(self.hashes) == 0:
+            return None
+
+        fragment = np.array(hashes, dtype=np.int64).reshape(-1, 2)
+        starts = np.searchsorted(self.hashes, fragment[:, 0].astype(INDEX_DTYPE), side='left')
+        ends = np.searchsorted(self.hashes, fragment[:, 0].astype(INDEX_DTYPE), side='right')
+        counts = ends - starts
+        total = int(counts.sum())
+        if total == 0:
+            return None
+
+        # Expand each [start, end) range into posting positions without a Python loop
+        run_starts = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        positions = run_starts + np.arange(total)
+
+        track_ids = self.track_ids[positions].astype(np.int64)
+        deltas = self.offsets[positions].astype(np.int64) - np.repeat(fragment[:, 1], counts)
+
+        # Vote on (track id, offset difference) packed into one integer key
+        keys, votes = np.unique((track_ids << 32) | (deltas + (1 << 31)), return_counts=True)
+        best = int(np.argmax(votes))
+        if votes[best] < MIN_MATCH_VOTES:
+            return None
+        key = int(keys[best])
+        return key >> 32, int(votes[best]), (key & 0xFFFFFFFF) - (1 << 31)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
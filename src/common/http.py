@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.breaker import CircuitBreaker
+from common.metrics import STAGE_SECONDS
+from common.tracing import SERVER_TIMING, ClientSpan, client_span
+
+# Defaults for every backend client, overridable per process through the environment
+POOL_SIZE = int(os.environ.get('BACKEND_POOL_SIZE', 32))
+CONNECT_TIMEOUT = float(os.environ.get('BACKEND_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('BACKEND_READ_TIMEOUT', 30))
+
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised when a route's deadline has passed before an outbound call could be made."""
+
+
+class Deadline:
+    """
+    Time budget shared by every outbound call made while handling one request.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        """
+        Args:
+            seconds (float): Budget from now.
+        """
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        Returns:
+            float: Seconds left, never negative.
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+
+class BackendClient:
+    """
+    Keep-alive HTTP client for one backend service.
+
+    Requests share a pool of persistent connections (urllib3 pools are thread-safe), every
+    call has a connect and a read timeout, and a Deadline caps the read timeout to what is
+    left of the route's budget. With a circuit breaker, calls fail fast while the backend is
+    unhealthy and a background thread probes 'probe_path' until it recovers. With a stage name,
+    the time of every call (until the response headers, for streamed calls) is recorded in the
+    stage_duration_seconds metric. Calls made while handling a traced request carry its trace on
+    to the backend and are recorded as spans.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = POOL_SIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 breaker: Optional[CircuitBreaker] = None, probe_path: str = '/', stage: Optional[str] = None) -> None:
+        """
+        Args:
+            base_url (str): URL the request paths are appended to.
+            pool_size (int): Maximum number of connections kept open to the backend.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait between bytes of the response.
+            breaker (Optional[CircuitBreaker]): Circuit breaker guarding the backend, if any.
+            probe_path (str): Cheap endpoint requested to check whether the backend has recovered.
+            stage (Optional[str]): Stage the calls are timed as, e.g. 'upstream_catalogue'.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self.probe_path = probe_path
+        self.stage_name = stage or 'upstream'
+        self.stage_series = STAGE_SECONDS.labels(stage) if stage else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method: str, path: str, deadline: Optional[Deadline] = None,
+                record_latency: bool = True, **kwargs) -> requests.Response:
+        """
+        Send a request to the backend.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Path of the endpoint, starting with '/'.
+            deadline (Optional[Deadline]): Budget of the route making the call.
+            record_latency (bool): Count the call as slow for the circuit breaker when it takes long;
+                False for calls that are expected to, such as bulk uploads.
+            **kwargs: Passed on to requests.
+
+        Returns:
+            requests.Response: The backend's response.
+
+        Raises:
+            CircuitOpen: If the backend's circuit breaker is open.
+            DeadlineExceeded: If the deadline has already passed.
+            requests.Timeout: If the backend did not connect or respond in time.
+        """
+        read_timeout = self.read_timeout
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise DeadlineExceeded(f'Deadline exceeded before calling {self.base_url}{path}')
+            read_timeout = min(read_timeout, remaining)
+        kwargs.setdefault('timeout', (min(self.connect_timeout, read_timeout), read_timeout))
+        trial = self.breaker.before_call() if self.breaker is not None else False
+        span = client_span(self.stage_name, method, path)
+        if span is not None:
+            kwargs['headers'] = span.headers(kwargs.get('headers'))
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+        except requests.RequestException:
+            self.finish(False, started, trial, record_latency, span)
+            raise
+        self.finish(response.status_code < 500, started, trial, record_latency, span,
+                    response.status_code, response.headers.get(SERVER_TIMING))
+        return response
+
+    def finish(self, success: bool, started: float, trial: bool, record_latency: bool,
+               span: Optional[ClientSpan] = None, status: Optional[int] = None, server_timing: Optional[str] = None) -> None:
+        """
+        Record the outcome and duration of a call, starting the background probe if it opened the circuit breaker.
+        """
+        duration = time.perf_counter() - started
+        if self.stage_series is not None:
+            self.stage_series.observe(duration)
+        if span is not None:
+            span.end(started, duration, status, server_timing)
+        if self.breaker is not None and self.breaker.record(success, duration if record_latency else 0.0, trial):
+            threading.Thread(target=self.probe, name=f'probe {self.base_url}', daemon=True).start()
+
+    def probe(self) -> None:
+        """
+        Request the probe path every few seconds until the backend answers without a 5xx, then half-open the breaker.
+        """
+        while True:
+            time.sleep(self.breaker.open_seconds)
+            try:
+                response = self.session.get(f'{self.base_url}{self.probe_path}', timeout=(self.connect_timeout, self.connect_timeout))
+                healthy = response.status_code < 500
+                response.close()
+            except requests.RequestException:
+                healthy = False
+            if healthy:
+                self.breaker.probe_succeeded()
+                return
+            self.breaker.probe_failed()
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, **kwargs)
@@ -0,0 +1,301 @@
+import json
+import logging
+import threading
+import time
+from sqlite3 import Connection, Row
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.db import ConnectionPool
+from common.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the job duration histograms, in seconds: jobs take longer than requests
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+JOBS = Counter('jobs_total', 'Jobs processed, by queue and outcome (succeeded, failed or retried).', ('queue', 'outcome'))
+JOB_SECONDS = Histogram('job_duration_seconds', 'Time a worker spent on a job, by queue and outcome.', ('queue', 'outcome'), JOB_BUCKETS)
+JOB_WAIT_SECONDS = Histogram('job_wait_seconds', 'Time jobs waited in the queue for a worker, by queue.', ('queue',), JOB_BUCKETS)
+
+# Processes a job: given a connection, the job's parameters and its payload, it returns the response
+# body and status code the job's request would have had. Its writes are committed along with the job's outcome
+Handler = Callable[[Connection, dict, Optional[bytes]], Tuple[dict, int]]
+
+
+class JobQueue:
+    """
+    Durable queue of jobs in an SQLite database, processed by a pool of worker threads.
+
+    Jobs are rows of the 'jobs' table, with their payload (e.g. an upload) in 'job_payloads' until
+    they finish. The tables live in the database the jobs write to, so a job's writes and its
+    outcome are committed together and every job takes effect once. A worker claims a job by
+    leasing it for 'lease_seconds': if the worker dies with the job (e.g. its process is killed),
+    the lease runs out and another worker, in this or any other process on the database, takes
+    it. A handler raising an exception is retried with exponential backoff, up to 'max_attempts'
+    attempts in all; a handler returning an error status fails the job at once.
+    """
+
+    def __init__(self, pool: ConnectionPool, name: str, handler: Handler, workers: int = 2, max_attempts: int = 3,
+                 retry_backoff: float = 1.0, lease_seconds: float = 300.0, poll_seconds: float = 1.0,
+                 retention_seconds: float = 86400.0) -> None:
+        """
+        Args:
+            pool (ConnectionPool): Pool of connections to the database holding the jobs.
+            name (str): Name of the queue, kept with its jobs and used as the metrics' 'queue' label.
+            handler (Handler): Processes a job.
+            workers (int): Worker threads; 0 only queues jobs, for other processes to process.
+            max_attempts (int): Attempts at a job before it fails.
+            retry_backoff (float): Seconds before the first retry, doubled for each retry after it.
+            lease_seconds (float): Seconds a job may run before it is presumed lost and run again.
+            poll_seconds (float): Seconds between checks for jobs queued by other processes or due for a retry.
+            retention_seconds (float): Seconds the outcome of a finished job is kept for.
+        """
+        self.pool = pool
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.retention_seconds = retention_seconds
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        # Released once per job queued by this process, so an idle worker starts on it at once
+        self.queued = threading.Semaphore(0)
+        self.purged_at = 0.0
+        Gauge('job_queue_depth', 'Jobs waiting or running, by queue and state.', ('queue', 'state'),
+              lambda: {(self.name, state): count for state, count in self.depths().items()})
+        Gauge('job_queue_oldest_seconds', 'Age of the oldest job waiting for a worker, by queue.', ('queue',),
+              lambda: {(self.name,): self.oldest_waiting()})
+
+    def schema(self) -> str:
+        """
+        Returns:
+            str: SQL creating the job tables. Partial indexes find the waiting, running and finished jobs
+                without reading the others.
+        """
+        return """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            queue TEXT NOT NULL,
+            state TEXT NOT NULL CHECK (state IN ('queued', 'running', 'succeeded', 'failed')),
+            params TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            started_at REAL,
+            lease_until REAL,
+            finished_at REAL,
+            status INTEGER,
+            result TEXT,
+            error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS job_payloads (
+            job_id INTEGER PRIMARY KEY,
+            payload BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (queue, available_at) WHERE state = 'queued';
+        CREATE INDEX IF NOT EXISTS jobs_running ON jobs (queue, lease_until) WHERE state = 'running';
+        CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (queue, finished_at) WHERE state IN ('succeeded', 'failed');
+        """
+
+    def enqueue(self, db: Connection, params: dict, payload: Optional[bytes] = None) -> int:
+        """
+        Queue a job and commit it.
+
+        Args:
+            db (Connection): Connection with no transaction of its own in progress.
+            params (dict): JSON-serialisable parameters passed to the handler.
+            payload (Optional[bytes]): Bytes passed to the handler, e.g. an upload.
+
+        Returns:
+            int: Id of the job.
+        """
+        now = time.time()
+        cursor = db.execute("INSERT INTO jobs (queue, state, params, created_at, available_at) VALUES (?, 'queued', ?, ?, ?)",
+                            (self.name, json.dumps(params), now, now))
+        if payload is not None:
+            db.execute('INSERT INTO job_payloads (job_id, payload) VALUES (?, ?)', (cursor.lastrowid, payload))
+        db.commit()
+        self.queued.release()
+        return cursor.lastrowid
+
+    def job(self, db: Connection, job_id: int) -> Optional[dict]:
+        """
+        Look a job up.
+
+        Args:
+            db (Connection): SQLite database connection object.
+            job_id (int): Id of the job.
+
+        Returns:
+            Optional[dict]: Its 'state', 'attempts', timestamps and, once finished, the 'status' and 'result'
+                of its handler (or the 'error' of its last failed attempt); None if there is no such job.
+        """
+        row = db.execute('SELECT * FROM jobs WHERE id = ? AND queue = ?', (job_id, self.name)).fetchone()
+        if row is None:
+            return None
+        job = {field: row[field] for field in ('state', 'attempts', 'created_at', 'started_at', 'finished_at', 'status', 'error')}
+        job['result'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def depths(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Number of jobs 'queued' (including those waiting for a retry) and 'running'.
+        """
+        db = self.pool.acquire()
+        try:
+            return {state: db.execute('SELECT count(*) FROM jobs WHERE queue = ? AND state = ?', (self.name, state)).fetchone()[0]
+                    for state in ('queued', 'running')}
+        finally:
+            self.pool.release(db)
+
+    def oldest_waiting(self) -> float:
+        """
+        Returns:
+            float: Seconds the oldest job available to a worker has been waiting for one, 0 if none is.
+        """
+        db = self.pool.acquire()
+        try:
+            now = time.time()
+            oldest = db.execute("SELECT min(available_at) FROM jobs WHERE queue = ? AND state = 'queued' AND available_at <= ?",
+                                (self.name, now)).fetchone()[0]
+            return round(now - oldest, 3) if oldest is not None else 0.0
+        finally:
+            self.pool.release(db)
+
+    def start(self) -> None:
+        """
+        Start the worker threads, unless they are already running.
+        """
+        with self.lock:
+            if self.threads or self.workers < 1:
+                return
+            self.stopping.clear()
+            self.threads = [threading.Thread(target=self.work, name=f'{self.name}-worker-{index}', daemon=True)
+                            for index in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the worker threads once they have finished their current job. Jobs still queued stay queued.
+
+        Args:
+            timeout (Optional[float]): Most seconds to wait for each thread.
+        """
+        with self.lock:
+            self.stopping.set()
+            for _ in self.threads:
+                self.queued.release()
+            for thread in self.threads:
+                thread.join(timeout)
+            self.threads = []
+
+    def work(self) -> None:
+        """
+        Worker thread: process jobs until the queue is stopped, on a connection of its own.
+        """
+        db = self.pool.connect()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    job = self.claim(db)
+                    if job is not None:
+                        self.process(db, job)
+                        continue
+                except Exception:
+                    logger.exception('Job queue %s failed to claim or finish a job', self.name)
+                    if db.in_transaction:
+                        db.rollback()
+                # Wait for a job from this process, or poll for those of others and for retries
+                self.queued.acquire(timeout=self.poll_seconds)
+        finally:
+            db.close()
+
+    def claim(self, db: Connection) -> Optional[Row]:
+        """
+        Lease the job that has been waiting longest, requeueing the jobs of workers whose lease ran out.
+
+        Returns:
+            Optional[Row]: The job, None if no job is waiting.
+        """
+        now = time.time()
+        self.purge(db, now)
+        # Most polls find nothing, which is checked without taking the write lock
+        waiting = db.execute("SELECT 1 FROM jobs WHERE queue = ? AND state = 'queued' AND available_at <= ? "
+                             "UNION ALL SELECT 1 FROM jobs WHERE queue = ? AND state = 'running' AND lease_until < ? LIMIT 1",
+                             (self.name, now, self.name, now)).fetchone()
+        if waiting is None:
+            return None
+
+        db.execute('BEGIN IMMEDIATE')
+        db.execute("UPDATE jobs SET state = 'queued', available_at = ?, lease_until = NULL, "
+                   "error = 'The worker stopped before finishing the job' "
+                   "WHERE queue = ? AND state = 'running' AND lease_until < ?", (now, self.name, now))
+        rows = db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, started_at = ?, lease_until = ? "
+                          "WHERE id = (SELECT id FROM jobs WHERE queue = ? AND state = 'queued' AND available_at <= ? "
+                          "ORDER BY available_at LIMIT 1) RETURNING *",
+                          (now, now + self.lease_seconds, self.name, now)).fetchall()
+        db.commit()
+        return rows[0] if rows else None
+
+    def process(self, db: Connection, job: Row) -> None:
+        """
+        Run a claimed job through the handler and record its outcome, retrying it later if the handler raised.
+        """
+        started = time.time()
+        JOB_WAIT_SECONDS.labels(self.name).observe(max(started - job['available_at'], 0.0))
+        if job['attempts'] > self.max_attempts:
+            # Its workers kept stopping while processing it, e.g. because it crashes the process
+            self.finish(db, job, 'failed', 500, {'error': 'Job failed', 'message': job['error']}, started)
+            return
+
+        payload = db.execute('SELECT payload FROM job_payloads WHERE job_id = ?', (job['id'],)).fetchone()
+        try:
+            body, status = self.handler(db, json.loads(job['params']), payload[0] if payload else None)
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            if job['attempts'] >= self.max_attempts:
+                self.finish(db, job, 'failed', 500, {'error': 'Job failed', 'message': str(e)}, started)
+                return
+            # Retry with exponential backoff
+            retry_at = time.time() + self.retry_backoff * 2 ** (job['attempts'] - 1)
+            db.execute("UPDATE jobs SET state = 'queued', available_at = ?, lease_until = NULL, error = ? "
+                       "WHERE id = ? AND state = 'running' AND started_at = ?", (retry_at, str(e), job['id'], job['started_at']))
+            db.commit()
+            JOBS.labels(self.name, 'retried').inc()
+            JOB_SECONDS.labels(self.name, 'retried').observe(time.time() - started)
+            return
+        self.finish(db, job, 'succeeded' if status < 400 else 'failed', status, body, started)
+
+    def finish(self, db: Connection, job: Row, state: str, status: int, body: dict, started: float) -> None:
+        """
+        Record the outcome of a job in the handler's transaction and commit both, unless the job's lease
+        ran out meanwhile and another worker took it, in which case the handler's writes are rolled back.
+        """
+        cursor = db.execute('UPDATE jobs SET state = ?, status = ?, result = ?, finished_at = ?, lease_until = NULL '
+                            "WHERE id = ? AND state = 'running' AND started_at = ?",
+                            (state, status, json.dumps(body), time.time(), job['id'], job['started_at']))
+        if cursor.rowcount == 0:
+            db.rollback()
+            return
+        db.execute('DELETE FROM job_payloads WHERE job_id = ?', (job['id'],))
+        db.commit()
+        JOBS.labels(self.name, state).inc()
+        JOB_SECONDS.labels(self.name, state).observe(time.time() - started)
+
+    def purge(self, db: Connection, now: float) -> None:
+        """
+        Delete the jobs that finished more than 'retention_seconds' ago, at most once per minute.
+        """
+        if now - self.purged_at < 60:
+            return
+        self.purged_at = now
+        db.execute("DELETE FROM jobs WHERE queue = ? AND state IN ('succeeded', 'failed') AND finished_at < ?",
+                   (self.name, now - self.retention_seconds))
+        db.commit()
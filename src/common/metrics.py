@@ -0,0 +1,333 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.tracing import record_span
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upper bounds of the payload size histograms, in bytes (256 B to 64 MB)
+SIZE_BUCKETS = tuple(256 * 4 ** power for power in range(10))
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """
+    Format a label set as '{name="value",...}', escaping the values as the exposition format requires.
+    """
+    pairs = [f'{name}="{value}"' for name, value in zip(names, (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values))]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterChild:
+    """
+    One labelled series of a Counter.
+    """
+
+    __slots__ = ('value', 'lock')
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class HistogramChild:
+    """
+    One labelled series of a Histogram. Bucket counts are kept per bucket and only made cumulative when rendered.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    """
+    A named family of series distinguished by their label values, registered for export on /metrics.
+    """
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> None:
+        """
+        Args:
+            name (str): Metric name.
+            documentation (str): The HELP text.
+            label_names (Tuple[str, ...]): Names of the labels, whose values are passed to labels() in this order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values: str):
+        """
+        Get the series for a set of label values, creating it on first use.
+
+        Args:
+            *values (str): One value per label name.
+
+        Returns:
+            The series, a CounterChild or HistogramChild.
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count, e.g. of requests.
+    """
+
+    kind = 'counter'
+
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in list(self.children.items()):
+            lines.append(f'{self.name}{format_labels(self.label_names, values)} {child.value}')
+        return lines
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, e.g. latencies or payload sizes, over fixed buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Args:
+            name (str): Metric name.
+            documentation (str): The HELP text.
+            label_names (Tuple[str, ...]): Names of the labels.
+            buckets (Tuple[float, ...]): Sorted upper bounds of the buckets; a +Inf bucket is added.
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, label_names)
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, values, le)} {cumulative}')
+            labels = format_labels(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    """
+    Current value of something that goes up and down, e.g. a queue's depth, read when the metrics are rendered.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """
+        Args:
+            name (str): Metric name.
+            documentation (str): The HELP text.
+            label_names (Tuple[str, ...]): Names of the labels.
+            collect (Callable[[], Dict[Tuple[str, ...], float]]): Returns the current value of each series,
+                keyed by its label values. A failing call renders no series.
+        """
+        self.collect = collect
+        super().__init__(name, documentation, label_names)
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception:
+            return []
+        return [f'{self.name}{format_labels(self.label_names, labels)} {value}' for labels, value in values.items()]
+
+
+# Every metric created in this process, in creation order
+REGISTRY: List[Metric] = []
+
+# Metrics shared by every service
+REQUESTS = Counter('http_requests_total', 'Requests handled, by method, route and status code.', ('method', 'route', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to handle a request, until its response starts.', ('method', 'route'))
+REQUEST_BYTES = Histogram('http_request_size_bytes', 'Size of request bodies with a Content-Length.', ('route',), SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram('http_response_size_bytes', 'Size of response bodies with a Content-Length.', ('route',), SIZE_BUCKETS)
+STAGE_SECONDS = Histogram('stage_duration_seconds', 'Time spent in each internal stage of handling requests.', ('stage',))
+
+
+def render_metrics() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition, one HELP/TYPE header and its series per metric.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Context manager recording the time spent in one internal stage, e.g. a database query,
+    in its histogram and as a span of the current request's trace.
+    """
+
+    __slots__ = ('name', 'series', 'started')
+
+    def __init__(self, name: str, series: HistogramChild) -> None:
+        self.name = name
+        self.series = series
+
+    def __enter__(self) -> 'StageTimer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        duration = time.perf_counter() - self.started
+        self.series.observe(duration)
+        record_span(self.name, self.started, duration)
+
+
+def stage(name: str) -> StageTimer:
+    """
+    Time a stage of request handling into stage_duration_seconds.
+
+    Example:
+        with stage('db_query'):
+            rows = db.execute(...).fetchall()
+
+    Args:
+        name (str): Name of the stage, e.g. 'db_query', 'decode' or 'upstream_audd'.
+
+    Returns:
+        StageTimer: Context manager timing its block.
+    """
+    return StageTimer(name, STAGE_SECONDS.labels(name))
+
+
+def route_of(request) -> str:
+    """
+    Label a request by its URL rule rather than its path, so the number of series stays bounded.
+    """
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def record_request(request, response, started: float) -> None:
+    """
+    Record the count, latency and payload sizes of a handled request.
+
+    Args:
+        request: The Flask or Quart request.
+        response: Its response.
+        started (float): perf_counter() when the request started.
+    """
+    route = route_of(request)
+    REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+    REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    if request.content_length is not None:
+        REQUEST_BYTES.labels(route).observe(request.content_length)
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(route).observe(response.content_length)
+
+
+def instrument_app(app) -> None:
+    """
+    Record request metrics for every route of a Flask app and serve them on GET /metrics.
+
+    Streamed responses are timed until their first byte is ready, and have no response size.
+
+    Args:
+        app (Flask): The application.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer() -> None:
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record(response: Response) -> Response:
+        started: Optional[float] = g.pop('request_started', None)
+        if started is not None:
+            record_request(request, response, started)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics() -> Response:
+        return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def instrument_async_app(app) -> None:
+    """
+    Record request metrics for every route of a Quart app and serve them on GET /metrics.
+
+    The hooks are coroutines, as Quart runs plain functions in a thread pool.
+
+    Args:
+        app (Quart): The application.
+    """
+    from quart import Response, g, request
+
+    @app.before_request
+    async def start_timer() -> None:
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    async def record(response: Response) -> Response:
+        started: Optional[float] = g.pop('request_started', None)
+        if started is not None:
+            record_request(request, response, started)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    async def metrics() -> Response:
+        return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
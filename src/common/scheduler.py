@@ -0,0 +1,257 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, TypeVar
+
+from common.http import Deadline, DeadlineExceeded
+
+T = TypeVar('T')
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a call cannot be made within the rate limit, by the upstream or by the scheduler itself.
+    """
+
+    def __init__(self, retry_after: Optional[float] = None) -> None:
+        """
+        Args:
+            retry_after (Optional[float]): Seconds until a call is likely to be accepted, if known.
+        """
+        super().__init__('Rate limit exceeded')
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, given either as a number of seconds or as an HTTP date.
+
+    Args:
+        value (Optional[str]): The header's value.
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at 'rate' tokens per second up to 'burst' tokens.
+
+    Callers reserve a token and are told how long to wait for it, so tokens can be owed
+    (negative) while callers queue. Pausing the bucket stops the refill until the pause ends.
+    Not thread-safe on its own; UpstreamScheduler holds a lock around it.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        Args:
+            rate (float): Tokens added per second.
+            burst (int): Most tokens the bucket holds.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        # Time the tokens were last refilled up to, in the future while the bucket is paused
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Take a token.
+
+        Returns:
+            float: Seconds until the token may be used.
+        """
+        now = time.monotonic()
+        self.refill(now)
+        self.tokens -= 1
+        return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def cancel(self) -> None:
+        """
+        Give back a token that was reserved but will not be used.
+        """
+        self.tokens += 1
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for 'seconds', e.g. while the upstream asks callers to back off.
+
+        Args:
+            seconds (float): Length of the pause.
+        """
+        now = time.monotonic()
+        self.refill(now)
+        # Nothing saved up before the pause may be spent in a burst after it
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, now + seconds)
+
+    def paused_for(self) -> float:
+        """
+        Returns:
+            float: Seconds left of the current pause, 0 if the bucket is not paused.
+        """
+        return max(0.0, self.updated - time.monotonic())
+
+
+class Flight:
+    """
+    An upstream call in progress, whose result is shared with the callers that asked for the same key.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class UpstreamScheduler:
+    """
+    Schedules calls to a rate-limited upstream API from many threads.
+
+    - A token bucket keeps calls within the API quota ('rate' per second, bursts of up to 'burst').
+    - At most 'max_waiting' callers queue for a token, and only if their token comes within 'max_wait'
+      seconds and their deadline; anyone else is turned away at once with RateLimitExceeded.
+    - Concurrent calls with the same key share one upstream call (single-flight).
+    - An upstream call that raises RateLimitExceeded pauses the bucket for its Retry-After (or an
+      exponential backoff when none was given) and is retried up to 'max_retries' times.
+    """
+
+    def __init__(self, rate: float, burst: int, max_waiting: int, max_wait: float,
+                 max_retries: int = 2, backoff: float = 1.0) -> None:
+        """
+        Args:
+            rate (float): Calls per second allowed by the API quota.
+            burst (int): Calls that may be made at once after an idle period.
+            max_waiting (int): Most callers queued for a token at any time.
+            max_wait (float): Longest a caller may queue for a token, in seconds.
+            max_retries (int): Times a rate-limited call is retried.
+            backoff (float): First backoff in seconds when the upstream gives no Retry-After, doubled on each retry.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.flights: Dict[str, Flight] = {}
+        self.stats = {'calls': 0, 'upstream_calls': 0, 'coalesced': 0, 'rejected': 0, 'upstream_rate_limited': 0, 'retries': 0}
+
+    def call(self, key: str, function: Callable[[], T], deadline: Deadline) -> T:
+        """
+        Make an upstream call, or wait for an identical one already in flight.
+
+        Args:
+            key (str): Identity of the call; concurrent calls with the same key share one result.
+            function (Callable[[], T]): Makes the upstream call. Raises RateLimitExceeded when the upstream rate limits it.
+            deadline (Deadline): Budget of the caller, covering the wait for a token and any retries.
+
+        Returns:
+            T: The result of the upstream call.
+
+        Raises:
+            RateLimitExceeded: If no token could be had within the deadline, or the upstream kept rate limiting.
+            DeadlineExceeded: If the deadline passed while waiting for an identical call.
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(deadline.remaining()):
+                raise DeadlineExceeded('Deadline exceeded waiting for an identical upstream call')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.call_with_retries(function, deadline)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def call_with_retries(self, function: Callable[[], T], deadline: Deadline) -> T:
+        """
+        Make an upstream call once a token is available, backing off and retrying while it is rate limited.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(deadline)
+            with self.lock:
+                self.stats['upstream_calls'] += 1
+            try:
+                return function()
+            except RateLimitExceeded as e:
+                delay = e.retry_after if e.retry_after is not None else self.backoff * 2 ** attempt
+                with self.lock:
+                    self.stats['upstream_rate_limited'] += 1
+                    self.bucket.pause(delay)
+                if attempt == self.max_retries or delay >= deadline.remaining():
+                    raise RateLimitExceeded(delay)
+                with self.lock:
+                    self.stats['retries'] += 1
+
+    def acquire(self, deadline: Deadline) -> None:
+        """
+        Wait for a token of the bucket.
+
+        Args:
+            deadline (Deadline): Budget of the caller.
+
+        Raises:
+            RateLimitExceeded: If the queue is full or the token would come too late.
+        """
+        with self.lock:
+            wait = self.bucket.reserve()
+            if wait > 0 and (self.waiting >= self.max_waiting or wait > min(self.max_wait, deadline.remaining())):
+                self.bucket.cancel()
+                self.stats['rejected'] += 1
+                raise RateLimitExceeded(wait)
+            self.waiting += 1
+
+        try:
+            time.sleep(wait)
+            # The bucket may have been paused by a rate-limited call while this one slept
+            with self.lock:
+                wait = self.bucket.paused_for()
+            if wait > deadline.remaining():
+                with self.lock:
+                    self.stats['rejected'] += 1
+                raise RateLimitExceeded(wait)
+            time.sleep(wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: Counters of the scheduler, plus the callers currently queued for a token.
+        """
+        with self.lock:
+            return {**self.stats, 'waiting': self.waiting}
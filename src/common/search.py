@@ -0,0 +1,248 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from itertools import combinations
+from typing import Dict, List, Optional, Set, Tuple
+
+# Name of the FTS5 table holding the normalised artist and title of every track, keyed by its rowid
+SEARCH_TABLE = 'track_search'
+
+# Tracks rescored per query; matches are chosen among these candidates
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', 20))
+
+# Rarest trigrams of each query field that candidates are looked up by: tracks with all of the first
+# EXACT_TRIGRAMS or, for misspelt fields, any two of the first RARE_TRIGRAMS
+EXACT_TRIGRAMS = int(os.environ.get('SEARCH_EXACT_TRIGRAMS', 3))
+RARE_TRIGRAMS = int(os.environ.get('SEARCH_RARE_TRIGRAMS', 4))
+
+# Seconds between reloads of the trigram document counts used to pick the rarest trigrams
+VOCABULARY_TTL = float(os.environ.get('SEARCH_VOCABULARY_TTL', 300))
+
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalise(text: str) -> str:
+    """
+    Fold a string for matching: lowercase, without diacritics or punctuation, single spaces.
+
+    Args:
+        text (str): Artist, title or query.
+
+    Returns:
+        str: The folded text, e.g. 'Beyoncé - Halo!' -> 'beyonce halo'.
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    return SEPARATORS.sub(' ', stripped.casefold()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Returns:
+        Set[str]: Every run of three characters of a normalised string, as indexed by the FTS5 trigram tokenizer.
+    """
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+
+def similarity(query: Set[str], candidate: Set[str]) -> float:
+    """
+    Score how well a candidate matches a query, from their trigrams.
+
+    The mean of containment (the share of the query found in the candidate, 1 for prefixes and
+    substrings) and the Dice coefficient (which prefers candidates of the query's length).
+
+    Returns:
+        float: 1 for identical strings, down to 0 for nothing in common.
+    """
+    if not query or not candidate:
+        return 0.0
+    common = len(query & candidate)
+    return (common / len(query) + 2 * common / (len(query) + len(candidate))) / 2
+
+
+def phrase(text: str) -> str:
+    """
+    Quote a normalised string as an FTS5 phrase, which the trigram tokenizer matches as a substring.
+    """
+    return '"' + text.replace('"', '""') + '"'
+
+
+class TrackSearch:
+    """
+    Ranked, typo-tolerant search over the artist and title of the catalogue's tracks.
+
+    Matching runs on an FTS5 trigram index of the normalised artist and title. Candidates are
+    looked up by the query's rarest trigrams and only they are scored, so a query costs about the
+    same whatever the catalogue's size. How rare each trigram is comes from
+    per-process document counts reloaded every VOCABULARY_TTL seconds; trigrams first added since
+    are taken for misspellings, which only costs their queries the slower typo-tolerant lookup.
+    """
+
+    def __init__(self) -> None:
+        self.frequencies: Dict[str, int] = {}
+        self.loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def schema(self) -> str:
+        """
+        Returns:
+            str: SQL creating the indexes and the triggers that keep them in step with 'tracks'. They
+                call search_text(), which every connection writing tracks must register (see normalise()).
+        """
+        return f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(artist, title, tokenize='trigram');
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}_vocabulary USING fts5vocab({SEARCH_TABLE}, 'row');
+        CREATE INDEX IF NOT EXISTS tracks_search_key ON tracks (search_text(artist), search_text(title));
+        CREATE TRIGGER IF NOT EXISTS tracks_search_insert AFTER INSERT ON tracks
+        BEGIN INSERT INTO {SEARCH_TABLE} (rowid, artist, title) VALUES (new.rowid, search_text(new.artist), search_text(new.title)); END;
+        CREATE TRIGGER IF NOT EXISTS tracks_search_delete AFTER DELETE ON tracks
+        BEGIN DELETE FROM {SEARCH_TABLE} WHERE rowid = old.rowid; END;
+        CREATE TRIGGER IF NOT EXISTS tracks_search_update AFTER UPDATE OF artist, title ON tracks
+        BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.rowid;
+            INSERT INTO {SEARCH_TABLE} (rowid, artist, title) VALUES (new.rowid, search_text(new.artist), search_text(new.title));
+        END;
+        """
+
+    def rebuild_if_stale(self, db: sqlite3.Connection) -> bool:
+        """
+        Rebuild the index from 'tracks' if they hold different numbers of tracks, e.g. for a database
+        created before the index existed.
+
+        Args:
+            db (sqlite3.Connection): Connection with search_text() registered.
+
+        Returns:
+            bool: Whether the index was rebuilt.
+        """
+        indexed = db.execute(f'SELECT count(*) FROM {SEARCH_TABLE}').fetchone()[0]
+        if indexed == db.execute('SELECT count(*) FROM tracks').fetchone()[0]:
+            return False
+        db.execute(f'DELETE FROM {SEARCH_TABLE}')
+        db.execute(f'INSERT INTO {SEARCH_TABLE} (rowid, artist, title) '
+                   'SELECT rowid, search_text(artist), search_text(title) FROM tracks')
+        db.commit()
+        return True
+
+    def document_frequencies(self, db: sqlite3.Connection) -> Dict[str, int]:
+        """
+        Get the number of tracks containing each trigram, reloading them once they are VOCABULARY_TTL old.
+
+        Only one thread reloads at a time; the others keep using the previous counts meanwhile.
+        """
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > VOCABULARY_TTL:
+            if self.lock.acquire(blocking=self.loaded_at is None):
+                try:
+                    self.frequencies = dict(db.execute(f'SELECT term, doc FROM {SEARCH_TABLE}_vocabulary'))
+                    self.loaded_at = time.monotonic()
+                finally:
+                    self.lock.release()
+        return self.frequencies
+
+    def matching(self, db: sqlite3.Connection, expression: str) -> List[int]:
+        """
+        Returns:
+            List[int]: Rowids of up to SEARCH_CANDIDATES tracks matching an FTS5 query expression.
+        """
+        return [row[0] for row in db.execute(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ? LIMIT ?',
+                                             (expression, SEARCH_CANDIDATES))]
+
+    def candidates(self, db: sqlite3.Connection, fields: Dict[str, str]) -> List[int]:
+        """
+        Find the rowids of the tracks worth scoring for a query.
+
+        When an artist is given, tracks whose normalised artist (and title) equal the query's come first. Then only the
+        query's rarest trigrams are looked up, so a query costs a few short postings lists however
+        common its other trigrams are, and FTS5 combines them without reading any track. For a field
+        with trigrams that are in no track as of the last counts (it is misspelt, or the tracks
+        having them are newer than the counts), or when no track contains the rarest trigrams of
+        every field, tracks with any two of its rarest trigrams do, which still finds a track when a
+        few characters are wrong.
+
+        Args:
+            db (sqlite3.Connection): Database connection.
+            fields (Dict[str, str]): Normalised query text for 'artist' and/or 'title', or for 'text' (either column).
+
+        Returns:
+            List[int]: Up to SEARCH_CANDIDATES rowids, the likeliest first.
+        """
+        rowids = []
+        if 'artist' in fields:
+            # Tracks whose artist and title are the query's once normalised, from the key index (which leads with the artist)
+            where = ' AND '.join(f'search_text({field}) = ?' for field in fields)
+            rowids = [row[0] for row in db.execute(f'SELECT rowid FROM tracks WHERE {where} LIMIT ?', (*fields.values(), SEARCH_CANDIDATES))]
+
+        frequencies = self.document_frequencies(db)
+        exact: Dict[str, str] = {}
+        tolerant: Dict[str, str] = {}
+        misspelt = set()
+        for field, text in fields.items():
+            # Trigrams within a word first: those spanning words may span the artist and title of a free text query
+            ranked = sorted((' ' in trigram, frequencies.get(trigram, 0), trigram) for trigram in trigrams(text))
+            if any(not spans and not frequency for spans, frequency, _ in ranked):
+                misspelt.add(field)
+            # Trigrams in no track are kept on top of the rarest ones, as they may be in tracks newer than the counts
+            unknown = [trigram for _, frequency, trigram in ranked if not frequency][:RARE_TRIGRAMS]
+            known = [trigram for _, frequency, trigram in ranked if frequency][:RARE_TRIGRAMS]
+            rarest = [phrase(trigram) if field == 'text' else f'{field} : {phrase(trigram)}' for trigram in unknown + known]
+            exact[field] = ' AND '.join(rarest[:EXACT_TRIGRAMS])
+            tolerant[field] = ' OR '.join(f'({first} AND {second})' for first, second in combinations(rarest, 2)) or rarest[0]
+
+        # Tracks with all of the rarest trigrams, trying any two of them only for the misspelt fields
+        expressions = [' AND '.join(f'({tolerant[field] if field in misspelt else exact[field]})' for field in fields)]
+        if misspelt != set(fields):
+            # A misspelling can also make trigrams that other tracks have
+            expressions.append(' AND '.join(f'({tolerant[field]})' for field in fields))
+        for expression in expressions:
+            rowids = list(dict.fromkeys(rowids + self.matching(db, expression)))
+            if rowids:
+                break
+        return rowids[:SEARCH_CANDIDATES]
+
+    def search(self, db: sqlite3.Connection, fields: Dict[str, str], limit: int, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Search the catalogue.
+
+        Tracks are scored with similarity(): free text against the artist, the title and both
+        together, keeping the best, and fields against their own column, keeping the worst, so that
+        a track only scores well if every field given matches.
+
+        Args:
+            db (sqlite3.Connection): Database connection.
+            fields (Dict[str, str]): Query text (not yet normalised) for 'artist' and/or 'title', or for 'text'
+                to match against either. Every field must be at least 3 characters once normalised.
+            limit (int): Maximum number of results.
+            min_score (float): Lowest score returned.
+
+        Returns:
+            List[Tuple[int, float]]: Rowid and score of the best matching tracks, best first.
+
+        Raises:
+            ValueError: If a field is too short to be matched.
+        """
+        fields = {field: normalise(text) for field, text in fields.items()}
+        for field, text in fields.items():
+            if len(text) < 3:
+                raise ValueError(f"{'Query' if field == 'text' else field.capitalize()} must be at least 3 letters or digits long")
+        rowids = self.candidates(db, fields)
+        if not rowids:
+            return []
+
+        query = {field: trigrams(text) for field, text in fields.items()}
+        rows = db.execute(f"SELECT rowid, artist, title FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join('?' * len(rowids))})", rowids)
+        scored = []
+        for rowid, artist, title in rows:
+            if 'text' in query:
+                # Free text may name the artist, the title or both
+                score = max(similarity(query['text'], trigrams(candidate)) for candidate in (artist, title, f'{artist} {title}'))
+            else:
+                candidate = {'artist': trigrams(artist), 'title': trigrams(title)}
+                # Every field given has to match
+                score = min(similarity(query[field], candidate[field]) for field in query)
+            if score >= min_score:
+                scored.append((rowid, round(score, 3)))
+        scored.sort(key=lambda result: -result[1])
+        return scored[:limit]
@@ -0,0 +1,195 @@
+import base64
+import hashlib
+import heapq
+import json
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from common.compression import identity_etag
+
+
+def parse_urls(value: str) -> List[str]:
+    """
+    Split a comma-separated list of service URLs, e.g. the catalogue shards in shard order.
+
+    Args:
+        value (str): The list, e.g. 'http://localhost:5002,http://localhost:5012'.
+
+    Returns:
+        List[str]: The URLs, without trailing slashes.
+    """
+    return [url.strip().rstrip('/') for url in value.split(',') if url.strip()]
+
+
+def key_hash(artist: str, title: str) -> int:
+    """
+    Stable 64-bit hash of a track's (artist, title) key, the same in every process and Python version.
+    """
+    key = f'{artist}\0{title}'.encode('utf-8', 'surrogatepass')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping and Veach): map a 64-bit key to one of 'buckets' buckets, so that
+    going from n to n + 1 buckets only moves 1 / (n + 1) of the keys, all of them to the new bucket.
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(artist: str, title: str, shard_count: int) -> int:
+    """
+    Find the shard that owns a track.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+        shard_count (int): Number of shards.
+
+    Returns:
+        int: Index of the owning shard, from 0 to shard_count - 1.
+    """
+    if shard_count <= 1:
+        return 0
+    return jump_hash(key_hash(artist, title), shard_count)
+
+
+def encode_cursor(artist: str, title: str) -> str:
+    """
+    Encode the key of the last track of a page as an opaque pagination cursor.
+
+    Cursors are keys rather than positions, so one cursor pages through every shard at once.
+
+    Args:
+        artist (str): Artist of the last track returned.
+        title (str): Title of the last track returned.
+
+    Returns:
+        str: URL-safe cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([artist, title]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a pagination cursor made by encode_cursor().
+
+    Args:
+        cursor (str): Cursor from a previous page.
+
+    Returns:
+        Tuple[str, str]: Artist and title the next page starts after.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        artist, title = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(artist, str) or not isinstance(title, str):
+        raise ValueError('Invalid cursor')
+    return artist, title
+
+
+def track_key(track: dict) -> Tuple[str, str]:
+    return track['artist'], track['title']
+
+
+def combine_etags(etags: List[Optional[str]]) -> str:
+    """
+    Build one entity tag for the contents of every shard, which changes when any of theirs does.
+
+    Args:
+        etags (List[Optional[str]]): The ETag of each shard, in shard order, uncompressed or in any content coding.
+
+    Returns:
+        str: Quoted entity tag of the uncompressed listing.
+    """
+    digest = hashlib.blake2b(','.join(identity_etag(etag or '') for etag in etags).encode('utf-8'), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def merge_pages(pages: List[Tuple[List[dict], Optional[str]]], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """
+    Merge the same page of every shard, each ordered by artist then title, into that page of the whole catalogue.
+
+    Args:
+        pages (List[Tuple[List[dict], Optional[str]]]): The tracks and 'next_cursor' of each shard's page,
+            all read with the same cursor and a limit of 'limit'.
+        limit (int): Page size.
+
+    Returns:
+        Tuple[List[dict], Optional[str]]: The page and the cursor of the next one, None on the last page.
+    """
+    merged = list(heapq.merge(*(tracks for tracks, _ in pages), key=track_key))
+    page = merged[:limit]
+    more = len(merged) > limit or any(next_cursor is not None for _, next_cursor in pages)
+    return page, encode_cursor(*track_key(page[-1])) if more and page else None
+
+
+class ShardedListing:
+    """
+    Merge of the ordered track listings of every shard into one ordered listing, read page by page.
+
+    A track can be placed once every shard either has a later track buffered or has no tracks
+    left, so only about one page per shard is held at a time. The caller fetches the pages asked
+    for by wanted() and passes them to add_page(); shared by the sync and async gateways.
+    """
+
+    def __init__(self, shard_count: int, cursor: Optional[str] = None) -> None:
+        """
+        Args:
+            shard_count (int): Number of shards.
+            cursor (Optional[str]): Cursor the listing starts after, None to start at the beginning.
+        """
+        self.buffers: List[Deque[dict]] = [deque() for _ in range(shard_count)]
+        self.cursors: List[Optional[str]] = [cursor] * shard_count
+        self.exhausted = [False] * shard_count
+
+    def wanted(self) -> List[Tuple[int, Optional[str]]]:
+        """
+        List the shards whose next page is needed before more tracks can be placed.
+
+        Returns:
+            List[Tuple[int, Optional[str]]]: Index of each shard and the cursor to fetch its next page with.
+        """
+        return [(shard, self.cursors[shard]) for shard, buffer in enumerate(self.buffers)
+                if not buffer and not self.exhausted[shard]]
+
+    def add_page(self, shard: int, tracks: List[dict], next_cursor: Optional[str]) -> None:
+        """
+        Record the next page of a shard.
+
+        Args:
+            shard (int): Index of the shard.
+            tracks (List[dict]): Tracks of the page, empty if the shard has none left.
+            next_cursor (Optional[str]): The page's 'next_cursor', None on the shard's last page.
+        """
+        self.buffers[shard].extend(tracks)
+        self.cursors[shard] = next_cursor
+        self.exhausted[shard] = next_cursor is None or not tracks
+
+    def take(self) -> List[dict]:
+        """
+        Take every track that can be placed with the pages fetched so far.
+
+        Returns:
+            List[dict]: The tracks, in order, following those taken before.
+        """
+        taken = []
+        while not self.wanted():
+            heads = [(track_key(buffer[0]), shard) for shard, buffer in enumerate(self.buffers) if buffer]
+            if not heads:
+                break
+            taken.append(self.buffers[min(heads)[1]].popleft())
+        return taken
+
+    @property
+    def done(self) -> bool:
+        return all(self.exhausted) and not any(self.buffers)
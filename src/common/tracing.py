@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Header carrying the trace between services, in the W3C Trace Context format
+TRACEPARENT = 'traceparent'
+
+# Response headers with the trace id and the breakdown of where the time went
+REQUEST_ID = 'X-Request-ID'
+SERVER_TIMING = 'Server-Timing'
+
+# JSON-lines file every finished span is appended to; tracing still propagates ids and sets Server-Timing without it
+TRACE_FILE = os.environ.get('TRACE_FILE')
+
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Parse a 'traceparent' header.
+
+    Args:
+        value (Optional[str]): The header, '00-<32 hex trace id>-<16 hex parent span id>-<flags>'.
+
+    Returns:
+        Optional[Tuple[str, str]]: Trace id and parent span id, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    parts = value.strip().lower().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+            return None
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+def parse_server_timing(value: Optional[str]) -> List[Tuple[str, float]]:
+    """
+    Parse the 'name;dur=milliseconds' entries of a Server-Timing header, skipping entries without a duration.
+    """
+    entries = []
+    for entry in (value or '').split(','):
+        name, *parameters = entry.strip().split(';')
+        for parameter in parameters:
+            key, _, duration = parameter.strip().partition('=')
+            if key == 'dur':
+                try:
+                    entries.append((name, float(duration)))
+                except ValueError:
+                    pass
+    return entries
+
+
+class Trace:
+    """
+    Spans of the request one service is handling, all children of its server span.
+
+    Durations of spans with the same name add up in the Server-Timing header. Client spans also
+    carry the Server-Timing entries of the service they called, so the header of the gateway
+    breaks a request down across every hop, e.g. 'upstream_identification.upstream_audd'.
+    """
+
+    def __init__(self, service: str, name: str, traceparent: Optional[str] = None) -> None:
+        """
+        Args:
+            service (str): Name of the service handling the request.
+            name (str): Name of the server span, e.g. 'POST /music/identify'.
+            traceparent (Optional[str]): The incoming 'traceparent' header, which makes this a continuation of the caller's trace.
+        """
+        parent = parse_traceparent(traceparent)
+        self.trace_id, self.parent_id = parent if parent is not None else (new_id(16), None)
+        self.span_id = new_id(8)
+        self.service = service
+        self.name = name
+        self.wall_started = time.time()
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self.timings: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, started: float, duration: float, span_id: Optional[str] = None,
+               attributes: Optional[dict] = None, server_timing: Optional[str] = None) -> None:
+        """
+        Record a finished span.
+
+        Args:
+            name (str): Name of the span, e.g. 'db_query' or 'upstream_catalogue'.
+            started (float): perf_counter() when it started.
+            duration (float): Seconds it took.
+            span_id (Optional[str]): Id of the span, for client spans whose id was sent on to the callee.
+            attributes (Optional[dict]): Details of the span, e.g. the path and status of a call.
+            server_timing (Optional[str]): Server-Timing header of the callee's response.
+        """
+        span = {
+            'trace_id': self.trace_id,
+            'span_id': span_id or new_id(8),
+            'parent_id': self.span_id,
+            'service': self.service,
+            'name': name,
+            'start': round(self.wall_started + started - self.started, 6),
+            'duration_ms': round(duration * 1000, 3),
+        }
+        if attributes:
+            span['attributes'] = attributes
+        with self.lock:
+            self.spans.append(span)
+            self.timings[name] = self.timings.get(name, 0.0) + duration * 1000
+            for entry, milliseconds in parse_server_timing(server_timing):
+                if entry != 'total':
+                    key = f'{name}.{entry}'
+                    self.timings[key] = self.timings.get(key, 0.0) + milliseconds
+
+    def outbound_headers(self, span_id: str) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: Headers continuing this trace in a call made as the client span 'span_id'.
+        """
+        return {TRACEPARENT: f'00-{self.trace_id}-{span_id}-01'}
+
+    def finish(self, status: int) -> Tuple[str, List[dict]]:
+        """
+        Close the server span.
+
+        Args:
+            status (int): Status code of the response.
+
+        Returns:
+            Tuple[str, List[dict]]: The Server-Timing header value and every span of the request, server span first.
+        """
+        total = (time.perf_counter() - self.started) * 1000
+        with self.lock:
+            timings = ', '.join(f'{name};dur={milliseconds:.3f}' for name, milliseconds in self.timings.items())
+            spans = [{
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'service': self.service,
+                'name': self.name,
+                'start': round(self.wall_started, 6),
+                'duration_ms': round(total, 3),
+                'attributes': {'status': status},
+            }, *self.spans]
+        return f'{timings}, total;dur={total:.3f}' if timings else f'total;dur={total:.3f}', spans
+
+
+class SpanWriter:
+    """
+    Appends spans to a JSON-lines file, the spans of one request in a single write.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def write(self, spans: List[dict]) -> None:
+        lines = ''.join(json.dumps(span, separators=(',', ':')) + '\n' for span in spans)
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(lines)
+            self.file.flush()
+
+
+span_writer = SpanWriter(TRACE_FILE) if TRACE_FILE else None
+
+# Trace of the request being handled; thread pools working for a request need to run in a copy of its context
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+def record_span(name: str, started: float, duration: float) -> None:
+    """
+    Record a span in the trace of the current request, if there is one.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(name, started, duration)
+
+
+class ClientSpan:
+    """
+    A call to another service made while handling a traced request.
+    """
+
+    __slots__ = ('trace', 'span_id', 'name', 'method', 'path')
+
+    def __init__(self, trace: Trace, name: str, method: str, path: str) -> None:
+        self.trace = trace
+        self.span_id = new_id(8)
+        self.name = name
+        self.method = method
+        self.path = path.split('?', 1)[0]
+
+    def headers(self, headers: Optional[dict] = None) -> dict:
+        """
+        Returns:
+            dict: 'headers' plus the 'traceparent' of this call.
+        """
+        return {**(headers or {}), **self.trace.outbound_headers(self.span_id)}
+
+    def end(self, started: float, duration: float, status: Optional[int] = None, server_timing: Optional[str] = None) -> None:
+        """
+        Record the call, with the status and Server-Timing header of the response if there was one.
+        """
+        attributes = {'method': self.method, 'path': self.path}
+        if status is not None:
+            attributes['status'] = status
+        self.trace.record(self.name, started, duration, self.span_id, attributes, server_timing)
+
+
+def client_span(name: str, method: str, path: str) -> Optional[ClientSpan]:
+    """
+    Start a client span for a call made while handling a traced request.
+
+    Returns:
+        Optional[ClientSpan]: The span, or None outside a traced request.
+    """
+    trace = current_trace.get()
+    return ClientSpan(trace, name, method, path) if trace is not None else None
+
+
+def start_trace(service: str, request) -> Trace:
+    """
+    Start the trace of a request, continuing the caller's if it sent a 'traceparent' header.
+    """
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    trace = Trace(service, f'{request.method} {route}', request.headers.get(TRACEPARENT))
+    current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, response) -> None:
+    """
+    Close the trace of a request, setting the response's X-Request-ID and Server-Timing headers and writing its spans.
+    """
+    server_timing, spans = trace.finish(response.status_code)
+    response.headers[REQUEST_ID] = trace.trace_id
+    response.headers[SERVER_TIMING] = server_timing
+    if span_writer is not None:
+        span_writer.write(spans)
+
+
+def trace_app(app, service: str) -> None:
+    """
+    Trace every request to a Flask app.
+
+    Spans recorded once a streamed response has started are not part of the trace.
+
+    Args:
+        app (Flask): The application.
+        service (str): Name of the service in the spans.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def begin() -> None:
+        g.trace = start_trace(service, request)
+
+    @app.after_request
+    def end(response: Response) -> Response:
+        trace = g.pop('trace', None)
+        if trace is not None:
+            finish_trace(trace, response)
+        return response
+
+
+def trace_async_app(app, service: str) -> None:
+    """
+    Trace every request to a Quart app. The hooks are coroutines, so the trace is set in the request's own context.
+
+    Args:
+        app (Quart): The application.
+        service (str): Name of the service in the spans.
+    """
+    from quart import Response, g, request
+
+    @app.before_request
+    async def begin() -> None:
+        g.trace = start_trace(service, request)
+
+    @app.after_request
+    async def end(response: Response) -> Response:
+        trace = g.pop('trace', None)
+        if trace is not None:
+            finish_trace(trace, response)
+        return response
@@ -0,0 +1,164 @@
+import socket
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from flask import Request
+
+# Content types accepted as raw audio uploads alongside the JSON + base64 contract
+OCTET_STREAM = 'application/octet-stream'
+MULTIPART = 'multipart/form-data'
+BINARY_MIMETYPES = (OCTET_STREAM, MULTIPART)
+
+# Content types of JSON bodies, and of newline-delimited JSON with one object per line
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+
+# Headers carrying the track metadata of an application/octet-stream upload, percent-encoded UTF-8
+ARTIST_HEADER = 'X-Artist'
+TITLE_HEADER = 'X-Title'
+
+# Size of the chunks a request body is relayed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Size of the reads of audio identified as it arrives: small, as a read waits until it is filled
+AUDIO_STREAM_CHUNK_SIZE = 4 * 1024
+
+
+def is_binary_upload(request: Request) -> bool:
+    """
+    Check whether a request carries raw audio rather than JSON.
+
+    Args:
+        request (Request): Incoming Flask request.
+
+    Returns:
+        bool: True for application/octet-stream and multipart/form-data bodies.
+    """
+    return request.mimetype in BINARY_MIMETYPES
+
+
+def encode_metadata_headers(metadata: Dict[str, str]) -> Dict[str, str]:
+    """
+    Build the metadata headers for an application/octet-stream upload.
+
+    Args:
+        metadata (Dict[str, str]): Fields such as 'artist' and 'title'.
+
+    Returns:
+        Dict[str, str]: Headers with percent-encoded values.
+    """
+    headers = {}
+    if 'artist' in metadata:
+        headers[ARTIST_HEADER] = quote(metadata['artist'])
+    if 'title' in metadata:
+        headers[TITLE_HEADER] = quote(metadata['title'])
+    return headers
+
+
+def read_metadata(request: Request) -> Dict[str, str]:
+    """
+    Read the artist and title of a binary upload without touching its body.
+
+    For multipart bodies the fields can only be read by parsing the body, so this
+    returns an empty dict and the service that owns the upload validates them.
+
+    Args:
+        request (Request): Incoming Flask request.
+
+    Returns:
+        Dict[str, str]: The fields that are present.
+    """
+    metadata = {}
+    if request.headers.get(ARTIST_HEADER) is not None:
+        metadata['artist'] = unquote(request.headers[ARTIST_HEADER])
+    if request.headers.get(TITLE_HEADER) is not None:
+        metadata['title'] = unquote(request.headers[TITLE_HEADER])
+    return metadata
+
+
+def read_binary_upload(request: Request, file_field: str) -> Tuple[Dict[str, str], Optional[bytes]]:
+    """
+    Read the metadata and audio of an application/octet-stream or multipart/form-data upload.
+
+    Args:
+        request (Request): Incoming Flask request.
+        file_field (str): Name of the multipart field holding the audio.
+
+    Returns:
+        Tuple[Dict[str, str], Optional[bytes]]: The metadata fields and the audio, None if no audio was sent.
+    """
+    if request.mimetype == MULTIPART:
+        metadata = {field: request.form[field] for field in ('artist', 'title') if field in request.form}
+        upload = request.files.get(file_field)
+        return metadata, upload.read() if upload else None
+
+    audio = request.get_data()
+    return read_metadata(request), audio or None
+
+
+def stream_body(request: Request, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Iterate over a request body in fixed-size chunks, so it can be relayed without buffering it.
+
+    Args:
+        request (Request): Incoming Flask request.
+        chunk_size (int): Size of the chunks, all but the last of which are full.
+
+    Yields:
+        bytes: The next chunk of the body.
+    """
+    while True:
+        chunk = request.stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def stream_lines(request: Request) -> Iterator[bytes]:
+    """
+    Iterate over the lines of a request body as it arrives, e.g. the records of an NDJSON upload.
+
+    The body is read in fixed-size chunks and split here, which is much faster than the
+    request stream's own readline() on long lines.
+
+    Args:
+        request (Request): Incoming Flask request.
+
+    Yields:
+        bytes: The next line, without its newline.
+    """
+    pending = []
+    for chunk in stream_body(request):
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            if end == -1:
+                break
+            pending.append(chunk[start:end])
+            yield b''.join(pending)
+            pending = []
+            start = end + 1
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield b''.join(pending)
+
+
+def stop_reading(request: Request) -> None:
+    """
+    Stop reading a request body a route has answered without needing all of it, so the connection
+    closes after the response and a client still sending the body stops.
+
+    The development server otherwise reads whatever is left of the body before closing the
+    connection, which for an upload that is still being recorded lasts as long as the upload.
+    Servers that do not expose their socket are left to deal with the rest of the body themselves.
+
+    Args:
+        request (Request): Incoming Flask request.
+    """
+    connection = request.environ.get('werkzeug.socket')
+    if connection is not None:
+        try:
+            connection.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
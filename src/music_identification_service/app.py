@@ -1,69 +1,466 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
 import os
+import sys
 import base64
+import hashlib
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.audio import WavError, WavStream
+from common.cache import ResultCache
+from common.fingerprint import MIN_MATCH_VOTES, FingerprintIndex, fingerprint_samples, fingerprint_wav
+from common.http import BackendClient, Deadline
+from common.metrics import instrument_app, stage
+from common.tracing import trace_app
+from common.scheduler import RateLimitExceeded, UpstreamScheduler, parse_retry_after
+from common.sharding import parse_urls
+from common.uploads import (AUDIO_STREAM_CHUNK_SIZE, MULTIPART, NDJSON, OCTET_STREAM, is_binary_upload, read_binary_upload, stop_reading,
+                            stream_body)
 
 app = Flask(__name__)
+instrument_app(app)
+trace_app(app, 'identification')
+
+# Identification backend: 'audd' sends fragments to Audd.io, 'local' matches them against the catalogue's own fingerprints
+IDENTIFY_BACKEND = os.environ.get('IDENTIFY_BACKEND', 'audd')
+if IDENTIFY_BACKEND not in ('audd', 'local'):
+    raise ValueError(f"IDENTIFY_BACKEND must be 'audd' or 'local', not {IDENTIFY_BACKEND!r}")
+
+# Get the Audd.io API key from the environment (only needed by the Audd.io backend)
+audd_api_key = os.environ['AUDD_API_KEY'] if IDENTIFY_BACKEND == 'audd' else os.environ.get('AUDD_API_KEY')
+
+# URL of the catalogue management service, which stores the fingerprints used by the local backend.
+# A sharded catalogue is given as comma-separated URLs, one per shard, which are all matched against
+CATALOGUE_URLS = parse_urls(os.environ.get('CATALOGUE_URL', 'http://localhost:5002'))
+
+# Keep-alive connection pools with connect/read timeouts for the outbound calls
+AUDD_URL = os.environ.get('AUDD_URL', 'https://api.audd.io')
+audd_client = BackendClient(AUDD_URL, read_timeout=float(os.environ.get('AUDD_READ_TIMEOUT', 20)), stage='upstream_audd')
+
+# Calls to Audd.io are kept within the API quota (AUDD_RATE_LIMIT calls per second, bursts of AUDD_BURST).
+# Up to AUDD_QUEUE_SIZE callers wait for their turn for at most AUDD_QUEUE_TIMEOUT seconds, concurrent
+# identical fragments share one call, and calls Audd.io rate limits are retried after its Retry-After,
+# all within AUDD_DEADLINE seconds per fragment
+audd_scheduler = UpstreamScheduler(rate=float(os.environ.get('AUDD_RATE_LIMIT', 10)),
+                                   burst=int(os.environ.get('AUDD_BURST', 10)),
+                                   max_waiting=int(os.environ.get('AUDD_QUEUE_SIZE', 100)),
+                                   max_wait=float(os.environ.get('AUDD_QUEUE_TIMEOUT', 10)),
+                                   max_retries=int(os.environ.get('AUDD_MAX_RETRIES', 2)),
+                                   backoff=float(os.environ.get('AUDD_BACKOFF', 1)))
+AUDD_DEADLINE = float(os.environ.get('AUDD_DEADLINE', 30))
+catalogue_clients = [BackendClient(url, stage='upstream_catalogue') for url in CATALOGUE_URLS]
+# Matches against several catalogue shards are made at once
+match_pool = ThreadPoolExecutor(max_workers=4 * len(CATALOGUE_URLS), thread_name_prefix='match') if len(CATALOGUE_URLS) > 1 else None
+
+# Memory-mapped fingerprint index written by build_index.py, matched in-process by the local backend
+FINGERPRINT_INDEX_PATH = os.environ.get('FINGERPRINT_INDEX_PATH', 'fingerprints.idx')
+fingerprint_index: Optional[FingerprintIndex] = None
+fingerprint_index_mtime: Optional[float] = None
+index_lock = threading.Lock()
+
+# Identification results keyed by a digest of the decoded fragment, so repeated fragments skip the backend.
+# Matches are kept for IDENTIFY_CACHE_TTL seconds and "no match" results for the shorter IDENTIFY_CACHE_NEGATIVE_TTL;
+# set IDENTIFY_CACHE_DB to also keep them in an SQLite file that survives restarts
+IDENTIFY_CACHE_SIZE = int(os.environ.get('IDENTIFY_CACHE_SIZE', 1024))
+IDENTIFY_CACHE_TTL = float(os.environ.get('IDENTIFY_CACHE_TTL', 24 * 60 * 60))
+IDENTIFY_CACHE_NEGATIVE_TTL = float(os.environ.get('IDENTIFY_CACHE_NEGATIVE_TTL', 5 * 60))
+result_cache = ResultCache(IDENTIFY_CACHE_SIZE, os.environ.get('IDENTIFY_CACHE_DB'))
+
+# Fragments of /identify/batch requests are identified by a shared pool of IDENTIFY_BATCH_WORKERS threads,
+# so concurrent batches queue for the backend instead of each opening its own set of calls
+IDENTIFY_BATCH_WORKERS = int(os.environ.get('IDENTIFY_BATCH_WORKERS', 8))
+MAX_BATCH_FRAGMENTS = int(os.environ.get('MAX_BATCH_FRAGMENTS', 100))
+batch_pool = ThreadPoolExecutor(max_workers=IDENTIFY_BATCH_WORKERS, thread_name_prefix='identify')
+
+# Fragments streamed to /identify/stream are matched locally every IDENTIFY_STREAM_STEP seconds of audio
+# as they arrive, and answered as soon as a match lines up IDENTIFY_STREAM_MIN_VOTES hashes. The Audd.io
+# backend is sent the first AUDD_STREAM_SECONDS instead. No more than IDENTIFY_STREAM_MAX_SECONDS are read
+IDENTIFY_STREAM_STEP = float(os.environ.get('IDENTIFY_STREAM_STEP', 0.5))
+IDENTIFY_STREAM_MIN_VOTES = int(os.environ.get('IDENTIFY_STREAM_MIN_VOTES', 3 * MIN_MATCH_VOTES))
+AUDD_STREAM_SECONDS = float(os.environ.get('AUDD_STREAM_SECONDS', 5))
+IDENTIFY_STREAM_MAX_SECONDS = float(os.environ.get('IDENTIFY_STREAM_MAX_SECONDS', 30))
+
+
+# Helper functions:
+def get_fingerprint_index() -> Optional[FingerprintIndex]:
+    """
+    Return the memory-mapped fingerprint index, remapping it if the file has been rebuilt.
+
+    Returns:
+        Optional[FingerprintIndex]: The index, or None if no index file exists.
+    """
+    global fingerprint_index, fingerprint_index_mtime
+    try:
+        mtime = os.stat(FINGERPRINT_INDEX_PATH).st_mtime
+    except FileNotFoundError:
+        fingerprint_index, fingerprint_index_mtime = None, None
+        return None
+
+    with index_lock:
+        if mtime != fingerprint_index_mtime:
+            fingerprint_index = FingerprintIndex.load(FINGERPRINT_INDEX_PATH)
+            fingerprint_index_mtime = mtime
+        return fingerprint_index
+
+
+def identify_with_audd(fragment: bytes, deadline: Deadline) -> Tuple[dict, int]:
+    """
+    Identify a music fragment using the Audd.io API.
+
+    Args:
+        fragment (bytes): Decoded music fragment.
+        deadline (Deadline): Budget of the call, which caps the read timeout.
+
+    Returns:
+        Tuple[dict, int]: Response body and status code.
+
+    Raises:
+        RateLimitExceeded: If Audd.io rate limited the call.
+    """
+    # Prepare the data payload including the API key, uploading the audio as a file rather than base64
+    data = {
+        'api_token': audd_api_key
+    }
+    files = {
+        'file': ('fragment.wav', fragment)
+    }
+
+    # Make the API call to Audd.io
+    response = audd_client.post('/', data=data, files=files, deadline=deadline)
+
+    # Handle rate limit response, left to the scheduler to back off and retry
+    if response.status_code == 429:
+        raise RateLimitExceeded(parse_retry_after(response.headers.get('Retry-After')))
+    
+    # Handle other API errors if any
+    if response.status_code != 200:
+        return {'error': 'API call failed', 'status_code': response.status_code}, response.status_code
+
+    # Parse the JSON response from Audd.io
+    audd_response = response.json()
+    
+    # Check if a result exists
+    if 'result' in audd_response and audd_response['result']:
+        result = audd_response['result']
+        artist = result.get('artist')
+        title = result.get('title')
+
+        # Return the result to the Shamzam service
+        return {'artist': artist, 'title': title}, 200
+    
+    return {'error': 'Audd.io unable to find matches for fragment in their database.'}, 404
+
+
+def identify_locally(fragment: bytes) -> Tuple[dict, int]:
+    """
+    Identify a music fragment by matching its fingerprints against the catalogue.
+
+    Args:
+        fragment (bytes): Decoded music fragment.
+
+    Returns:
+        Tuple[dict, int]: Response body and status code.
+    """
+    try:
+        with stage('fingerprint'):
+            hashes = fingerprint_wav(fragment)
+    except WavError as e:
+        return {'error': 'Invalid content format: fragment must be a WAV file', 'message': str(e)}, 400
+    return match_fingerprints(hashes)
+
+
+def match_fingerprints(hashes: List[Tuple[int, int]]) -> Tuple[dict, int]:
+    """
+    Find the catalogue track that best matches the fingerprints of a fragment.
+
+    Args:
+        hashes (List[Tuple[int, int]]): (hash, offset) pairs of the fragment.
+
+    Returns:
+        Tuple[dict, int]: Response body, with the match's 'score' in aligned hashes, and status code.
+    """
+    # Match in-process against the memory-mapped index when one has been built
+    index = get_fingerprint_index()
+    if index is not None:
+        with stage('index_match'):
+            match = index.match(hashes)
+        if match is not None and match[0] in index.names:
+            artist, title = index.names[match[0]]
+            return {'artist': artist, 'title': title, 'score': match[1]}, 200
+
+    # Otherwise (or for tracks added since the index was built) the catalogue does the lookup
+    # against the fingerprints it computed when each track was added. Each shard returns its own
+    # best match, and the highest score among them wins
+    if match_pool is None:
+        responses = [catalogue_clients[0].post('/match', json={'fingerprints': hashes})]
+    else:
+        futures = [match_pool.submit(copy_context().run, client.post, '/match', json={'fingerprints': hashes})
+                   for client in catalogue_clients]
+        responses = [future.result() for future in futures]
+    for response in responses:
+        if response.status_code not in (200, 404):
+            return {'error': 'Catalogue match failed', 'status_code': response.status_code}, response.status_code
+
+    matches = [response.json() for response in responses if response.status_code == 200]
+    if not matches:
+        return {'error': 'Unable to find matches for fragment in the catalogue.'}, 404
+
+    result = max(matches, key=lambda match: match['score'])
+    return {'artist': result['artist'], 'title': result['title'], 'score': result['score']}, 200
+
+
+def identify_fragment(fragment: bytes) -> Tuple[dict, int, str]:
+    """
+    Identify a decoded music fragment with the configured backend, answering repeated fragments from the cache.
+
+    Args:
+        fragment (bytes): Decoded music fragment.
+
+    Returns:
+        Tuple[dict, int, str]: Response body, status code, and 'HIT' or 'MISS' for the cache.
+    """
+    with stage('cache_lookup'):
+        cache_key = f'{IDENTIFY_BACKEND}:{hashlib.sha256(fragment).hexdigest()}'
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        result, status_code = cached
+        return result, status_code, 'HIT'
+
+    try:
+        if IDENTIFY_BACKEND == 'local':
+            result, status_code = identify_locally(fragment)
+        else:
+            deadline = Deadline(AUDD_DEADLINE)
+            result, status_code = audd_scheduler.call(cache_key, lambda: identify_with_audd(fragment, deadline), deadline)
+
+        # Only definite answers are cached, never rate limits or upstream failures. A local "no match"
+        # stops being true as soon as the track is added to the catalogue, so only Audd.io's are cached
+        if status_code == 200:
+            result_cache.put(cache_key, [result, status_code], IDENTIFY_CACHE_TTL)
+        elif status_code == 404 and IDENTIFY_BACKEND == 'audd':
+            result_cache.put(cache_key, [result, status_code], IDENTIFY_CACHE_NEGATIVE_TTL)
+        return result, status_code, 'MISS'
+
+    except RateLimitExceeded as e:
+        result = {'error': 'Rate limit exceeded. Please try again later.'}
+        if e.retry_after is not None:
+            result['retry_after'] = round(e.retry_after, 3)
+        return result, 429, 'MISS'
+    except requests.Timeout:
+        return {'error': 'Identification backend timed out'}, 504, 'MISS'
+    except Exception as e:
+        return {'error': 'Failed to process identification', 'message': str(e)}, 500, 'MISS'
+
+
+def identify_streamed_fragment(chunks: Iterator[bytes]) -> Tuple[dict, int, str]:
+    """
+    Identify a WAV fragment while it is still arriving, reading no more of it than it takes.
+
+    With the local backend the audio received so far is fingerprinted and matched every
+    IDENTIFY_STREAM_STEP seconds, and a match lining up IDENTIFY_STREAM_MIN_VOTES hashes (well
+    over the MIN_MATCH_VOTES a whole fragment needs) is returned straight away. With Audd.io, the
+    first AUDD_STREAM_SECONDS are identified. Otherwise, once the fragment has all arrived (or
+    IDENTIFY_STREAM_MAX_SECONDS of it), it is identified like any other with identify_fragment().
+
+    Args:
+        chunks (Iterator[bytes]): The bytes of the WAV file, as they arrive.
+
+    Returns:
+        Tuple[dict, int, str]: Response body, with the seconds of audio used as 'audio_seconds', status code,
+            and 'HIT' or 'MISS' for the cache.
+    """
+    stream = WavStream()
+    checkpoint = AUDD_STREAM_SECONDS if IDENTIFY_BACKEND == 'audd' else IDENTIFY_STREAM_STEP
+    try:
+        for chunk in chunks:
+            stream.feed(chunk)
+            if stream.done or stream.seconds >= IDENTIFY_STREAM_MAX_SECONDS:
+                break
+            if stream.seconds < checkpoint:
+                continue
+            if IDENTIFY_BACKEND == 'audd':
+                break
+
+            # Fingerprinting the whole prefix again, rather than only the new audio, gives the same
+            # peaks and hashes as fingerprinting the complete fragment would
+            checkpoint = stream.seconds + IDENTIFY_STREAM_STEP
+            with stage('fingerprint'):
+                hashes = fingerprint_samples(stream.samples(), stream.fmt['sample_rate'])
+            result, status_code = match_fingerprints(hashes)
+            if (status_code == 200 and result['score'] >= IDENTIFY_STREAM_MIN_VOTES) or status_code not in (200, 404):
+                return {**result, 'audio_seconds': round(stream.seconds, 3)}, status_code, 'MISS'
+        fragment = stream.wav()
+    except WavError as e:
+        return {'error': 'Invalid content format: fragment must be a WAV file', 'message': str(e)}, 400, 'MISS'
+    except requests.Timeout:
+        return {'error': 'Identification backend timed out'}, 504, 'MISS'
+    except Exception as e:
+        return {'error': 'Failed to process identification', 'message': str(e)}, 500, 'MISS'
+
+    result, status_code, cache_status = identify_fragment(fragment)
+    return {**result, 'audio_seconds': round(stream.seconds, 3)}, status_code, cache_status
+
+
+def result_line(index: int, result: dict, status_code: int) -> bytes:
+    """
+    Encode the result of one fragment of a batch as an NDJSON line.
+
+    Args:
+        index (int): Position of the fragment in the batch.
+        result (dict): Response body for the fragment.
+        status_code (int): Status code for the fragment.
+
+    Returns:
+        bytes: The JSON object and its newline.
+    """
+    return json.dumps({'index': index, 'status': status_code, **result}).encode('utf-8') + b'\n'
 
-# Get the Audd.io API key from the environment
-audd_api_key = os.environ['AUDD_API_KEY'] 
 
 # Routes
 @app.route('/identify', methods=['POST'])
 def identify() -> jsonify:
     """
-    Identify the artist and title of a music fragment by sending it to the Audd.io API.
+    Identify the artist and title of a music fragment using the configured backend.
     
     Returns:
         jsonify: JSON response containing the identification result or an error message.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
-    encoded_content = request.json.get('encoded_fragment')
+    if is_binary_upload(request):
+        # Raw audio uploads skip the base64 round trip
+        _, fragment = read_binary_upload(request, 'fragment')
+        if fragment is None:
+            return jsonify({'error': 'Fragment file is required'}), 400
+    else:
+        # Check if the request is JSON
+        if not request.is_json:
+            return jsonify({'error': 'Request must be JSON'}), 415
+        
+        encoded_content = request.json.get('encoded_fragment')
+        
+        # Check if the encoded_content is a valid Base64 encoded string
+        try:
+            with stage('decode'):
+                fragment = base64.b64decode(encoded_content, validate=True)
+        except Exception:
+            return jsonify({'error': 'Invalid content format: must be Base64 encoded string'}), 400
     
-    # Check if the encoded_content is a valid Base64 encoded string
-    try:
-        base64.b64decode(encoded_content, validate=True)
-    except Exception:
-        return jsonify({'error': 'Invalid content format: must be Base64 encoded string'}), 400
+    result, status_code, cache_status = identify_fragment(fragment)
+    headers = {'X-Cache': cache_status}
+    if 'retry_after' in result:
+        headers['Retry-After'] = str(math.ceil(result['retry_after']))
+    return jsonify(result), status_code, headers
+
+
+@app.route('/identify/stream', methods=['POST'])
+def identify_stream() -> jsonify:
+    """
+    Identify a WAV fragment uploaded as application/octet-stream while it is still being sent, e.g.
+    with chunked transfer encoding as it is recorded.
+
+    The answer is sent as soon as it is known and the rest of the upload is never read; closing
+    the connection after the response ends it. 'audio_seconds' gives how much audio the answer
+    is based on.
+
+    Returns:
+        jsonify: JSON response containing the identification result or an error message.
+    """
+    if request.mimetype != OCTET_STREAM:
+        return jsonify({'error': 'Request must be application/octet-stream'}), 415
+
+    result, status_code, cache_status = identify_streamed_fragment(stream_body(request, AUDIO_STREAM_CHUNK_SIZE))
+    stop_reading(request)
+    headers = {'X-Cache': cache_status}
+    if 'retry_after' in result:
+        headers['Retry-After'] = str(math.ceil(result['retry_after']))
+    return jsonify(result), status_code, headers
+
+
+@app.route('/identify/batch', methods=['POST'])
+def identify_batch() -> Response:
+    """
+    Identify a batch of music fragments concurrently, streaming one NDJSON result per fragment as each completes.
+
+    Fragments are sent as a JSON list of base64 strings under 'fragments', or as repeated 'fragment'
+    files of a multipart/form-data upload. Identical fragments are identified once and their result
+    is reported for each of their positions.
+
+    Returns:
+        Response: NDJSON stream of {'index': ..., 'status': ..., ...} lines, or a JSON error message.
+    """
+    if request.mimetype == MULTIPART:
+        fragments = [upload.read() for upload in request.files.getlist('fragment')]
+    else:
+        # Check if the request is JSON
+        if not request.is_json:
+            return jsonify({'error': 'Request must be JSON'}), 415
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get('fragments'), list):
+            return jsonify({'error': 'Fragments must be a list'}), 400
+        fragments = data['fragments']
+
+    if not fragments:
+        return jsonify({'error': 'At least one fragment is required'}), 400
+    if len(fragments) > MAX_BATCH_FRAGMENTS:
+        return jsonify({'error': f'A batch holds at most {MAX_BATCH_FRAGMENTS} fragments'}), 413
+
+    # Group the positions of identical fragments under one digest, so each is identified once
+    invalid = []
+    positions: Dict[str, List[int]] = {}
+    decoded: Dict[str, bytes] = {}
+    for index, fragment in enumerate(fragments):
+        if not isinstance(fragment, bytes):
+            try:
+                with stage('decode'):
+                    fragment = base64.b64decode(fragment, validate=True)
+            except Exception:
+                invalid.append(index)
+                continue
+        digest = hashlib.sha256(fragment).hexdigest()
+        positions.setdefault(digest, []).append(index)
+        decoded[digest] = fragment
+
+    # Queue the work before the response starts, so the pool is busy while the first lines are sent.
+    # Each fragment runs in a copy of the request's context, so its calls carry the request's trace
+    futures = {batch_pool.submit(copy_context().run, identify_fragment, fragment): digest for digest, fragment in decoded.items()}
+
+    def generate() -> Iterator[bytes]:
+        for index in invalid:
+            yield result_line(index, {'error': 'Invalid content format: must be Base64 encoded string'}, 400)
+        for future in as_completed(futures):
+            result, status_code, _ = future.result()
+            for index in positions[futures[future]]:
+                yield result_line(index, result, status_code)
+
+    return Response(generate(), mimetype=NDJSON)
+
+
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats() -> jsonify:
+    """
+    Report the counters of the Audd.io call scheduler: calls, upstream calls, coalesced calls, rejections and retries.
     
-    try:
-        # Prepare the data payload including the API key
-        data = {
-            'api_token': audd_api_key,
-            'audio': encoded_content
-        }
-
-        # Make the API call to Audd.io
-        response = requests.post('https://api.audd.io/', data=data)
-
-        # Handle rate limit response
-        if response.status_code == 429:
-            return jsonify({'error': 'Rate limit exceeded. Please try again later.'}), 429
-        
-        # Handle other API errors if any
-        if response.status_code != 200:
-            return jsonify({'error': 'API call failed', 'status_code': response.status_code}), response.status_code
+    Returns:
+        jsonify: JSON response containing the scheduler counters.
+    """
+    return jsonify({'message': 'Scheduler statistics', 'scheduler': audd_scheduler.snapshot()}), 200
 
-        # Parse the JSON response from Audd.io
-        audd_response = response.json()
-        
-        # Check if a result exists
-        if 'result' in audd_response and audd_response['result']:
-            result = audd_response['result']
-            artist = result.get('artist')
-            title = result.get('title')
-
-            # Return the result to the Shamzam service
-            return jsonify({'artist': artist, 'title': title}), 200
-        
-        else:
-            return jsonify({'error': 'Audd.io unable to find matches for fragment in their database.'}), 404
 
-    except Exception as e:
-        return jsonify({'error': 'Failed to process identification', 'message': str(e)}), 500
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats() -> jsonify:
+    """
+    Report the hit, miss and eviction counters of the identification result cache.
+    
+    Returns:
+        jsonify: JSON response containing the cache counters.
+    """
+    return jsonify({'message': 'Cache statistics', 'cache': result_cache.snapshot()}), 200
+
 
 if __name__ == '__main__':
     app.run(debug=True, 
@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.scheduler import TokenBucket
+
+
+def create_stub(rate: float, burst: int, latency: float, artist: str, title: str) -> Flask:
+    """
+    Build a local stand-in for the Audd.io API, for testing and benchmarking without an API key.
+
+    Every fragment is identified as the same track after 'latency' seconds. Calls beyond the
+    quota get a 429 with a Retry-After header, as a rate-limited API would answer them.
+
+    Args:
+        rate (float): Calls per second allowed by the quota.
+        burst (int): Calls that may be made at once after an idle period.
+        latency (float): Seconds each identification takes.
+        artist (str): Artist of the track every fragment is identified as.
+        title (str): Title of the track every fragment is identified as.
+
+    Returns:
+        Flask: The stub application.
+    """
+    stub = Flask(__name__)
+    quota = TokenBucket(rate, burst)
+    lock = threading.Lock()
+    stats = {'calls': 0, 'rate_limited': 0}
+
+    @stub.route('/', methods=['POST'])
+    def identify():
+        if 'file' not in request.files or 'api_token' not in request.form:
+            return jsonify({'status': 'error', 'error': {'error_message': 'File and API token are required'}}), 400
+
+        with lock:
+            stats['calls'] += 1
+            wait = quota.reserve()
+            if wait > 0:
+                quota.cancel()
+                stats['rate_limited'] += 1
+                return jsonify({'status': 'error', 'error': {'error_message': 'Too many requests'}}), 429, {'Retry-After': f'{wait:.3f}'}
+
+        time.sleep(latency)
+        return jsonify({'status': 'success', 'result': {'artist': artist, 'title': title}}), 200
+
+    @stub.route('/stats', methods=['GET'])
+    def stub_stats():
+        with lock:
+            return jsonify({'message': 'Stub statistics', 'stats': dict(stats)}), 200
+
+    return stub
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Audd.io API (point AUDD_URL at it).')
+    parser.add_argument('--port', type=int, default=5009)
+    parser.add_argument('--rate', type=float, default=5.0, help='Calls per second allowed before answering 429')
+    parser.add_argument('--burst', type=int, default=5, help='Calls allowed at once after an idle period')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds each identification takes')
+    parser.add_argument('--artist', default='The Weeknd')
+    parser.add_argument('--title', default='Blinding Lights')
+    args = parser.parse_args()
+
+    create_stub(args.rate, args.burst, args.latency, args.artist, args.title).run(port=args.port, host='localhost', threaded=True)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.fingerprint import INDEX_DTYPE, FingerprintIndex
+from common.sharding import parse_urls
+
+CATALOGUE_URL = os.environ.get('CATALOGUE_URL', 'http://localhost:5002')
+FINGERPRINT_INDEX_PATH = os.environ.get('FINGERPRINT_INDEX_PATH', 'fingerprints.idx')
+
+
+def build_index(catalogue_url: str, path: str) -> FingerprintIndex:
+    """
+    Download the catalogue's fingerprints and save them as a memory-mappable index.
+
+    The running identification service notices the new file and remaps it on its next request.
+    For a sharded catalogue the fingerprints of every shard go into one index, with each shard's
+    track ids renumbered (id * shards + shard) so they stay unique.
+
+    Args:
+        catalogue_url (str): URL of the catalogue management service, or comma-separated URLs of its shards.
+        path (str): File to write the index to.
+
+    Returns:
+        FingerprintIndex: The index that was saved.
+
+    Raises:
+        Exception: If the catalogue management service could not be reached.
+    """
+    urls = parse_urls(catalogue_url)
+    names = {}
+    postings = []
+    for shard, url in enumerate(urls):
+        response = requests.get(f'{url}/fingerprints/tracks')
+        if response.status_code != 200:
+            raise Exception(f'Failed to list catalogue tracks: {response.text}')
+        names.update({track['id'] * len(urls) + shard: (track['artist'], track['title']) for track in response.json()['tracks']})
+
+        response = requests.get(f'{url}/fingerprints/export')
+        if response.status_code != 200:
+            raise Exception(f'Failed to export catalogue fingerprints: {response.text}')
+        columns = np.frombuffer(response.content, dtype=INDEX_DTYPE).reshape(-1, 3).copy()
+        columns[:, 1] = columns[:, 1] * len(urls) + shard
+        postings.append(columns)
+
+    columns = np.concatenate(postings) if postings else np.empty((0, 3), dtype=INDEX_DTYPE)
+    index = FingerprintIndex.build(columns[:, 0], columns[:, 1], columns[:, 2], names)
+    index.save(path)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the memory-mapped fingerprint index used by the local identification backend.')
+    parser.add_argument('--catalogue-url', default=CATALOGUE_URL, help='URL of the catalogue management service, or comma-separated URLs of its shards')
+    parser.add_argument('--output', default=FINGERPRINT_INDEX_PATH, help='Index file to write')
+    args = parser.parse_args()
+
+    index = build_index(args.catalogue_url, args.output)
+    print(f'Wrote {len(index)} fingerprints for {len(index.names)} tracks to {args.output}')
@@ -0,0 +1,195 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from typing import Callable, Dict, List
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.util import import_app
+
+SOURCE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# The services: the folder each runs from, its app, where it listens and how many threads each worker
+# has. The gateway and the identification service spend most of a request waiting on other services,
+# so they get more threads than the catalogue, whose requests mostly run Python on the GIL
+SERVICES: Dict[str, Dict[str, object]] = {
+    'shamzam': {'folder': 'shamzam_service', 'app': 'app:app', 'bind': 'localhost:5000', 'threads': 32},
+    'identification': {'folder': 'music_identification_service', 'app': 'app:app', 'bind': 'localhost:5001', 'threads': 16},
+    'catalogue': {'folder': 'catalogue_managment_service', 'app': 'app:app', 'bind': 'localhost:5002', 'threads': 8},
+}
+
+# The gateway's asyncio mode (async_app.py), served by uvicorn workers, each running every request on one event loop
+ASYNC_GATEWAY_APP = 'async_app:app'
+ASYNC_WORKER_CLASS = 'uvicorn_worker.UvicornWorker'
+
+# Gateway mode served as 'shamzam', 'sync' (app.py) or 'async' (async_app.py)
+GATEWAY_MODE = os.environ.get('GATEWAY_MODE', 'sync')
+
+# Seconds workers get to finish their requests when stopped or replaced by a reload, before they are killed
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+
+# Seconds an idle keep-alive connection is kept open. The services keep pools of connections to each
+# other, which gunicorn's default of 2 s would mostly close between calls
+KEEPALIVE_TIMEOUT = int(os.environ.get('KEEPALIVE_TIMEOUT', 75))
+
+# Signals relayed to every service when several are run together: reload, graceful stop, quick stop
+RELAYED_SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+
+
+class ServiceApplication(BaseApplication):
+    """
+    Gunicorn application serving one of the services.
+
+    The master process never imports the service. Each worker imports it after it is forked, so every
+    worker opens its own database and backend connections and starts its own threads, and a reload
+    (SIGHUP to the master) starts workers running the code as it now is on disk.
+    """
+
+    def __init__(self, app_path: str, options: Dict[str, object]) -> None:
+        """
+        Args:
+            app_path (str): The app, as 'module:variable' in the service's folder.
+            options (Dict[str, object]): Gunicorn settings.
+        """
+        self.app_path = app_path
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        # Settings this version of gunicorn does not have are left out
+        for key, value in self.options.items():
+            if key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+    def load(self) -> Callable:
+        return import_app(self.app_path)
+
+
+def service_options(service: str, args: argparse.Namespace) -> Dict[str, object]:
+    """
+    Work out the gunicorn settings of a service.
+
+    The workers, threads and address of each service come from the command line, then from the
+    service's environment variables (e.g. CATALOGUE_WORKERS, CATALOGUE_THREADS, CATALOGUE_BIND),
+    then default to one worker per CPU and the service's usual address.
+
+    Args:
+        service (str): Name of the service, a key of SERVICES.
+        args (argparse.Namespace): The parsed command line.
+
+    Returns:
+        Dict[str, object]: Gunicorn settings.
+    """
+    settings = SERVICES[service]
+    prefix = service.upper()
+    options = {
+        'bind': [args.bind or os.environ.get(f'{prefix}_BIND', settings['bind'])],
+        'workers': args.workers or int(os.environ.get(f'{prefix}_WORKERS', os.cpu_count() or 1)),
+        'threads': args.threads or int(os.environ.get(f'{prefix}_THREADS', settings['threads'])),
+        'worker_class': 'gthread',
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': KEEPALIVE_TIMEOUT,
+        'proc_name': f'shamzam-{service}',
+        'pidfile': args.pid_file,
+        # Services are controlled with signals; the control socket's default path would be shared by all three
+        'control_socket_disable': True,
+    }
+    if service == 'shamzam' and args.gateway_mode == 'async':
+        options['worker_class'] = ASYNC_WORKER_CLASS
+    return options
+
+
+def serve(service: str, args: argparse.Namespace) -> None:
+    """
+    Run one service under a gunicorn master process, from the service's folder as when it is run directly.
+
+    Args:
+        service (str): Name of the service, a key of SERVICES.
+        args (argparse.Namespace): The parsed command line.
+    """
+    folder = os.path.join(SOURCE_FOLDER, SERVICES[service]['folder'])
+    os.chdir(folder)
+    sys.path.insert(0, folder)
+    app_path = ASYNC_GATEWAY_APP if service == 'shamzam' and args.gateway_mode == 'async' else SERVICES[service]['app']
+    ServiceApplication(app_path, service_options(service, args)).run()
+
+
+def supervise(services: List[str], args: argparse.Namespace) -> int:
+    """
+    Run several services, each under its own gunicorn master in a child process.
+
+    Reload and stop signals sent to this process are passed on to every service. If one service exits,
+    e.g. because its port is taken, the others are stopped too.
+
+    Args:
+        services (List[str]): Names of the services, keys of SERVICES.
+        args (argparse.Namespace): The parsed command line.
+
+    Returns:
+        int: Exit status of the first service to exit.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--gateway-mode', args.gateway_mode,
+               '--graceful-timeout', str(args.graceful_timeout)]
+    for option in ('workers', 'threads'):
+        if getattr(args, option):
+            command += [f'--{option}', str(getattr(args, option))]
+    # Each service gets its own session, so a Ctrl-C in the terminal reaches them once, through the relay
+    children = {subprocess.Popen([*command, service], start_new_session=True).pid: service for service in services}
+    stopping = False
+
+    def relay(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = stopping or signum != signal.SIGHUP
+        for pid in children:
+            os.kill(pid, signum)
+
+    for signum in RELAYED_SIGNALS:
+        signal.signal(signum, relay)
+    if args.pid_file:
+        with open(args.pid_file, 'w') as pid_file:
+            pid_file.write(f'{os.getpid()}\n')
+
+    status = None
+    try:
+        while children:
+            pid, exit_status = os.wait()
+            service = children.pop(pid, None)
+            if service is None:
+                continue
+            code = os.waitstatus_to_exitcode(exit_status)
+            if status is None:
+                status = code
+                if children and not stopping:
+                    print(f'{service} exited with status {code}, stopping the other services', file=sys.stderr)
+                    relay(signal.SIGTERM, None)
+    finally:
+        if args.pid_file and os.path.exists(args.pid_file):
+            os.remove(args.pid_file)
+    return status or 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Shamzam services under gunicorn, with several worker processes each. '
+                                                 'Send SIGHUP to reload them gracefully, SIGTERM to stop them gracefully.')
+    parser.add_argument('services', nargs='*', metavar='service', help=f'Services to run, of {", ".join(SERVICES)} (default: all)')
+    parser.add_argument('--workers', type=int, help='Worker processes per service (default: one per CPU)')
+    parser.add_argument('--threads', type=int, help='Request threads per worker of the sync services')
+    parser.add_argument('--bind', help='Address to listen on, e.g. localhost:5012 (one service only)')
+    parser.add_argument('--gateway-mode', choices=('sync', 'async'), default=GATEWAY_MODE, help='Gateway served as shamzam')
+    parser.add_argument('--graceful-timeout', type=int, default=GRACEFUL_TIMEOUT,
+                        help='Seconds workers get to finish their requests when stopped or reloaded')
+    parser.add_argument('--pid-file', help='Write the process id to signal to this file')
+    args = parser.parse_args()
+
+    services = args.services or list(SERVICES)
+    unknown = [service for service in services if service not in SERVICES]
+    if unknown:
+        parser.error(f'unknown services {", ".join(unknown)}, choose from {", ".join(SERVICES)}')
+    if args.bind and len(services) > 1:
+        parser.error('--bind needs a single service')
+
+    if len(services) == 1:
+        serve(services[0], args)
+    else:
+        sys.exit(supervise(services, args))
@@ -1,181 +1,711 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import chain
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.breaker import CircuitBreaker
+from common.compression import compress_app, etag_matches, is_encoded
+from common.http import BackendClient, Deadline
+from common.metrics import instrument_app
+from common.sharding import shard_of
+from common.tracing import trace_app
+from common.uploads import (AUDIO_STREAM_CHUNK_SIZE, MULTIPART, NDJSON, OCTET_STREAM, STREAM_CHUNK_SIZE, encode_metadata_headers,
+                            is_binary_upload, read_metadata, stop_reading, stream_body)
+from gateway import (AUDIO_PROBE_PATH, AUDIO_SECONDS_HEADER, AUDIO_URL, CATALOGUE_SEARCH_HEADERS, CATALOGUE_SERVICE, DATABASE_PROBE_PATH,
+                     DATABASE_URLS, IDENTIFICATION_SERVICE, MATCH_HEADER, RELAYED_HEADERS, ROUTE_DEADLINES, SHARD_FANOUT_WORKERS,
+                     SLOW_CALL_SECONDS, BatchResults, Reply, ShardedList, UnroutableUpload, add_params, added_reply, best_match,
+                     bulk_headers, catalogue_name, check_bulk_request, check_form_upload, check_json, check_song, check_stream_request,
+                     check_track_params, failure_reply, form_upload_shard, fuzzy_match_params, fuzzy_search_reply, group_by_shard,
+                     identification_failed_reply, job_not_found_reply, job_path, job_shard, json_upload_shard, list_headers, range_headers,
+                     relayed_reply, search_headers, search_params, split_bulk_body, split_bulk_form, status_reply, upload_headers,
+                     upload_shard)
 
 app = Flask(__name__)
+instrument_app(app)
+trace_app(app, 'gateway')
+# Compressed request bodies are passed through for the backends to decompress
+compress_app(app, decompress_requests=False)
+
+# Shared keep-alive connection pools to each backend (sized by BACKEND_POOL_SIZE, with
+# BACKEND_CONNECT_TIMEOUT / BACKEND_READ_TIMEOUT per call). Each has a circuit breaker, tuned by the
+# BREAKER_* variables, that fails calls fast while the backend is down or slow. Every catalogue shard
+# gets its own pool and breaker, in shard order
+catalogue_clients = [BackendClient(url, probe_path=DATABASE_PROBE_PATH, stage='upstream_catalogue',
+                                   breaker=CircuitBreaker(catalogue_name(shard), slow_call_seconds=SLOW_CALL_SECONDS['catalogue']))
+                     for shard, url in enumerate(DATABASE_URLS)]
+audio_client = BackendClient(AUDIO_URL, probe_path=AUDIO_PROBE_PATH, stage='upstream_identification',
+                             breaker=CircuitBreaker(IDENTIFICATION_SERVICE, slow_call_seconds=SLOW_CALL_SECONDS['identification']))
+
+# Calls made to several catalogue shards at once
+shard_pool = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS, thread_name_prefix='shard')
+
+T = TypeVar('T')
+
+# Helper functions. What to check, where to route and what to answer is decided in gateway.py,
+# shared with the async gateway (async_app.py); these make the backend calls and build Flask responses
+def shard_client(artist: str, title: str) -> BackendClient:
+    """
+    Get the client of the catalogue shard that owns a track.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+
+    Returns:
+        BackendClient: Client of the owning shard.
+    """
+    return catalogue_clients[shard_of(artist, title, len(catalogue_clients))]
+
+def fan_out(calls: List[Callable[[], T]]) -> List[T]:
+    """
+    Make calls to several catalogue shards at once and wait for all of them.
+
+    Args:
+        calls (List[Callable[[], T]]): The calls.
+
+    Returns:
+        List[T]: Their results, in the same order.
+
+    Raises:
+        Exception: The first error raised by a call.
+    """
+    if len(calls) == 1:
+        return [calls[0]()]
+    # Each call keeps the request's trace context
+    futures = [shard_pool.submit(copy_context().run, call) for call in calls]
+    return [future.result() for future in futures]
+
+def respond(reply: Reply) -> Tuple[Response, int, dict]:
+    """
+    Turn a reply built by the gateway module into a Flask response.
+
+    Args:
+        reply (Reply): JSON body, status code and headers.
+
+    Returns:
+        Tuple[Response, int, dict]: JSON response, its status code and headers.
+    """
+    body, status_code, headers = reply
+    return jsonify(body), status_code, headers
+
+def failure_response(error: Exception, service: str = CATALOGUE_SERVICE) -> Tuple[Response, int, dict]:
+    """
+    Build the response for a backend call that failed (see gateway.failure_reply()).
+
+    Args:
+        error (Exception): The error the call raised.
+        service (str): Name of the backend.
+
+    Returns:
+        Tuple[Response, int, dict]: JSON error response, its status code and headers.
+    """
+    return respond(failure_reply(error, service, isinstance(error, requests.Timeout)))
+
+def forward_binary_upload(client: BackendClient, path: str, deadline: Deadline, stream: bool = False,
+                          params: Optional[dict] = None, extra_headers: Optional[dict] = None) -> requests.Response:
+    """
+    Relay a raw audio upload to a backend service chunk by chunk, without buffering the body (see gateway.upload_headers()).
+
+    Args:
+        client (BackendClient): Client of the backend service.
+        path (str): Backend endpoint to forward the upload to.
+        deadline (Deadline): Budget of the route.
+        stream (bool): Return as soon as the backend's headers arrive, leaving its body to be read.
+        params (Optional[dict]): Query parameters of the backend call.
+        extra_headers (Optional[dict]): Headers sent on top of those describing the body.
+
+    Returns:
+        requests.Response: The backend's response.
+    """
+    headers = upload_headers(request.mimetype, request.content_type, request.headers, read_metadata(request), extra_headers)
+    return client.post(path, data=stream_body(request), headers=headers, params=params, stream=stream, deadline=deadline)
+
+def forward_routed_upload(deadline: Deadline) -> requests.Response:
+    """
+    Add a track uploaded as multipart/form-data, or as a compressed JSON body, on the catalogue shard that owns it.
+
+    These uploads only show the track's artist and title once their body is read, so unlike other
+    uploads they are read in full. Multipart uploads are sent on as raw audio with metadata headers,
+    compressed bodies are sent on still compressed.
+
+    Args:
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        requests.Response: The shard's response.
+
+    Raises:
+        UnroutableUpload: If the upload's artist and title cannot be read.
+    """
+    if request.mimetype == MULTIPART:
+        check_form_upload(request.headers)
+        metadata, shard = form_upload_shard(request.form)
+        song = request.files.get('song')
+        return catalogue_clients[shard].post(
+            '/add', data=song.stream if song else b'', deadline=deadline, params=add_params(request.args),
+            headers={'Content-Type': OCTET_STREAM, **encode_metadata_headers(metadata), **CATALOGUE_SEARCH_HEADERS})
+
+    body = request.get_data()
+    shard = json_upload_shard(body, request.headers['Content-Encoding'])
+    return catalogue_clients[shard].post('/add', data=body, deadline=deadline, params=add_params(request.args),
+                                         headers={'Content-Type': request.content_type, 'Content-Encoding': request.headers['Content-Encoding'],
+                                                  **CATALOGUE_SEARCH_HEADERS})
+
+def open_search(song_data: dict, deadline: Deadline) -> requests.Response:
+    """
+    Look a track up in the Catalogue Management Service, leaving its response open to be relayed.
+
+    The track's audio is inlined as 'encoded_song' unless the client passed 'include_song=false'.
+    The catalogue points the download reference at this service's /catalogue/download and
+    compresses the body in a coding the client accepts, so it is relayed without being decoded.
+
+    Args:
+        song_data (dict): Artist and title of the track.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        requests.Response: The catalogue's response, opened with stream=True.
+    """
+    return shard_client(song_data['artist'], song_data['title']).post('/search', json=song_data, deadline=deadline, stream=True,
+                                                                      params=search_params(request.args), headers=search_headers(request.headers))
+
+def find_fuzzy_match(song_data: dict, deadline: Deadline) -> Optional[dict]:
+    """
+    Find the catalogue track that best matches an identified track, searching every shard.
+
+    Args:
+        song_data (dict): Artist and title returned by the identification service.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        Optional[dict]: Artist and title of the best match scoring at least FUZZY_MATCH_MIN_SCORE, None if there is none.
+    """
+    params = fuzzy_match_params(song_data)
+    if params is None:
+        return None
+    return best_match(fan_out([lambda client=client: client.get('/search/fuzzy', params=params, deadline=deadline)
+                               for client in catalogue_clients]))
+
+def relay_identified_track(identified: dict, deadline: Deadline) -> Response:
+    """
+    Look an identified track up in the catalogue and relay the catalogue's response.
+
+    When the catalogue has no track with exactly the identified artist and title, the closest
+    track found by a fuzzy search is relayed instead, provided it scores at least
+    FUZZY_MATCH_MIN_SCORE, with an 'X-Catalogue-Match: fuzzy' header.
+
+    Args:
+        identified (dict): Response body of the identification service.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        Response: The catalogue's response.
+    """
+    song_data = {'artist': identified.get('artist'), 'title': identified.get('title')}
+    response = open_search(song_data, deadline)
+    if response.status_code != 404:
+        return relay_response(response)
+
+    # Not under that exact artist and title, e.g. spelt or capitalised differently: take the closest track if it is close enough
+    try:
+        match = find_fuzzy_match(song_data, deadline)
+    except Exception:
+        response.close()
+        raise
+    if match is None:
+        return relay_response(response)
+    response.close()
+    relay = relay_response(open_search(match, deadline))
+    relay.headers[MATCH_HEADER] = 'fuzzy'
+    return relay
+
+def relay_response(response: requests.Response) -> Response:
+    """
+    Relay a streamed backend response to the client chunk by chunk, without parsing it.
+
+    The body is relayed as it was sent, still compressed if the backend compressed it.
+
+    Args:
+        response (requests.Response): Backend response opened with stream=True.
+
+    Returns:
+        Response: Response with the backend's status, body and caching/range headers.
+    """
+    relayed_headers = {name: response.headers[name] for name in RELAYED_HEADERS if name in response.headers}
+    relay = Response(response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False), status=response.status_code,
+                     content_type=response.headers.get('Content-Type'), headers=relayed_headers, direct_passthrough=True)
+    relay.call_on_close(response.close)
+    return relay
+
+def fetch_pages(listing: ShardedList, wanted: List[Tuple[int, Optional[str]]]) -> List[requests.Response]:
+    """
+    Read the next page of several catalogue shards at once.
+
+    Args:
+        listing (ShardedList): The listing the pages are read for.
+        wanted (List[Tuple[int, Optional[str]]]): Index of each shard and the cursor to read it from.
+
+    Returns:
+        List[requests.Response]: Each shard's response, in the same order.
+    """
+    deadline = Deadline(ROUTE_DEADLINES['list'])
+    return fan_out([lambda shard=shard, cursor=cursor: catalogue_clients[shard].get('/tracks', params=listing.read_params(cursor), deadline=deadline)
+                    for shard, cursor in wanted])
+
+
+def resolve_results(batch: BatchResults, results: list, deadline: Deadline) -> bytes:
+    """
+    Look up the songs newly matched by a burst of batch identification results and render their lines.
+
+    Args:
+        batch (BatchResults): State of the batch being streamed.
+        results (list): Fragment results just read from the identification stream.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        bytes: The NDJSON lines for the results.
+    """
+    tracks = batch.unresolved(results)
+    if not tracks:
+        return batch.render(results)
+    try:
+        # One lookup per catalogue shard owning some of the tracks
+        responses = fan_out([lambda shard=shard, group=group: catalogue_clients[shard].post(
+                                 '/search/batch', json={'tracks': group}, headers=CATALOGUE_SEARCH_HEADERS, deadline=deadline)
+                             for shard, group in group_by_shard(tracks).items()])
+        failure = batch.lookup_failure(responses)
+        if failure is None:
+            batch.resolve(tracks, [track for response in responses for track in response.json()['tracks']])
+    except Exception as e:
+        body, status_code, _ = failure_reply(e, timed_out=isinstance(e, requests.Timeout))
+        failure = (body, status_code)
+    return batch.render(results, failure)
 
-# URLs for the catalogue management service and audio identification service
-DATABASE_URL = 'http://localhost:5002'
-AUDIO_URL = 'http://localhost:5001'
 
 # Routes
 @app.route('/catalogue/add', methods=['POST'])
 def add_song() -> jsonify:
     """
     Add a new song to the catalogue.
-    
+
     Returns:
         jsonify: JSON response indicating success or failure.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
+    deadline = Deadline(ROUTE_DEADLINES['add'])
+
+    # Raw audio uploads and compressed bodies are streamed straight through to the Catalogue Management
+    # Service, which checks compressed bodies once it has decompressed them
+    if is_binary_upload(request) or is_encoded(request.headers):
+        try:
+            shard = upload_shard(request.mimetype, read_metadata(request))
+            if shard is None:
+                response = forward_routed_upload(deadline)
+            else:
+                response = forward_binary_upload(catalogue_clients[shard], '/add', deadline, params=add_params(request.args),
+                                                 extra_headers=CATALOGUE_SEARCH_HEADERS)
+        except UnroutableUpload as e:
+            return respond(e.reply())
+        except Exception as e:
+            return failure_response(e)
+        return respond(added_reply(response))
+
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(request.json, ('artist', 'title', 'encoded_song'))
+    if invalid:
+        return respond(invalid)
     song_data = request.json
-    
-    # Check if the required fields are present
-    if not song_data:
-        return jsonify({'error': 'No data provided'}), 400
-    if 'artist' not in song_data:
-        return jsonify({'error': 'Artist is required'}), 400
-    if 'title' not in song_data:
-        return jsonify({'error': 'Title is required'}), 400
-    if 'encoded_song' not in song_data:
-        return jsonify({'error': 'Encoded song is required'}), 400
-    
-    # Check if all fields are strings
-    for field, value in song_data.items():
-        if not isinstance(value, str):
-            return jsonify({'error': f'{field.capitalize()} must be a string'}), 400
 
     try:
         # Forward the song data to the Catalogue Management Service
-        response = requests.post(f'{DATABASE_URL}/add', json=song_data)
+        response = shard_client(song_data['artist'], song_data['title']).post('/add', json=song_data, deadline=deadline,
+                                                                              params=add_params(request.args), headers=CATALOGUE_SEARCH_HEADERS)
     except Exception as e:
-        return jsonify({'error': 'Failed to communicate with Catalogue Management Service', 'message': str(e)}), 500
+        return failure_response(e)
+
+    return respond(added_reply(response))
 
-    return jsonify(response.json()), response.status_code
+
+@app.route('/catalogue/add/bulk', methods=['POST'])
+def add_songs_bulk() -> Response:
+    """
+    Add many songs to the catalogue in one request.
+
+    The body (JSON, NDJSON or multipart/form-data) is streamed through to the Catalogue Management
+    Service as it arrives, and its per-track results are relayed back without being re-serialised.
+
+    Returns:
+        Response: JSON response with the result of each track, or an error message.
+    """
+    # Check the content type
+    invalid = check_bulk_request(request.mimetype)
+    if invalid:
+        return respond(invalid)
+
+    if len(catalogue_clients) > 1:
+        return add_songs_sharded()
+
+    # Forwards the request to the Catalogue Management Service
+    try:
+        response = catalogue_clients[0].post('/add/bulk', data=stream_body(request), headers=bulk_headers(request.content_type, request.headers),
+                                             stream=True, record_latency=False, deadline=Deadline(ROUTE_DEADLINES['bulk_add']))
+    except Exception as e:
+        return failure_response(e)
+
+    return relay_response(response)
+
+def add_songs_sharded() -> Response:
+    """
+    Add many songs to a sharded catalogue, with one bulk add per shard made at the same time.
+
+    The body is read in full and split by owning shard into NDJSON bulk adds, whose per-track results
+    are merged back in request order.
+
+    Returns:
+        Response: JSON response with the result of each track, or an error message.
+    """
+    try:
+        if request.mimetype == MULTIPART:
+            check_form_upload(request.headers)
+            bulk = split_bulk_form(request.form.getlist('artist'), request.form.getlist('title'),
+                                   [song.read() for song in request.files.getlist('song')])
+        else:
+            bulk = split_bulk_body(request.mimetype, request.get_data(), request.headers)
+    except UnroutableUpload as e:
+        return respond(e.reply())
+
+    deadline = Deadline(ROUTE_DEADLINES['bulk_add'])
+
+    def send(shard: int, body: bytes) -> Tuple[int, dict, int]:
+        # A shard that cannot be reached fails its own tracks, not the whole request
+        try:
+            response = catalogue_clients[shard].post('/add/bulk', data=body, headers={'Content-Type': NDJSON},
+                                                     record_latency=False, deadline=deadline)
+            return shard, response.json(), response.status_code
+        except Exception as e:
+            error, status_code, _ = failure_reply(e, catalogue_name(shard), isinstance(e, requests.Timeout))
+            return shard, error, status_code
+
+    for shard, body, status_code in fan_out([lambda shard=shard, body=body: send(shard, body) for shard, body in bulk.bodies()]):
+        bulk.record(shard, body, status_code)
+    return jsonify(bulk.body()), 200
 
 
 @app.route('/catalogue/delete', methods=['DELETE'])
 def delete_song() -> jsonify:
     """
     Delete a song in the catalogue by its artist and title.
-    
+
     Returns:
         jsonify: JSON response indicating success or failure.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(request.json, ('artist', 'title'))
+    if invalid:
+        return respond(invalid)
     song_data = request.json
 
-    # Check if the required fields are present
-    if not song_data:
-        return jsonify({'error': 'No data provided'}), 400
-    if 'artist' not in song_data:
-        return jsonify({'error': 'Artist is required'}), 400
-    if 'title' not in song_data:
-        return jsonify({'error': 'Title is required'}), 400
-    
-    # Check if all fields are strings
-    for field, value in song_data.items():
-        if not isinstance(value, str):
-            return jsonify({'error': f'{field.capitalize()} must be a string'}), 400
-    
     # Sends the song data to the Catalogue Management Service
     try:
-        response = requests.delete(f'{DATABASE_URL}/delete', params={'artist': song_data['artist'], 'title': song_data['title']})
+        response = shard_client(song_data['artist'], song_data['title']).delete(
+            '/delete', params={'artist': song_data['artist'], 'title': song_data['title']}, deadline=Deadline(ROUTE_DEADLINES['delete']))
     except Exception as e:
-        return jsonify({'error': 'Failed to communicate with Catalogue Management Service', 'message': str(e)}), 500
+        return failure_response(e)
 
-    return jsonify(response.json()), response.status_code
+    return respond(relayed_reply(response))
 
 
 @app.route('/catalogue/list', methods=['GET'])
-def list_songs() -> jsonify:
+def list_songs() -> Response:
     """
     List all songs in the catalogue.
-    
+
+    Pagination parameters and 'If-None-Match' are passed through, and the catalogue's response
+    (ETag included) is relayed as it streams in rather than parsed and re-serialised.
+
     Returns:
-        jsonify: JSON response containing the list of songs or an error message.
+        Response: JSON response containing the list of songs or an error message.
     """
+    if len(catalogue_clients) > 1:
+        return list_songs_sharded()
+
     # Forwards the request to the Catalogue Management Service
     try:
-        response = requests.get(f'{DATABASE_URL}/tracks')
+        response = catalogue_clients[0].get('/tracks', params=request.args, headers=list_headers(request.headers), stream=True,
+                                            deadline=Deadline(ROUTE_DEADLINES['list']))
     except Exception as e:
-        return jsonify({'error': 'Failed to communicate with Catalogue Management Service', 'message': str(e)}), 500
-    
-    return jsonify(response.json()), response.status_code
+        return failure_response(e)
+
+    return relay_response(response)
+
+def list_songs_sharded() -> Response:
+    """
+    List the songs of a sharded catalogue, merging the ordered listings of every shard (see gateway.ShardedList).
+
+    Returns:
+        Response: JSON response containing the list of songs or an error message.
+    """
+    listing = ShardedList(request.args)
+    try:
+        error = listing.start(fetch_pages(listing, listing.first))
+    except Exception as e:
+        return failure_response(e)
+    if error:
+        return respond(error)
+
+    if etag_matches(request.if_none_match, listing.etag):
+        return Response(status=304, headers={'ETag': listing.etag})
+    reply = listing.reply()
+    if reply:
+        return respond(reply)
+
+    def generate() -> Iterator[str]:
+        while True:
+            text = listing.take()
+            if text:
+                yield text
+            wanted = listing.wanted()
+            if not wanted:
+                break
+            listing.add_pages(wanted, fetch_pages(listing, wanted))
+
+    return Response(generate(), status=200, mimetype='application/json', headers={'ETag': listing.etag})
 
 
 @app.route('/catalogue/search', methods=['POST'])
 def search_catalogue() -> jsonify:
     """
     Search for a song in the catalogue by artist and title.
-    
+
     Returns:
         jsonify: JSON response containing the song details or an error message.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
-    song_data = request.json
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(request.json, ('artist', 'title'))
+    if invalid:
+        return respond(invalid)
 
-    # Check if the required fields are present
-    if not song_data:
-        return jsonify({'error': 'No data provided'}), 400
-    if 'artist' not in song_data:
-        return jsonify({'error': 'Artist is required'}), 400
-    if 'title' not in song_data:
-        return jsonify({'error': 'Title is required'}), 400
-    
-    # Check if all fields are strings
-    for field, value in song_data.items():
-        if not isinstance(value, str):
-            return jsonify({'error': f'{field.capitalize()} must be a string'}), 400
-    
-    # Sends the song data to the Catalogue Management Service
+    # Sends the song data to the Catalogue Management Service and relays its response
     try:
-        response = requests.post(f'{DATABASE_URL}/search', json=song_data)
+        return relay_response(open_search(request.json, Deadline(ROUTE_DEADLINES['search'])))
+    except Exception as e:
+        return failure_response(e)
+
+
+@app.route('/catalogue/search/fuzzy', methods=['GET'])
+def search_catalogue_fuzzy() -> Response:
+    """
+    Search the catalogue by approximate artist and/or title, or free text ('q'), best match first.
+
+    The query parameters are passed through. A sharded catalogue is searched on every shard and
+    the results merged by score.
+
+    Returns:
+        Response: JSON response listing the matching songs or an error message.
+    """
+    deadline = Deadline(ROUTE_DEADLINES['search'])
+    try:
+        if len(catalogue_clients) == 1:
+            return relay_response(catalogue_clients[0].get('/search/fuzzy', params=request.args, stream=True, deadline=deadline,
+                                                           headers=search_headers(request.headers)))
+        responses = fan_out([lambda client=client: client.get('/search/fuzzy', params=request.args, headers=CATALOGUE_SEARCH_HEADERS,
+                                                              deadline=deadline)
+                             for client in catalogue_clients])
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(fuzzy_search_reply(responses, request.args))
 
-        try:
-            response_json = response.json()
-        except ValueError:
-            return jsonify({'error': 'Invalid JSON response from Catalogue Management Service'}), 500
 
+@app.route('/catalogue/download', methods=['GET'])
+def download_song() -> Response:
+    """
+    Stream a song's audio from the catalogue, passing 'Range' requests through for seeking and resumable downloads.
+
+    Returns:
+        Response: The audio (or the requested part of it), or a JSON error message.
+    """
+    artist = request.args.get('artist')
+    title = request.args.get('title')
+
+    # Check if the required parameters are present
+    invalid = check_track_params(artist, title)
+    if invalid:
+        return respond(invalid)
+
+    try:
+        response = shard_client(artist, title).get('/download', params={'artist': artist, 'title': title}, headers=range_headers(request.headers),
+                                                   stream=True, deadline=Deadline(ROUTE_DEADLINES['download']))
     except Exception as e:
-        return jsonify({'error': 'Failed to communicate with Catalogue Management Service', 'message': str(e)}), 500
-    
-    return jsonify(response.json()), response.status_code
+        return failure_response(e)
+
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        reply = relayed_reply(response)
+        response.close()
+        return respond(reply)
+
+    # Relay the audio chunk by chunk, keeping the headers that describe the range
+    return relay_response(response)
+
+
+@app.route('/catalogue/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str) -> jsonify:
+    """
+    Get the status of a song queued by /catalogue/add?async=true, from the catalogue shard holding its job.
+
+    Args:
+        job_id (str): Id of the job, as /catalogue/add returned it.
+
+    Returns:
+        jsonify: JSON response with the job's state and, once it finished, the result of adding the song.
+    """
+    shard = job_shard(job_id)
+    if shard is None:
+        return respond(job_not_found_reply())
+
+    try:
+        response = catalogue_clients[shard].get(job_path(job_id), headers=CATALOGUE_SEARCH_HEADERS, deadline=Deadline(ROUTE_DEADLINES['jobs']))
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(relayed_reply(response))
 
 
 @app.route('/music/identify', methods=['POST'])
 def identify():
     """
     Identify a song by sending a music fragment to the audio identification service and then searching the catalogue for the song data.
-    
+
+    When the catalogue has no track with exactly the identified artist and title, the closest
+    track found by a fuzzy search is returned instead, provided it scores at least
+    FUZZY_MATCH_MIN_SCORE, with an 'X-Catalogue-Match: fuzzy' header.
+
     Returns:
         jsonify: JSON response containing the identification result or an error message.
     """
-    # Check if the request is JSON
-    if not request.is_json:
-        return jsonify({'error': 'Request must be JSON'}), 415
-    
-    music_fragment = request.json
+    # Raw audio fragments are streamed through, anything else must be JSON
+    invalid = check_json(is_binary_upload(request) or request.is_json)
+    if invalid:
+        return respond(invalid)
+
+    # One budget covers both the identification and the catalogue lookup
+    deadline = Deadline(ROUTE_DEADLINES['identify'])
 
     # Sends the music fragment to the Music Identification Service to get the song details
     try:
-        auddio_response = requests.post(f'{AUDIO_URL}/identify', json=music_fragment)
-
-        detected_artist = None
-        detected_title = None
-        if auddio_response.status_code == 200:
-            detected_artist = auddio_response.json().get('artist')
-            detected_title = auddio_response.json().get('title')
+        if is_binary_upload(request):
+            auddio_response = forward_binary_upload(audio_client, '/identify', deadline)
         else:
-            return jsonify({'error': 'Failed to identify music', 'message': auddio_response.json()}), auddio_response.status_code
-        
+            auddio_response = audio_client.post('/identify', json=request.json, deadline=deadline)
+
+        if auddio_response.status_code != 200:
+            return respond(identification_failed_reply(auddio_response))
+
         # Search the Catalogue Management Service for the detected song
-        response = requests.post(f'{DATABASE_URL}/search', json={'artist': detected_artist, 'title': detected_title})
-        return jsonify(response.json()), response.status_code
+        return relay_identified_track(auddio_response.json(), deadline)
 
     except Exception as e:
-        return jsonify({'error': 'Failed to communicate with Music Identification Service', 'message': str(e)}), 500
-    
+        return failure_response(e, IDENTIFICATION_SERVICE)
+
+
+@app.route('/music/identify/stream', methods=['POST'])
+def identify_stream() -> Response:
+    """
+    Identify a song from a WAV fragment uploaded as application/octet-stream while it is still being
+    sent, e.g. with chunked transfer encoding as it is recorded, then search the catalogue for it like /music/identify.
+
+    The fragment is relayed to the audio identification service as it arrives, which answers as
+    soon as it is sure of the song. The rest of the upload is then never read, and the connection
+    is closed after the response. 'X-Audio-Seconds' gives how much of the fragment was used.
+
+    Returns:
+        Response: The catalogue's response for the identified song, or a JSON error message.
+    """
+    invalid = check_stream_request(request.mimetype, request.headers)
+    if invalid:
+        return respond(invalid)
+
+    deadline = Deadline(ROUTE_DEADLINES['identify_stream'])
+    try:
+        # The call lasts as long as the client takes to send the fragment, so it never counts as slow
+        auddio_response = audio_client.post('/identify/stream', data=stream_body(request, AUDIO_STREAM_CHUNK_SIZE),
+                                            headers={'Content-Type': OCTET_STREAM}, deadline=deadline, record_latency=False)
+        if auddio_response.status_code != 200:
+            return respond(identification_failed_reply(auddio_response))
+
+        relay = relay_identified_track(auddio_response.json(), deadline)
+        relay.headers[AUDIO_SECONDS_HEADER] = str(auddio_response.json()['audio_seconds'])
+        return relay
+
+    except Exception as e:
+        return failure_response(e, IDENTIFICATION_SERVICE)
+    finally:
+        stop_reading(request)
+
+
+@app.route('/music/identify/batch', methods=['POST'])
+def identify_batch() -> Response:
+    """
+    Identify a batch of songs, streaming one NDJSON line per fragment as each is identified and looked up.
+
+    The fragments are identified concurrently by the audio identification service, and the matched
+    songs are resolved together against the catalogue rather than with one search per fragment.
+
+    Returns:
+        Response: NDJSON stream of {'index': ..., 'status': ..., ...} lines, or a JSON error message.
+    """
+    # Multipart fragments are streamed through, anything else must be JSON
+    invalid = check_json(request.mimetype == MULTIPART or request.is_json)
+    if invalid:
+        return respond(invalid)
+
+    deadline = Deadline(ROUTE_DEADLINES['identify_batch'])
+    try:
+        if request.mimetype == MULTIPART:
+            auddio_response = forward_binary_upload(audio_client, '/identify/batch', deadline, stream=True)
+        else:
+            auddio_response = audio_client.post('/identify/batch', json=request.json, stream=True, deadline=deadline)
+    except Exception as e:
+        return failure_response(e, IDENTIFICATION_SERVICE)
+
+    # A rejected batch is answered with a single JSON error
+    if auddio_response.status_code != 200:
+        reply = identification_failed_reply(auddio_response)
+        auddio_response.close()
+        return respond(reply)
+
+    def generate() -> Iterator[bytes]:
+        batch = BatchResults()
+        try:
+            for chunk in chain(auddio_response.iter_content(chunk_size=STREAM_CHUNK_SIZE), [b'']):
+                results = batch.feed(chunk)
+                if results:
+                    yield resolve_results(batch, results, deadline)
+        except requests.RequestException:
+            # The status line has already been sent, so a failure mid-stream is reported as a final line
+            yield b'{"error": "Music identification stream interrupted", "status": 502}\n'
+        finally:
+            auddio_response.close()
+
+    return Response(generate(), mimetype=NDJSON)
+
+
+@app.route('/status', methods=['GET'])
+def status() -> Response:
+    """
+    Report the state of each backend's circuit breaker.
+
+    Returns:
+        Response: JSON response with the state, recent failure rate and counters of each breaker.
+    """
+    return respond(status_reply([client.breaker for client in catalogue_clients], audio_client.breaker))
+
 
 if __name__ == '__main__':
-    app.run(debug=True, 
+    app.run(debug=True,
             port=5000,
             host='localhost')
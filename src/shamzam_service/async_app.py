@@ -0,0 +1,748 @@
+from quart import Quart, Response, after_this_request, request, jsonify
+import asyncio
+import os
+import sys
+from typing import AsyncIterator, Awaitable, List, Optional, Tuple
+
+import aiohttp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.breaker import CircuitBreaker
+from common.compression import compress_async_app, etag_matches, is_encoded
+from common.async_http import TIMEOUT_ERRORS, AsyncBackendClient, BackendResponse
+from common.http import Deadline
+from common.metrics import instrument_async_app
+from common.sharding import shard_of
+from common.tracing import trace_async_app
+from common.uploads import MULTIPART, NDJSON, OCTET_STREAM, STREAM_CHUNK_SIZE, encode_metadata_headers, is_binary_upload, read_metadata
+from gateway import (AUDIO_PROBE_PATH, AUDIO_SECONDS_HEADER, AUDIO_URL, CATALOGUE_SEARCH_HEADERS, CATALOGUE_SERVICE, DATABASE_PROBE_PATH,
+                     DATABASE_URLS, IDENTIFICATION_SERVICE, MATCH_HEADER, RELAYED_HEADERS, ROUTE_DEADLINES, SLOW_CALL_SECONDS, BatchResults,
+                     Reply, ShardedList, UnroutableUpload, add_params, added_reply, best_match, bulk_headers, catalogue_name,
+                     check_bulk_request, check_form_upload, check_json, check_song, check_stream_request, check_track_params,
+                     failure_reply, form_upload_shard, fuzzy_match_params, fuzzy_search_reply, group_by_shard, identification_failed_reply,
+                     job_not_found_reply, job_path, job_shard, json_upload_shard, list_headers, range_headers, relayed_reply,
+                     search_headers, search_params, split_bulk_body, split_bulk_form, status_reply, upload_headers, upload_shard)
+
+app = Quart(__name__)
+instrument_async_app(app)
+trace_async_app(app, 'gateway')
+compress_async_app(app)
+
+# Request and response bodies are bounded by the route deadlines rather than Quart's defaults (16 MB, 60 s),
+# as they are in the sync gateway
+app.config.update(MAX_CONTENT_LENGTH=None, BODY_TIMEOUT=ROUTE_DEADLINES['bulk_add'], RESPONSE_TIMEOUT=None)
+
+# Shared keep-alive connection pools to each backend, with at most BACKEND_CONCURRENCY calls in
+# flight to each (and BACKEND_CONNECT_TIMEOUT / BACKEND_READ_TIMEOUT per call). Each has a circuit breaker, tuned by the
+# BREAKER_* variables, that fails calls fast while the backend is down or slow. Every catalogue shard
+# gets its own pool and breaker, in shard order
+catalogue_clients = [AsyncBackendClient(url, probe_path=DATABASE_PROBE_PATH, stage='upstream_catalogue',
+                                        breaker=CircuitBreaker(catalogue_name(shard), slow_call_seconds=SLOW_CALL_SECONDS['catalogue']))
+                     for shard, url in enumerate(DATABASE_URLS)]
+audio_client = AsyncBackendClient(AUDIO_URL, probe_path=AUDIO_PROBE_PATH, stage='upstream_identification',
+                                  breaker=CircuitBreaker(IDENTIFICATION_SERVICE, slow_call_seconds=SLOW_CALL_SECONDS['identification']))
+
+# Helper functions. What to check, where to route and what to answer is decided in gateway.py,
+# shared with the sync gateway (app.py); these make the backend calls and build Quart responses
+def shard_client(artist: str, title: str) -> AsyncBackendClient:
+    """
+    Get the client of the catalogue shard that owns a track.
+
+    Args:
+        artist (str): Artist of the track.
+        title (str): Title of the track.
+
+    Returns:
+        AsyncBackendClient: Client of the owning shard.
+    """
+    return catalogue_clients[shard_of(artist, title, len(catalogue_clients))]
+
+def respond(reply: Reply) -> Tuple[Response, int, dict]:
+    """
+    Turn a reply built by the gateway module into a Quart response.
+
+    Args:
+        reply (Reply): JSON body, status code and headers.
+
+    Returns:
+        Tuple[Response, int, dict]: JSON response, its status code and headers.
+    """
+    body, status_code, headers = reply
+    return jsonify(body), status_code, headers
+
+def failure_response(error: Exception, service: str = CATALOGUE_SERVICE) -> Tuple[Response, int, dict]:
+    """
+    Build the response for a backend call that failed (see gateway.failure_reply()).
+
+    Args:
+        error (Exception): The error the call raised.
+        service (str): Name of the backend.
+
+    Returns:
+        Tuple[Response, int, dict]: JSON error response, its status code and headers.
+    """
+    return respond(failure_reply(error, service, isinstance(error, TIMEOUT_ERRORS)))
+
+async def request_body() -> AsyncIterator[bytes]:
+    """
+    Iterate over the request body as it arrives, so it can be relayed without buffering it.
+
+    Yields:
+        bytes: The next chunk of the body.
+    """
+    async for chunk in request.body:
+        yield chunk
+
+async def forward_binary_upload(client: AsyncBackendClient, path: str, deadline: Deadline, stream: bool = False,
+                                params: Optional[dict] = None, extra_headers: Optional[dict] = None) -> BackendResponse:
+    """
+    Relay a raw audio upload to a backend service as it arrives, without buffering the body (see gateway.upload_headers()).
+
+    Args:
+        client (AsyncBackendClient): Client of the backend service.
+        path (str): Backend endpoint to forward the upload to.
+        deadline (Deadline): Budget of the route.
+        stream (bool): Return as soon as the backend's headers arrive, leaving its body to be read.
+        params (Optional[dict]): Query parameters of the backend call.
+        extra_headers (Optional[dict]): Headers sent on top of those describing the body.
+
+    Returns:
+        BackendResponse: The backend's response.
+    """
+    headers = upload_headers(request.mimetype, request.content_type, request.headers, read_metadata(request), extra_headers)
+    return await client.post(path, data=request_body(), headers=headers, params=params, stream=stream, deadline=deadline)
+
+async def forward_routed_upload(deadline: Deadline) -> BackendResponse:
+    """
+    Add a track uploaded as multipart/form-data, or as a compressed JSON body, on the catalogue shard that owns it.
+
+    These uploads only show the track's artist and title once their body is read, so unlike other
+    uploads they are read in full. Multipart uploads are sent on as raw audio with metadata headers,
+    compressed bodies are sent on still compressed.
+
+    Args:
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        BackendResponse: The shard's response.
+
+    Raises:
+        UnroutableUpload: If the upload's artist and title cannot be read.
+    """
+    if request.mimetype == MULTIPART:
+        check_form_upload(request.headers)
+        metadata, shard = form_upload_shard(await request.form)
+        song = (await request.files).get('song')
+        return await catalogue_clients[shard].post(
+            '/add', data=song.read() if song else b'', deadline=deadline, params=add_params(request.args),
+            headers={'Content-Type': OCTET_STREAM, **encode_metadata_headers(metadata), **CATALOGUE_SEARCH_HEADERS})
+
+    body = await request.get_data()
+    shard = json_upload_shard(body, request.headers['Content-Encoding'])
+    return await catalogue_clients[shard].post('/add', data=body, deadline=deadline, params=add_params(request.args),
+                                               headers={'Content-Type': request.content_type, 'Content-Encoding': request.headers['Content-Encoding'],
+                                                        **CATALOGUE_SEARCH_HEADERS})
+
+async def open_search(song_data: dict, deadline: Deadline) -> Tuple[AsyncBackendClient, BackendResponse]:
+    """
+    Look a track up in the Catalogue Management Service, leaving its response open to be relayed.
+
+    The track's audio is inlined as 'encoded_song' unless the client passed 'include_song=false'.
+    The catalogue points the download reference at this service's /catalogue/download and
+    compresses the body in a coding the client accepts, so it is relayed without being decoded.
+
+    Args:
+        song_data (dict): Artist and title of the track.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        Tuple[AsyncBackendClient, BackendResponse]: Client of the shard searched and its response, opened with stream=True.
+    """
+    client = shard_client(song_data['artist'], song_data['title'])
+    response = await client.post('/search', json=song_data, deadline=deadline, stream=True, auto_decompress=False,
+                                 params=search_params(request.args), headers=search_headers(request.headers))
+    return client, response
+
+async def find_fuzzy_match(song_data: dict, deadline: Deadline) -> Optional[dict]:
+    """
+    Find the catalogue track that best matches an identified track, searching every shard.
+
+    Args:
+        song_data (dict): Artist and title returned by the identification service.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        Optional[dict]: Artist and title of the best match scoring at least FUZZY_MATCH_MIN_SCORE, None if there is none.
+    """
+    params = fuzzy_match_params(song_data)
+    if params is None:
+        return None
+    return best_match(await asyncio.gather(*(client.get('/search/fuzzy', params=params, deadline=deadline) for client in catalogue_clients)))
+
+async def relay_identified_track(identified: dict, deadline: Deadline) -> Response:
+    """
+    Look an identified track up in the catalogue and relay the catalogue's response.
+
+    When the catalogue has no track with exactly the identified artist and title, the closest
+    track found by a fuzzy search is relayed instead, provided it scores at least
+    FUZZY_MATCH_MIN_SCORE, with an 'X-Catalogue-Match: fuzzy' header.
+
+    Args:
+        identified (dict): Response body of the identification service.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        Response: The catalogue's response.
+    """
+    song_data = {'artist': identified.get('artist'), 'title': identified.get('title')}
+    client, response = await open_search(song_data, deadline)
+    if response.status_code != 404:
+        return relay_response(client, response)
+
+    # Not under that exact artist and title, e.g. spelt or capitalised differently: take the closest track if it is close enough
+    try:
+        match = await find_fuzzy_match(song_data, deadline)
+    except BaseException:
+        await client.aclose(response)
+        raise
+    if match is None:
+        return relay_response(client, response)
+    await client.aclose(response)
+    relay = relay_response(*await open_search(match, deadline))
+    relay.headers[MATCH_HEADER] = 'fuzzy'
+    return relay
+
+def relay_response(client: AsyncBackendClient, response: BackendResponse) -> Response:
+    """
+    Relay a streamed backend response to the client chunk by chunk, without parsing it.
+
+    The body is relayed as it was sent, still compressed if the backend compressed it, provided the
+    call was made with auto_decompress=False.
+
+    Args:
+        client (AsyncBackendClient): Client the response was received from, which frees its slot once it is closed.
+        response (BackendResponse): Backend response opened with stream=True.
+
+    Returns:
+        Response: Response with the backend's status, body and caching/range headers.
+    """
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in response.iter_chunks(STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await client.aclose(response)
+
+    relayed_headers = {name: response.headers[name] for name in RELAYED_HEADERS if name in response.headers}
+    return Response(body(), status=response.status_code, headers=relayed_headers,
+                    content_type=response.headers.get('Content-Type'))
+
+async def read_json(client: AsyncBackendClient, response: BackendResponse) -> BackendResponse:
+    """
+    Read the JSON body of a backend response opened with stream=True, then close it.
+
+    Args:
+        client (AsyncBackendClient): Client the response was received from.
+        response (BackendResponse): The response.
+
+    Returns:
+        BackendResponse: The same response, its body read.
+    """
+    try:
+        await response.aread()
+    finally:
+        await client.aclose(response)
+    return response
+
+async def fetch_pages(listing: ShardedList, wanted: List[Tuple[int, Optional[str]]]) -> List[BackendResponse]:
+    """
+    Read the next page of several catalogue shards at once.
+
+    Args:
+        listing (ShardedList): The listing the pages are read for.
+        wanted (List[Tuple[int, Optional[str]]]): Index of each shard and the cursor to read it from.
+
+    Returns:
+        List[BackendResponse]: Each shard's response, in the same order.
+    """
+    deadline = Deadline(ROUTE_DEADLINES['list'])
+    calls: List[Awaitable[BackendResponse]] = [
+        catalogue_clients[shard].get('/tracks', params=listing.read_params(cursor), deadline=deadline)
+        for shard, cursor in wanted]
+    return await asyncio.gather(*calls)
+
+
+async def resolve_results(batch: BatchResults, results: list, deadline: Deadline) -> bytes:
+    """
+    Look up the songs newly matched by a burst of batch identification results and render their lines.
+
+    Args:
+        batch (BatchResults): State of the batch being streamed.
+        results (list): Fragment results just read from the identification stream.
+        deadline (Deadline): Budget of the route.
+
+    Returns:
+        bytes: The NDJSON lines for the results.
+    """
+    tracks = batch.unresolved(results)
+    if not tracks:
+        return batch.render(results)
+    try:
+        # One lookup per catalogue shard owning some of the tracks
+        responses = await asyncio.gather(*(catalogue_clients[shard].post('/search/batch', json={'tracks': group},
+                                                                         headers=CATALOGUE_SEARCH_HEADERS, deadline=deadline)
+                                           for shard, group in group_by_shard(tracks).items()))
+        failure = batch.lookup_failure(responses)
+        if failure is None:
+            batch.resolve(tracks, [track for response in responses for track in response.json()['tracks']])
+    except Exception as e:
+        body, status_code, _ = failure_reply(e, timed_out=isinstance(e, TIMEOUT_ERRORS))
+        failure = (body, status_code)
+    return batch.render(results, failure)
+
+
+@app.after_serving
+async def close_clients() -> None:
+    """
+    Close the backend connection pools when the server shuts down.
+    """
+    for client in catalogue_clients:
+        await client.shutdown()
+    await audio_client.shutdown()
+
+
+# Routes
+@app.route('/catalogue/add', methods=['POST'])
+async def add_song() -> Response:
+    """
+    Add a new song to the catalogue.
+
+    Returns:
+        Response: JSON response indicating success or failure.
+    """
+    deadline = Deadline(ROUTE_DEADLINES['add'])
+
+    # Raw audio uploads and compressed bodies are streamed straight through to the Catalogue Management
+    # Service, which checks compressed bodies once it has decompressed them
+    if is_binary_upload(request) or is_encoded(request.headers):
+        try:
+            shard = upload_shard(request.mimetype, read_metadata(request))
+            if shard is None:
+                response = await forward_routed_upload(deadline)
+            else:
+                response = await forward_binary_upload(catalogue_clients[shard], '/add', deadline, params=add_params(request.args),
+                                                       extra_headers=CATALOGUE_SEARCH_HEADERS)
+        except UnroutableUpload as e:
+            return respond(e.reply())
+        except Exception as e:
+            return failure_response(e)
+        return respond(added_reply(response))
+
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(await request.get_json(), ('artist', 'title', 'encoded_song'))
+    if invalid:
+        return respond(invalid)
+    song_data = await request.get_json()
+
+    try:
+        # Forward the song data to the Catalogue Management Service
+        response = await shard_client(song_data['artist'], song_data['title']).post('/add', json=song_data, deadline=deadline,
+                                                                                    params=add_params(request.args), headers=CATALOGUE_SEARCH_HEADERS)
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(added_reply(response))
+
+
+@app.route('/catalogue/add/bulk', methods=['POST'])
+async def add_songs_bulk() -> Response:
+    """
+    Add many songs to the catalogue in one request.
+
+    The body (JSON, NDJSON or multipart/form-data) is streamed through to the Catalogue Management
+    Service as it arrives, and its per-track results are relayed back without being re-serialised.
+
+    Returns:
+        Response: JSON response with the result of each track, or an error message.
+    """
+    # Check the content type
+    invalid = check_bulk_request(request.mimetype)
+    if invalid:
+        return respond(invalid)
+
+    if len(catalogue_clients) > 1:
+        return await add_songs_sharded()
+
+    # Forwards the request to the Catalogue Management Service
+    try:
+        response = await catalogue_clients[0].post('/add/bulk', data=request_body(), headers=bulk_headers(request.content_type, request.headers),
+                                                   stream=True, auto_decompress=False, record_latency=False, deadline=Deadline(ROUTE_DEADLINES['bulk_add']))
+    except Exception as e:
+        return failure_response(e)
+
+    return relay_response(catalogue_clients[0], response)
+
+async def add_songs_sharded() -> Response:
+    """
+    Add many songs to a sharded catalogue, with one bulk add per shard made at the same time.
+
+    The body is read in full and split by owning shard into NDJSON bulk adds, whose per-track results
+    are merged back in request order.
+
+    Returns:
+        Response: JSON response with the result of each track, or an error message.
+    """
+    try:
+        if request.mimetype == MULTIPART:
+            check_form_upload(request.headers)
+            form, files = await request.form, await request.files
+            bulk = split_bulk_form(form.getlist('artist'), form.getlist('title'), [song.read() for song in files.getlist('song')])
+        else:
+            bulk = split_bulk_body(request.mimetype, await request.get_data(), request.headers)
+    except UnroutableUpload as e:
+        return respond(e.reply())
+
+    deadline = Deadline(ROUTE_DEADLINES['bulk_add'])
+
+    async def send(shard: int, body: bytes) -> Tuple[int, dict, int]:
+        # A shard that cannot be reached fails its own tracks, not the whole request
+        try:
+            response = await catalogue_clients[shard].post('/add/bulk', data=body, headers={'Content-Type': NDJSON},
+                                                           record_latency=False, deadline=deadline)
+            return shard, response.json(), response.status_code
+        except Exception as e:
+            error, status_code, _ = failure_reply(e, catalogue_name(shard), isinstance(e, TIMEOUT_ERRORS))
+            return shard, error, status_code
+
+    for shard, body, status_code in await asyncio.gather(*(send(shard, body) for shard, body in bulk.bodies())):
+        bulk.record(shard, body, status_code)
+    return jsonify(bulk.body()), 200
+
+
+@app.route('/catalogue/delete', methods=['DELETE'])
+async def delete_song() -> Response:
+    """
+    Delete a song in the catalogue by its artist and title.
+
+    Returns:
+        Response: JSON response indicating success or failure.
+    """
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(await request.get_json(), ('artist', 'title'))
+    if invalid:
+        return respond(invalid)
+    song_data = await request.get_json()
+
+    # Sends the song data to the Catalogue Management Service
+    try:
+        response = await shard_client(song_data['artist'], song_data['title']).delete(
+            '/delete', params={'artist': song_data['artist'], 'title': song_data['title']}, deadline=Deadline(ROUTE_DEADLINES['delete']))
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(relayed_reply(response))
+
+
+@app.route('/catalogue/list', methods=['GET'])
+async def list_songs() -> Response:
+    """
+    List all songs in the catalogue.
+
+    Pagination parameters and 'If-None-Match' are passed through, and the catalogue's response
+    (ETag included) is relayed as it streams in rather than parsed and re-serialised.
+
+    Returns:
+        Response: JSON response containing the list of songs or an error message.
+    """
+    if len(catalogue_clients) > 1:
+        return await list_songs_sharded()
+
+    # Forwards the request to the Catalogue Management Service
+    try:
+        response = await catalogue_clients[0].get('/tracks', params=list(request.args.items(multi=True)), headers=list_headers(request.headers),
+                                                  stream=True, auto_decompress=False, deadline=Deadline(ROUTE_DEADLINES['list']))
+    except Exception as e:
+        return failure_response(e)
+
+    return relay_response(catalogue_clients[0], response)
+
+async def list_songs_sharded() -> Response:
+    """
+    List the songs of a sharded catalogue, merging the ordered listings of every shard (see gateway.ShardedList).
+
+    Returns:
+        Response: JSON response containing the list of songs or an error message.
+    """
+    listing = ShardedList(request.args)
+    try:
+        error = listing.start(await fetch_pages(listing, listing.first))
+    except Exception as e:
+        return failure_response(e)
+    if error:
+        return respond(error)
+
+    if etag_matches(request.if_none_match, listing.etag):
+        return Response('', status=304, headers={'ETag': listing.etag})
+    reply = listing.reply()
+    if reply:
+        return respond(reply)
+
+    async def generate() -> AsyncIterator[str]:
+        while True:
+            text = listing.take()
+            if text:
+                yield text
+            wanted = listing.wanted()
+            if not wanted:
+                break
+            listing.add_pages(wanted, await fetch_pages(listing, wanted))
+
+    return Response(generate(), status=200, mimetype='application/json', headers={'ETag': listing.etag})
+
+
+@app.route('/catalogue/search', methods=['POST'])
+async def search_catalogue() -> Response:
+    """
+    Search for a song in the catalogue by artist and title.
+
+    Returns:
+        Response: JSON response containing the song details or an error message.
+    """
+    # Check the request is JSON, with the required fields present and strings
+    invalid = check_json(request.is_json) or check_song(await request.get_json(), ('artist', 'title'))
+    if invalid:
+        return respond(invalid)
+
+    # Sends the song data to the Catalogue Management Service and relays its response
+    try:
+        return relay_response(*await open_search(await request.get_json(), Deadline(ROUTE_DEADLINES['search'])))
+    except Exception as e:
+        return failure_response(e)
+
+
+@app.route('/catalogue/search/fuzzy', methods=['GET'])
+async def search_catalogue_fuzzy() -> Response:
+    """
+    Search the catalogue by approximate artist and/or title, or free text ('q'), best match first.
+
+    The query parameters are passed through. A sharded catalogue is searched on every shard and
+    the results merged by score.
+
+    Returns:
+        Response: JSON response listing the matching songs or an error message.
+    """
+    deadline = Deadline(ROUTE_DEADLINES['search'])
+    params = list(request.args.items(multi=True))
+    try:
+        if len(catalogue_clients) == 1:
+            response = await catalogue_clients[0].get('/search/fuzzy', params=params, stream=True, auto_decompress=False, deadline=deadline,
+                                                      headers=search_headers(request.headers))
+            return relay_response(catalogue_clients[0], response)
+        responses = await asyncio.gather(*(client.get('/search/fuzzy', params=params, headers=CATALOGUE_SEARCH_HEADERS, deadline=deadline)
+                                           for client in catalogue_clients))
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(fuzzy_search_reply(responses, request.args))
+
+
+@app.route('/catalogue/download', methods=['GET'])
+async def download_song() -> Response:
+    """
+    Stream a song's audio from the catalogue, passing 'Range' requests through for seeking and resumable downloads.
+
+    Returns:
+        Response: The audio (or the requested part of it), or a JSON error message.
+    """
+    artist = request.args.get('artist')
+    title = request.args.get('title')
+
+    # Check if the required parameters are present
+    invalid = check_track_params(artist, title)
+    if invalid:
+        return respond(invalid)
+
+    client = shard_client(artist, title)
+    try:
+        response = await client.get('/download', params={'artist': artist, 'title': title}, headers=range_headers(request.headers),
+                                    stream=True, deadline=Deadline(ROUTE_DEADLINES['download']))
+    except Exception as e:
+        return failure_response(e)
+
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        return respond(relayed_reply(await read_json(client, response)))
+
+    # Relay the audio chunk by chunk, keeping the headers that describe the range
+    return relay_response(client, response)
+
+
+@app.route('/catalogue/jobs/<job_id>', methods=['GET'])
+async def job_status(job_id: str) -> Response:
+    """
+    Get the status of a song queued by /catalogue/add?async=true, from the catalogue shard holding its job.
+
+    Args:
+        job_id (str): Id of the job, as /catalogue/add returned it.
+
+    Returns:
+        Response: JSON response with the job's state and, once it finished, the result of adding the song.
+    """
+    shard = job_shard(job_id)
+    if shard is None:
+        return respond(job_not_found_reply())
+
+    try:
+        response = await catalogue_clients[shard].get(job_path(job_id), headers=CATALOGUE_SEARCH_HEADERS,
+                                                     deadline=Deadline(ROUTE_DEADLINES['jobs']))
+    except Exception as e:
+        return failure_response(e)
+
+    return respond(relayed_reply(response))
+
+
+@app.route('/music/identify', methods=['POST'])
+async def identify() -> Response:
+    """
+    Identify a song by sending a music fragment to the audio identification service and then searching the catalogue for the song data.
+
+    When the catalogue has no track with exactly the identified artist and title, the closest
+    track found by a fuzzy search is returned instead, provided it scores at least
+    FUZZY_MATCH_MIN_SCORE, with an 'X-Catalogue-Match: fuzzy' header.
+
+    While either backend is being waited on, the request holds no thread, only a slot of that
+    backend's concurrency limit.
+
+    Returns:
+        Response: JSON response containing the identification result or an error message.
+    """
+    # Raw audio fragments are streamed through, anything else must be JSON
+    invalid = check_json(is_binary_upload(request) or request.is_json)
+    if invalid:
+        return respond(invalid)
+
+    # One budget covers both the identification and the catalogue lookup
+    deadline = Deadline(ROUTE_DEADLINES['identify'])
+
+    # Sends the music fragment to the Music Identification Service to get the song details
+    try:
+        if is_binary_upload(request):
+            auddio_response = await forward_binary_upload(audio_client, '/identify', deadline)
+        else:
+            auddio_response = await audio_client.post('/identify', json=await request.get_json(), deadline=deadline)
+
+        if auddio_response.status_code != 200:
+            return respond(identification_failed_reply(auddio_response))
+
+        # Search the Catalogue Management Service for the detected song
+        return await relay_identified_track(auddio_response.json(), deadline)
+
+    except Exception as e:
+        return failure_response(e, IDENTIFICATION_SERVICE)
+
+
+@app.route('/music/identify/stream', methods=['POST'])
+async def identify_stream() -> Response:
+    """
+    Identify a song from a WAV fragment uploaded as application/octet-stream while it is still being
+    sent, e.g. with chunked transfer encoding as it is recorded, then search the catalogue for it like /music/identify.
+
+    The fragment is relayed to the audio identification service as it arrives, which answers as
+    soon as it is sure of the song. The rest of the upload is then never read, and the connection
+    is closed after the response. 'X-Audio-Seconds' gives how much of the fragment was used.
+
+    Returns:
+        Response: The catalogue's response for the identified song, or a JSON error message.
+    """
+    # Some ASGI servers (e.g. uvicorn) otherwise read the rest of the body to keep the connection open,
+    # which for an upload that is still being recorded lasts as long as the upload
+    @after_this_request
+    async def close_connection(response: Response) -> Response:
+        response.headers['Connection'] = 'close'
+        return response
+
+    invalid = check_stream_request(request.mimetype, request.headers)
+    if invalid:
+        return respond(invalid)
+
+    deadline = Deadline(ROUTE_DEADLINES['identify_stream'])
+    try:
+        # The call lasts as long as the client takes to send the fragment, so it never counts as slow
+        auddio_response = await audio_client.post('/identify/stream', data=request_body(), headers={'Content-Type': OCTET_STREAM},
+                                                  deadline=deadline, record_latency=False)
+        if auddio_response.status_code != 200:
+            return respond(identification_failed_reply(auddio_response))
+
+        relay = await relay_identified_track(auddio_response.json(), deadline)
+        relay.headers[AUDIO_SECONDS_HEADER] = str(auddio_response.json()['audio_seconds'])
+        return relay
+
+    except Exception as e:
+        return failure_response(e, IDENTIFICATION_SERVICE)
+
+
+@app.route('/music/identify/batch', methods=['POST'])
+async def identify_batch() -> Response:
+    """
+    Identify a batch of songs, streaming one NDJSON line per fragment as each is identified and looked up.
+
+    The fragments are identified concurrently by the audio identification service, and the matched
+    songs are resolved together against the catalogue rather than with one search per fragment.
+
+    Returns:
+        Response: NDJSON stream of {'index': ..., 'status': ..., ...} lines, or a JSON error message.
+    """
+    # Multipart fragments are streamed through, anything else must be JSON
+    invalid = check_json(request.mimetype == MULTIPART or request.is_json)
+    if invalid:
+        return respond(invalid)
+
+    deadline = Deadline(ROUTE_DEADLINES['identify_batch'])
+    try:
+        if request.mimetype == MULTIPART:
+            auddio_response = await forward_binary_upload(audio_client, '/identify/batch', deadline, stream=True)
+        else:
+            auddio_response = await audio_client.post('/identify/batch', json=await request.get_json(), stream=True, deadline=deadline)
+    except Exception as e:
+        return failure_response(e, IDENTIFICATION_SERVICE)
+
+    # A rejected batch is answered with a single JSON error
+    if auddio_response.status_code != 200:
+        return respond(identification_failed_reply(await read_json(audio_client, auddio_response)))
+
+    async def generate() -> AsyncIterator[bytes]:
+        batch = BatchResults()
+        try:
+            async for chunk in auddio_response.iter_chunks(STREAM_CHUNK_SIZE):
+                results = batch.feed(chunk)
+                if results:
+                    yield await resolve_results(batch, results, deadline)
+            results = batch.feed(b'')
+            if results:
+                yield await resolve_results(batch, results, deadline)
+        except (aiohttp.ClientError, *TIMEOUT_ERRORS):
+            # The status line has already been sent, so a failure mid-stream is reported as a final line
+            yield b'{"error": "Music identification stream interrupted", "status": 502}\n'
+        finally:
+            await audio_client.aclose(auddio_response)
+
+    return Response(generate(), mimetype=NDJSON)
+
+
+@app.route('/status', methods=['GET'])
+async def status() -> Response:
+    """
+    Report the state of each backend's circuit breaker.
+
+    Returns:
+        Response: JSON response with the state, recent failure rate and counters of each breaker.
+    """
+    return respond(status_reply([client.breaker for client in catalogue_clients], audio_client.breaker))
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ['localhost:5000']
+    asyncio.run(serve(app, config))
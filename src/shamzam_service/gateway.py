@@ -0,0 +1,905 @@
+import base64
+import json
+import math
+import os
+import sys
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.breaker import CircuitOpen
+from common.compression import DecompressionLimitExceeded, UnsupportedEncoding, accept_encoding, decompress, is_encoded
+from common.sharding import ShardedListing, combine_etags, merge_pages, parse_urls, shard_of
+from common.uploads import JSON, MULTIPART, NDJSON, OCTET_STREAM, encode_metadata_headers
+
+# URLs for the catalogue management service and audio identification service. DATABASE_URL may list
+# several comma-separated URLs, one per catalogue shard in shard order, which the gateway routes between
+DATABASE_URLS = parse_urls(os.environ.get('DATABASE_URL', 'http://localhost:5002'))
+AUDIO_URL = os.environ.get('AUDIO_URL', 'http://localhost:5001')
+
+# Largest number of tracks one bulk add may carry, checked by the gateway when it splits bulk adds across shards
+MAX_BULK_TRACKS = int(os.environ.get('MAX_BULK_TRACKS', 1000))
+
+# Page size used to read each shard when the whole sharded catalogue is listed
+SHARD_PAGE_SIZE = 1000
+
+# Threads the sync gateway calls several catalogue shards at once with
+SHARD_FANOUT_WORKERS = int(os.environ.get('SHARD_FANOUT_WORKERS', 32))
+
+# Cheap endpoints probed to tell when a backend whose circuit breaker opened has recovered
+DATABASE_PROBE_PATH = '/tracks?limit=1'
+AUDIO_PROBE_PATH = '/cache/stats'
+
+# Calls slower than this count against a backend's circuit breaker. Identifications may queue for the
+# Audd.io quota for several seconds, so they get more room than catalogue calls
+SLOW_CALL_SECONDS = {
+    'catalogue': float(os.environ.get('CATALOGUE_SLOW_CALL_SECONDS', 5)),
+    'identification': float(os.environ.get('IDENTIFY_SLOW_CALL_SECONDS', 15)),
+}
+
+# Total time each route may spend waiting on backends, in seconds
+ROUTE_DEADLINES = {
+    'add': float(os.environ.get('ADD_DEADLINE', 60)),
+    'bulk_add': float(os.environ.get('BULK_ADD_DEADLINE', 300)),
+    'delete': float(os.environ.get('DELETE_DEADLINE', 10)),
+    'list': float(os.environ.get('LIST_DEADLINE', 10)),
+    'search': float(os.environ.get('SEARCH_DEADLINE', 10)),
+    'download': float(os.environ.get('DOWNLOAD_DEADLINE', 10)),
+    'jobs': float(os.environ.get('JOBS_DEADLINE', 10)),
+    'identify': float(os.environ.get('IDENTIFY_DEADLINE', 30)),
+    'identify_batch': float(os.environ.get('IDENTIFY_BATCH_DEADLINE', 300)),
+    # Includes the time the client takes to send the fragment, e.g. while recording it
+    'identify_stream': float(os.environ.get('IDENTIFY_STREAM_DEADLINE', 60)),
+}
+
+# Backend response headers passed on when a response is relayed as-is
+RELAYED_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Content-Encoding', 'Vary')
+
+# Sent with catalogue searches and adds, so the download references and job status URLs they return
+# point at this service's /catalogue/download and /catalogue/jobs
+CATALOGUE_SEARCH_HEADERS = {'X-Forwarded-Prefix': '/catalogue'}
+
+# Lowest fuzzy search score (see common.search) at which /music/identify takes a catalogue track
+# for an identified track the catalogue does not hold under exactly the same artist and title
+FUZZY_MATCH_MIN_SCORE = float(os.environ.get('FUZZY_MATCH_MIN_SCORE', 0.6))
+
+# Response header set to 'fuzzy' when /music/identify returned a fuzzy match
+MATCH_HEADER = 'X-Catalogue-Match'
+
+# Response header of /music/identify/stream giving the seconds of the streamed fragment the identification used
+AUDIO_SECONDS_HEADER = 'X-Audio-Seconds'
+
+# Names of the backends in error messages, and what a timeout of each is reported as
+CATALOGUE_SERVICE = 'Catalogue Management Service'
+IDENTIFICATION_SERVICE = 'Music Identification Service'
+TIMEOUT_NAMES = {IDENTIFICATION_SERVICE: 'Music identification'}
+
+# A reply as the routes of both gateways build it: JSON body, status code and headers. Each gateway
+# turns it into a response of its own web framework
+Reply = Tuple[dict, int, Dict[str, str]]
+
+
+def check_song_fields(song_data: Optional[dict], required: Iterable[str]) -> Optional[str]:
+    """
+    Check that a request body has every required field and only string values.
+
+    Shared by the sync (app.py) and async (async_app.py) gateways so both answer invalid
+    requests identically.
+
+    Args:
+        song_data (Optional[dict]): The parsed JSON body.
+        required (Iterable[str]): Fields that must be present, in the order they are checked.
+
+    Returns:
+        Optional[str]: The error message for the first problem found, None if the body is valid.
+    """
+    # Check if the required fields are present
+    if not song_data:
+        return 'No data provided'
+    for field in required:
+        if field not in song_data:
+            return f"{field.replace('_', ' ').capitalize()} is required"
+
+    # Check if all fields are strings
+    for field, value in song_data.items():
+        if not isinstance(value, str):
+            return f'{field.capitalize()} must be a string'
+    return None
+
+
+def add_params(args: Dict[str, str]) -> Dict[str, str]:
+    """
+    Query parameters of a /catalogue/add request passed on to the catalogue: 'async=true' queues the track.
+
+    Args:
+        args (Dict[str, str]): The request's query parameters.
+
+    Returns:
+        Dict[str, str]: The parameters to forward.
+    """
+    return {'async': args['async']} if 'async' in args else {}
+
+
+def job_shard(job_id: str) -> Optional[int]:
+    """
+    Find the catalogue shard holding an ingest job, from the shard index its id starts with when the catalogue is sharded.
+
+    Args:
+        job_id (str): Id of the job, e.g. '17', or '1.17' on shard 1.
+
+    Returns:
+        Optional[int]: Index of the shard, None if the id names none.
+    """
+    if len(DATABASE_URLS) == 1:
+        return 0
+    shard, _, _ = job_id.partition('.')
+    if not shard.isdigit() or int(shard) >= len(DATABASE_URLS):
+        return None
+    return int(shard)
+
+
+def catalogue_name(shard: int) -> str:
+    """
+    Name of a catalogue shard in error messages, just the service's name when the catalogue is not sharded.
+    """
+    if len(DATABASE_URLS) == 1:
+        return CATALOGUE_SERVICE
+    return f'{CATALOGUE_SERVICE} shard {shard}'
+
+
+def catalogue_backend(shard: int) -> str:
+    """
+    Key of a catalogue shard in /status.
+    """
+    return 'catalogue' if len(DATABASE_URLS) == 1 else f'catalogue/{shard}'
+
+
+def track_shard(artist: str, title: str) -> int:
+    """
+    Index of the catalogue shard that owns a track.
+    """
+    return shard_of(artist, title, len(DATABASE_URLS))
+
+
+def error_reply(message: str, status_code: int) -> Reply:
+    """
+    Build the reply for a request the gateway refuses itself.
+    """
+    return {'error': message}, status_code, {}
+
+
+def failure_reply(error: BaseException, service: str = CATALOGUE_SERVICE, timed_out: bool = False) -> Reply:
+    """
+    Build the reply for a backend call that failed.
+
+    Args:
+        error (BaseException): The error the call raised.
+        service (str): Name of the backend in the error message.
+        timed_out (bool): Whether the error is the gateway's HTTP client timing out, which each
+            gateway recognises from its own client's errors.
+
+    Returns:
+        Reply: 503 with a Retry-After header if the backend's circuit breaker is open, 504 if it did
+            not answer within the route's deadline, 500 otherwise.
+    """
+    if isinstance(error, CircuitOpen):
+        return ({'error': f'{error.name} unavailable', 'message': str(error)}, 503,
+                {'Retry-After': str(max(1, math.ceil(error.retry_after)))})
+    if timed_out:
+        return error_reply(f'{TIMEOUT_NAMES.get(service, service)} timed out', 504)
+    return {'error': f'Failed to communicate with {service}', 'message': str(error)}, 500, {}
+
+
+def relayed_reply(response) -> Reply:
+    """
+    Build the reply passing on a backend's JSON response (requests or common.async_http, whose body has been read).
+    """
+    return response.json(), response.status_code, {}
+
+
+def added_reply(response) -> Reply:
+    """
+    Build the reply passing on the catalogue's answer to an add, with the 'Location' of the job status of a queued song.
+    """
+    headers = {'Location': response.headers['Location']} if 'Location' in response.headers else {}
+    return response.json(), response.status_code, headers
+
+
+def identification_failed_reply(response) -> Reply:
+    """
+    Build the reply for an identification the identification service refused or could not make.
+    """
+    return {'error': 'Failed to identify music', 'message': response.json()}, response.status_code, {}
+
+
+def check_json(is_json: bool) -> Optional[Reply]:
+    """
+    Returns:
+        Optional[Reply]: The 415 reply for a request whose body should have been JSON, None if it is.
+    """
+    return None if is_json else error_reply('Request must be JSON', 415)
+
+
+def check_song(song_data: Optional[dict], required: Iterable[str]) -> Optional[Reply]:
+    """
+    Returns:
+        Optional[Reply]: The 400 reply for a JSON body missing a field (see check_song_fields()), None if it is valid.
+    """
+    error = check_song_fields(song_data, required)
+    return None if error is None else error_reply(error, 400)
+
+
+def check_track_params(artist: Optional[str], title: Optional[str]) -> Optional[Reply]:
+    """
+    Returns:
+        Optional[Reply]: The 400 reply for query parameters missing the artist or title, None if both are given.
+    """
+    if not artist:
+        return error_reply('Artist is required', 400)
+    if not title:
+        return error_reply('Title is required', 400)
+    return None
+
+
+def check_bulk_request(mimetype: str) -> Optional[Reply]:
+    """
+    Returns:
+        Optional[Reply]: The 415 reply for a bulk add in a content type it cannot be, None if it is fine.
+    """
+    if mimetype not in (JSON, NDJSON, MULTIPART):
+        return error_reply('Request must be JSON, NDJSON or multipart/form-data', 415)
+    return None
+
+
+def check_stream_request(mimetype: str, headers: Mapping[str, str]) -> Optional[Reply]:
+    """
+    Returns:
+        Optional[Reply]: The 415 reply for a streamed fragment that is not raw, uncompressed audio, None if it is.
+    """
+    if mimetype != OCTET_STREAM:
+        return error_reply('Request must be application/octet-stream', 415)
+    # The fragment is decoded as it arrives, which a compressed body would prevent
+    if is_encoded(headers):
+        return error_reply('Streamed fragments must not be compressed', 415)
+    return None
+
+
+def upload_headers(mimetype: str, content_type: str, headers: Mapping[str, str], metadata: Dict[str, str],
+                   extra_headers: Optional[dict] = None) -> Dict[str, str]:
+    """
+    Headers of a binary upload relayed to a backend as it arrives.
+
+    Multipart bodies are passed through untouched (boundary included) for the backend to parse,
+    octet-stream bodies keep their percent-encoded metadata headers. Compressed bodies (of any
+    content type) are passed through still compressed.
+
+    Args:
+        mimetype (str): Content type of the upload, without parameters.
+        content_type (str): Its full Content-Type header.
+        headers (Mapping[str, str]): The request's headers.
+        metadata (Dict[str, str]): The artist and title sent in headers (see common.uploads.read_metadata()).
+        extra_headers (Optional[dict]): Headers sent on top of those describing the body.
+
+    Returns:
+        Dict[str, str]: The headers to send.
+    """
+    if mimetype == OCTET_STREAM:
+        relayed = {'Content-Type': OCTET_STREAM, **encode_metadata_headers(metadata)}
+    else:
+        relayed = {'Content-Type': content_type}
+    if is_encoded(headers):
+        relayed['Content-Encoding'] = headers['Content-Encoding']
+    if extra_headers:
+        relayed.update(extra_headers)
+    return relayed
+
+
+def upload_shard(mimetype: str, metadata: Dict[str, str]) -> Optional[int]:
+    """
+    Find the catalogue shard to stream a binary or compressed /catalogue/add upload to.
+
+    Args:
+        mimetype (str): Content type of the upload, without parameters.
+        metadata (Dict[str, str]): The artist and title sent in headers (see common.uploads.read_metadata()).
+
+    Returns:
+        Optional[int]: Index of the shard, None if it can only be found by reading the body (multipart
+            and compressed JSON uploads to a sharded catalogue, see form_upload_shard() and json_upload_shard()).
+
+    Raises:
+        UnroutableUpload: If a raw audio upload has no artist or title.
+    """
+    if mimetype == OCTET_STREAM:
+        if 'artist' not in metadata:
+            raise UnroutableUpload('Artist is required')
+        if 'title' not in metadata:
+            raise UnroutableUpload('Title is required')
+        return track_shard(metadata['artist'], metadata['title'])
+    return 0 if len(DATABASE_URLS) == 1 else None
+
+
+def check_form_upload(headers: Mapping[str, str]) -> None:
+    """
+    Check that a multipart upload whose fields decide its shard can be parsed by the gateway.
+
+    Raises:
+        UnroutableUpload: If the body is compressed.
+    """
+    if is_encoded(headers):
+        raise UnroutableUpload('Compressed multipart uploads cannot be routed to a catalogue shard', 415)
+
+
+def form_upload_shard(form: Mapping[str, str]) -> Tuple[Dict[str, str], int]:
+    """
+    Find the catalogue shard owning a track uploaded as multipart/form-data.
+
+    Args:
+        form (Mapping[str, str]): The upload's form fields.
+
+    Returns:
+        Tuple[Dict[str, str], int]: The track's artist and title, and the index of its shard.
+
+    Raises:
+        UnroutableUpload: If the artist or title is missing.
+    """
+    metadata = {field: form[field] for field in ('artist', 'title') if field in form}
+    error = check_song_fields(metadata, ('artist', 'title'))
+    if error:
+        raise UnroutableUpload(error)
+    return metadata, track_shard(metadata['artist'], metadata['title'])
+
+
+def json_upload_shard(body: bytes, encoding: str) -> int:
+    """
+    Find the catalogue shard owning a track uploaded as a compressed JSON body.
+
+    Bodies without a readable artist and title go to the first shard, which reports what is wrong with them.
+
+    Args:
+        body (bytes): The compressed body.
+        encoding (str): Its Content-Encoding.
+
+    Returns:
+        int: Index of the shard.
+
+    Raises:
+        UnroutableUpload: If the body is in an unsupported coding or decompresses to too much.
+    """
+    try:
+        song_data = json.loads(decompress(body, encoding))
+    except UnsupportedEncoding as e:
+        raise UnroutableUpload(str(e), 415)
+    except DecompressionLimitExceeded as e:
+        raise UnroutableUpload(str(e), 413)
+    except Exception:
+        song_data = None
+    if isinstance(song_data, dict) and isinstance(song_data.get('artist'), str) and isinstance(song_data.get('title'), str):
+        return track_shard(song_data['artist'], song_data['title'])
+    return 0
+
+
+def search_params(args: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Query parameters of a catalogue /search: the track's audio is inlined as 'encoded_song' unless
+    the client passed 'include_song=false'.
+    """
+    include_song = args.get('include_song', 'true').lower() != 'false'
+    return {'include_song': 'true' if include_song else 'false'}
+
+
+def search_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Headers of a catalogue call whose response is relayed as it is: the catalogue points download
+    references at this service and compresses the body in a coding the client accepts.
+    """
+    return {**CATALOGUE_SEARCH_HEADERS, **accept_encoding(headers)}
+
+
+def list_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Headers of a catalogue /tracks call whose response is relayed as it is, 'If-None-Match' included.
+    """
+    relayed = accept_encoding(headers)
+    if 'If-None-Match' in headers:
+        relayed['If-None-Match'] = headers['If-None-Match']
+    return relayed
+
+
+def bulk_headers(content_type: str, headers: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Headers of a bulk add streamed through to an unsharded catalogue, whose response is relayed as it is.
+    """
+    relayed = {'Content-Type': content_type, **accept_encoding(headers)}
+    if is_encoded(headers):
+        relayed['Content-Encoding'] = headers['Content-Encoding']
+    return relayed
+
+
+def range_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    """
+    Headers of a catalogue /download call, passing 'Range' through for seeking and resumable downloads.
+    """
+    return {'Range': headers['Range']} if 'Range' in headers else {}
+
+
+def job_path(job_id: str) -> str:
+    """
+    Path of an ingest job's status on the catalogue shard holding it.
+    """
+    return f"/jobs/{quote(job_id, safe='')}"
+
+
+def job_not_found_reply() -> Reply:
+    return error_reply('Job not found', 404)
+
+
+def fuzzy_search_reply(responses: list, args: Mapping[str, str]) -> Reply:
+    """
+    Build the reply to a fuzzy search of a sharded catalogue from the response of every shard.
+
+    Args:
+        responses (list): Each shard's response, in shard order.
+        args (Mapping[str, str]): The request's query parameters.
+
+    Returns:
+        Reply: The best matches of all shards, or the first error of a shard (e.g. a query too short) as it is.
+    """
+    for response in responses:
+        if response.status_code not in (200, 404):
+            return relayed_reply(response)
+
+    tracks = merge_search_results([response.json() for response in responses if response.status_code == 200], int(args.get('limit', 10)))
+    if not tracks:
+        return {'message': 'No tracks found'}, 404, {}
+    return {'message': 'Tracks found', 'tracks': tracks}, 200, {}
+
+
+def best_match(responses: list) -> Optional[dict]:
+    """
+    Pick the best fuzzy match of an identified track from the /search/fuzzy response of every shard.
+
+    Args:
+        responses (list): Each shard's response to fuzzy_match_params().
+
+    Returns:
+        Optional[dict]: Artist and title of the best match, None if no shard found one.
+    """
+    tracks = merge_search_results([response.json() for response in responses if response.status_code == 200], 1)
+    return {'artist': tracks[0]['artist'], 'title': tracks[0]['title']} if tracks else None
+
+
+def status_reply(catalogue_breakers: list, audio_breaker) -> Reply:
+    """
+    Build the /status reply from the circuit breaker of each catalogue shard, in shard order, and of the identification service.
+    """
+    return {
+        'message': 'Gateway status',
+        'backends': {
+            **{catalogue_backend(shard): breaker.snapshot() for shard, breaker in enumerate(catalogue_breakers)},
+            'identification': audio_breaker.snapshot()
+        }
+    }, 200, {}
+
+
+def fuzzy_match_params(song_data: dict) -> Optional[dict]:
+    """
+    Build the catalogue /search/fuzzy parameters looking for the best match of an identified track.
+
+    Args:
+        song_data (dict): Artist and title returned by the identification service.
+
+    Returns:
+        Optional[dict]: The query parameters, None if the identification has no artist or title to search for.
+    """
+    if not isinstance(song_data.get('artist'), str) or not isinstance(song_data.get('title'), str):
+        return None
+    return {'artist': song_data['artist'], 'title': song_data['title'], 'limit': '1', 'min_score': str(FUZZY_MATCH_MIN_SCORE)}
+
+
+def merge_search_results(bodies: List[dict], limit: int) -> List[dict]:
+    """
+    Merge the /search/fuzzy results of every catalogue shard, best score first.
+
+    Args:
+        bodies (List[dict]): The response body of each shard, in shard order.
+        limit (int): Number of results wanted.
+
+    Returns:
+        List[dict]: The best 'limit' tracks of all shards.
+    """
+    tracks = [track for body in bodies for track in body['tracks']]
+    return sorted(tracks, key=lambda track: -track['score'])[:limit]
+
+
+def group_by_shard(tracks: List[dict]) -> Dict[int, List[dict]]:
+    """
+    Group {'artist': ..., 'title': ...} pairs by the catalogue shard that owns them.
+    """
+    groups: Dict[int, List[dict]] = {}
+    for track in tracks:
+        groups.setdefault(shard_of(track['artist'], track['title'], len(DATABASE_URLS)), []).append(track)
+    return groups
+
+
+def bulk_lines(mimetype: str, body: bytes) -> Iterator[Tuple[bytes, object]]:
+    """
+    Read the tracks of a JSON or NDJSON bulk add body as NDJSON lines.
+
+    Args:
+        mimetype (str): Content type of the body.
+        body (bytes): The (decompressed) body.
+
+    Yields:
+        Tuple[bytes, object]: Each track's line and its parsed value, None for lines that are not valid JSON.
+
+    Raises:
+        ValueError: If a JSON body does not hold a list of tracks.
+    """
+    if mimetype == NDJSON:
+        for line in body.split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                yield line, json.loads(line)
+            except ValueError:
+                yield line, None
+        return
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get('tracks'), list):
+        raise ValueError('Tracks must be a JSON list')
+    for track in data['tracks']:
+        yield json.dumps(track).encode('utf-8'), track
+
+
+class ShardedBulk:
+    """
+    A bulk add split into one NDJSON bulk add per catalogue shard, whose results are merged back in request order.
+
+    Each track goes to the shard that owns it, so repeats of a track meet in the same shard's request
+    and are reported there. Tracks whose artist or title cannot be read go to shard 0, to be reported
+    as invalid with the catalogue's own message. Shared by the sync and async gateways.
+    """
+
+    def __init__(self) -> None:
+        self.lines: Dict[int, List[bytes]] = {}
+        # Request index of each line sent to each shard
+        self.indexes: Dict[int, List[int]] = {}
+        self.count = 0
+        self.added = 0
+        self.results: List[dict] = []
+
+    def add(self, line: bytes, track: object) -> None:
+        """
+        Route the next track of the request.
+
+        Args:
+            line (bytes): The track as an NDJSON line.
+            track (object): The parsed line, None if it is not valid JSON.
+        """
+        shard = 0
+        if isinstance(track, dict) and isinstance(track.get('artist'), str) and isinstance(track.get('title'), str):
+            shard = shard_of(track['artist'], track['title'], len(DATABASE_URLS))
+        self.lines.setdefault(shard, []).append(line)
+        self.indexes.setdefault(shard, []).append(self.count)
+        self.count += 1
+
+    def bodies(self) -> List[Tuple[int, bytes]]:
+        """
+        Returns:
+            List[Tuple[int, bytes]]: Each shard with tracks to add and the NDJSON body of its bulk add.
+        """
+        return [(shard, b'\n'.join(lines) + b'\n') for shard, lines in sorted(self.lines.items())]
+
+    def record(self, shard: int, body: dict, status_code: int) -> None:
+        """
+        Record the response of a shard's bulk add.
+
+        Args:
+            shard (int): Index of the shard.
+            body (dict): The response body, or the error every track sent to the shard failed with.
+            status_code (int): The response status.
+        """
+        if status_code != 200:
+            self.results.extend({'index': index, 'status': status_code, **body} for index in self.indexes[shard])
+            return
+        self.added += body['added']
+        for result in body['results']:
+            self.results.append({**result, 'index': self.indexes[shard][result['index']]})
+
+    def body(self) -> dict:
+        return {'message': 'Bulk add processed', 'added': self.added,
+                'results': sorted(self.results, key=lambda result: result['index'])}
+
+
+class UnroutableUpload(ValueError):
+    """
+    Raised for an upload whose owning catalogue shard cannot be found.
+    """
+
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+    def reply(self) -> Reply:
+        return error_reply(str(self), self.status_code)
+
+
+def split_bulk_form(artists: List[str], titles: List[str], songs: List[bytes]) -> ShardedBulk:
+    """
+    Split a multipart bulk add over the catalogue shards (see ShardedBulk).
+
+    Args:
+        artists (List[str]): The 'artist' fields, in request order.
+        titles (List[str]): The 'title' fields.
+        songs (List[bytes]): The audio of the 'song' files.
+
+    Returns:
+        ShardedBulk: The tracks, routed.
+
+    Raises:
+        UnroutableUpload: If the fields do not pair up, or there are no or too many tracks.
+    """
+    if not len(artists) == len(titles) == len(songs):
+        raise UnroutableUpload('Each song needs an artist and a title')
+    bulk = ShardedBulk()
+    for artist, title, song in zip(artists, titles, songs):
+        track = {'artist': artist, 'title': title, 'encoded_song': base64.b64encode(song).decode('ascii')}
+        bulk.add(json.dumps(track).encode('utf-8'), track)
+    return check_bulk_size(bulk)
+
+
+def split_bulk_body(mimetype: str, body: bytes, headers: Mapping[str, str]) -> ShardedBulk:
+    """
+    Split a JSON or NDJSON bulk add, decompressed if need be, over the catalogue shards (see ShardedBulk).
+
+    Args:
+        mimetype (str): Content type of the body.
+        body (bytes): The body as it was sent.
+        headers (Mapping[str, str]): The request's headers.
+
+    Returns:
+        ShardedBulk: The tracks, routed.
+
+    Raises:
+        UnroutableUpload: If the body cannot be decoded or read, or there are no or too many tracks.
+    """
+    bulk = ShardedBulk()
+    try:
+        if is_encoded(headers):
+            body = decompress(body, headers['Content-Encoding'])
+        for line, track in bulk_lines(mimetype, body):
+            bulk.add(line, track)
+    except UnsupportedEncoding as e:
+        raise UnroutableUpload(str(e), 415)
+    except DecompressionLimitExceeded as e:
+        raise UnroutableUpload(str(e), 413)
+    except ValueError as e:
+        raise UnroutableUpload(str(e))
+    return check_bulk_size(bulk)
+
+
+def check_bulk_size(bulk: ShardedBulk) -> ShardedBulk:
+    if bulk.count > MAX_BULK_TRACKS:
+        raise UnroutableUpload(f'At most {MAX_BULK_TRACKS} tracks can be added per request')
+    if not bulk.count:
+        raise UnroutableUpload('No tracks provided')
+    return bulk
+
+
+class ShardedList:
+    """
+    A /catalogue/list request on a sharded catalogue, merging the ordered listings of every shard.
+
+    A page ('limit' given) is merged from the same page of every shard. The full listing is streamed,
+    reading every shard a page at a time. The ETag covers every shard's catalogue version. Each
+    gateway reads the pages this asks for, with its own HTTP client. Shared by the sync and async gateways.
+    """
+
+    def __init__(self, args: Mapping[str, str]) -> None:
+        """
+        Args:
+            args (Mapping[str, str]): The request's query parameters.
+        """
+        self.limit = args.get('limit')
+        cursor = args.get('cursor')
+        self.params = {name: value for name, value in args.items() if name != 'cursor'}
+        if self.limit is None:
+            self.params['limit'] = str(SHARD_PAGE_SIZE)
+        self.listing = ShardedListing(len(DATABASE_URLS), cursor)
+        self.first = [(shard, cursor) for shard in range(len(DATABASE_URLS))]
+        self.pages: List[Tuple[List[dict], Optional[str]]] = []
+        self.etag = ''
+        self.separator = None
+
+    def read_params(self, cursor: Optional[str]) -> dict:
+        """
+        Query parameters of the catalogue /tracks call reading a shard from a cursor.
+        """
+        return {**self.params, **({'cursor': cursor} if cursor else {})}
+
+    def start(self, responses: list) -> Optional[Reply]:
+        """
+        Take the first page read from every shard (the reads in 'first').
+
+        Args:
+            responses (list): Each shard's response, in shard order.
+
+        Returns:
+            Optional[Reply]: The first error of a shard (e.g. an invalid limit or cursor) as it is, None
+                if every shard answered, leaving 'etag' set.
+        """
+        for response in responses:
+            if response.status_code not in (200, 404):
+                return relayed_reply(response)
+        self.etag = combine_etags([response.headers.get('ETag') for response in responses])
+        self.pages = [page_of(response) for response in responses]
+        return None
+
+    def reply(self) -> Optional[Reply]:
+        """
+        Returns:
+            Optional[Reply]: The reply when no shard has tracks or a page was asked for, None for a
+                full listing, whose body is streamed with take() and add_pages().
+        """
+        if not any(tracks for tracks, _ in self.pages):
+            return {'message': 'No tracks found'}, 404, {'ETag': self.etag}
+
+        if self.limit is not None:
+            page, next_cursor = merge_pages(self.pages, int(self.limit))
+            return {'message': 'Tracks listed', 'tracks': page, 'next_cursor': next_cursor}, 200, {'ETag': self.etag}
+
+        for shard, (tracks, next_cursor) in enumerate(self.pages):
+            self.listing.add_page(shard, tracks, next_cursor)
+        return None
+
+    def take(self) -> str:
+        """
+        The next part of the streamed listing: the tracks that can be sent in order from the pages
+        read so far, opening the body the first time and closing it once every shard is exhausted.
+        """
+        text = ''
+        if self.separator is None:
+            text, self.separator = '{"message": "Tracks listed", "tracks": [', ''
+        tracks = self.listing.take()
+        if tracks:
+            text += self.separator + ', '.join(json.dumps(track) for track in tracks)
+            self.separator = ', '
+        if self.listing.done:
+            text += ']}'
+        return text
+
+    def wanted(self) -> List[Tuple[int, Optional[str]]]:
+        """
+        Returns:
+            List[Tuple[int, Optional[str]]]: The shards to read next and their cursors, none once the listing is complete.
+        """
+        return [] if self.listing.done else self.listing.wanted()
+
+    def add_pages(self, wanted: List[Tuple[int, Optional[str]]], responses: list) -> None:
+        """
+        Take the pages read for wanted().
+
+        Raises:
+            RuntimeError: If a shard failed. The status is already sent, so this aborts the stream.
+        """
+        for (shard, _), response in zip(wanted, responses):
+            if response.status_code not in (200, 404):
+                raise RuntimeError(f'{catalogue_name(shard)} failed with status {response.status_code}')
+            self.listing.add_page(shard, *page_of(response))
+
+
+def page_of(response) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns:
+        Tuple[List[dict], Optional[str]]: The tracks and 'next_cursor' of a shard's page, none for a 404.
+    """
+    if response.status_code == 404:
+        return [], None
+    body = response.json()
+    return body['tracks'], body['next_cursor']
+
+
+class BatchResults:
+    """
+    Turns the NDJSON stream of an identification batch into per-fragment catalogue results.
+
+    Lines are parsed as the stream arrives. The tracks matched by the lines read together are
+    resolved with one multi-key catalogue lookup, and tracks already resolved for this batch are
+    not looked up again, so a batch costs one catalogue call per burst of completed fragments
+    rather than one per fragment. Shared by the sync and async gateways.
+    """
+
+    def __init__(self) -> None:
+        self.pending = b''
+        # Catalogue result of each track resolved so far, None for tracks not in the catalogue
+        self.tracks: Dict[Tuple[str, str], Optional[dict]] = {}
+
+    def feed(self, chunk: bytes) -> List[dict]:
+        """
+        Parse the complete lines of the next chunk of the identification stream.
+
+        Args:
+            chunk (bytes): The next chunk, b'' once the stream has ended.
+
+        Returns:
+            List[dict]: The fragment results completed by this chunk.
+        """
+        self.pending += chunk
+        if chunk:
+            complete, _, self.pending = self.pending.rpartition(b'\n')
+        else:
+            complete, self.pending = self.pending, b''
+        return [json.loads(line) for line in complete.split(b'\n') if line.strip()]
+
+    def unresolved(self, results: List[dict]) -> List[dict]:
+        """
+        List the matched tracks that still need a catalogue lookup.
+
+        Args:
+            results (List[dict]): Fragment results returned by feed().
+
+        Returns:
+            List[dict]: Unique {'artist': ..., 'title': ...} pairs, in the catalogue's /search/batch format.
+        """
+        keys = dict.fromkeys((result.get('artist'), result.get('title')) for result in results
+                             if result.get('status') == 200)
+        return [{'artist': artist, 'title': title} for artist, title in keys
+                if (artist, title) not in self.tracks]
+
+    def resolve(self, requested: List[dict], found: List[dict]) -> None:
+        """
+        Record the outcome of a catalogue /search/batch lookup.
+
+        Args:
+            requested (List[dict]): The tracks that were looked up.
+            found (List[dict]): The 'tracks' of the catalogue's response.
+        """
+        for track in requested:
+            self.tracks[(track['artist'], track['title'])] = None
+        for track in found:
+            self.tracks[(track['artist'], track['title'])] = {'message': 'Track found', **track}
+
+    def lookup_failure(self, responses: list) -> Optional[Tuple[dict, int]]:
+        """
+        Check the catalogue's responses to the /search/batch lookups of the tracks in unresolved().
+
+        Args:
+            responses (list): The response of each shard looked up.
+
+        Returns:
+            Optional[Tuple[dict, int]]: Error body and status for the results, None if every lookup succeeded.
+        """
+        for response in responses:
+            if response.status_code != 200:
+                return {'error': 'Catalogue lookup failed', 'message': response.json()}, response.status_code
+        return None
+
+    def render(self, results: List[dict], failure: Optional[Tuple[dict, int]] = None) -> bytes:
+        """
+        Encode the gateway's NDJSON lines for a list of fragment results.
+
+        Args:
+            results (List[dict]): Fragment results returned by feed().
+            failure (Optional[Tuple[dict, int]]): Error body and status for matched fragments whose
+                catalogue lookup failed.
+
+        Returns:
+            bytes: One line per fragment, carrying its 'index' and 'status'.
+        """
+        lines = []
+        for result in results:
+            index, status_code = result.pop('index', None), result.pop('status', None)
+            if status_code != 200:
+                body = {'error': 'Failed to identify music', 'message': result}
+            elif failure is not None:
+                body, status_code = failure
+            else:
+                body = self.tracks.get((result.get('artist'), result.get('title')))
+                if body is None:
+                    body, status_code = {'error': 'Track not found in catalogue'}, 404
+            lines.append(json.dumps({'index': index, 'status': status_code, **body}).encode('utf-8') + b'\n')
+        return b''.join(lines)
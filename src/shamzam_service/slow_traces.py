@@ -0,0 +1,85 @@
+import argparse
+import json
+from typing import Dict, List
+
+
+def load_traces(path: str) -> Dict[str, List[dict]]:
+    """
+    Read a span file written with TRACE_FILE and group its spans by trace.
+
+    Several services may append to the same file; lines that are not valid JSON (e.g. cut short by a crash) are skipped.
+
+    Args:
+        path (str): The JSON-lines span file.
+
+    Returns:
+        Dict[str, List[dict]]: Spans of each trace id, in file order.
+    """
+    traces: Dict[str, List[dict]] = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            traces.setdefault(span['trace_id'], []).append(span)
+    return traces
+
+
+def render_trace(spans: List[dict]) -> List[str]:
+    """
+    Render the spans of one trace as an indented tree, each span under the span that caused it.
+
+    Args:
+        spans (List[dict]): Spans of the trace.
+
+    Returns:
+        List[str]: One line per span, with its offset from the start of the trace and its duration.
+    """
+    children: Dict[str, List[dict]] = {}
+    span_ids = {span['span_id'] for span in spans}
+    roots = []
+    for span in spans:
+        if span['parent_id'] in span_ids:
+            children.setdefault(span['parent_id'], []).append(span)
+        else:
+            roots.append(span)
+    started = min(span['start'] for span in spans)
+
+    lines = []
+
+    def visit(span: dict, depth: int) -> None:
+        attributes = ' '.join(f'{key}={value}' for key, value in span.get('attributes', {}).items())
+        lines.append(f"{(span['start'] - started) * 1000:9.1f} ms {span['duration_ms']:9.1f} ms  "
+                     f"{'  ' * depth}{span['service']}: {span['name']} {attributes}".rstrip())
+        for child in sorted(children.get(span['span_id'], []), key=lambda child: child['start']):
+            visit(child, depth + 1)
+
+    for root in sorted(roots, key=lambda root: root['start']):
+        visit(root, 0)
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Show the slowest requests recorded in a span file.')
+    parser.add_argument('path', help='Span file the services were started with as TRACE_FILE')
+    parser.add_argument('--top', type=int, default=10, help='Number of requests to show')
+    parser.add_argument('--route', help="Only requests to this route of the entry service, e.g. 'POST /music/identify'")
+    args = parser.parse_args()
+
+    # A request is as slow as the span that started its trace, the one without a parent
+    requests = []
+    for spans in load_traces(args.path).values():
+        entry = next((span for span in spans if span['parent_id'] is None), None)
+        if entry is not None and (args.route is None or entry['name'] == args.route):
+            requests.append((entry['duration_ms'], entry, spans))
+
+    for _, entry, spans in sorted(requests, key=lambda request: request[0], reverse=True)[:args.top]:
+        print(f"{entry['trace_id']}  {entry['name']}  {entry['duration_ms']:.1f} ms")
+        for line in render_trace(spans):
+            print(f'  {line}')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import unittest
+import io
+import os
+import random
+import sys
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.audio_codec import compress_audio, decompress_audio, decompress_range
+
+TRACK_FOLDER = os.path.join(os.path.dirname(__file__), '../music/tracks')
+
+
+def synthetic_wav(width: int, channels: int, frames: int, trailer: bytes = b'') -> bytes:
+    """Build a noisy tone as an integer PCM WAV file, followed by any trailing chunks."""
+    rng = np.random.default_rng(width * channels)
+    tone = np.sin(np.arange(frames) / 20) * 0.5 + rng.normal(0, 0.05, frames)
+    values = (tone * (2 ** (8 * width - 1) - 1)).astype(np.int64)
+    values = np.stack([values + channel for channel in range(channels)], axis=1).ravel()
+    if width == 1:
+        pcm = (values + 128).astype(np.uint8).tobytes()
+    elif width == 3:
+        values &= 0xFFFFFF
+        pcm = np.stack([values & 0xFF, (values >> 8) & 0xFF, values >> 16], axis=1).astype(np.uint8).tobytes()
+    else:
+        pcm = values.astype(f'<i{width}').tobytes()
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(width)
+        wav_file.setframerate(8000)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue() + trailer
+
+
+class TestAudioCodec(unittest.TestCase):
+    """Tests for the lossless audio compression the catalogue stores tracks with."""
+
+    """Happy paths for the audio codec."""
+    def test_sample_tracks_round_trip(self):
+        for file_name in sorted(os.listdir(TRACK_FOLDER)):
+            with open(os.path.join(TRACK_FOLDER, file_name), 'rb') as audio_file:
+                song = audio_file.read()
+            compressed = compress_audio(song)
+            self.assertLess(len(compressed), len(song) * 0.85, file_name)
+            self.assertEqual(decompress_audio(compressed), song, file_name)
+
+    def test_every_sample_format_round_trips(self):
+        for width in (1, 2, 3, 4):
+            for channels in (1, 2):
+                song = synthetic_wav(width, channels, 50001, trailer=b'LIST\x04\x00\x00\x00abcd')
+                compressed = compress_audio(song)
+                self.assertIsNotNone(compressed, (width, channels))
+                self.assertEqual(decompress_audio(compressed), song, (width, channels))
+
+    def test_ranges_decode_only_their_bytes(self):
+        song = synthetic_wav(2, 2, 200000, trailer=b'LIST\x04\x00\x00\x00abcd')
+        compressed = compress_audio(song)
+        reads = []
+
+        def read(offset, length):
+            reads.append(length)
+            return compressed[offset:offset + length]
+
+        rng = random.Random(0)
+        for _ in range(100):
+            start = rng.randrange(len(song))
+            stop = rng.randrange(start, len(song) + 10)
+            self.assertEqual(b''.join(decompress_range(read, start, stop)), song[start:stop], (start, stop))
+
+        # A short range near the end reads a block, not the whole file
+        reads.clear()
+        self.assertEqual(b''.join(decompress_range(read, len(song) - 100, len(song))), song[-100:])
+        self.assertLess(sum(reads), len(compressed) // 4)
+
+    """Unhappy paths for the audio codec."""
+    def test_unsupported_audio_is_not_compressed(self):
+        self.assertIsNone(compress_audio(b'not a wav file'))
+        # White noise does not compress, so it is stored as it is
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(8000)
+            wav_file.writeframes(np.random.default_rng(0).integers(-32768, 32767, 10000).astype('<i2').tobytes())
+        self.assertIsNone(compress_audio(buffer.getvalue()))
+
+    def test_corrupt_file_is_rejected(self):
+        with self.assertRaises(ValueError):
+            decompress_audio(b'RIFF' + bytes(64))
+
+
+if __name__ == '__main__':
+    unittest.main()
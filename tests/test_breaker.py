@@ -0,0 +1,83 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.breaker import CircuitBreaker, CircuitOpen
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the per-backend circuit breaker."""
+
+    def open_breaker(self, breaker: CircuitBreaker) -> None:
+        for _ in range(breaker.min_calls):
+            breaker.before_call()
+            breaker.record(False, 0.01)
+
+    """Happy paths for the circuit breaker."""
+    def test_stays_closed_below_failure_rate(self):
+        breaker = CircuitBreaker('catalogue', failure_rate=0.5, window_size=10, min_calls=4)
+        for success in (True, False, True, True, False, True):
+            breaker.before_call()
+            breaker.record(success, 0.01)
+        self.assertEqual(breaker.snapshot()['state'], CircuitBreaker.CLOSED)
+
+    def test_probe_half_opens_and_good_trials_close(self):
+        breaker = CircuitBreaker('catalogue', min_calls=4, half_open_calls=2)
+        self.open_breaker(breaker)
+        breaker.probe_succeeded()
+        self.assertEqual(breaker.snapshot()['state'], CircuitBreaker.HALF_OPEN)
+
+        for _ in range(2):
+            trial = breaker.before_call()
+            self.assertTrue(trial)
+            breaker.record(True, 0.01, trial)
+        self.assertEqual(breaker.snapshot()['state'], CircuitBreaker.CLOSED)
+
+    """Unhappy paths for the circuit breaker."""
+    def test_opens_at_failure_rate(self):
+        """Unhappy path: Most recent calls failed."""
+        breaker = CircuitBreaker('catalogue', min_calls=4)
+        started_probe = [breaker.record(False, 0.01) for _ in range(4)]
+        # Only the call that opened the breaker starts the background probe
+        self.assertEqual(started_probe, [False, False, False, True])
+        with self.assertRaises(CircuitOpen) as context:
+            breaker.before_call()
+        self.assertEqual(context.exception.name, 'catalogue')
+        self.assertGreater(context.exception.retry_after, 0)
+        self.assertEqual(breaker.snapshot()['rejected'], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        """Unhappy path: The backend answers, but too slowly."""
+        breaker = CircuitBreaker('catalogue', slow_call_seconds=1, min_calls=4)
+        for _ in range(4):
+            breaker.record(True, 2.0)
+        self.assertEqual(breaker.snapshot()['state'], CircuitBreaker.OPEN)
+        self.assertEqual(breaker.snapshot()['slow_calls'], 4)
+
+    def test_failed_trial_reopens(self):
+        """Unhappy path: The backend fails again while half-open."""
+        breaker = CircuitBreaker('catalogue', min_calls=4, half_open_calls=2)
+        self.open_breaker(breaker)
+        breaker.probe_succeeded()
+
+        trial = breaker.before_call()
+        self.assertTrue(breaker.record(False, 0.01, trial))
+        self.assertEqual(breaker.snapshot()['state'], CircuitBreaker.OPEN)
+
+    def test_half_open_limits_trials(self):
+        """Unhappy path: More calls arrive than there are trial slots."""
+        breaker = CircuitBreaker('catalogue', min_calls=4, half_open_calls=1)
+        self.open_breaker(breaker)
+        breaker.probe_succeeded()
+
+        trial = breaker.before_call()
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        # A trial that was never made frees its slot
+        breaker.release(trial)
+        self.assertTrue(breaker.before_call())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    """Tests for the identification result cache."""
+
+    """Happy paths for the result cache."""
+    def test_hit_after_put(self):
+        cache = ResultCache(4)
+        cache.put('fragment', [{'artist': 'The Weeknd', 'title': 'Blinding Lights'}, 200], ttl=60)
+        self.assertEqual(cache.get('fragment'), [{'artist': 'The Weeknd', 'title': 'Blinding Lights'}, 200])
+        self.assertEqual(cache.snapshot()['hits'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResultCache(2)
+        cache.put('a', 1, ttl=60)
+        cache.put('b', 2, ttl=60)
+        cache.get('a') # 'b' is now the least recently used
+        cache.put('c', 3, ttl=60)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.snapshot()['evictions'], 1)
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'cache.db')
+            ResultCache(4, database).put('fragment', [{'error': 'no match'}, 404], ttl=60)
+
+            restarted = ResultCache(4, database)
+            self.assertEqual(restarted.get('fragment'), [{'error': 'no match'}, 404])
+            self.assertEqual(restarted.snapshot()['disk_hits'], 1)
+            restarted.db.close()
+
+    """Unhappy paths for the result cache."""
+    def test_miss(self):
+        """Unhappy path: Key was never cached."""
+        cache = ResultCache(4)
+        self.assertIsNone(cache.get('fragment'))
+        self.assertEqual(cache.snapshot()['misses'], 1)
+
+    def test_expired_entry(self):
+        """Unhappy path: Entry has outlived its TTL."""
+        cache = ResultCache(4)
+        cache.put('fragment', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('fragment'))
+        self.assertEqual(cache.snapshot()['expirations'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main(debug=True)
@@ -0,0 +1,250 @@
+import unittest
+import base64
+import importlib.util
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+
+CATALOGUE_APP = os.path.join(os.path.dirname(__file__), '../src/catalogue_managment_service/app.py')
+REBUILD_FINGERPRINTS = os.path.join(os.path.dirname(__file__), '../src/catalogue_managment_service/rebuild_fingerprints.py')
+COMPRESS_SONGS = os.path.join(os.path.dirname(__file__), '../src/catalogue_managment_service/compress_songs.py')
+RESHARD = os.path.join(os.path.dirname(__file__), '../src/catalogue_managment_service/reshard.py')
+TRACK_PATH = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
+
+# Schema of a catalogue from before the audio was split from the metadata
+OLD_SCHEMA = """
+CREATE TABLE tracks (artist TEXT NOT NULL, title TEXT NOT NULL, song BLOB NOT NULL, PRIMARY KEY (artist, title));
+CREATE TABLE fingerprints (hash INTEGER NOT NULL, track_id INTEGER NOT NULL, track_offset INTEGER NOT NULL,
+                           PRIMARY KEY (hash, track_id, track_offset)) WITHOUT ROWID;
+CREATE TABLE catalogue_version (id INTEGER PRIMARY KEY CHECK (id = 0), epoch TEXT NOT NULL, version INTEGER NOT NULL);
+INSERT INTO catalogue_version (id, epoch, version) VALUES (0, 'old', 2);
+"""
+
+
+def load_catalogue(database: str):
+    """Import the catalogue service on a database, under its own module name as the gateway is 'app', and initialise it."""
+    os.environ['CATALOGUE_DATABASE'] = database
+    spec = importlib.util.spec_from_file_location('catalogue_app', CATALOGUE_APP)
+    catalogue = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(catalogue)
+    catalogue.create_tables()
+    return catalogue
+
+
+class TestCatalogueSchema(unittest.TestCase):
+    """Tests for the catalogue's split of track metadata from audio, and the migration of older databases."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(TRACK_PATH, 'rb') as file:
+            self.song = file.read()
+
+        # A catalogue of the old format, the second track fingerprinted
+        self.database = os.path.join(self.directory.name, 'catalogue.db')
+        db = sqlite3.connect(self.database)
+        db.executescript(OLD_SCHEMA)
+        db.execute("INSERT INTO tracks (artist, title, song) VALUES ('Oasis', 'Wonderwall', x'00')")
+        db.execute("INSERT INTO tracks (artist, title, song) VALUES ('The Weeknd', 'Blinding Lights', ?)", (self.song,))
+        db.execute('INSERT INTO fingerprints (hash, track_id, track_offset) VALUES (42, 2, 7)')
+        db.commit()
+        db.close()
+        self.catalogue = load_catalogue(self.database)
+
+    def tearDown(self):
+        self.catalogue.pool.close_all()
+        self.directory.cleanup()
+
+    """Happy paths for the catalogue schema."""
+    def test_migration_moves_audio(self):
+        db = self.catalogue.pool.connect()
+        columns = [column['name'] for column in db.execute('PRAGMA table_info(tracks)')]
+        self.assertNotIn('song', columns)
+        self.assertEqual(db.execute('SELECT song FROM songs WHERE track_id = 2').fetchone()['song'], self.song)
+
+        # Ids are the old rowids, so the fingerprints still point at their track
+        track = db.execute('SELECT tracks.* FROM fingerprints JOIN tracks ON tracks.id = fingerprints.track_id').fetchone()
+        self.assertEqual((track['title'], track['size'], track['sample_rate'], track['channels']),
+                         ('Blinding Lights', len(self.song), 48000, 1))
+        self.assertAlmostEqual(track['duration'], 8.9, delta=0.1)
+        # Listings changed, so cached ones are stale
+        self.assertEqual(db.execute('SELECT version FROM catalogue_version').fetchone()['version'], 3)
+        db.close()
+
+        # Migrating again does nothing
+        self.catalogue.create_tables()
+        client = self.catalogue.app.test_client()
+        response = client.get('/download', query_string={'artist': 'The Weeknd', 'title': 'Blinding Lights'})
+        self.assertEqual(response.data, self.song)
+        self.assertEqual(client.get('/search/fuzzy', query_string={'q': 'wonderwall'}).get_json()['tracks'][0]['size'], 1)
+
+    def test_listing_reads_covering_index(self):
+        response = self.catalogue.app.test_client().get('/tracks', query_string={'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['tracks'][0],
+                         {'artist': 'Oasis', 'title': 'Wonderwall', 'size': 1, 'duration': None, 'sample_rate': None, 'channels': None})
+
+        db = self.catalogue.pool.connect()
+        plan = ' '.join(row['detail'] for row in db.execute(
+            f"EXPLAIN QUERY PLAN SELECT {', '.join(self.catalogue.METADATA_COLUMNS)} FROM tracks ORDER BY artist, title"))
+        db.close()
+        self.assertIn('COVERING INDEX tracks_listing', plan)
+
+    def test_add_and_delete(self):
+        client = self.catalogue.app.test_client()
+        response = client.post('/add', data=self.song, content_type='application/octet-stream',
+                               headers={'X-Artist': 'Dua Lipa', 'X-Title': 'Levitating'})
+        self.assertEqual(response.status_code, 201)
+        track = client.post('/search', json={'artist': 'Dua Lipa', 'title': 'Levitating'}).get_json()
+        self.assertEqual((track['size'], track['sample_rate']), (len(self.song), 48000))
+
+        response = client.delete('/delete', query_string={'artist': 'Dua Lipa', 'title': 'Levitating'})
+        self.assertEqual(response.status_code, 200)
+        db = self.catalogue.pool.connect()
+        self.assertEqual(db.execute('SELECT count(*) FROM songs').fetchone()[0], 2)
+        db.close()
+
+    def test_audio_stored_compressed(self):
+        client = self.catalogue.app.test_client()
+        response = client.post('/add', data=self.song, content_type='application/octet-stream',
+                               headers={'X-Artist': 'Dua Lipa', 'X-Title': 'Levitating'})
+        self.assertEqual(response.status_code, 201)
+        db = self.catalogue.pool.connect()
+        stored = db.execute("SELECT songs.* FROM songs JOIN tracks ON tracks.id = songs.track_id WHERE title = 'Levitating'").fetchone()
+        # Migrated audio stays as it was stored
+        migrated = db.execute('SELECT encoding FROM songs WHERE track_id = 2').fetchone()
+        db.close()
+        self.assertEqual((stored['encoding'], migrated['encoding']), ('zpcm', 'raw'))
+        self.assertLess(len(stored['song']), len(self.song) * 0.8)
+
+        # It is decoded as it is read, whole or by range
+        query = {'artist': 'Dua Lipa', 'title': 'Levitating'}
+        self.assertEqual(client.get('/download', query_string=query).data, self.song)
+        response = client.get('/download', query_string=query, headers={'Range': 'bytes=300000-300099'})
+        self.assertEqual((response.status_code, response.data), (206, self.song[300000:300100]))
+        response = client.post('/search', json=query, query_string={'include_song': 'true'})
+        self.assertEqual(base64.b64decode(response.get_json()['encoded_song']), self.song)
+
+    def run_tool(self, tool: str, *args: str) -> subprocess.CompletedProcess:
+        """Run one of the catalogue's tools from an empty folder, where the default database would be created."""
+        self.tool_folder = os.path.join(self.directory.name, 'tool')
+        os.makedirs(self.tool_folder, exist_ok=True)
+        return subprocess.run([sys.executable, os.path.abspath(tool), *args], cwd=self.tool_folder,
+                              env={key: value for key, value in os.environ.items() if key != 'CATALOGUE_DATABASE'},
+                              capture_output=True, text=True, timeout=120)
+
+    def test_tool_opens_only_its_database(self):
+        result = self.run_tool(REBUILD_FINGERPRINTS, '--database', self.database)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Fingerprinted 2 tracks', result.stdout)
+        self.assertEqual(os.listdir(self.tool_folder), [])
+
+    def test_compress_songs_opens_only_its_database(self):
+        result = self.run_tool(COMPRESS_SONGS, '--database', self.database)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Compressed 1 tracks', result.stdout)
+        self.assertEqual(os.listdir(self.tool_folder), [])
+        # The audio that is not a WAV file is left as it was
+        db = self.catalogue.pool.connect()
+        self.assertEqual([row['encoding'] for row in db.execute('SELECT encoding FROM songs ORDER BY track_id')], ['raw', 'zpcm'])
+        db.close()
+
+    def test_reshard_leaves_sources_alone(self):
+        with open(self.database, 'rb') as file:
+            source = file.read()
+        targets = [os.path.join(self.directory.name, f'new{shard}.db') for shard in range(2)]
+        result = self.run_tool(RESHARD, '--source', self.database, '--target', *targets)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('2 tracks', result.stdout)
+        with open(self.database, 'rb') as file:
+            self.assertEqual(file.read(), source)
+        self.assertEqual(os.listdir(self.tool_folder), [])
+
+        # Every track, with its audio and fingerprints, is in the shard that owns it
+        copied = {}
+        for target in targets:
+            db = sqlite3.connect(target)
+            copied.update({row[0]: row[1:] for row in db.execute(
+                'SELECT title, length(song), (SELECT count(*) FROM fingerprints WHERE track_id = tracks.id) '
+                'FROM tracks JOIN songs ON songs.track_id = tracks.id')})
+            db.close()
+        self.assertEqual(copied, {'Wonderwall': (1, 0), 'Blinding Lights': (len(self.song), 1)})
+
+    def test_reshard_dry_run_writes_nothing(self):
+        # A source from before the audio was split from the metadata can be counted as it is
+        database = os.path.join(self.directory.name, 'old.db')
+        db = sqlite3.connect(database)
+        db.executescript(OLD_SCHEMA)
+        db.execute("INSERT INTO tracks (artist, title, song) VALUES ('Oasis', 'Wonderwall', x'00')")
+        db.commit()
+        db.close()
+        with open(database, 'rb') as file:
+            source = file.read()
+
+        result = self.run_tool(RESHARD, '--source', database, '--target', 'new0.db', 'new1.db', '--dry-run')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('1 tracks', result.stdout)
+        with open(database, 'rb') as file:
+            self.assertEqual(file.read(), source)
+        self.assertEqual(os.listdir(self.tool_folder), [])
+        self.assertNotIn('old.db.lock', os.listdir(self.directory.name))
+
+    """Unhappy paths for the catalogue schema."""
+    def test_migration_is_atomic(self):
+        """Unhappy path: A migration that fails part way leaves the old tables untouched."""
+        database = os.path.join(self.directory.name, 'broken.db')
+        db = sqlite3.connect(database)
+        db.executescript(OLD_SCHEMA)
+        db.execute("INSERT INTO tracks (artist, title, song) VALUES ('Oasis', 'Wonderwall', x'00')")
+        # Taken by the migration for its temporary table
+        db.execute('CREATE TABLE tracks_migrated (id INTEGER)')
+        db.commit()
+        db.close()
+
+        with self.assertRaises(sqlite3.OperationalError):
+            load_catalogue(database)
+        db = sqlite3.connect(database)
+        self.assertEqual(db.execute('SELECT song FROM tracks').fetchone()[0], b'\x00')
+        db.close()
+
+    def test_reshard_needs_migrated_sources(self):
+        """Unhappy path: Tracks are not copied from a source from an older version, which is left to the catalogue service to migrate."""
+        database = os.path.join(self.directory.name, 'old.db')
+        db = sqlite3.connect(database)
+        db.executescript(OLD_SCHEMA)
+        db.commit()
+        db.close()
+        target = os.path.join(self.directory.name, 'new0.db')
+        result = self.run_tool(RESHARD, '--source', database, '--target', target)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('migrate it first', result.stderr)
+        db = sqlite3.connect(database)
+        self.assertEqual(db.execute('SELECT version FROM catalogue_version').fetchone()[0], 2)
+        db.close()
+
+    def test_add_raced_by_duplicate(self):
+        """Unhappy path: The same track is added by another request while this one is fingerprinting it."""
+        compute_fingerprints = self.catalogue.compute_fingerprints
+
+        def add_meanwhile(song):
+            self.catalogue.compute_fingerprints = compute_fingerprints
+            other = self.catalogue.pool.connect()
+            self.assertEqual(self.catalogue.store_track(other, 'Dua Lipa', 'Levitating', song)[1], 201)
+            other.commit()
+            other.close()
+            return compute_fingerprints(song)
+
+        self.catalogue.compute_fingerprints = add_meanwhile
+        response = self.catalogue.app.test_client().post('/add', data=self.song, content_type='application/octet-stream',
+                                                         headers={'X-Artist': 'Dua Lipa', 'X-Title': 'Levitating'})
+        self.assertEqual(response.status_code, 409)
+        db = self.catalogue.pool.connect()
+        self.assertEqual(db.execute("SELECT count(*) FROM tracks WHERE title = 'Levitating'").fetchone()[0], 1)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import gzip
+import json
+import os
+import sys
+import zlib
+
+from flask import Flask, Response, jsonify, request
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common import compression
+from common.compression import (DecompressionLimitExceeded, Decompressor, UnsupportedEncoding, compress, compress_app, decompress, etag_matches,
+                                identity_etag, negotiate)
+
+# A JSON body large enough to be compressed
+TRACK = {'artist': 'The Weeknd', 'title': 'Blinding Lights', 'encoded_song': 'UklGRiQAAABXQVZF' * 1000}
+
+
+class TestCompression(unittest.TestCase):
+    """Tests for compressed request and response bodies."""
+
+    def make_app(self) -> Flask:
+        app = Flask(__name__)
+        compress_app(app)
+
+        @app.route('/search')
+        def search():
+            return jsonify(TRACK)
+
+        @app.route('/small')
+        def small():
+            return jsonify({'message': 'Track found'})
+
+        @app.route('/tracks')
+        def tracks():
+            return Response((json.dumps({'index': index}) + '\n' for index in range(3)), mimetype='application/x-ndjson')
+
+        @app.route('/versioned')
+        def versioned():
+            etag = '"7"'
+            if etag_matches(request.if_none_match, etag):
+                return Response(status=304, headers={'ETag': etag})
+            return jsonify(TRACK), 200, {'ETag': etag}
+
+        @app.route('/add', methods=['POST'])
+        def add():
+            return jsonify({'size': len(request.json['encoded_song'])}), 201
+
+        return app
+
+    """Happy paths for compression."""
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate('deflate, *;q=0.5'), compression.ENCODINGS[0])
+        self.assertIsNone(negotiate('gzip;q=0, identity'))
+        self.assertIsNone(negotiate(None))
+
+    def test_round_trip(self):
+        data = json.dumps(TRACK).encode('utf-8')
+        for encoding in compression.ENCODINGS:
+            compressed = compress(data, encoding)
+            self.assertLess(len(compressed), len(data))
+            if encoding != 'br' or compression.BROTLI_BOUNDED:
+                self.assertEqual(decompress(compressed, encoding), data)
+
+    @unittest.skipUnless(compression.zstandard is not None, 'zstandard is not installed')
+    def test_zstd_preferred(self):
+        self.assertEqual(negotiate('gzip, br, zstd'), 'zstd')
+
+    @unittest.skipUnless(compression.brotli is not None, 'brotli is not installed')
+    def test_brotli_negotiated(self):
+        self.assertEqual(negotiate('gzip;q=0.5, br'), 'br')
+
+    def test_response_is_compressed(self):
+        response = self.make_app().test_client().get('/search', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.data)), TRACK)
+
+    def test_streamed_response_is_compressed(self):
+        response = self.make_app().test_client().get('/tracks', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['index'] for line in lines], [0, 1, 2])
+
+    def test_uncompressed_without_accept_encoding(self):
+        client = self.make_app().test_client()
+        for path, headers in (('/search', {}), ('/small', {'Accept-Encoding': 'gzip'})):
+            response = client.get(path, headers=headers)
+            self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data), {'message': 'Track found'})
+
+    def test_compressed_response_etag(self):
+        client = self.make_app().test_client()
+        # Each coding is a representation of its own, with its own validator
+        self.assertEqual(client.get('/versioned').headers['ETag'], '"7"')
+        response = client.get('/versioned', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['ETag'], '"7-gzip"')
+        self.assertEqual(identity_etag(response.headers['ETag']), '"7"')
+
+        # Either is current, and the 304 names the one the client has
+        for etag in ('"7"', '"7-gzip"'):
+            response = client.get('/versioned', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual((response.status_code, response.headers['ETag']), (304, etag))
+        response = client.get('/versioned', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"6-gzip"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_compressed_request_body(self):
+        response = self.make_app().test_client().post('/add', data=gzip.compress(json.dumps(TRACK).encode('utf-8')),
+                                                      headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['size'], len(TRACK['encoded_song']))
+
+    """Unhappy paths for compression."""
+    def test_decompression_bomb(self):
+        """Unhappy path: A small body that decompresses to more than the limit."""
+        bomb = compress(b'\0' * 1024 * 1024, 'gzip')
+        with self.assertRaises(DecompressionLimitExceeded):
+            Decompressor('gzip', limit=1024).decompress(bomb)
+
+    def test_decompression_bomb_request(self):
+        """Unhappy path: A request body that decompresses to more than MAX_DECOMPRESSED_SIZE."""
+        limit = compression.MAX_DECOMPRESSED_SIZE
+        compression.MAX_DECOMPRESSED_SIZE = 1024
+        try:
+            response = self.make_app().test_client().post('/add', data=compress(b' ' * 1024 * 1024, 'gzip'),
+                                                          headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        finally:
+            compression.MAX_DECOMPRESSED_SIZE = limit
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('too large', response.json['error'])
+
+    @unittest.skipUnless(compression.zstandard is not None, 'zstandard is not installed')
+    def test_zstd_decompression_bomb(self):
+        """Unhappy path: A zstd body that decompresses to more than the limit."""
+        self.check_bomb('zstd')
+
+    @unittest.skipUnless(compression.BROTLI_BOUNDED, 'brotli >= 1.2 is not installed')
+    def test_brotli_decompression_bomb(self):
+        """Unhappy path: A brotli body that decompresses to more than the limit."""
+        self.check_bomb('br')
+
+    def check_bomb(self, encoding):
+        bomb = compress(b'\0' * 64 * 1024 * 1024, encoding)
+        with self.assertRaises(DecompressionLimitExceeded):
+            Decompressor(encoding, limit=1024).decompress(bomb)
+
+        limit = compression.MAX_DECOMPRESSED_SIZE
+        compression.MAX_DECOMPRESSED_SIZE = 1024
+        try:
+            response = self.make_app().test_client().post('/add', data=compress(b' ' * 1024 * 1024, encoding),
+                                                          headers={'Content-Type': 'application/json', 'Content-Encoding': encoding})
+        finally:
+            compression.MAX_DECOMPRESSED_SIZE = limit
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('too large', response.json['error'])
+
+    def test_invalid_request_body(self):
+        """Unhappy path: A request body that is not valid in the coding it claims."""
+        response = self.make_app().test_client().post('/add', data=b'not gzip',
+                                                      headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['error'], 'Request body is not valid gzip')
+
+    def test_unsupported_request_encoding(self):
+        """Unhappy path: A request body in a coding the service cannot decode."""
+        response = self.make_app().test_client().post('/add', data=zlib.compress(b'{}'),
+                                                      headers={'Content-Type': 'application/json', 'Content-Encoding': 'compress'})
+        self.assertEqual(response.status_code, 415)
+        with self.assertRaises(UnsupportedEncoding):
+            Decompressor('compress')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.audio import MAX_HEADER_SIZE, IncompleteWav, WavError, WavStream, decode_wav, parse_wav_header, wav_properties
+from common.fingerprint import FingerprintIndex, fingerprint_samples, fingerprint_wav
+
+TRACK_FOLDER = os.path.join(os.path.dirname(__file__), '../music/tracks')
+FRAGMENT_FOLDER = os.path.join(os.path.dirname(__file__), '../music/fragments')
+
+
+def read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as audio_file:
+        return audio_file.read()
+
+
+class TestFingerprintEngine(unittest.TestCase):
+    """Tests for the local fingerprint engine used by the music identification service."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Index every track in the music folder once."""
+        tracks = {}
+        cls.names = {}
+        for track_id, file_name in enumerate(sorted(os.listdir(TRACK_FOLDER))):
+            tracks[track_id] = fingerprint_wav(read_file(os.path.join(TRACK_FOLDER, file_name)))
+            cls.names[track_id] = os.path.splitext(file_name)[0]
+        cls.index = FingerprintIndex.from_tracks(tracks)
+
+    """Happy paths for the fingerprint engine."""
+    def test_match_fragment(self):
+        hashes = fingerprint_wav(read_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav')))
+        match = self.index.match(hashes)
+        self.assertIsNotNone(match)
+        self.assertEqual(self.names[match[0]], 'Blinding Lights')
+
+    def test_match_track_to_itself(self):
+        for track_id, name in self.names.items():
+            hashes = fingerprint_wav(read_file(os.path.join(TRACK_FOLDER, f'{name}.wav')))
+            match = self.index.match(hashes)
+            self.assertEqual(match[0], track_id)
+            self.assertEqual(match[2], 0) # Whole track lines up at offset zero
+
+    def test_decode_extensible_wav(self):
+        samples, sample_rate = decode_wav(read_file(os.path.join(FRAGMENT_FOLDER, '~Davos.wav')))
+        self.assertEqual(sample_rate, 48000)
+        self.assertGreater(len(samples), 0)
+
+    def test_stream_decodes_like_whole_file(self):
+        fragment = read_file(os.path.join(FRAGMENT_FOLDER, '~Davos.wav'))
+        stream = WavStream()
+        for start in range(0, len(fragment), 1001):
+            stream.feed(fragment[start:start + 1001])
+        samples, sample_rate = decode_wav(fragment)
+        self.assertTrue(stream.done)
+        self.assertEqual(stream.samples().tolist(), samples.tolist())
+        self.assertEqual(stream.wav(), fragment)
+
+    def test_stream_prefix_matches(self):
+        fragment = read_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        stream = WavStream()
+        stream.feed(fragment[:len(fragment) // 3])
+        self.assertFalse(stream.done)
+        self.assertGreater(stream.seconds, 1)
+        match = self.index.match(fingerprint_samples(stream.samples(), stream.fmt['sample_rate']))
+        self.assertEqual(self.names[match[0]], 'Blinding Lights')
+        # The audio received so far makes a WAV file of its own
+        self.assertEqual(decode_wav(stream.wav())[0].tolist(), stream.samples().tolist())
+
+    def test_wav_properties(self):
+        fragment = read_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        samples, sample_rate = decode_wav(fragment)
+        properties = wav_properties(fragment[:MAX_HEADER_SIZE], len(fragment))
+        self.assertEqual(properties['sample_rate'], sample_rate)
+        self.assertAlmostEqual(properties['duration'], len(samples) / sample_rate, places=3)
+        # A file shorter than its header declares lasts as long as the samples it has
+        self.assertLess(wav_properties(fragment, len(fragment) // 2)['duration'], properties['duration'])
+
+    def test_save_and_load(self):
+        hashes = fingerprint_wav(read_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav')))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fingerprints.idx')
+            index = FingerprintIndex.from_tracks({7: fingerprint_wav(read_file(os.path.join(TRACK_FOLDER, 'Blinding Lights.wav')))},
+                                                 {7: ('The Weeknd', 'Blinding Lights')})
+            index.save(path)
+            loaded = FingerprintIndex.load(path)
+            self.assertEqual(len(loaded), len(index))
+            self.assertEqual(loaded.names[7], ('The Weeknd', 'Blinding Lights'))
+            self.assertEqual(loaded.match(hashes), index.match(hashes))
+            del loaded # Release the memory map before the directory is removed
+
+    """Unhappy paths for the fingerprint engine."""
+    def test_fragment_not_in_index(self):
+        """Unhappy path: Davos has no track in the music folder."""
+        hashes = fingerprint_wav(read_file(os.path.join(FRAGMENT_FOLDER, '~Davos.wav')))
+        self.assertIsNone(self.index.match(hashes))
+
+    def test_not_a_wav_file(self):
+        """Unhappy path: Bytes that are not a WAV file."""
+        with self.assertRaises(WavError):
+            fingerprint_wav(b'not a wav file')
+
+        with self.assertRaises(WavError):
+            WavStream().feed(b'not a wav file')
+
+        with self.assertRaises(WavError):
+            wav_properties(b'not a wav file', 14)
+
+    def test_incomplete_header(self):
+        """Unhappy path: A WAV file cut off before its samples start."""
+        fragment = read_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        with self.assertRaises(IncompleteWav):
+            parse_wav_header(fragment[:30])
+        stream = WavStream()
+        stream.feed(fragment[:30])
+        self.assertIsNone(stream.fmt)
+        self.assertEqual(stream.seconds, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(debug=True)
@@ -9,14 +9,16 @@ logger = logging.getLogger(__name__)
 def clear_database() -> None:
     """
     Clears the database by making an API call to the Catalogue Management Service.
+
+    Every shard listed in CATALOGUE_URL (comma-separated, default http://localhost:5002) is cleared.
     
     Raises:
         Exception: If the database could not be cleared.
     """
-    url = 'http://localhost:5002/clear_database' # URL of the Catalogue Management Service
-    response = requests.delete(url)
-    if response.status_code != 200:
-        raise Exception("Failed to clear the database: " + response.text)
+    for url in os.environ.get('CATALOGUE_URL', 'http://localhost:5002').split(','): # URLs of the Catalogue Management Service shards
+        response = requests.delete(f"{url.strip().rstrip('/')}/clear_database")
+        if response.status_code != 200:
+            raise Exception("Failed to clear the database: " + response.text)
     
 def encode_audio_to_base64(file_path: str) -> str:
     """
@@ -60,4 +62,24 @@ def decode_base64_to_wav(encoded_string: str, output_file_name: str) -> None:
         logger.info(f"File saved to {output_file_path}")
     except Exception as e:
         logger.error(f"Failed to write file {output_file_name}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def read_audio_file(file_path: str) -> bytes:
+    """
+    Reads the raw bytes of an audio file, for the application/octet-stream and multipart upload paths.
+    
+    Args:
+        file_path (str): Path to the audio file.
+    
+    Returns:
+        bytes: Contents of the audio file.
+    
+    Raises:
+        Exception: If the file could not be read.
+    """
+    try:
+        with open(file_path, "rb") as audio_file:
+            return audio_file.read()
+    except Exception as e:
+        logger.error(f"Failed to read file {file_path}: {e}")
+        raise
@@ -0,0 +1,135 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.db import ConnectionPool
+from common.jobs import JobQueue
+from common.metrics import render_metrics
+
+
+class TestJobQueue(unittest.TestCase):
+    """Tests for the durable SQLite job queue and its workers."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.directory.name, 'jobs.db'), 4)
+        self.db = self.pool.connect()
+        # What the handlers write, to check each job takes effect once
+        self.db.execute('CREATE TABLE results (value TEXT NOT NULL)')
+        self.db.commit()
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.stop(5)
+        self.db.close()
+        self.pool.close_all()
+        self.directory.cleanup()
+
+    def make_queue(self, handler, **options) -> JobQueue:
+        options = {'workers': 1, 'max_attempts': 3, 'retry_backoff': 0.01, 'poll_seconds': 0.02, **options}
+        queue = JobQueue(self.pool, 'test', handler, **options)
+        self.db.executescript(queue.schema())
+        self.queues.append(queue)
+        return queue
+
+    def wait_for(self, queue: JobQueue, job_id: int) -> dict:
+        for _ in range(500):
+            job = queue.job(self.db, job_id)
+            if job['state'] in ('succeeded', 'failed'):
+                return job
+            time.sleep(0.01)
+        self.fail('Job did not finish')
+
+    def count_results(self) -> int:
+        return self.db.execute('SELECT count(*) FROM results').fetchone()[0]
+
+    """Happy paths for the job queue."""
+    def test_job_runs_with_its_payload(self):
+        def handler(db, params, payload):
+            db.execute('INSERT INTO results (value) VALUES (?)', (payload.decode(),))
+            return {'message': f"Hello {params['name']}"}, 201
+
+        queue = self.make_queue(handler)
+        job_id = queue.enqueue(self.db, {'name': 'Oasis'}, b'Wonderwall')
+        queue.start()
+        job = self.wait_for(queue, job_id)
+        self.assertEqual((job['state'], job['status'], job['attempts']), ('succeeded', 201, 1))
+        self.assertEqual(job['result'], {'message': 'Hello Oasis'})
+        self.assertEqual(self.db.execute('SELECT value FROM results').fetchall()[0][0], 'Wonderwall')
+        # The payload is dropped once the job is done
+        self.assertEqual(self.db.execute('SELECT count(*) FROM job_payloads').fetchone()[0], 0)
+
+    def test_failed_attempts_are_retried(self):
+        attempts = []
+
+        def handler(db, params, payload):
+            attempts.append(1)
+            db.execute("INSERT INTO results (value) VALUES ('written')")
+            if len(attempts) < 3:
+                raise RuntimeError('Database is busy')
+            return {'message': 'Done'}, 200
+
+        queue = self.make_queue(handler)
+        queue.start()
+        job = self.wait_for(queue, queue.enqueue(self.db, {}))
+        self.assertEqual((job['state'], job['attempts']), ('succeeded', 3))
+        # The writes of the failed attempts were rolled back
+        self.assertEqual(self.count_results(), 1)
+
+        metrics = render_metrics()
+        self.assertIn('jobs_total{queue="test",outcome="retried"}', metrics)
+        self.assertIn('job_queue_depth{queue="test",state="queued"} 0', metrics)
+        self.assertIn('job_wait_seconds_count{queue="test"}', metrics)
+
+    def test_lost_job_is_run_again(self):
+        def handler(db, params, payload):
+            db.execute("INSERT INTO results (value) VALUES ('written')")
+            return {'message': 'Done'}, 200
+
+        # A worker claims the job and stops before finishing it, e.g. because its process was killed
+        lost = self.make_queue(handler, workers=0, lease_seconds=0.05)
+        job_id = lost.enqueue(self.db, {})
+        worker_db = self.pool.connect()
+        claimed = lost.claim(worker_db)
+        self.assertEqual(claimed['id'], job_id)
+
+        # Once the lease runs out another worker takes it
+        time.sleep(0.1)
+        queue = self.make_queue(handler)
+        queue.start()
+        job = self.wait_for(queue, job_id)
+        self.assertEqual((job['state'], job['attempts']), ('succeeded', 2))
+
+        # The first worker finishing late does not add the job's writes twice
+        lost.process(worker_db, claimed)
+        worker_db.close()
+        self.assertEqual(self.count_results(), 1)
+
+    """Unhappy paths for the job queue."""
+    def test_job_fails_after_max_attempts(self):
+        def handler(db, params, payload):
+            raise RuntimeError('Corrupt audio')
+
+        queue = self.make_queue(handler, max_attempts=2)
+        queue.start()
+        job = self.wait_for(queue, queue.enqueue(self.db, {}, b'song'))
+        self.assertEqual((job['state'], job['status'], job['attempts']), ('failed', 500, 2))
+        self.assertEqual(job['result'], {'error': 'Job failed', 'message': 'Corrupt audio'})
+
+    def test_error_status_is_not_retried(self):
+        def handler(db, params, payload):
+            return {'error': 'Track already exists'}, 409
+
+        queue = self.make_queue(handler)
+        queue.start()
+        job = self.wait_for(queue, queue.enqueue(self.db, {}))
+        self.assertEqual((job['state'], job['status'], job['attempts']), ('failed', 409, 1))
+        self.assertIsNone(queue.job(self.db, 999))
+
+
+if __name__ == '__main__':
+    unittest.main()
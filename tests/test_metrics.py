@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.metrics import PROMETHEUS_CONTENT_TYPE, Counter, Histogram, REGISTRY, format_labels, instrument_app, render_metrics, stage
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for the shared Prometheus metrics."""
+
+    def setUp(self):
+        self.registered = len(REGISTRY)
+
+    def tearDown(self):
+        # Keep the metrics created by a test out of the shared registry
+        del REGISTRY[self.registered:]
+
+    """Happy paths for the metrics."""
+    def test_counter_renders_labelled_series(self):
+        counter = Counter('test_calls_total', 'Calls.', ('route',))
+        counter.labels('/a').inc()
+        counter.labels('/a').inc(2)
+        counter.labels('/b').inc()
+        output = render_metrics()
+        self.assertIn('# HELP test_calls_total Calls.\n# TYPE test_calls_total counter\n', output)
+        self.assertIn('test_calls_total{route="/a"} 3.0\n', output)
+        self.assertIn('test_calls_total{route="/b"} 1.0\n', output)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Durations.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.labels().observe(value)
+        lines = histogram.render()
+        self.assertEqual(lines, [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1.0"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 3.65',
+            'test_seconds_count 4',
+        ])
+
+    def test_stage_timer_records_duration(self):
+        with stage('test_stage'):
+            pass
+        self.assertRegex(render_metrics(), r'stage_duration_seconds_count\{stage="test_stage"\} [1-9]')
+
+    def test_instrumented_app_serves_metrics(self):
+        app = Flask(__name__)
+        instrument_app(app)
+
+        @app.route('/tracks/<name>')
+        def track(name):
+            return jsonify({'name': name})
+
+        client = app.test_client()
+        client.get('/tracks/one')
+        client.get('/tracks/two')
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, PROMETHEUS_CONTENT_TYPE)
+        # Requests are labelled by their route, not their path
+        body = response.get_data(as_text=True)
+        self.assertIn('http_requests_total{method="GET",route="/tracks/<name>",status="200"} 2.0', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/tracks/<name>"} 2', body)
+
+    """Unhappy paths for the metrics."""
+    def test_label_values_are_escaped(self):
+        """Unhappy path: A label value holds quotes, backslashes and newlines."""
+        self.assertEqual(format_labels(('route',), ('a"b\\c\nd',)), '{route="a\\"b\\\\c\\nd"}')
+
+    def test_unmatched_paths_share_one_series(self):
+        """Unhappy path: Requests for paths no route matches."""
+        app = Flask(__name__)
+        instrument_app(app)
+        client = app.test_client()
+        client.get('/missing/1')
+        client.get('/missing/2')
+        body = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_requests_total{method="GET",route="unmatched",status="404"} 2.0', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common.http import Deadline
+from common.scheduler import RateLimitExceeded, TokenBucket, UpstreamScheduler, parse_retry_after
+
+
+class TestUpstreamScheduler(unittest.TestCase):
+    """Tests for the rate-limited upstream call scheduler."""
+
+    """Happy paths for the scheduler."""
+    def test_bucket_spaces_calls_after_burst(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, places=2)
+
+    def test_pause_stops_refill(self):
+        bucket = TokenBucket(rate=10, burst=5)
+        bucket.pause(1.0)
+        self.assertGreater(bucket.reserve(), 1.0)
+
+    def test_identical_calls_are_coalesced(self):
+        scheduler = UpstreamScheduler(rate=100, burst=10, max_waiting=10, max_wait=1)
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(scheduler.call('fragment', upstream, Deadline(5))))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Let every caller join the leader's flight before it finishes
+        while scheduler.snapshot()['calls'] < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(scheduler.snapshot()['coalesced'], 4)
+
+    def test_rate_limited_call_is_retried_after_retry_after(self):
+        scheduler = UpstreamScheduler(rate=100, burst=10, max_waiting=10, max_wait=1)
+        attempts = []
+
+        def upstream():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RateLimitExceeded(0.2)
+            return 'result'
+
+        self.assertEqual(scheduler.call('fragment', upstream, Deadline(5)), 'result')
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.19)
+        self.assertEqual(scheduler.snapshot()['retries'], 1)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('2'), 2.0)
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+
+    """Unhappy paths for the scheduler."""
+    def test_call_rejected_when_token_comes_too_late(self):
+        """Unhappy path: The next token is further away than the caller may wait."""
+        scheduler = UpstreamScheduler(rate=1, burst=1, max_waiting=10, max_wait=0.5)
+        scheduler.call('a', lambda: 'result', Deadline(5))
+        with self.assertRaises(RateLimitExceeded) as context:
+            scheduler.call('b', lambda: 'result', Deadline(5))
+        self.assertGreater(context.exception.retry_after, 0.5)
+        self.assertEqual(scheduler.snapshot()['rejected'], 1)
+
+    def test_call_rejected_when_queue_is_full(self):
+        """Unhappy path: Too many callers are already waiting for a token."""
+        scheduler = UpstreamScheduler(rate=10, burst=1, max_waiting=0, max_wait=5)
+        scheduler.call('a', lambda: 'result', Deadline(5))
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.call('b', lambda: 'result', Deadline(5))
+
+    def test_gives_up_after_max_retries(self):
+        """Unhappy path: The upstream keeps rate limiting the call."""
+        scheduler = UpstreamScheduler(rate=100, burst=10, max_waiting=10, max_wait=1, max_retries=1)
+
+        def upstream():
+            raise RateLimitExceeded(0.05)
+
+        with self.assertRaises(RateLimitExceeded):
+            scheduler.call('fragment', upstream, Deadline(5))
+        self.assertEqual(scheduler.snapshot()['upstream_calls'], 2)
+
+    def test_parse_invalid_retry_after(self):
+        """Unhappy path: Missing or malformed Retry-After header."""
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+import os
+import sqlite3
+import sys
+from unittest.mock import MagicMock, patch
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/shamzam_service'))
+# The in-process gateway talks to the same catalogue shards as the running one
+os.environ.setdefault('DATABASE_URL', os.environ.get('CATALOGUE_URL', 'http://localhost:5002'))
+from common.search import TrackSearch, normalise, similarity, trigrams
+import app as gateway_app
+from test_helpers import clear_database, encode_audio_to_base64
+
+BASE_URL = "http://localhost:5000"  # URL of the Shamzam service
+TRACKS_FOLDER = os.path.join(os.path.dirname(__file__), '../music/tracks')
+FRAGMENT_FOLDER = os.path.join(os.path.dirname(__file__), '../music/fragments')
+
+TRACKS = [('The Weeknd', 'Blinding Lights'), ('Beyoncé', 'Halo'), ('Dua Lipa', 'Levitating'),
+          ('Sigur Rós', 'Hoppípolla'), ('The Weeknd', 'Save Your Tears'), ('Lipps Inc.', 'Funkytown')]
+
+
+def catalogue() -> sqlite3.Connection:
+    """An in-memory 'tracks' table with the search index, as the catalogue creates it."""
+    db = sqlite3.connect(':memory:')
+    db.create_function('search_text', 1, normalise, deterministic=True)
+    db.execute('CREATE TABLE tracks (artist TEXT NOT NULL, title TEXT NOT NULL, song BLOB NOT NULL, PRIMARY KEY (artist, title))')
+    return db
+
+
+def found(db: sqlite3.Connection, matches: list) -> list:
+    return [tuple(db.execute('SELECT artist, title FROM tracks WHERE rowid = ?', (rowid,)).fetchone()) for rowid, _ in matches]
+
+
+class TestTrackSearch(unittest.TestCase):
+    """Tests for the fuzzy track search index."""
+
+    def setUp(self):
+        self.db = catalogue()
+        self.search = TrackSearch()
+        self.db.executescript(self.search.schema())
+        self.db.executemany("INSERT INTO tracks (artist, title, song) VALUES (?, ?, x'00')", TRACKS)
+
+    """Happy paths for the fuzzy track search."""
+    def test_normalise(self):
+        self.assertEqual(normalise('  Beyoncé - HALO!! '), 'beyonce halo')
+        self.assertEqual(normalise('Sigur Rós'), 'sigur ros')
+        self.assertEqual(normalise('Guns_N’Roses'), 'guns n roses')
+
+    def test_similarity(self):
+        self.assertEqual(similarity(trigrams('halo'), trigrams('halo')), 1.0)
+        # A prefix is fully contained, but scores below the whole title
+        self.assertLess(similarity(trigrams('blind'), trigrams('blinding lights')), 1.0)
+        self.assertGreater(similarity(trigrams('blind'), trigrams('blinding lights')), similarity(trigrams('blind'), trigrams('halo')))
+        self.assertEqual(similarity(set(), trigrams('halo')), 0.0)
+
+    def test_fields_ignore_case_and_diacritics(self):
+        matches = self.search.search(self.db, {'artist': 'BEYONCE', 'title': 'halo'}, 5)
+        self.assertEqual(found(self.db, matches)[0], ('Beyoncé', 'Halo'))
+        self.assertEqual(matches[0][1], 1.0)
+
+    def test_misspelt_text(self):
+        matches = self.search.search(self.db, {'text': 'blindng lihgts'}, 5)
+        self.assertEqual(found(self.db, matches)[0], ('The Weeknd', 'Blinding Lights'))
+
+    def test_prefix_and_artist_text(self):
+        self.assertEqual(found(self.db, self.search.search(self.db, {'text': 'levit'}, 5))[0], ('Dua Lipa', 'Levitating'))
+        self.assertEqual(set(found(self.db, self.search.search(self.db, {'text': 'weeknd'}, 5))),
+                         {('The Weeknd', 'Blinding Lights'), ('The Weeknd', 'Save Your Tears')})
+        self.assertEqual(found(self.db, self.search.search(self.db, {'text': 'sigur ros hoppipolla'}, 5))[0], ('Sigur Rós', 'Hoppípolla'))
+
+    def test_index_follows_tracks(self):
+        self.db.execute("DELETE FROM tracks WHERE artist = 'Beyoncé'")
+        self.db.execute("UPDATE tracks SET title = 'Physical' WHERE title = 'Levitating'")
+        self.assertEqual(self.search.search(self.db, {'title': 'halo'}, 5), [])
+        self.assertEqual(found(self.db, self.search.search(self.db, {'title': 'physical'}, 5)), [('Dua Lipa', 'Physical')])
+
+    def test_rebuild_if_stale(self):
+        db = catalogue()
+        db.executemany("INSERT INTO tracks (artist, title, song) VALUES (?, ?, x'00')", TRACKS)
+        search = TrackSearch()
+        db.executescript(search.schema())
+        self.assertTrue(search.rebuild_if_stale(db))
+        self.assertFalse(search.rebuild_if_stale(db))
+        self.assertEqual(found(db, search.search(db, {'text': 'funkytown'}, 1)), [('Lipps Inc.', 'Funkytown')])
+
+    """Unhappy paths for the fuzzy track search."""
+    def test_fields_must_all_match(self):
+        """Unhappy path: The right artist with another title scores below a fuzzy identification match."""
+        matches = self.search.search(self.db, {'artist': 'The Weeknd', 'title': 'Starboy'}, 5)
+        self.assertTrue(all(score < 0.6 for _, score in matches))
+
+    def test_query_too_short(self):
+        """Unhappy path: A query without three letters or digits cannot be matched."""
+        with self.assertRaises(ValueError):
+            self.search.search(self.db, {'text': 'a!'}, 5)
+
+
+class TestFuzzySearchRoutes(unittest.TestCase):
+    """Tests for /catalogue/search/fuzzy and the fuzzy fallback of /music/identify."""
+
+    def setUp(self):
+        """Add a track to an empty catalogue."""
+        clear_database()
+        response = requests.post(f"{BASE_URL}/catalogue/add", json={
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encode_audio_to_base64(os.path.join(TRACKS_FOLDER, 'Blinding Lights.wav'))
+        })
+        self.assertEqual(response.status_code, 201)
+
+    def tearDown(self):
+        """Clear the database after each test."""
+        clear_database()
+
+    """Happy paths for fuzzy catalogue searches."""
+    def test_search_fuzzy(self):
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy", params={'q': 'blinding lites'})
+        self.assertEqual(response.status_code, 200)
+        track = response.json()['tracks'][0]
+        self.assertEqual((track['artist'], track['title']), ('The Weeknd', 'Blinding Lights'))
+        self.assertTrue(track['download_url'].startswith('/catalogue/download'))
+
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy", params={'artist': 'the weeknd', 'title': 'BLINDING LIGHTS'})
+        self.assertEqual(response.json()['tracks'][0]['score'], 1.0)
+
+    def test_identify_falls_back_to_fuzzy_match(self):
+        # The identification service names the track differently from the catalogue
+        identified = MagicMock(status_code=200)
+        identified.json.return_value = {'artist': 'The Weeknd', 'title': 'Blinding Lights (Radio Edit)'}
+        fragment = encode_audio_to_base64(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        with patch.object(gateway_app.audio_client, 'post', return_value=identified):
+            response = gateway_app.app.test_client().post('/music/identify?include_song=false', json={'encoded_fragment': fragment})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Catalogue-Match'], 'fuzzy')
+        self.assertEqual(response.get_json()['title'], 'Blinding Lights')
+
+    """Unhappy paths for fuzzy catalogue searches."""
+    def test_search_fuzzy_no_match(self):
+        """Unhappy path: Nothing in the catalogue resembles the query."""
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy", params={'q': 'zzzzzz'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('No tracks found', response.json()['message'])
+
+    def test_search_fuzzy_invalid_query(self):
+        """Unhappy path: Queries that are missing, too short or with an invalid limit."""
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Query, artist or title is required', response.json()['error'])
+
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy", params={'q': 'ab'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at least 3 letters or digits', response.json()['error'])
+
+        response = requests.get(f"{BASE_URL}/catalogue/search/fuzzy", params={'q': 'blinding', 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_identify_fuzzy_match_too_far(self):
+        """Unhappy path: A track that only shares its artist with the identified one is not returned."""
+        identified = MagicMock(status_code=200)
+        identified.json.return_value = {'artist': 'The Weeknd', 'title': 'Starboy'}
+        with patch.object(gateway_app.audio_client, 'post', return_value=identified):
+            response = gateway_app.app.test_client().post('/music/identify', json={'encoded_fragment': 'UklGRg=='})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Catalogue-Match', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+SERVE_PATH = os.path.join(os.path.dirname(__file__), '../src/serve.py')
+TRACK_PATH = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
+
+
+def free_port() -> int:
+    """Find a port nothing is listening on."""
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return listener.getsockname()[1]
+
+
+class TestServe(unittest.TestCase):
+    """Tests for the multi-worker launcher, running the catalogue on a fresh database."""
+
+    WORKERS = 3
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.url = f'http://127.0.0.1:{free_port()}'
+        environment = dict(os.environ, CATALOGUE_DATABASE=os.path.join(self.directory.name, 'catalogue.db'))
+        self.server = subprocess.Popen([sys.executable, SERVE_PATH, 'catalogue', '--workers', str(self.WORKERS), '--threads', '4',
+                                        '--bind', self.url[len('http://'):], '--graceful-timeout', '10'],
+                                       env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_for_workers(self.WORKERS)
+        for _ in range(300):
+            try:
+                requests.get(f'{self.url}/tracks', timeout=5)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+        self.directory.cleanup()
+
+    def workers(self) -> set:
+        """Process ids of the server's workers (Linux only)."""
+        try:
+            with open(f'/proc/{self.server.pid}/task/{self.server.pid}/children') as children:
+                return set(children.read().split())
+        except OSError:
+            return set()
+
+    def wait_for_workers(self, count: int, excluding: set = frozenset()) -> set:
+        for _ in range(300):
+            workers = self.workers() - excluding
+            if len(workers) == count:
+                return workers
+            time.sleep(0.1)
+        self.fail(f'Expected {count} workers, found {self.workers()}')
+
+    def add_track(self) -> requests.Response:
+        with open(TRACK_PATH, 'rb') as audio_file:
+            return requests.post(f'{self.url}/add', data=audio_file.read(), timeout=30,
+                                 headers={'Content-Type': 'application/octet-stream', 'X-Artist': 'The Weeknd', 'X-Title': 'Blinding Lights'})
+
+    """Happy paths for the launcher."""
+    def test_workers_initialise_one_database(self):
+        # The workers started together on a database none of them had created, and every one of them serves it
+        self.assertEqual(len(self.workers()), self.WORKERS)
+        self.assertEqual(self.add_track().status_code, 201)
+        for _ in range(30):
+            # A new connection each time, spread over the workers
+            response = requests.get(f'{self.url}/tracks', timeout=5)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([track['title'] for track in response.json()['tracks']], ['Blinding Lights'])
+
+    def test_reload_replaces_workers_without_dropping_requests(self):
+        self.assertEqual(self.add_track().status_code, 201)
+        old_workers = self.workers()
+        statuses = []
+        stop = threading.Event()
+
+        def client():
+            while not stop.is_set():
+                try:
+                    statuses.append(requests.get(f'{self.url}/tracks', timeout=10).status_code)
+                except requests.RequestException as e:
+                    statuses.append(type(e).__name__)
+
+        thread = threading.Thread(target=client)
+        thread.start()
+        time.sleep(0.5)
+        self.server.send_signal(signal.SIGHUP)
+        new_workers = self.wait_for_workers(self.WORKERS, excluding=old_workers)
+        # Until the old workers are gone
+        for _ in range(300):
+            if not self.workers() & old_workers:
+                break
+            time.sleep(0.1)
+        time.sleep(0.5)
+        stop.set()
+        thread.join()
+
+        self.assertEqual(self.workers(), new_workers)
+        self.assertTrue(statuses)
+        self.assertEqual(set(statuses), {200})
+
+    def test_terminate_stops_gracefully(self):
+        self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(timeout=20), 0)
+
+    """Unhappy paths for the launcher."""
+    def test_unknown_service(self):
+        result = subprocess.run([sys.executable, SERVE_PATH, 'jukebox'], capture_output=True, text=True, timeout=30)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('unknown services jukebox', result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import json
+import os
+import sys
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src/shamzam_service'))
+from common.sharding import ShardedListing, combine_etags, decode_cursor, encode_cursor, merge_pages, parse_urls, shard_of
+import gateway
+from gateway import ShardedBulk
+
+KEYS = [(f'Artist {index % 97}', f'Title {index}') for index in range(4000)]
+
+
+def tracks(*keys):
+    return [{'artist': artist, 'title': title} for artist, title in keys]
+
+
+class TestSharding(unittest.TestCase):
+    """Tests for routing tracks to catalogue shards and merging their results."""
+
+    """Happy paths for sharding."""
+    def test_shard_of_is_stable_and_in_range(self):
+        shards = [shard_of(artist, title, 4) for artist, title in KEYS]
+        self.assertEqual(shards, [shard_of(artist, title, 4) for artist, title in KEYS])
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+        # Roughly even: every shard within 20% of its fair share
+        for count in Counter(shards).values():
+            self.assertLess(abs(count - len(KEYS) / 4), len(KEYS) / 4 * 0.2)
+        self.assertEqual({shard_of(artist, title, 1) for artist, title in KEYS}, {0})
+
+    def test_adding_a_shard_only_moves_keys_to_it(self):
+        moved = [(shard_of(artist, title, 4), shard_of(artist, title, 5)) for artist, title in KEYS]
+        moved = [(before, after) for before, after in moved if before != after]
+        self.assertTrue(all(after == 4 for _, after in moved))
+        self.assertLess(len(moved), len(KEYS) / 5 * 1.2)
+
+    def test_parse_urls(self):
+        self.assertEqual(parse_urls('http://a:1/, http://b:2'), ['http://a:1', 'http://b:2'])
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor('AC/DC', 'Thunderstruck')), ('AC/DC', 'Thunderstruck'))
+
+    def test_combine_etags(self):
+        self.assertEqual(combine_etags(['"a"', '"b"']), combine_etags(['"a"', '"b"']))
+        self.assertNotEqual(combine_etags(['"a"', '"b"']), combine_etags(['"a"', '"c"']))
+        # Whichever coding a shard answered in
+        self.assertEqual(combine_etags(['"a-gzip"', '"b"']), combine_etags(['"a"', '"b"']))
+
+    def test_merge_pages(self):
+        pages = [(tracks(('A', '1'), ('C', '1')), encode_cursor('C', '1')), (tracks(('B', '1')), None)]
+        page, next_cursor = merge_pages(pages, 2)
+        self.assertEqual(page, tracks(('A', '1'), ('B', '1')))
+        self.assertEqual(decode_cursor(next_cursor), ('B', '1'))
+        self.assertEqual(merge_pages([(tracks(('A', '1')), None), ([], None)], 2), (tracks(('A', '1')), None))
+
+    def test_sharded_listing(self):
+        keys = sorted(KEYS[:200])
+        shards = [[key for key in keys if shard_of(*key, 3) == shard] for shard in range(3)]
+        listing = ShardedListing(3)
+        listed = []
+        while not listing.done:
+            for shard, cursor in listing.wanted():
+                after = decode_cursor(cursor) if cursor else None
+                remaining = [key for key in shards[shard] if after is None or key > after]
+                page = remaining[:10]
+                next_cursor = encode_cursor(*page[-1]) if len(remaining) > 10 else None
+                listing.add_page(shard, tracks(*page), next_cursor)
+            listed.extend(listing.take())
+        self.assertEqual(listed, tracks(*keys))
+
+    def test_sharded_bulk(self):
+        bulk = ShardedBulk()
+        keys = KEYS[:20]
+        for artist, title in keys:
+            track = {'artist': artist, 'title': title, 'encoded_song': 'UklGRg=='}
+            bulk.add(json.dumps(track).encode('utf-8'), track)
+        bulk.add(b'not json', None)
+        self.assertEqual(bulk.count, 21)
+
+        for shard, body in bulk.bodies():
+            lines = [json.loads(line) for line in body.splitlines() if line != b'not json']
+            self.assertTrue(all(shard_of(line['artist'], line['title'], len(gateway.DATABASE_URLS)) == shard for line in lines))
+            results = [{'index': index, 'status': 201} for index in range(len(body.splitlines()))]
+            bulk.record(shard, {'added': len(results), 'results': results}, 200)
+
+        body = bulk.body()
+        self.assertEqual([result['index'] for result in body['results']], list(range(21)))
+        self.assertEqual(body['added'], 21)
+
+    """Unhappy paths for sharding."""
+    def test_sharded_bulk_shard_failure(self):
+        """Unhappy path: A shard that cannot be reached fails only the tracks sent to it."""
+        urls = gateway.DATABASE_URLS
+        gateway.DATABASE_URLS = ['http://a', 'http://b']
+        try:
+            bulk = ShardedBulk()
+            for artist, title in KEYS[:20]:
+                bulk.add(b'{}', {'artist': artist, 'title': title})
+        finally:
+            gateway.DATABASE_URLS = urls
+        (first, first_body), (second, second_body) = bulk.bodies()
+        bulk.record(first, {'added': 0, 'results': [{'index': index, 'status': 409} for index in range(len(first_body.splitlines()))]}, 200)
+        bulk.record(second, {'error': 'Catalogue Management Service shard 1 unavailable'}, 503)
+
+        statuses = Counter(result['status'] for result in bulk.body()['results'])
+        self.assertEqual(statuses, {409: len(first_body.splitlines()), 503: len(second_body.splitlines())})
+
+    def test_invalid_cursor(self):
+        """Unhappy path: A cursor that was not made by encode_cursor()."""
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+
+from flask import Flask, jsonify
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
+from common import tracing
+from common.metrics import stage
+from common.tracing import REQUEST_ID, SERVER_TIMING, TRACEPARENT, SpanWriter, Trace, parse_server_timing, parse_traceparent, trace_app
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class TestTracing(unittest.TestCase):
+    """Tests for cross-service request tracing."""
+
+    def make_app(self) -> Flask:
+        app = Flask(__name__)
+        trace_app(app, 'catalogue')
+
+        @app.route('/search')
+        def search():
+            with stage('db_query'):
+                pass
+            return jsonify({'message': 'Track found'})
+
+        return app
+
+    """Happy paths for tracing."""
+    def test_new_trace_sets_headers(self):
+        response = self.make_app().test_client().get('/search')
+        self.assertRegex(response.headers[REQUEST_ID], r'^[0-9a-f]{32}$')
+        names = [name for name, _ in parse_server_timing(response.headers[SERVER_TIMING])]
+        self.assertEqual(names, ['db_query', 'total'])
+
+    def test_incoming_traceparent_is_continued(self):
+        response = self.make_app().test_client().get('/search', headers={TRACEPARENT: f'00-{TRACE_ID}-{PARENT_ID}-01'})
+        self.assertEqual(response.headers[REQUEST_ID], TRACE_ID)
+
+    def test_callee_timings_are_nested(self):
+        trace = Trace('gateway', 'POST /music/identify')
+        trace.record('upstream_identification', trace.started, 0.5, 'a' * 16,
+                     server_timing='upstream_audd;dur=400.0, cache_lookup;dur=0.5, total;dur=450.0')
+        server_timing, spans = trace.finish(200)
+        entries = dict(parse_server_timing(server_timing))
+        self.assertAlmostEqual(entries['upstream_identification'], 500.0)
+        self.assertAlmostEqual(entries['upstream_identification.upstream_audd'], 400.0)
+        self.assertNotIn('upstream_identification.total', entries)
+        self.assertIn('total', entries)
+        # The server span comes first and is the parent of the others
+        self.assertIsNone(spans[0]['parent_id'])
+        self.assertEqual(spans[1]['parent_id'], spans[0]['span_id'])
+        self.assertEqual(spans[1]['span_id'], 'a' * 16)
+
+    def test_spans_are_written(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.jsonl')
+            tracing.span_writer = SpanWriter(path)
+            try:
+                self.make_app().test_client().get('/search')
+            finally:
+                tracing.span_writer.file.close()
+                tracing.span_writer = None
+            with open(path) as file:
+                spans = [json.loads(line) for line in file]
+        self.assertEqual([span['name'] for span in spans], ['GET /search', 'db_query'])
+        self.assertEqual(spans[0]['service'], 'catalogue')
+        self.assertEqual(spans[0]['attributes'], {'status': 200})
+        self.assertEqual(spans[1]['trace_id'], spans[0]['trace_id'])
+
+    """Unhappy paths for tracing."""
+    def test_malformed_traceparent_starts_new_trace(self):
+        """Unhappy path: The caller sent a traceparent that is not valid."""
+        for value in ('', 'junk', f'00-{TRACE_ID}-{PARENT_ID}', f'00-{"0" * 32}-{PARENT_ID}-01', f'00-{TRACE_ID}-{"z" * 16}-01'):
+            self.assertIsNone(parse_traceparent(value))
+        response = self.make_app().test_client().get('/search', headers={TRACEPARENT: 'junk'})
+        self.assertNotEqual(response.headers[REQUEST_ID], TRACE_ID)
+
+    def test_malformed_server_timing_is_skipped(self):
+        """Unhappy path: The callee's Server-Timing header has entries without a valid duration."""
+        self.assertEqual(parse_server_timing('a;dur=1.5, b, c;dur=x, d;desc="x";dur=2'), [('a', 1.5), ('d', 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
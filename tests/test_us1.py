@@ -1,7 +1,10 @@
 import unittest
 import requests
 import os
-from test_helpers import encode_audio_to_base64, clear_database
+import json
+import time
+from urllib.parse import quote
+from test_helpers import encode_audio_to_base64, clear_database, read_audio_file
 
 BASE_URL = "http://localhost:5000"  # URL of the Shamzam service   
 file_path = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
@@ -34,6 +37,117 @@ class TestAddSongToCatalogue(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('Track found', response.json()['message'])
 
+
+    def test_add_song_binary(self):
+        """Happy path: Raw audio body with the metadata in percent-encoded headers."""
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Artist': quote('The Weeknd'),
+            'X-Title': quote('Blinding Lights')
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", data=read_audio_file(file_path), headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('Track added successfully', response.json()['message'])
+
+        # Verify the stored song is the uploaded audio
+        response = requests.post(f"{BASE_URL}/catalogue/search", json={'artist': 'The Weeknd', 'title': 'Blinding Lights'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['encoded_song'], encoded_song)
+
+    def test_add_song_multipart(self):
+        """Happy path: Multipart form with the audio as a file field."""
+        response = requests.post(f"{BASE_URL}/catalogue/add",
+                                 data={'artist': 'The Weeknd', 'title': 'Blinding Lights'},
+                                 files={'song': ('Blinding Lights.wav', read_audio_file(file_path), 'audio/wav')})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('Track added successfully', response.json()['message'])
+
+
+    def test_download_added_song(self):
+        """Happy path: The added song can be streamed whole and by byte range."""
+        data = {
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encoded_song
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", json=data)
+        self.assertEqual(response.status_code, 201)
+        song = read_audio_file(file_path)
+
+        # Search without inlining the song and follow its download reference
+        response = requests.post(f"{BASE_URL}/catalogue/search?include_song=false", json={'artist': 'The Weeknd', 'title': 'Blinding Lights'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('encoded_song', response.json())
+        self.assertEqual(response.json()['size'], len(song))
+        download_url = f"{BASE_URL}{response.json()['download_url']}"
+
+        response = requests.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, song)
+
+        response = requests.get(download_url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(song)}')
+        self.assertEqual(response.content, song[100:200])
+
+    def test_add_songs_bulk(self):
+        """Happy path: Bulk add reports the status of every track and adds the valid ones."""
+        response = requests.post(f"{BASE_URL}/catalogue/add", json={'artist': 'Oasis', 'title': 'Wonderwall', 'encoded_song': encoded_song})
+        self.assertEqual(response.status_code, 201)
+
+        response = requests.post(f"{BASE_URL}/catalogue/add/bulk", json={'tracks': [
+            {'artist': 'The Weeknd', 'title': 'Blinding Lights', 'encoded_song': encoded_song},
+            {'artist': 'Oasis', 'title': 'Wonderwall', 'encoded_song': encoded_song},
+            {'artist': 'Blur'},
+            {'artist': 'The Weeknd', 'title': 'Blinding Lights', 'encoded_song': encoded_song},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['added'], 1)
+        self.assertEqual([result['status'] for result in response.json()['results']], [201, 409, 400, 409])
+        self.assertIn('Title is required', response.json()['results'][2]['error'])
+
+        # The added track is stored whole
+        response = requests.post(f"{BASE_URL}/catalogue/search", json={'artist': 'The Weeknd', 'title': 'Blinding Lights'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['encoded_song'], encoded_song)
+
+    def test_add_songs_bulk_ndjson(self):
+        """Happy path: Bulk add from an NDJSON body, one track per line."""
+        lines = [json.dumps({'artist': 'Blur', 'title': f'Song {number}', 'encoded_song': encoded_song}) for number in range(3)]
+        response = requests.post(f"{BASE_URL}/catalogue/add/bulk", data='\n'.join(lines),
+                                 headers={'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['added'], 3)
+
+        response = requests.get(f"{BASE_URL}/catalogue/list")
+        self.assertEqual(len(response.json()['tracks']), 3)
+
+    def test_add_song_async(self):
+        """Happy path: A queued song is added by the catalogue's workers, and its job reports the result."""
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Artist': quote('The Weeknd'),
+            'X-Title': quote('Blinding Lights')
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add?async=true", data=read_audio_file(file_path), headers=headers)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.headers['Location'], response.json()['status_url'])
+        self.assertTrue(response.json()['status_url'].startswith('/catalogue/jobs/'))
+
+        # Poll the job until a worker has finished it
+        for _ in range(100):
+            job = requests.get(f"{BASE_URL}{response.json()['status_url']}").json()
+            if job['state'] in ('succeeded', 'failed'):
+                break
+            time.sleep(0.1)
+        self.assertEqual(job['state'], 'succeeded')
+        self.assertEqual(job['status'], 201)
+        self.assertIn('Track added successfully', job['result']['message'])
+
+        response = requests.post(f"{BASE_URL}/catalogue/search", json={'artist': 'The Weeknd', 'title': 'Blinding Lights'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['encoded_song'], encoded_song)
+
     
     """Unhappy paths for adding a song."""
     def test_add_song_no_artist(self):
@@ -56,6 +170,38 @@ class TestAddSongToCatalogue(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('Title is required', response.json()['error'])
 
+    def test_add_song_binary_no_title(self):
+        """Unhappy path: Raw audio body missing the title header."""
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Artist': quote('The Weeknd')
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", data=read_audio_file(file_path), headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Title is required', response.json()['error'])
+
+    def test_add_song_multipart_no_file(self):
+        """Unhappy path: Multipart form without the audio file."""
+        response = requests.post(f"{BASE_URL}/catalogue/add",
+                                 data={'artist': 'The Weeknd', 'title': 'Blinding Lights'},
+                                 files={'other': ('notes.txt', b'not a song')})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Song file is required', response.json()['error'])
+
+    def test_download_range_not_satisfiable(self):
+        """Unhappy path: Range starts past the end of the song."""
+        data = {
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encoded_song
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", json=data)
+        self.assertEqual(response.status_code, 201)
+
+        response = requests.get(f"{BASE_URL}/catalogue/download", params={'artist': 'The Weeknd', 'title': 'Blinding Lights'},
+                                headers={'Range': 'bytes=99999999-'})
+        self.assertEqual(response.status_code, 416)
+
     def test_add_song_already_exists(self):
         """Unhappy path: Track already exists."""
         data = {
@@ -73,6 +219,36 @@ class TestAddSongToCatalogue(unittest.TestCase):
         self.assertEqual(response.status_code, 409)
         self.assertIn('Track already exists', response.json()['error'])
 
+    def test_add_song_async_invalid(self):
+        """Unhappy path: Queued adds are checked before they are queued, and unknown jobs are not found."""
+        data = {'artist': 'The Weeknd', 'title': 'Blinding Lights', 'encoded_song': encoded_song}
+        response = requests.post(f"{BASE_URL}/catalogue/add", json=data)
+        self.assertEqual(response.status_code, 201)
+
+        response = requests.post(f"{BASE_URL}/catalogue/add?async=true", json=data)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Track already exists', response.json()['error'])
+
+        response = requests.post(f"{BASE_URL}/catalogue/add?async=true", json={**data, 'encoded_song': 'not base64!'})
+        self.assertEqual(response.status_code, 400)
+
+        response = requests.get(f"{BASE_URL}/catalogue/jobs/999999999")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('Job not found', response.json()['error'])
+
+    def test_add_songs_bulk_invalid_body(self):
+        """Unhappy path: Bulk add without a list of tracks or with an unsupported content type."""
+        response = requests.post(f"{BASE_URL}/catalogue/add/bulk", json={'tracks': []})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('No tracks provided', response.json()['error'])
+
+        response = requests.post(f"{BASE_URL}/catalogue/add/bulk", json={'artist': 'Oasis'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Tracks must be a JSON list', response.json()['error'])
+
+        response = requests.post(f"{BASE_URL}/catalogue/add/bulk", data='tracks', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(response.status_code, 415)
+
 
 if __name__ == '__main__':
     unittest.main(debug=True)
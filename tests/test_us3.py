@@ -69,6 +69,54 @@ class TestListAllSongs(unittest.TestCase):
         # Checks that the titles in the response match the expected titles
         self.assertEqual(track_titles, expected_titles)  
 
+        # The properties of each track's audio are listed with it
+        blinding_lights = next(track for track in tracks if track['title'] == 'Blinding Lights')
+        self.assertEqual((blinding_lights['sample_rate'], blinding_lights['channels']), (48000, 1))
+        self.assertGreater(blinding_lights['duration'], 8)
+
+    def test_list_songs_paginated(self):
+        """Happy path: Pages follow next_cursor in artist, title order until it is null."""
+        for artist, title in [('Oasis', 'Wonderwall'), ('Oasis', 'Champagne Supernova'), ('Blur', 'Song 2')]:
+            response = requests.post(f"{BASE_URL}/catalogue/add", json={'artist': artist, 'title': title, 'encoded_song': 'UklGRg=='})
+            self.assertEqual(response.status_code, 201)
+
+        # Walk the pages two tracks at a time
+        tracks, cursor = [], None
+        while True:
+            params = {'limit': 2, 'cursor': cursor} if cursor else {'limit': 2}
+            response = requests.get(f"{BASE_URL}/catalogue/list", params=params)
+            self.assertEqual(response.status_code, 200)
+            tracks.extend((track['artist'], track['title']) for track in response.json()['tracks'])
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(tracks, [('Blur', 'Song 2'), ('Oasis', 'Champagne Supernova'), ('Oasis', 'Wonderwall')])
+
+        # Filter on an artist prefix
+        response = requests.get(f"{BASE_URL}/catalogue/list", params={'prefix': 'Oa'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({track['artist'] for track in response.json()['tracks']}, {'Oasis'})
+
+    def test_list_songs_conditional_get(self):
+        """Happy path: An unchanged catalogue answers If-None-Match with 304 until a track is added."""
+        response = requests.post(f"{BASE_URL}/catalogue/add", json={'artist': 'Blur', 'title': 'Song 2', 'encoded_song': 'UklGRg=='})
+        self.assertEqual(response.status_code, 201)
+
+        response = requests.get(f"{BASE_URL}/catalogue/list")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = requests.get(f"{BASE_URL}/catalogue/list", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Any change to the catalogue changes the ETag
+        response = requests.post(f"{BASE_URL}/catalogue/add", json={'artist': 'Oasis', 'title': 'Wonderwall', 'encoded_song': 'UklGRg=='})
+        self.assertEqual(response.status_code, 201)
+        response = requests.get(f"{BASE_URL}/catalogue/list", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     
     """Unhappy paths for listing all songs."""
     def test_list_no_songs(self):
@@ -83,5 +131,15 @@ class TestListAllSongs(unittest.TestCase):
         self.assertEqual(response.status_code, 405)
         self.assertIn('Method Not Allowed', response.text)
 
+    def test_list_invalid_page_parameters(self):
+        """Unhappy path: Limit out of range and malformed cursor."""
+        response = requests.get(f"{BASE_URL}/catalogue/list", params={'limit': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Limit must be an integer', response.json()['error'])
+
+        response = requests.get(f"{BASE_URL}/catalogue/list", params={'limit': 2, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid cursor', response.json()['error'])
+
 if __name__ == '__main__':
     unittest.main(debug=True)
\ No newline at end of file
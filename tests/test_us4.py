@@ -1,8 +1,10 @@
 import unittest
 import requests
 import os
+import json
+import time
 from unittest.mock import patch
-from test_helpers import encode_audio_to_base64, clear_database, decode_base64_to_wav
+from test_helpers import encode_audio_to_base64, clear_database, decode_base64_to_wav, read_audio_file
 
 BASE_URL = "http://localhost:5000"  # URL of the Shamzam service
 FRAGMENT_FOLDER = os.path.join(os.path.dirname(__file__), '../music/fragments')
@@ -50,6 +52,78 @@ class TestIdentifyFragment(unittest.TestCase):
         output_file_name = f"{found_artist}-{found_title}.wav"
         decode_base64_to_wav(encoded_track, output_file_name)
 
+    def test_identify_music_fragment_binary(self):
+        """Happy path: Fragment uploaded as a raw audio body."""
+        file_path1 = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
+        data = {
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encode_audio_to_base64(file_path1)
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", json=data)
+        self.assertEqual(response.status_code, 201)
+
+        fragment_path = os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav')
+        response = requests.post(f"{BASE_URL}/music/identify", data=read_audio_file(fragment_path),
+                                 headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Track found', response.json()['message'])
+        self.assertEqual(response.json()['title'], 'Blinding Lights')
+
+    def test_identify_batch(self):
+        """Happy path: Batch of fragments, with a repeated fragment and one that is not Base64 encoded."""
+        file_path1 = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
+        data = {
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encode_audio_to_base64(file_path1)
+        }
+        response = requests.post(f"{BASE_URL}/catalogue/add", json=data)
+        self.assertEqual(response.status_code, 201)
+
+        encoded_fragment = encode_audio_to_base64(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        response = requests.post(f"{BASE_URL}/music/identify/batch",
+                                 json={'fragments': [encoded_fragment, 'not_encoded', encoded_fragment]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+
+        # One line per fragment, in the order they completed
+        results = {line['index']: line for line in map(json.loads, response.text.splitlines())}
+        self.assertEqual(sorted(results), [0, 1, 2])
+        for index in (0, 2):
+            self.assertEqual(results[index]['status'], 200)
+            self.assertEqual(results[index]['title'], 'Blinding Lights')
+            self.assertTrue(results[index]['download_url'].startswith('/catalogue/download'))
+        self.assertEqual(results[1]['status'], 400)
+        self.assertIn('Invalid content format: must be Base64 encoded string', results[1]['message']['error'])
+
+    def test_identify_stream(self):
+        """Happy path: Fragment streamed in real time, answered before it has all been sent."""
+        file_path1 = os.path.join(os.path.dirname(__file__), '../music/tracks/Blinding Lights.wav')
+        response = requests.post(f"{BASE_URL}/catalogue/add", json={
+            'artist': 'The Weeknd',
+            'title': 'Blinding Lights',
+            'encoded_song': encode_audio_to_base64(file_path1)
+        })
+        self.assertEqual(response.status_code, 201)
+
+        # Send a tenth of a second of audio (48 kHz, 16-bit mono) every tenth of a second, as if recording it
+        fragment = read_audio_file(os.path.join(FRAGMENT_FOLDER, '~Blinding Lights.wav'))
+        chunks = [fragment[start:start + 9600] for start in range(0, len(fragment), 9600)]
+        sent = []
+        def record():
+            for chunk in chunks:
+                sent.append(chunk)
+                yield chunk
+                time.sleep(0.1)
+
+        response = requests.post(f"{BASE_URL}/music/identify/stream?include_song=false", data=record(),
+                                 headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Blinding Lights')
+        self.assertLess(float(response.headers['X-Audio-Seconds']), 4.4)
+        self.assertLess(len(sent), len(chunks))
+
     """Unhappy paths for identifying a music fragment."""
     def test_fragment_not_in_catalogue(self):
         """"Unhappy path: Attempt to identify a fragment that is not in the catalogue."""
@@ -74,6 +148,27 @@ class TestIdentifyFragment(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('Invalid content format: must be Base64 encoded string', response.json()['message']['error'])
 
+    def test_identify_batch_invalid_body(self):
+        """Unhappy path: Batch without a list of fragments."""
+        response = requests.post(f"{BASE_URL}/music/identify/batch", json={'fragments': 'not_a_list'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Fragments must be a list', response.json()['message']['error'])
+
+        response = requests.post(f"{BASE_URL}/music/identify/batch", json={'fragments': []})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At least one fragment is required', response.json()['message']['error'])
+
+    def test_identify_stream_invalid_body(self):
+        """Unhappy path: Streamed fragment that is not raw WAV audio."""
+        response = requests.post(f"{BASE_URL}/music/identify/stream", json={'encoded_fragment': 'UklGRg=='})
+        self.assertEqual(response.status_code, 415)
+        self.assertIn('Request must be application/octet-stream', response.json()['error'])
+
+        response = requests.post(f"{BASE_URL}/music/identify/stream", data=b'not a wav file',
+                                 headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid content format: fragment must be a WAV file', response.json()['message']['error'])
+
     @patch('requests.post')
     def test_identify_api_failure(self, mock_post):
         """Unhappy path: API call to Audd.io failure."""